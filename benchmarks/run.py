@@ -0,0 +1,394 @@
+"""
+Run the Fatiando benchmark suite from the command line.
+
+Times the computationally intensive parts of Fatiando (forward modeling,
+inversions and wave propagation) at several problem sizes. Each benchmark runs
+in a separate process so that the peak memory used can be measured. The results
+are saved to a JSON file and can be compared against a baseline (the output of
+a previous run) to spot performance regressions.
+
+Fatiando must be installed or in the ``PYTHONPATH`` (``make bench`` runs the
+suite on the source tree after building the extension modules).
+
+Usage::
+
+    python benchmarks/run.py [-h] [-s SIZES] [-r REPEAT] [-o OUTPUT]
+                             [-b BASELINE] [-t TOLERANCE] [-l] [pattern ...]
+
+Examples::
+
+    # Run the small problems and save the timings
+    python benchmarks/run.py -o baseline.json
+    # Run the prism benchmarks at all sizes and compare with a previous run
+    python benchmarks/run.py -s small,medium,large -b baseline.json prism
+
+Exits with status 1 if any benchmark is slower than the baseline by more than
+the tolerance.
+"""
+import sys
+import os
+import json
+import time
+import timeit
+import fnmatch
+import argparse
+import platform
+import subprocess
+import multiprocessing
+try:
+    import resource
+except ImportError:
+    # Not available on Windows
+    resource = None
+
+import numpy
+
+import fatiando
+from fatiando import gridder, utils, mesher, logger
+from fatiando.gravmag import prism, tesseroid, polyprism, harvester
+from fatiando.seismic import srtomo, ttime2d, wavefd
+from fatiando.inversion import gradient
+
+
+SIZES = ['small', 'medium', 'large']
+# List of (name, setup function, {size: arguments of the setup function})
+BENCHMARKS = []
+
+
+def benchmark(name, small, medium, large):
+    """
+    Register a benchmark.
+
+    The decorated function receives the arguments given for a problem size,
+    does any setup that shouldn't be timed, and returns a function without
+    arguments that does the work.
+    """
+    def decorator(setup):
+        BENCHMARKS.append((name, setup,
+                           dict(small=small, medium=medium, large=large)))
+        return setup
+    return decorator
+
+def _prism_model(npoints, nprisms):
+    """
+    Computation points and a prism mesh with *nprisms* cells.
+    """
+    x, y = gridder.regular((-5000, 5000, -5000, 5000),
+                           _grid_shape(npoints))[:2]
+    z = -100*numpy.ones_like(x)
+    nx = int(round(nprisms**(1./3)))
+    shape = (nprisms//(nx*nx), nx, nx)
+    mesh = mesher.PrismMesh((-2000, 2000, -2000, 2000, 0, 2000), shape)
+    mesh.addprop('density', 1000*numpy.ones(mesh.size))
+    mesh.addprop('magnetization', 2*numpy.ones(mesh.size))
+    return x, y, z, mesh
+
+def _grid_shape(npoints):
+    n = int(round(numpy.sqrt(npoints)))
+    return (n, n)
+
+@benchmark('gravmag.prism.gz', small=(1000, 125), medium=(10000, 1000),
+           large=(100000, 1000))
+def prism_gz(npoints, nprisms):
+    x, y, z, mesh = _prism_model(npoints, nprisms)
+    return lambda: prism.gz(x, y, z, mesh)
+
+@benchmark('gravmag.prism.gzz', small=(1000, 125), medium=(10000, 1000),
+           large=(100000, 1000))
+def prism_gzz(npoints, nprisms):
+    x, y, z, mesh = _prism_model(npoints, nprisms)
+    return lambda: prism.gzz(x, y, z, mesh)
+
+@benchmark('gravmag.prism.tf', small=(1000, 125), medium=(10000, 1000),
+           large=(100000, 1000))
+def prism_tf(npoints, nprisms):
+    x, y, z, mesh = _prism_model(npoints, nprisms)
+    return lambda: prism.tf(x, y, z, mesh, 30, -15)
+
+def _tesseroid_model(npoints, ntesseroids):
+    lon, lat = gridder.regular((-20, 20, -20, 20), _grid_shape(npoints))[:2]
+    height = 250000*numpy.ones_like(lon)
+    nx = int(round(ntesseroids**(1./3)))
+    shape = (ntesseroids//(nx*nx), nx, nx)
+    mesh = mesher.TesseroidMesh((-10, 10, -10, 10, 0, -50000), shape)
+    mesh.addprop('density', 200*numpy.ones(mesh.size))
+    return lon, lat, height, mesh
+
+@benchmark('gravmag.tesseroid.gz', small=(100, 8), medium=(1000, 27),
+           large=(10000, 64))
+def tesseroid_gz(npoints, ntesseroids):
+    lon, lat, height, mesh = _tesseroid_model(npoints, ntesseroids)
+    return lambda: tesseroid.gz(lon, lat, height, mesh)
+
+@benchmark('gravmag.tesseroid.gzz', small=(100, 8), medium=(1000, 27),
+           large=(10000, 64))
+def tesseroid_gzz(npoints, ntesseroids):
+    lon, lat, height, mesh = _tesseroid_model(npoints, ntesseroids)
+    return lambda: tesseroid.gzz(lon, lat, height, mesh)
+
+def _polyprism_model(npoints, nprisms, nvertices):
+    x, y = gridder.regular((-5000, 5000, -5000, 5000),
+                           _grid_shape(npoints))[:2]
+    z = -100*numpy.ones_like(x)
+    angles = numpy.linspace(0, 2*numpy.pi, nvertices, endpoint=False)
+    vertices = numpy.transpose([1000*numpy.cos(angles),
+                                1000*numpy.sin(angles)])
+    props = {'density':1000, 'magnetization':2}
+    model = [mesher.PolygonalPrism(vertices, 100*i, 100*(i + 1), props)
+             for i in xrange(nprisms)]
+    return x, y, z, model
+
+@benchmark('gravmag.polyprism.gz', small=(1000, 5, 10),
+           medium=(10000, 10, 20), large=(100000, 20, 50))
+def polyprism_gz(npoints, nprisms, nvertices):
+    x, y, z, model = _polyprism_model(npoints, nprisms, nvertices)
+    return lambda: polyprism.gz(x, y, z, model)
+
+@benchmark('gravmag.polyprism.tf', small=(1000, 5, 10),
+           medium=(10000, 10, 20), large=(100000, 20, 50))
+def polyprism_tf(npoints, nprisms, nvertices):
+    x, y, z, model = _polyprism_model(npoints, nprisms, nvertices)
+    return lambda: polyprism.tf(x, y, z, model, 30, -15)
+
+@benchmark('gravmag.harvester.harvest', small=((15, 15), (10, 10, 10)),
+           medium=((25, 25), (20, 20, 20)), large=((40, 40), (30, 30, 30)))
+def harvester_harvest(datashape, meshshape):
+    bounds = [0, 1000, 0, 1000, 0, 1000]
+    model = [mesher.Prism(250, 750, 250, 750, 200, 700, {'density':1000})]
+    x, y, z = gridder.regular(bounds[:4], datashape, z=-1)
+    gz = prism.gz(x, y, z, model)
+    def run():
+        mesh = mesher.PrismMesh(bounds, meshshape)
+        data = [harvester.Gz(x, y, z, gz)]
+        seeds = harvester.sow([[500, 500, 450, {'density':1000}]], mesh)
+        harvester.harvest(data, seeds, mesh, compactness=0.5,
+                          threshold=0.0005)
+    return run
+
+def _tomography(shape, nsources, nreceivers):
+    """
+    Synthetic travel-time data and the mesh for the inversion.
+    """
+    area = (0, 100000, 0, 100000)
+    model = mesher.SquareMesh(area, shape)
+    vel = 4000*numpy.ones(shape)
+    vel[shape[0]//4:shape[0]//2, shape[1]//4:shape[1]//2] = 6000
+    model.addprop('vp', vel.ravel())
+    numpy.random.seed(0)
+    srcs, recs = utils.connect_points(
+        utils.random_points(area, nsources),
+        utils.circular_points(area, nreceivers, random=True))
+    ttimes = ttime2d.straight(model, 'vp', srcs, recs)
+    return ttimes, srcs, recs, mesher.SquareMesh(area, shape)
+
+@benchmark('seismic.srtomo.run', small=((10, 10), 20, 10),
+           medium=((30, 30), 50, 30), large=((50, 50), 100, 50))
+def srtomo_run(shape, nsources, nreceivers):
+    ttimes, srcs, recs, mesh = _tomography(shape, nsources, nreceivers)
+    return lambda: srtomo.run(ttimes, srcs, recs, mesh, smooth=0.1)
+
+def _gradient_solver(factory, shape, nsources, nreceivers):
+    ttimes, srcs, recs, mesh = _tomography(shape, nsources, nreceivers)
+    def run():
+        solver = factory(numpy.ones(mesh.size)/4000.)
+        srtomo.run(ttimes, srcs, recs, mesh, solver=solver, damping=0.1)
+    return run
+
+@benchmark('inversion.gradient.newton', small=((10, 10), 20, 10),
+           medium=((30, 30), 50, 30), large=((50, 50), 100, 50))
+def gradient_newton(shape, nsources, nreceivers):
+    return _gradient_solver(gradient.newton, shape, nsources, nreceivers)
+
+@benchmark('inversion.gradient.levmarq', small=((10, 10), 20, 10),
+           medium=((30, 30), 50, 30), large=((50, 50), 100, 50))
+def gradient_levmarq(shape, nsources, nreceivers):
+    return _gradient_solver(gradient.levmarq, shape, nsources, nreceivers)
+
+@benchmark('inversion.gradient.steepest', small=((10, 10), 20, 10),
+           medium=((30, 30), 50, 30), large=((50, 50), 100, 50))
+def gradient_steepest(shape, nsources, nreceivers):
+    return _gradient_solver(gradient.steepest, shape, nsources, nreceivers)
+
+@benchmark('seismic.wavefd.elastic_psv', small=((50, 50), 50),
+           medium=((100, 100), 200), large=((200, 200), 500))
+def wavefd_elastic_psv(shape, iterations):
+    spacing = (500, 500)
+    sources = [wavefd.MexHatSource(shape[1]//4, shape[0]//4, 100, 0.5,
+                                   delay=1.5)]
+    dens = 2700*numpy.ones(shape)
+    svel = 3000*numpy.ones(shape)
+    pvel = 4000*numpy.ones(shape)
+    def run():
+        for step in wavefd.elastic_psv(spacing, shape, pvel, svel, dens, 0.05,
+                                       iterations, sources, sources,
+                                       padding=0.5):
+            pass
+    return run
+
+def _peak_memory():
+    """
+    The peak resident memory of this process in MB (None if unknown).
+    """
+    if resource is None:
+        return None
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # Linux gives the value in kB, OS X in bytes
+    if sys.platform == 'darwin':
+        return peak/1024.**2
+    return peak/1024.
+
+def _measure(setup, args, repeat, conn):
+    """
+    Time a benchmark and send the results through pipe *conn*.
+    Runs in a separate process.
+    """
+    try:
+        func = setup(*args)
+        before = _peak_memory()
+        times = []
+        for i in xrange(repeat):
+            start = timeit.default_timer()
+            func()
+            times.append(timeit.default_timer() - start)
+        after = _peak_memory()
+        result = {'min':min(times), 'median':float(numpy.median(times)),
+                  'times':times, 'peak_memory':after}
+        if before is not None:
+            # Memory used by the computation, not counting the setup
+            result['memory'] = after - before
+        conn.send(result)
+    except Exception, e:
+        conn.send({'error':'%s: %s' % (type(e).__name__, e)})
+    finally:
+        conn.close()
+
+def run(names, sizes, repeat):
+    """
+    Run the benchmarks matching *names* at the given sizes.
+
+    Returns a list of dicts with the results.
+    """
+    results = []
+    for name, setup, params in BENCHMARKS:
+        if names and not any(fnmatch.fnmatch(name, '*%s*' % (n))
+                             for n in names):
+            continue
+        for size in sizes:
+            args = params[size]
+            recv, send = multiprocessing.Pipe(False)
+            proc = multiprocessing.Process(target=_measure,
+                                           args=(setup, args, repeat, send))
+            proc.start()
+            result = recv.recv()
+            proc.join()
+            result.update(name=name, size=size, args=args)
+            results.append(result)
+            if 'error' in result:
+                print '%-30s %-7s FAILED %s' % (name, size, result['error'])
+            else:
+                print '%-30s %-7s %10.4f s %10s' % (name, size,
+                    result['min'], _format_memory(result.get('memory')))
+            sys.stdout.flush()
+    return results
+
+def _format_memory(memory):
+    if memory is None:
+        return '?'
+    return '%.1f MB' % (memory)
+
+def compare(results, baseline, tolerance):
+    """
+    Compare the minimum times with those of a previous run.
+
+    Returns the list of benchmarks slower than the baseline by more than
+    *tolerance* (fraction of the baseline time).
+    """
+    old = dict(((r['name'], r['size']), r) for r in baseline['results']
+               if 'error' not in r)
+    slower = []
+    print
+    print 'Comparison with the baseline (%s):' % (baseline.get('date', '?'))
+    for res in results:
+        key = (res['name'], res['size'])
+        if 'error' in res or key not in old:
+            continue
+        ratio = res['min']/old[key]['min']
+        status = ''
+        if ratio > 1 + tolerance:
+            status = 'SLOWER'
+            slower.append(key)
+        elif ratio < 1 - tolerance:
+            status = 'faster'
+        print '%-30s %-7s %6.2fx %s' % (key[0], key[1], ratio, status)
+    return slower
+
+def _metadata():
+    """
+    Information about the machine and versions used.
+    """
+    try:
+        commit = subprocess.check_output(
+            ['git', 'rev-parse', 'HEAD'], stderr=open(os.devnull, 'w'),
+            cwd=os.path.dirname(os.path.abspath(__file__))).strip()
+    except (OSError, subprocess.CalledProcessError):
+        commit = None
+    return {'date':time.strftime('%Y-%m-%d %H:%M:%S'),
+            'commit':commit,
+            'fatiando':fatiando.version,
+            'python':platform.python_version(),
+            'numpy':numpy.__version__,
+            'platform':platform.platform(),
+            'processor':platform.processor(),
+            'cpus':multiprocessing.cpu_count()}
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(
+        description="Run the Fatiando benchmark suite.")
+    parser.add_argument('patterns', nargs='*',
+        help="Only run the benchmarks with names containing these patterns "
+             + "(wildcards allowed)")
+    parser.add_argument('-s', '--sizes', default='small',
+        help="Comma separated problem sizes to run: %s (default: small)"
+             % (', '.join(SIZES)))
+    parser.add_argument('-r', '--repeat', type=int, default=3,
+        help="Number of times each benchmark is run (default: 3)")
+    parser.add_argument('-o', '--output',
+        help="Save the results to this JSON file")
+    parser.add_argument('-b', '--baseline',
+        help="Compare the results with this JSON file from a previous run")
+    parser.add_argument('-t', '--tolerance', type=float, default=0.1,
+        help="Slowdown relative to the baseline that counts as a regression "
+             + "(default: 0.1)")
+    parser.add_argument('-l', '--list', action='store_true',
+        help="List the benchmarks and exit")
+    args = parser.parse_args(argv)
+    if args.list:
+        for name, setup, params in BENCHMARKS:
+            print name, ' '.join('%s=%s' % (s, params[s]) for s in SIZES)
+        return 0
+    sizes = args.sizes.split(',')
+    for size in sizes:
+        if size not in SIZES:
+            parser.error("invalid size '%s'" % (size))
+    if args.repeat < 1:
+        parser.error("repeat must be >= 1")
+    # Don't let the log messages of the inversions get mixed with the results
+    logger.get().setLevel(logger.logging.WARNING)
+    output = _metadata()
+    output['repeat'] = args.repeat
+    output['results'] = run(args.patterns, sizes, args.repeat)
+    if args.output is not None:
+        with open(args.output, 'w') as f:
+            json.dump(output, f, indent=2, sort_keys=True)
+    status = 0
+    if any('error' in r for r in output['results']):
+        status = 1
+    if args.baseline is not None:
+        with open(args.baseline) as f:
+            baseline = json.load(f)
+        if compare(output['results'], baseline, args.tolerance):
+            status = 1
+    return status
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -29,6 +29,8 @@ The inversion modules use the forward modeling models and the
   planting anomalous densities
 * :mod:`~fatiando.gravmag.euler`: 3D Euler deconvolution methods to estimate source
   location
+* :mod:`~fatiando.gravmag.sensitivity`: Build large sensitivity matrices on disk
+  or compressed with wavelets
 
 **Processing**
 
@@ -50,4 +52,4 @@ after modeling.
 
 from fatiando.gravmag import (basin2d, polyprism, prism, talwani, transform,
     harvester, sphere, tensor, fourier, imaging, euler, tesseroid,
-    half_sph_shell)
+    half_sph_shell, sensitivity)
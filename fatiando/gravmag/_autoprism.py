@@ -0,0 +1,748 @@
+"""
+.. note::
+
+    Selection of the implementation (backend) used by the forward modeling
+    functions of :mod:`fatiando.gravmag.prism`. Functions are loaded into
+    :mod:`fatiando.gravmag.prism`.
+
+----
+"""
+import timeit
+
+import numpy
+
+from fatiando.mesher import PrismArray
+from fatiando.gravmag import _prism
+try:
+    from fatiando.gravmag import _cprism
+except ImportError:
+    _cprism = None
+try:
+    from fatiando.gravmag import _neprism
+except ImportError:
+    _neprism = None
+
+__all__ = ['set_backend', 'get_backend', 'potential', 'gx', 'gy', 'gz', 'gxx',
+    'gxy', 'gxz', 'gyy', 'gyz', 'gzz', 'tf']
+
+# The implementations that are available, from fastest to slowest in general
+_BACKENDS = [(name, module) for name, module in [('cython', _cprism),
+                                                 ('numexpr', _neprism),
+                                                 ('numpy', _prism)]
+             if module is not None]
+# The current backend and the fastest backend found by 'auto' for each
+# (function, number of points, number of prisms) bucket
+_backend = _BACKENDS[0][0]
+_calibration = {}
+# The maximum size of the synthetic problem timed by 'auto' (number of points,
+# number of prisms, and number of point-prism pairs, but always at least 10
+# prisms) and how many times each backend is timed
+_CALIBRATION_POINTS = 5000
+_CALIBRATION_PRISMS = 200
+_CALIBRATION_PAIRS = 50000
+_CALIBRATION_REPEAT = 3
+
+
+def set_backend(backend='auto'):
+    """
+    Set the implementation used by the forward modeling functions.
+
+    The Cython implementation is used by default if it was compiled. With
+    ``'auto'``, the first time a function is called with a certain problem size
+    all available backends are timed on a synthetic model with the same number
+    of computation points and prisms (up to a maximum size), keeping the best
+    of a few runs. The fastest is used from then on for problems of similar
+    size (same order of magnitude of the number of points and prisms).
+
+    The backend is used by :func:`~fatiando.gravmag._autoprism.potential`,
+    :func:`~fatiando.gravmag._autoprism.gx`,
+    :func:`~fatiando.gravmag._autoprism.gy`,
+    :func:`~fatiando.gravmag._autoprism.gz`,
+    :func:`~fatiando.gravmag._autoprism.gxx`,
+    :func:`~fatiando.gravmag._autoprism.gxy`,
+    :func:`~fatiando.gravmag._autoprism.gxz`,
+    :func:`~fatiando.gravmag._autoprism.gyy`,
+    :func:`~fatiando.gravmag._autoprism.gyz`,
+    :func:`~fatiando.gravmag._autoprism.gzz`, and
+    :func:`~fatiando.gravmag._autoprism.tf`.
+
+    Parameters:
+
+    * backend : str
+        Can be ``'cython'`` (compiled extension), ``'numpy'`` (pure Python and
+        numpy), ``'numexpr'`` (needs the numexpr package), or ``'auto'``.
+
+    Examples:
+
+        >>> from fatiando.gravmag import prism
+        >>> prism.set_backend('numpy')
+        >>> print prism.get_backend()
+        numpy
+        >>> prism.set_backend('cython')
+        >>> print prism.get_backend()
+        cython
+
+    """
+    global _backend
+    names = [name for name, module in _BACKENDS]
+    if backend != 'auto' and backend not in names:
+        raise ValueError("Invalid backend '%s'. Available: %s"
+                         % (backend, ', '.join(names + ['auto'])))
+    _backend = backend
+    _calibration.clear()
+
+def get_backend():
+    """
+    Get the name of the backend used by the forward modeling functions.
+
+    See :func:`~fatiando.gravmag._autoprism.set_backend`.
+
+    Returns:
+
+    * backend : str
+        One of ``'cython'``, ``'numpy'``, ``'numexpr'``, or ``'auto'``.
+
+    """
+    return _backend
+
+def _choose(name, xp, prisms, kwargs):
+    """
+    Get the module that implements function *name* for this problem.
+    """
+    if _backend != 'auto':
+        return dict(_BACKENDS)[_backend]
+    ndata = len(xp)
+    if isinstance(prisms, PrismArray) or hasattr(prisms, 'shape'):
+        ncells = prisms.size
+    else:
+        ncells = len(prisms)
+    bucket = (name, int(numpy.log10(max(ndata, 1))),
+              int(numpy.log10(max(ncells, 1))))
+    if bucket not in _calibration:
+        _calibration[bucket] = _calibrate(name, ndata, ncells, kwargs)
+    return dict(_BACKENDS)[_calibration[bucket]]
+
+def _calibrate(name, ndata, ncells, kwargs):
+    """
+    Time all backends on a synthetic problem with *ndata* points and *ncells*
+    prisms (limited by the _CALIBRATION_* sizes) and return the name of the
+    fastest. Each backend is timed _CALIBRATION_REPEAT times and the best time
+    is used, so that a single slow run doesn't decide.
+    """
+    from fatiando.mesher import Prism
+    npoints = max(min(ndata, _CALIBRATION_POINTS), 1)
+    nprisms = max(min(ncells, _CALIBRATION_PRISMS,
+                      max(_CALIBRATION_PAIRS//npoints, 10)), 1)
+    x = numpy.linspace(-1000, 1000, npoints)
+    y = numpy.linspace(-500, 1500, npoints)
+    z = -10*numpy.ones(npoints)
+    props = {'density':1000., 'magnetization':1.}
+    model = [Prism(100*i, 100*(i + 1), -100, 100, 50, 250, props)
+             for i in xrange(nprisms)]
+    times = []
+    for backend, module in _BACKENDS:
+        func = getattr(module, name)
+        # Call once first so that things like the compilation of the numexpr
+        # expressions don't count
+        func(x[:2], y[:2], z[:2], model[:1], **kwargs)
+        timer = timeit.Timer(lambda: func(x, y, z, model, **kwargs))
+        times.append((min(timer.repeat(_CALIBRATION_REPEAT, 1)), backend))
+    return min(times)[1]
+
+def _call(name, xp, yp, zp, prisms, **kwargs):
+    """
+    Call function *name* of the backend chosen for this problem.
+    """
+    module = _choose(name, xp, prisms, kwargs)
+    return getattr(module, name)(xp, yp, zp, prisms, **kwargs)
+
+def potential(xp, yp, zp, prisms, dens=None, njobs=1, ratio=None,
+              dtype=numpy.float):
+    """
+    Calculates the gravitational potential.
+
+    Uses the backend set by :func:`~fatiando.gravmag._autoprism.set_backend`
+    (the Cython implementation by default, if it was compiled).
+
+    .. note:: The coordinate system of the input parameters is to be x -> North,
+        y -> East and z -> Down.
+
+    .. note:: All input values in **SI** units(!) and output in **mGal**!
+
+    Parameters:
+
+    * xp, yp, zp : arrays
+        Arrays with the x, y, and z coordinates of the computation points.
+    * prisms : list of :class:`~fatiando.mesher.Prism`
+        The density model used to calculate the gravitational effect.
+        Prisms must have the property ``'density'``. Prisms that don't have this
+        property will be ignored in the computations. Elements of *prisms* that
+        are None will also be ignored. *prisms* can also be a
+        :class:`~fatiando.mesher.PrismMesh` or a
+        :class:`~fatiando.mesher.PrismArray`.
+    * dens : float or None
+        If not None, will use this value instead of the ``'density'`` property
+        of the prisms. Use this, e.g., for sensitivity matrix building.
+
+        .. warning:: Uses this value for **all** prisms! Not only the ones that
+            have ``'density'`` as a property.
+
+    * njobs : int
+        Number of threads used to compute the points in parallel. Used by the
+        Cython (with OpenMP) and numexpr backends. The numpy backend ignores
+        it.
+    * ratio : float or None
+        If not None, prisms that are farther than *ratio* times their size
+        (the length of their diagonal) from a computation point are
+        approximated by their multipole expansion (a point mass at their
+        center plus the quadrupole term). This is faster and the error
+        decreases with the fourth power of the distance. If None, will always
+        use the exact formula.
+    * dtype : numpy dtype
+        The type of the output array. Can be ``numpy.float64`` or
+        ``numpy.float32``. The calculations are always done in double
+        precision, so single precision only rounds the result (relative error
+        smaller than 1e-7).
+
+    Returns:
+
+    * res : array
+        The field calculated on xp, yp, zp
+
+    """
+    return _call('potential', xp, yp, zp, prisms, dens=dens, njobs=njobs,
+                 ratio=ratio, dtype=dtype)
+
+def gx(xp, yp, zp, prisms, dens=None, njobs=1, ratio=None,
+       dtype=numpy.float):
+    """
+    Calculates the :math:`g_x` gravity acceleration component.
+
+    Uses the backend set by :func:`~fatiando.gravmag._autoprism.set_backend`
+    (the Cython implementation by default, if it was compiled).
+
+    .. note:: The coordinate system of the input parameters is to be x -> North,
+        y -> East and z -> **DOWN**.
+
+    .. note:: All input values in **SI** units(!) and output in **mGal**!
+
+    Parameters:
+
+    * xp, yp, zp : arrays
+        Arrays with the x, y, and z coordinates of the computation points.
+    * prisms : list of :class:`~fatiando.mesher.Prism`
+        The density model used to calculate the gravitational effect.
+        Prisms must have the property ``'density'``. Prisms that don't have this
+        property will be ignored in the computations. Elements of *prisms* that
+        are None will also be ignored. *prisms* can also be a
+        :class:`~fatiando.mesher.PrismMesh` or a
+        :class:`~fatiando.mesher.PrismArray`.
+    * dens : float or None
+        If not None, will use this value instead of the ``'density'`` property
+        of the prisms. Use this, e.g., for sensitivity matrix building.
+    * njobs : int
+        Number of threads used to compute the points in parallel. Used by the
+        Cython (with OpenMP) and numexpr backends. The numpy backend ignores
+        it.
+    * ratio : float or None
+        If not None, prisms that are farther than *ratio* times their size
+        (the length of their diagonal) from a computation point are
+        approximated by their multipole expansion (a point mass at their
+        center plus the quadrupole term). This is faster and the error
+        decreases with the fourth power of the distance. If None, will always
+        use the exact formula.
+    * dtype : numpy dtype
+        The type of the output array. Can be ``numpy.float64`` or
+        ``numpy.float32``. The calculations are always done in double
+        precision, so single precision only rounds the result (relative error
+        smaller than 1e-7).
+
+    Returns:
+
+    * res : array
+        The field calculated on xp, yp, zp
+
+    """
+    return _call('gx', xp, yp, zp, prisms, dens=dens, njobs=njobs,
+                 ratio=ratio, dtype=dtype)
+
+def gy(xp, yp, zp, prisms, dens=None, njobs=1, ratio=None,
+       dtype=numpy.float):
+    """
+    Calculates the :math:`g_y` gravity acceleration component.
+
+    Uses the backend set by :func:`~fatiando.gravmag._autoprism.set_backend`
+    (the Cython implementation by default, if it was compiled).
+
+    .. note:: The coordinate system of the input parameters is to be x -> North,
+        y -> East and z -> **DOWN**.
+
+    .. note:: All input values in **SI** units(!) and output in **mGal**!
+
+    Parameters:
+
+    * xp, yp, zp : arrays
+        Arrays with the x, y, and z coordinates of the computation points.
+    * prisms : list of :class:`~fatiando.mesher.Prism`
+        The density model used to calculate the gravitational effect.
+        Prisms must have the property ``'density'``. Prisms that don't have this
+        property will be ignored in the computations. Elements of *prisms* that
+        are None will also be ignored. *prisms* can also be a
+        :class:`~fatiando.mesher.PrismMesh` or a
+        :class:`~fatiando.mesher.PrismArray`.
+    * dens : float or None
+        If not None, will use this value instead of the ``'density'`` property
+        of the prisms. Use this, e.g., for sensitivity matrix building.
+    * njobs : int
+        Number of threads used to compute the points in parallel. Used by the
+        Cython (with OpenMP) and numexpr backends. The numpy backend ignores
+        it.
+    * ratio : float or None
+        If not None, prisms that are farther than *ratio* times their size
+        (the length of their diagonal) from a computation point are
+        approximated by their multipole expansion (a point mass at their
+        center plus the quadrupole term). This is faster and the error
+        decreases with the fourth power of the distance. If None, will always
+        use the exact formula.
+    * dtype : numpy dtype
+        The type of the output array. Can be ``numpy.float64`` or
+        ``numpy.float32``. The calculations are always done in double
+        precision, so single precision only rounds the result (relative error
+        smaller than 1e-7).
+
+    Returns:
+
+    * res : array
+        The field calculated on xp, yp, zp
+
+    """
+    return _call('gy', xp, yp, zp, prisms, dens=dens, njobs=njobs,
+                 ratio=ratio, dtype=dtype)
+
+def gz(xp, yp, zp, prisms, dens=None, njobs=1, ratio=None,
+       dtype=numpy.float):
+    """
+    Calculates the :math:`g_z` gravity acceleration component.
+
+    Uses the backend set by :func:`~fatiando.gravmag._autoprism.set_backend`
+    (the Cython implementation by default, if it was compiled).
+
+    .. note:: The coordinate system of the input parameters is to be x -> North,
+        y -> East and z -> **DOWN**.
+
+    .. note:: All input values in **SI** units(!) and output in **mGal**!
+
+    Parameters:
+
+    * xp, yp, zp : arrays
+        Arrays with the x, y, and z coordinates of the computation points.
+    * prisms : list of :class:`~fatiando.mesher.Prism`
+        The density model used to calculate the gravitational effect.
+        Prisms must have the property ``'density'``. Prisms that don't have this
+        property will be ignored in the computations. Elements of *prisms* that
+        are None will also be ignored. *prisms* can also be a
+        :class:`~fatiando.mesher.PrismMesh` or a
+        :class:`~fatiando.mesher.PrismArray`.
+    * dens : float or None
+        If not None, will use this value instead of the ``'density'`` property
+        of the prisms. Use this, e.g., for sensitivity matrix building.
+    * njobs : int
+        Number of threads used to compute the points in parallel. Used by the
+        Cython (with OpenMP) and numexpr backends. The numpy backend ignores
+        it.
+    * ratio : float or None
+        If not None, prisms that are farther than *ratio* times their size
+        (the length of their diagonal) from a computation point are
+        approximated by their multipole expansion (a point mass at their
+        center plus the quadrupole term). This is faster and the error
+        decreases with the fourth power of the distance. If None, will always
+        use the exact formula.
+    * dtype : numpy dtype
+        The type of the output array. Can be ``numpy.float64`` or
+        ``numpy.float32``. The calculations are always done in double
+        precision, so single precision only rounds the result (relative error
+        smaller than 1e-7).
+
+    Returns:
+
+    * res : array
+        The field calculated on xp, yp, zp
+
+    """
+    return _call('gz', xp, yp, zp, prisms, dens=dens, njobs=njobs,
+                 ratio=ratio, dtype=dtype)
+
+def gxx(xp, yp, zp, prisms, dens=None, njobs=1, ratio=None,
+        dtype=numpy.float):
+    """
+    Calculates the :math:`g_{xx}` gravity gradient tensor component.
+
+    Uses the backend set by :func:`~fatiando.gravmag._autoprism.set_backend`
+    (the Cython implementation by default, if it was compiled).
+
+    .. note:: The coordinate system of the input parameters is to be x -> North,
+        y -> East and z -> **DOWN**.
+
+    .. note:: All input values in **SI** units(!) and output in **mGal**!
+
+    Parameters:
+
+    * xp, yp, zp : arrays
+        Arrays with the x, y, and z coordinates of the computation points.
+    * prisms : list of :class:`~fatiando.mesher.Prism`
+        The density model used to calculate the gravitational effect.
+        Prisms must have the property ``'density'``. Prisms that don't have this
+        property will be ignored in the computations. Elements of *prisms* that
+        are None will also be ignored. *prisms* can also be a
+        :class:`~fatiando.mesher.PrismMesh` or a
+        :class:`~fatiando.mesher.PrismArray`.
+    * dens : float or None
+        If not None, will use this value instead of the ``'density'`` property
+        of the prisms. Use this, e.g., for sensitivity matrix building.
+    * njobs : int
+        Number of threads used to compute the points in parallel. Used by the
+        Cython (with OpenMP) and numexpr backends. The numpy backend ignores
+        it.
+    * ratio : float or None
+        If not None, prisms that are farther than *ratio* times their size
+        (the length of their diagonal) from a computation point are
+        approximated by their multipole expansion (a point mass at their
+        center plus the quadrupole term). This is faster and the error
+        decreases with the fourth power of the distance. If None, will always
+        use the exact formula.
+    * dtype : numpy dtype
+        The type of the output array. Can be ``numpy.float64`` or
+        ``numpy.float32``. The calculations are always done in double
+        precision, so single precision only rounds the result (relative error
+        smaller than 1e-7).
+
+    Returns:
+
+    * res : array
+        The field calculated on xp, yp, zp
+
+    """
+    return _call('gxx', xp, yp, zp, prisms, dens=dens, njobs=njobs,
+                 ratio=ratio, dtype=dtype)
+
+def gxy(xp, yp, zp, prisms, dens=None, njobs=1, ratio=None,
+        dtype=numpy.float):
+    """
+    Calculates the :math:`g_{xy}` gravity gradient tensor component.
+
+    Uses the backend set by :func:`~fatiando.gravmag._autoprism.set_backend`
+    (the Cython implementation by default, if it was compiled).
+
+    .. note:: The coordinate system of the input parameters is to be x -> North,
+        y -> East and z -> **DOWN**.
+
+    .. note:: All input values in **SI** units(!) and output in **mGal**!
+
+    Parameters:
+
+    * xp, yp, zp : arrays
+        Arrays with the x, y, and z coordinates of the computation points.
+    * prisms : list of :class:`~fatiando.mesher.Prism`
+        The density model used to calculate the gravitational effect.
+        Prisms must have the property ``'density'``. Prisms that don't have this
+        property will be ignored in the computations. Elements of *prisms* that
+        are None will also be ignored. *prisms* can also be a
+        :class:`~fatiando.mesher.PrismMesh` or a
+        :class:`~fatiando.mesher.PrismArray`.
+    * dens : float or None
+        If not None, will use this value instead of the ``'density'`` property
+        of the prisms. Use this, e.g., for sensitivity matrix building.
+    * njobs : int
+        Number of threads used to compute the points in parallel. Used by the
+        Cython (with OpenMP) and numexpr backends. The numpy backend ignores
+        it.
+    * ratio : float or None
+        If not None, prisms that are farther than *ratio* times their size
+        (the length of their diagonal) from a computation point are
+        approximated by their multipole expansion (a point mass at their
+        center plus the quadrupole term). This is faster and the error
+        decreases with the fourth power of the distance. If None, will always
+        use the exact formula.
+    * dtype : numpy dtype
+        The type of the output array. Can be ``numpy.float64`` or
+        ``numpy.float32``. The calculations are always done in double
+        precision, so single precision only rounds the result (relative error
+        smaller than 1e-7).
+
+    Returns:
+
+    * res : array
+        The field calculated on xp, yp, zp
+
+    """
+    return _call('gxy', xp, yp, zp, prisms, dens=dens, njobs=njobs,
+                 ratio=ratio, dtype=dtype)
+
+def gxz(xp, yp, zp, prisms, dens=None, njobs=1, ratio=None,
+        dtype=numpy.float):
+    """
+    Calculates the :math:`g_{xz}` gravity gradient tensor component.
+
+    Uses the backend set by :func:`~fatiando.gravmag._autoprism.set_backend`
+    (the Cython implementation by default, if it was compiled).
+
+    .. note:: The coordinate system of the input parameters is to be x -> North,
+        y -> East and z -> **DOWN**.
+
+    .. note:: All input values in **SI** units(!) and output in **mGal**!
+
+    Parameters:
+
+    * xp, yp, zp : arrays
+        Arrays with the x, y, and z coordinates of the computation points.
+    * prisms : list of :class:`~fatiando.mesher.Prism`
+        The density model used to calculate the gravitational effect.
+        Prisms must have the property ``'density'``. Prisms that don't have this
+        property will be ignored in the computations. Elements of *prisms* that
+        are None will also be ignored. *prisms* can also be a
+        :class:`~fatiando.mesher.PrismMesh` or a
+        :class:`~fatiando.mesher.PrismArray`.
+    * dens : float or None
+        If not None, will use this value instead of the ``'density'`` property
+        of the prisms. Use this, e.g., for sensitivity matrix building.
+    * njobs : int
+        Number of threads used to compute the points in parallel. Used by the
+        Cython (with OpenMP) and numexpr backends. The numpy backend ignores
+        it.
+    * ratio : float or None
+        If not None, prisms that are farther than *ratio* times their size
+        (the length of their diagonal) from a computation point are
+        approximated by their multipole expansion (a point mass at their
+        center plus the quadrupole term). This is faster and the error
+        decreases with the fourth power of the distance. If None, will always
+        use the exact formula.
+    * dtype : numpy dtype
+        The type of the output array. Can be ``numpy.float64`` or
+        ``numpy.float32``. The calculations are always done in double
+        precision, so single precision only rounds the result (relative error
+        smaller than 1e-7).
+
+    Returns:
+
+    * res : array
+        The field calculated on xp, yp, zp
+
+    """
+    return _call('gxz', xp, yp, zp, prisms, dens=dens, njobs=njobs,
+                 ratio=ratio, dtype=dtype)
+
+def gyy(xp, yp, zp, prisms, dens=None, njobs=1, ratio=None,
+        dtype=numpy.float):
+    """
+    Calculates the :math:`g_{yy}` gravity gradient tensor component.
+
+    Uses the backend set by :func:`~fatiando.gravmag._autoprism.set_backend`
+    (the Cython implementation by default, if it was compiled).
+
+    .. note:: The coordinate system of the input parameters is to be x -> North,
+        y -> East and z -> **DOWN**.
+
+    .. note:: All input values in **SI** units(!) and output in **mGal**!
+
+    Parameters:
+
+    * xp, yp, zp : arrays
+        Arrays with the x, y, and z coordinates of the computation points.
+    * prisms : list of :class:`~fatiando.mesher.Prism`
+        The density model used to calculate the gravitational effect.
+        Prisms must have the property ``'density'``. Prisms that don't have this
+        property will be ignored in the computations. Elements of *prisms* that
+        are None will also be ignored. *prisms* can also be a
+        :class:`~fatiando.mesher.PrismMesh` or a
+        :class:`~fatiando.mesher.PrismArray`.
+    * dens : float or None
+        If not None, will use this value instead of the ``'density'`` property
+        of the prisms. Use this, e.g., for sensitivity matrix building.
+    * njobs : int
+        Number of threads used to compute the points in parallel. Used by the
+        Cython (with OpenMP) and numexpr backends. The numpy backend ignores
+        it.
+    * ratio : float or None
+        If not None, prisms that are farther than *ratio* times their size
+        (the length of their diagonal) from a computation point are
+        approximated by their multipole expansion (a point mass at their
+        center plus the quadrupole term). This is faster and the error
+        decreases with the fourth power of the distance. If None, will always
+        use the exact formula.
+    * dtype : numpy dtype
+        The type of the output array. Can be ``numpy.float64`` or
+        ``numpy.float32``. The calculations are always done in double
+        precision, so single precision only rounds the result (relative error
+        smaller than 1e-7).
+
+    Returns:
+
+    * res : array
+        The field calculated on xp, yp, zp
+
+    """
+    return _call('gyy', xp, yp, zp, prisms, dens=dens, njobs=njobs,
+                 ratio=ratio, dtype=dtype)
+
+def gyz(xp, yp, zp, prisms, dens=None, njobs=1, ratio=None,
+        dtype=numpy.float):
+    """
+    Calculates the :math:`g_{yz}` gravity gradient tensor component.
+
+    Uses the backend set by :func:`~fatiando.gravmag._autoprism.set_backend`
+    (the Cython implementation by default, if it was compiled).
+
+    .. note:: The coordinate system of the input parameters is to be x -> North,
+        y -> East and z -> **DOWN**.
+
+    .. note:: All input values in **SI** units(!) and output in **mGal**!
+
+    Parameters:
+
+    * xp, yp, zp : arrays
+        Arrays with the x, y, and z coordinates of the computation points.
+    * prisms : list of :class:`~fatiando.mesher.Prism`
+        The density model used to calculate the gravitational effect.
+        Prisms must have the property ``'density'``. Prisms that don't have this
+        property will be ignored in the computations. Elements of *prisms* that
+        are None will also be ignored. *prisms* can also be a
+        :class:`~fatiando.mesher.PrismMesh` or a
+        :class:`~fatiando.mesher.PrismArray`.
+    * dens : float or None
+        If not None, will use this value instead of the ``'density'`` property
+        of the prisms. Use this, e.g., for sensitivity matrix building.
+    * njobs : int
+        Number of threads used to compute the points in parallel. Used by the
+        Cython (with OpenMP) and numexpr backends. The numpy backend ignores
+        it.
+    * ratio : float or None
+        If not None, prisms that are farther than *ratio* times their size
+        (the length of their diagonal) from a computation point are
+        approximated by their multipole expansion (a point mass at their
+        center plus the quadrupole term). This is faster and the error
+        decreases with the fourth power of the distance. If None, will always
+        use the exact formula.
+    * dtype : numpy dtype
+        The type of the output array. Can be ``numpy.float64`` or
+        ``numpy.float32``. The calculations are always done in double
+        precision, so single precision only rounds the result (relative error
+        smaller than 1e-7).
+
+    Returns:
+
+    * res : array
+        The field calculated on xp, yp, zp
+
+    """
+    return _call('gyz', xp, yp, zp, prisms, dens=dens, njobs=njobs,
+                 ratio=ratio, dtype=dtype)
+
+def gzz(xp, yp, zp, prisms, dens=None, njobs=1, ratio=None,
+        dtype=numpy.float):
+    """
+    Calculates the :math:`g_{zz}` gravity gradient tensor component.
+
+    Uses the backend set by :func:`~fatiando.gravmag._autoprism.set_backend`
+    (the Cython implementation by default, if it was compiled).
+
+    .. note:: The coordinate system of the input parameters is to be x -> North,
+        y -> East and z -> **DOWN**.
+
+    .. note:: All input values in **SI** units(!) and output in **mGal**!
+
+    Parameters:
+
+    * xp, yp, zp : arrays
+        Arrays with the x, y, and z coordinates of the computation points.
+    * prisms : list of :class:`~fatiando.mesher.Prism`
+        The density model used to calculate the gravitational effect.
+        Prisms must have the property ``'density'``. Prisms that don't have this
+        property will be ignored in the computations. Elements of *prisms* that
+        are None will also be ignored. *prisms* can also be a
+        :class:`~fatiando.mesher.PrismMesh` or a
+        :class:`~fatiando.mesher.PrismArray`.
+    * dens : float or None
+        If not None, will use this value instead of the ``'density'`` property
+        of the prisms. Use this, e.g., for sensitivity matrix building.
+    * njobs : int
+        Number of threads used to compute the points in parallel. Used by the
+        Cython (with OpenMP) and numexpr backends. The numpy backend ignores
+        it.
+    * ratio : float or None
+        If not None, prisms that are farther than *ratio* times their size
+        (the length of their diagonal) from a computation point are
+        approximated by their multipole expansion (a point mass at their
+        center plus the quadrupole term). This is faster and the error
+        decreases with the fourth power of the distance. If None, will always
+        use the exact formula.
+    * dtype : numpy dtype
+        The type of the output array. Can be ``numpy.float64`` or
+        ``numpy.float32``. The calculations are always done in double
+        precision, so single precision only rounds the result (relative error
+        smaller than 1e-7).
+
+    Returns:
+
+    * res : array
+        The field calculated on xp, yp, zp
+
+    """
+    return _call('gzz', xp, yp, zp, prisms, dens=dens, njobs=njobs,
+                 ratio=ratio, dtype=dtype)
+
+def tf(xp, yp, zp, prisms, inc, dec, pmag=None, pinc=None, pdec=None,
+       njobs=1, dtype=numpy.float):
+    """
+    Calculate the total-field anomaly of prisms.
+
+    Uses the backend set by :func:`~fatiando.gravmag._autoprism.set_backend`
+    (the Cython implementation by default, if it was compiled).
+
+    .. note:: Input units are SI. Output is in nT
+
+    .. note:: The coordinate system of the input parameters is to be x -> North,
+        y -> East and z -> Down.
+
+    Parameters:
+
+    * xp, yp, zp : arrays
+        Arrays with the x, y, and z coordinates of the computation points.
+    * prisms : list of :class:`~fatiando.mesher.Prism`
+        The model used to calculate the total field anomaly.
+        Prisms must have the physical property ``'magnetization'`` will be
+        ignored. If the physical properties ``'inclination'`` and
+        ``'declination'`` are not present, will use the values of *inc* and
+        *dec* instead (regional field).
+        *prisms* can also be a :class:`~fatiando.mesher.PrismMesh` or a
+        :class:`~fatiando.mesher.PrismArray`.
+    * inc : float
+        The inclination of the regional field (in degrees)
+    * dec : float
+        The declination of the regional field (in degrees)
+    * pmag : float or None
+        If not None, will use this value instead of the ``'magnetization'``
+        property of the prisms. Use this, e.g., for sensitivity matrix building.
+    * pinc : float or None
+        If not None, will use this value instead of the ``'inclination'``
+        property of the prisms. Use this, e.g., for sensitivity matrix building.
+    * pdec : float or None
+        If not None, will use this value instead of the ``'declination'``
+        property of the prisms. Use this, e.g., for sensitivity matrix building.
+    * njobs : int
+        Number of threads used to compute the points in parallel. Used by the
+        Cython (with OpenMP) and numexpr backends. The numpy backend ignores
+        it.
+    * dtype : numpy dtype
+        The type of the output array. Can be ``numpy.float64`` or
+        ``numpy.float32``. The calculations are always done in double
+        precision, so single precision only rounds the result (relative error
+        smaller than 1e-7).
+
+    Returns:
+
+    * res : array
+        The field calculated on xp, yp, zp
+
+    """
+    return _call('tf', xp, yp, zp, prisms, inc=inc, dec=dec, pmag=pmag,
+                 pinc=pinc, pdec=pdec, njobs=njobs, dtype=dtype)
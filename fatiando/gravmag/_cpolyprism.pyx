@@ -0,0 +1,747 @@
+"""
+Cython implementation of the potential field effects of prisms with polygonal
+crossection
+"""
+import numpy
+
+from libc.math cimport log, atan2, sqrt
+# Import Cython definitions for numpy
+cimport numpy
+cimport cython
+
+DTYPE = numpy.float
+ctypedef numpy.float_t DTYPE_T
+
+from fatiando.constants import CM, T2NT
+from fatiando import utils
+from fatiando.gravmag._prism import _check_dtype
+from fatiando.gravmag._polyprism import _FIELDS, _SCALE, _check_components
+
+__all__ = ['gz', 'gxx', 'gxy', 'gxz', 'gyy', 'gyz', 'gzz', 'tf', 'fields']
+
+# Used to avoid singularities
+cdef DTYPE_T dummy = 10.**(-10)
+
+# The integrals of the fields along one edge of the polygon. They are evaluated
+# with the coordinates of the two vertices of the edge relative to the
+# computation point. X1, Y1 and X2, Y2 are the horizontal coordinates of the
+# vertices and A1, A2 their horizontal distances to the point. Z1, Z2 are the
+# top and bottom of the prism. R11, R12 are the distances from the first
+# vertex at the top and bottom to the point and R21, R22 the same for the
+# second vertex. The distances are calculated once for each vertex and shared
+# by the two edges that touch it.
+ctypedef DTYPE_T (*edge_func)(DTYPE_T, DTYPE_T, DTYPE_T, DTYPE_T, DTYPE_T,
+                              DTYPE_T, DTYPE_T, DTYPE_T, DTYPE_T, DTYPE_T,
+                              DTYPE_T, DTYPE_T) nogil
+
+# The quantities that depend only on the horizontal geometry of an edge
+cdef struct edge_t:
+    DTYPE_T n, g, m, c, p, d1, d2
+
+@cython.cdivision(True)
+cdef inline void _edge_geometry(DTYPE_T X1, DTYPE_T Y1, DTYPE_T X2,
+        DTYPE_T Y2, edge_t *edge) nogil:
+    cdef DTYPE_T aux0, aux1, aux2
+    aux0 = X2 - X1 + dummy
+    aux1 = Y2 - Y1 + dummy
+    edge.n = aux0/aux1
+    edge.g = X1 - Y1*edge.n
+    edge.m = aux1/aux0
+    edge.c = Y1 - X1*edge.m
+    aux2 = sqrt(aux0*aux0 + aux1*aux1)
+    edge.p = (X1*Y2 - X2*Y1)/aux2 + dummy
+    edge.d1 = (aux0*X1 + aux1*Y1)/aux2 + dummy
+    edge.d2 = (aux0*X2 + aux1*Y2)/aux2 + dummy
+
+@cython.cdivision(True)
+cdef inline DTYPE_T _edge_gz(DTYPE_T X1, DTYPE_T Y1, DTYPE_T A1, DTYPE_T R11,
+        DTYPE_T R12, DTYPE_T X2, DTYPE_T Y2, DTYPE_T A2, DTYPE_T R21,
+        DTYPE_T R22, DTYPE_T Z1, DTYPE_T Z2) nogil:
+    cdef DTYPE_T p, Q1, Q2, B1, B2, C1, C2, res
+    p = X1*Y2 - X2*Y1
+    Q1 = (Y2 - Y1)*Y1 + (X2 - X1)*X1
+    Q2 = (Y2 - Y1)*Y2 + (X2 - X1)*X2
+    B1 = sqrt(Q1*Q1 + p*p)
+    B2 = sqrt(Q2*Q2 + p*p)
+    res = (Z2 - Z1)*(atan2(Q2, p) - atan2(Q1, p))
+    res += Z2*(atan2(Z2*Q1, R12*p) - atan2(Z2*Q2, R22*p))
+    res += Z1*(atan2(Z1*Q2, R21*p) - atan2(Z1*Q1, R11*p))
+    C1 = Q1*A1
+    C2 = Q2*A2
+    # dummy helps prevent zero division errors
+    res += 0.5*p*(A1/(B1 + dummy))*(
+        log((R11*B1 - C1)/(R11*B1 + C1 + dummy) + dummy) -
+        log((R12*B1 - C1)/(R12*B1 + C1 + dummy) + dummy))
+    res += 0.5*p*(A2/(B2 + dummy))*(
+        log((R22*B2 - C2)/(R22*B2 + C2 + dummy) + dummy) -
+        log((R21*B2 - C2)/(R21*B2 + C2 + dummy) + dummy))
+    return res
+
+@cython.cdivision(True)
+cdef inline DTYPE_T _edge_gxx(DTYPE_T X1, DTYPE_T Y1, DTYPE_T A1, DTYPE_T R11,
+        DTYPE_T R12, DTYPE_T X2, DTYPE_T Y2, DTYPE_T A2, DTYPE_T R21,
+        DTYPE_T R22, DTYPE_T Z1, DTYPE_T Z2) nogil:
+    cdef edge_t e
+    cdef DTYPE_T t1, t2, res
+    _edge_geometry(X1, Y1, X2, Y2, &e)
+    t2 = atan2(Z2*e.d2, e.p*R22) - atan2(Z1*e.d2, e.p*R21)
+    t1 = atan2(Z2*e.d1, e.p*R12) - atan2(Z1*e.d1, e.p*R11)
+    res = e.g*Y2*t2/(e.p*e.d2) + e.n*e.p*t2/e.d2
+    res -= e.g*Y1*t1/(e.p*e.d1) + e.n*e.p*t1/e.d1
+    res += e.n*((log(Z2 + R12 + dummy) - log(Z1 + R11 + dummy))
+                - (log(Z2 + R22 + dummy) - log(Z1 + R21 + dummy)))
+    return -res/(1. + e.n*e.n)
+
+@cython.cdivision(True)
+cdef inline DTYPE_T _edge_gxy(DTYPE_T X1, DTYPE_T Y1, DTYPE_T A1, DTYPE_T R11,
+        DTYPE_T R12, DTYPE_T X2, DTYPE_T Y2, DTYPE_T A2, DTYPE_T R21,
+        DTYPE_T R22, DTYPE_T Z1, DTYPE_T Z2) nogil:
+    cdef edge_t e
+    cdef DTYPE_T t1, t2, res
+    _edge_geometry(X1, Y1, X2, Y2, &e)
+    t2 = atan2(Z2*e.d2, e.p*R22) - atan2(Z1*e.d2, e.p*R21)
+    t1 = atan2(Z2*e.d1, e.p*R12) - atan2(Z1*e.d1, e.p*R11)
+    res = (e.g*e.g + e.g*e.n*Y2)*t2/(e.p*e.d2) - e.p*t2/e.d2
+    res -= (e.g*e.g + e.g*e.n*Y1)*t1/(e.p*e.d1) - e.p*t1/e.d1
+    res += ((log(Z2 + R22 + dummy) - log(Z1 + R21 + dummy))
+            - (log(Z2 + R12 + dummy) - log(Z1 + R11 + dummy)))
+    return res/(1. + e.n*e.n)
+
+@cython.cdivision(True)
+cdef inline DTYPE_T _edge_gxz(DTYPE_T X1, DTYPE_T Y1, DTYPE_T A1, DTYPE_T R11,
+        DTYPE_T R12, DTYPE_T X2, DTYPE_T Y2, DTYPE_T A2, DTYPE_T R21,
+        DTYPE_T R22, DTYPE_T Z1, DTYPE_T Z2) nogil:
+    cdef edge_t e
+    cdef DTYPE_T l1, l2, res
+    _edge_geometry(X1, Y1, X2, Y2, &e)
+    l2 = (log((R22 - e.d2)/(R22 + e.d2) + dummy)
+          - log((R21 - e.d2)/(R21 + e.d2) + dummy))/(2*e.d2)
+    l1 = (log((R12 - e.d1)/(R12 + e.d1) + dummy)
+          - log((R11 - e.d1)/(R11 + e.d1) + dummy))/(2*e.d1)
+    res = (Y2*(1. + e.n*e.n) + e.g*e.n)*l2
+    res -= (Y1*(1. + e.n*e.n) + e.g*e.n)*l1
+    return -res/(1. + e.n*e.n)
+
+@cython.cdivision(True)
+cdef inline DTYPE_T _edge_gyy(DTYPE_T X1, DTYPE_T Y1, DTYPE_T A1, DTYPE_T R11,
+        DTYPE_T R12, DTYPE_T X2, DTYPE_T Y2, DTYPE_T A2, DTYPE_T R21,
+        DTYPE_T R22, DTYPE_T Z1, DTYPE_T Z2) nogil:
+    cdef edge_t e
+    cdef DTYPE_T t1, t2, res
+    _edge_geometry(X1, Y1, X2, Y2, &e)
+    t2 = atan2(Z2*e.d2, e.p*R22) - atan2(Z1*e.d2, e.p*R21)
+    t1 = atan2(Z2*e.d1, e.p*R12) - atan2(Z1*e.d1, e.p*R11)
+    res = e.c*X2*t2/(e.p*e.d2) + e.m*e.p*t2/e.d2
+    res -= e.c*X1*t1/(e.p*e.d1) + e.m*e.p*t1/e.d1
+    res += e.m*((log(Z2 + R12 + dummy) - log(Z1 + R11 + dummy))
+                - (log(Z2 + R22 + dummy) - log(Z1 + R21 + dummy)))
+    return res/(1. + e.m*e.m)
+
+@cython.cdivision(True)
+cdef inline DTYPE_T _edge_gyz(DTYPE_T X1, DTYPE_T Y1, DTYPE_T A1, DTYPE_T R11,
+        DTYPE_T R12, DTYPE_T X2, DTYPE_T Y2, DTYPE_T A2, DTYPE_T R21,
+        DTYPE_T R22, DTYPE_T Z1, DTYPE_T Z2) nogil:
+    cdef edge_t e
+    cdef DTYPE_T l1, l2, res
+    _edge_geometry(X1, Y1, X2, Y2, &e)
+    l2 = (log((R22 - e.d2)/(R22 + e.d2) + dummy)
+          - log((R21 - e.d2)/(R21 + e.d2) + dummy))/(2*e.d2)
+    l1 = (log((R12 - e.d1)/(R12 + e.d1) + dummy)
+          - log((R11 - e.d1)/(R11 + e.d1) + dummy))/(2*e.d1)
+    res = (X2*(1. + e.m*e.m) + e.c*e.m)*l2
+    res -= (X1*(1. + e.m*e.m) + e.c*e.m)*l1
+    return res/(1. + e.m*e.m)
+
+@cython.cdivision(True)
+cdef inline DTYPE_T _edge_gzz(DTYPE_T X1, DTYPE_T Y1, DTYPE_T A1, DTYPE_T R11,
+        DTYPE_T R12, DTYPE_T X2, DTYPE_T Y2, DTYPE_T A2, DTYPE_T R21,
+        DTYPE_T R22, DTYPE_T Z1, DTYPE_T Z2) nogil:
+    cdef edge_t e
+    _edge_geometry(X1, Y1, X2, Y2, &e)
+    return ((atan2(Z2*e.d2, e.p*R22) - atan2(Z1*e.d2, e.p*R21))
+            - (atan2(Z2*e.d1, e.p*R12) - atan2(Z1*e.d1, e.p*R11)))
+
+@cython.cdivision(True)
+cdef inline void _edge_integrals(DTYPE_T X1, DTYPE_T Y1, DTYPE_T R11,
+        DTYPE_T R12, DTYPE_T X2, DTYPE_T Y2, DTYPE_T R21, DTYPE_T R22,
+        DTYPE_T Z1, DTYPE_T Z2, DTYPE_T *values) nogil:
+    """
+    Add the integrals of the 6 gradient tensor components along one edge to
+    values[1:7] (same order as _FIELDS). The edge geometry, arctangents and
+    logarithms are shared by the components.
+    """
+    cdef edge_t e
+    cdef DTYPE_T t1, t2, logz, l1, l2, n2, m2
+    _edge_geometry(X1, Y1, X2, Y2, &e)
+    t2 = atan2(Z2*e.d2, e.p*R22) - atan2(Z1*e.d2, e.p*R21)
+    t1 = atan2(Z2*e.d1, e.p*R12) - atan2(Z1*e.d1, e.p*R11)
+    logz = ((log(Z2 + R12 + dummy) - log(Z1 + R11 + dummy))
+            - (log(Z2 + R22 + dummy) - log(Z1 + R21 + dummy)))
+    l2 = (log((R22 - e.d2)/(R22 + e.d2) + dummy)
+          - log((R21 - e.d2)/(R21 + e.d2) + dummy))/(2*e.d2)
+    l1 = (log((R12 - e.d1)/(R12 + e.d1) + dummy)
+          - log((R11 - e.d1)/(R11 + e.d1) + dummy))/(2*e.d1)
+    n2 = 1. + e.n*e.n
+    m2 = 1. + e.m*e.m
+    values[1] -= ((e.g*Y2*t2/(e.p*e.d2) + e.n*e.p*t2/e.d2)
+                  - (e.g*Y1*t1/(e.p*e.d1) + e.n*e.p*t1/e.d1)
+                  + e.n*logz)/n2
+    values[2] += (((e.g*e.g + e.g*e.n*Y2)*t2/(e.p*e.d2) - e.p*t2/e.d2)
+                  - ((e.g*e.g + e.g*e.n*Y1)*t1/(e.p*e.d1) - e.p*t1/e.d1)
+                  - logz)/n2
+    values[3] -= ((Y2*n2 + e.g*e.n)*l2 - (Y1*n2 + e.g*e.n)*l1)/n2
+    values[4] += ((e.c*X2*t2/(e.p*e.d2) + e.m*e.p*t2/e.d2)
+                  - (e.c*X1*t1/(e.p*e.d1) + e.m*e.p*t1/e.d1)
+                  + e.m*logz)/m2
+    values[5] += ((X2*m2 + e.c*e.m)*l2 - (X1*m2 + e.c*e.m)*l1)/m2
+    values[6] += t2 - t1
+
+cdef edge_func _get_edge(field) except NULL:
+    """
+    Get the edge integral of the field.
+    """
+    if field == 'gz':
+        return _edge_gz
+    if field == 'gxx':
+        return _edge_gxx
+    if field == 'gxy':
+        return _edge_gxy
+    if field == 'gxz':
+        return _edge_gxz
+    if field == 'gyy':
+        return _edge_gyy
+    if field == 'gyz':
+        return _edge_gyz
+    if field == 'gzz':
+        return _edge_gzz
+    raise ValueError("Invalid field '%s'" % (field))
+
+def _polyprisms2array(prisms, prop):
+    """
+    Put the vertices, tops, bottoms and physical property *prop* of the prisms
+    that have it in contiguous arrays. The vertices of prism m are
+    x[offsets[m]:offsets[m + 1]] and y[offsets[m]:offsets[m + 1]].
+
+    Returns the prisms used and the arrays x, y, offsets, z1, z2, values.
+    """
+    use = [p for p in prisms if p is not None and prop in p.props]
+    if not use:
+        empty = numpy.zeros(0, dtype=DTYPE)
+        return (use, empty, empty, numpy.zeros(1, dtype=numpy.int_), empty,
+                empty, empty)
+    x = numpy.ascontiguousarray(numpy.concatenate([p.x for p in use]),
+                                dtype=DTYPE)
+    y = numpy.ascontiguousarray(numpy.concatenate([p.y for p in use]),
+                                dtype=DTYPE)
+    offsets = numpy.cumsum([0] + [p.nverts for p in use]).astype(numpy.int_)
+    z1 = numpy.array([p.z1 for p in use], dtype=DTYPE)
+    z2 = numpy.array([p.z2 for p in use], dtype=DTYPE)
+    values = numpy.array([p.props[prop] for p in use], dtype=DTYPE)
+    return use, x, y, offsets, z1, z2, values
+
+@cython.boundscheck(False)
+@cython.wraparound(False)
+@cython.cdivision(True)
+cdef inline DTYPE_T _prism_integral(DTYPE_T xp, DTYPE_T yp, DTYPE_T zp,
+        DTYPE_T[::1] x, DTYPE_T[::1] y, long first, long nverts, DTYPE_T z1,
+        DTYPE_T z2, edge_func edge) nogil:
+    """
+    Integrate the field of a single prism on a single point by walking the
+    edges of the polygon. The distances of each vertex are calculated once.
+    """
+    cdef long k, i
+    cdef DTYPE_T Z1, Z2, Z1_sqr, Z2_sqr, A_sqr, res = 0
+    cdef DTYPE_T X1, Y1, A1, R11, R12, X2, Y2, A2, R21, R22
+    Z1 = z1 - zp
+    Z2 = z2 - zp
+    Z1_sqr = Z1*Z1
+    Z2_sqr = Z2*Z2
+    X1 = x[first] - xp
+    Y1 = y[first] - yp
+    A_sqr = X1*X1 + Y1*Y1
+    A1 = sqrt(A_sqr)
+    R11 = sqrt(A_sqr + Z1_sqr)
+    R12 = sqrt(A_sqr + Z2_sqr)
+    for k in range(nverts):
+        i = first + (k + 1) % nverts
+        X2 = x[i] - xp
+        Y2 = y[i] - yp
+        A_sqr = X2*X2 + Y2*Y2
+        A2 = sqrt(A_sqr)
+        R21 = sqrt(A_sqr + Z1_sqr)
+        R22 = sqrt(A_sqr + Z2_sqr)
+        res += edge(X1, Y1, A1, R11, R12, X2, Y2, A2, R21, R22, Z1, Z2)
+        X1, Y1, A1, R11, R12 = X2, Y2, A2, R21, R22
+    return res
+
+@cython.boundscheck(False)
+@cython.wraparound(False)
+@cython.cdivision(True)
+cdef inline void _prism_fields(DTYPE_T xp, DTYPE_T yp, DTYPE_T zp,
+        DTYPE_T[::1] x, DTYPE_T[::1] y, long first, long nverts, DTYPE_T z1,
+        DTYPE_T z2, bint dogz, bint dotensor, DTYPE_T *values) nogil:
+    """
+    Integrate gz (if *dogz*) and the 6 gradient tensor components (if
+    *dotensor*) of a single prism on a single point walking the edges of the
+    polygon only once. The results are put in *values* in the same order as
+    _FIELDS.
+    """
+    cdef long k, i
+    cdef DTYPE_T Z1, Z2, Z1_sqr, Z2_sqr, A_sqr
+    cdef DTYPE_T X1, Y1, A1, R11, R12, X2, Y2, A2, R21, R22
+    for k in range(7):
+        values[k] = 0
+    Z1 = z1 - zp
+    Z2 = z2 - zp
+    Z1_sqr = Z1*Z1
+    Z2_sqr = Z2*Z2
+    X1 = x[first] - xp
+    Y1 = y[first] - yp
+    A_sqr = X1*X1 + Y1*Y1
+    A1 = sqrt(A_sqr)
+    R11 = sqrt(A_sqr + Z1_sqr)
+    R12 = sqrt(A_sqr + Z2_sqr)
+    for k in range(nverts):
+        i = first + (k + 1) % nverts
+        X2 = x[i] - xp
+        Y2 = y[i] - yp
+        A_sqr = X2*X2 + Y2*Y2
+        A2 = sqrt(A_sqr)
+        R21 = sqrt(A_sqr + Z1_sqr)
+        R22 = sqrt(A_sqr + Z2_sqr)
+        if dogz:
+            values[0] += _edge_gz(X1, Y1, A1, R11, R12, X2, Y2, A2, R21, R22,
+                                  Z1, Z2)
+        if dotensor:
+            _edge_integrals(X1, Y1, R11, R12, X2, Y2, R21, R22, Z1, Z2,
+                            values)
+        X1, Y1, A1, R11, R12 = X2, Y2, A2, R21, R22
+
+@cython.boundscheck(False)
+@cython.wraparound(False)
+cdef _gravity(numpy.ndarray[DTYPE_T, ndim=1] xp,
+              numpy.ndarray[DTYPE_T, ndim=1] yp,
+              numpy.ndarray[DTYPE_T, ndim=1] zp, prisms, field, dtype):
+    """
+    Integrate the field over all prisms on all computation points. Returns the
+    field converted to the units of *field* (e.g., mGal) and type *dtype*.
+    """
+    cdef Py_ssize_t l, m, size
+    cdef edge_func edge = _get_edge(field)
+    cdef DTYPE_T[::1] res, x, y, z1, z2, density
+    cdef long[::1] offsets
+    if len(xp) != len(yp) != len(zp):
+        raise ValueError("Input arrays xp, yp, and zp must have same length!")
+    dtype = _check_dtype(dtype)
+    size = len(xp)
+    result = numpy.zeros(size, dtype=DTYPE)
+    res = result
+    use, x, y, offsets, z1, z2, density = _polyprisms2array(prisms, 'density')
+    with nogil:
+        for l in range(size):
+            for m in range(density.shape[0]):
+                res[l] += density[m]*_prism_integral(xp[l], yp[l], zp[l], x,
+                    y, offsets[m], offsets[m + 1] - offsets[m], z1[m], z2[m],
+                    edge)
+    result *= _SCALE[field]
+    return result.astype(dtype, copy=False)
+
+@cython.boundscheck(False)
+@cython.wraparound(False)
+def tf(numpy.ndarray[DTYPE_T, ndim=1] xp not None,
+       numpy.ndarray[DTYPE_T, ndim=1] yp not None,
+       numpy.ndarray[DTYPE_T, ndim=1] zp not None, prisms, double inc,
+       double dec, dtype=DTYPE):
+    """
+    Calculate the total-field anomaly of polygonal prisms.
+
+    .. note:: The coordinate system of the input parameters is to be x -> North,
+        y -> East and z -> Down.
+
+    .. note:: Input units are SI. Output is in nT
+
+    Parameters:
+
+    * xp, yp, zp : arrays
+        Arrays with the x, y, and z coordinates of the computation points.
+    * prisms : list of :class:`fatiando.mesher.PolygonalPrism`
+        The model used to calculate the total field anomaly.
+        Prisms must have the physical property ``'magnetization'`` will be
+        ignored. If the physical properties ``'inclination'`` and
+        ``'declination'`` are not present, will use the values of *inc* and
+        *dec* instead (regional field).
+    * inc : float
+        The inclination of the regional field (in degrees)
+    * dec : float
+        The declination of the regional field (in degrees)
+    * dtype : numpy dtype
+        The type of the output array. Can be ``numpy.float64`` or
+        ``numpy.float32``. The calculations are always done in double
+        precision, so single precision only rounds the result (relative error
+        smaller than 1e-7).
+
+    Returns:
+
+    * res : array
+        The field calculated on xp, yp, zp
+
+    """
+    cdef Py_ssize_t l, m, size
+    cdef DTYPE_T[::1] res, x, y, z1, z2, mag
+    cdef DTYPE_T[:, ::1] coefs
+    cdef long[::1] offsets
+    cdef DTYPE_T values[7]
+    cdef DTYPE_T fx, fy, fz
+    if len(xp) != len(yp) != len(zp):
+        raise ValueError("Input arrays xp, yp, and zp must have same length!")
+    dtype = _check_dtype(dtype)
+    size = len(xp)
+    result = numpy.zeros(size, dtype=DTYPE)
+    res = result
+    # Calculate the 3 components of the unit vector in the direction of the
+    # regional field
+    fx, fy, fz = utils.dircos(inc, dec)
+    use, x, y, offsets, z1, z2, mag = _polyprisms2array(prisms,
+                                                        'magnetization')
+    # The coefficients of the 6 elements of the V matrix for each prism. They
+    # depend on the direction of the magnetization, given by the prism or
+    # the regional field.
+    coefs = numpy.empty((len(use), 6), dtype=DTYPE)
+    for m, prism in enumerate(use):
+        if 'inclination' in prism.props and 'declination' in prism.props:
+            mx, my, mz = utils.dircos(prism.props['inclination'],
+                                      prism.props['declination'])
+        else:
+            mx, my, mz = fx, fy, fz
+        coefs[m, 0] = mag[m]*mx*fx
+        coefs[m, 1] = mag[m]*(mx*fy + my*fx)
+        coefs[m, 2] = mag[m]*(mx*fz + mz*fx)
+        coefs[m, 3] = mag[m]*my*fy
+        coefs[m, 4] = mag[m]*(my*fz + mz*fy)
+        coefs[m, 5] = mag[m]*mz*fz
+    with nogil:
+        for l in range(size):
+            for m in range(mag.shape[0]):
+                _prism_fields(xp[l], yp[l], zp[l], x, y, offsets[m],
+                              offsets[m + 1] - offsets[m], z1[m], z2[m], 0, 1,
+                              values)
+                res[l] += (coefs[m, 0]*values[1] + coefs[m, 1]*values[2]
+                           + coefs[m, 2]*values[3] + coefs[m, 3]*values[4]
+                           + coefs[m, 4]*values[5] + coefs[m, 5]*values[6])
+    result *= CM*T2NT
+    return result.astype(dtype, copy=False)
+
+def gz(numpy.ndarray[DTYPE_T, ndim=1] xp not None,
+       numpy.ndarray[DTYPE_T, ndim=1] yp not None,
+       numpy.ndarray[DTYPE_T, ndim=1] zp not None, prisms, dtype=DTYPE):
+    """
+    Calculates the :math:`g_{z}` gravity acceleration component.
+
+    .. note:: The coordinate system of the input parameters is to be x -> North,
+        y -> East and z -> Down.
+
+    .. note:: All input values in SI units and output in mGal!
+
+    Parameters:
+
+    * xp, yp, zp : arrays
+        The x, y, and z coordinates of the computation points.
+    * prisms : list of :class:`fatiando.mesher.PolygonalPrism`
+        The model used to calculate the field.
+        Prisms must have the physical property ``'density'`` will be
+        ignored.
+    * dtype : numpy dtype
+        The type of the output array. Can be ``numpy.float64`` or
+        ``numpy.float32``. The calculations are always done in double
+        precision, so single precision only rounds the result (relative error
+        smaller than 1e-7).
+
+    Returns:
+
+    * res : array
+        The effect calculated on the computation points.
+
+    """
+    return _gravity(xp, yp, zp, prisms, 'gz', dtype)
+
+def gxx(numpy.ndarray[DTYPE_T, ndim=1] xp not None,
+        numpy.ndarray[DTYPE_T, ndim=1] yp not None,
+        numpy.ndarray[DTYPE_T, ndim=1] zp not None, prisms, dtype=DTYPE):
+    """
+    Calculates the :math:`g_{xx}` gravity gradient tensor component.
+
+    .. note:: The coordinate system of the input parameters is to be x -> North,
+        y -> East and z -> Down.
+
+    .. note:: All input values in SI units and output in Eotvos!
+
+    Parameters:
+
+    * xp, yp, zp : arrays
+        The x, y, and z coordinates of the computation points.
+    * prisms : list of :class:`fatiando.mesher.PolygonalPrism`
+        The model used to calculate the field.
+        Prisms must have the physical property ``'density'`` will be
+        ignored.
+    * dtype : numpy dtype
+        The type of the output array. Can be ``numpy.float64`` or
+        ``numpy.float32``. The calculations are always done in double
+        precision, so single precision only rounds the result (relative error
+        smaller than 1e-7).
+
+    Returns:
+
+    * res : array
+        The effect calculated on the computation points.
+
+    """
+    return _gravity(xp, yp, zp, prisms, 'gxx', dtype)
+
+def gxy(numpy.ndarray[DTYPE_T, ndim=1] xp not None,
+        numpy.ndarray[DTYPE_T, ndim=1] yp not None,
+        numpy.ndarray[DTYPE_T, ndim=1] zp not None, prisms, dtype=DTYPE):
+    """
+    Calculates the :math:`g_{xy}` gravity gradient tensor component.
+
+    .. note:: The coordinate system of the input parameters is to be x -> North,
+        y -> East and z -> Down.
+
+    .. note:: All input values in SI units and output in Eotvos!
+
+    Parameters:
+
+    * xp, yp, zp : arrays
+        The x, y, and z coordinates of the computation points.
+    * prisms : list of :class:`fatiando.mesher.PolygonalPrism`
+        The model used to calculate the field.
+        Prisms must have the physical property ``'density'`` will be
+        ignored.
+    * dtype : numpy dtype
+        The type of the output array. Can be ``numpy.float64`` or
+        ``numpy.float32``. The calculations are always done in double
+        precision, so single precision only rounds the result (relative error
+        smaller than 1e-7).
+
+    Returns:
+
+    * res : array
+        The effect calculated on the computation points.
+
+    """
+    return _gravity(xp, yp, zp, prisms, 'gxy', dtype)
+
+def gxz(numpy.ndarray[DTYPE_T, ndim=1] xp not None,
+        numpy.ndarray[DTYPE_T, ndim=1] yp not None,
+        numpy.ndarray[DTYPE_T, ndim=1] zp not None, prisms, dtype=DTYPE):
+    """
+    Calculates the :math:`g_{xz}` gravity gradient tensor component.
+
+    .. note:: The coordinate system of the input parameters is to be x -> North,
+        y -> East and z -> Down.
+
+    .. note:: All input values in SI units and output in Eotvos!
+
+    Parameters:
+
+    * xp, yp, zp : arrays
+        The x, y, and z coordinates of the computation points.
+    * prisms : list of :class:`fatiando.mesher.PolygonalPrism`
+        The model used to calculate the field.
+        Prisms must have the physical property ``'density'`` will be
+        ignored.
+    * dtype : numpy dtype
+        The type of the output array. Can be ``numpy.float64`` or
+        ``numpy.float32``. The calculations are always done in double
+        precision, so single precision only rounds the result (relative error
+        smaller than 1e-7).
+
+    Returns:
+
+    * res : array
+        The effect calculated on the computation points.
+
+    """
+    return _gravity(xp, yp, zp, prisms, 'gxz', dtype)
+
+def gyy(numpy.ndarray[DTYPE_T, ndim=1] xp not None,
+        numpy.ndarray[DTYPE_T, ndim=1] yp not None,
+        numpy.ndarray[DTYPE_T, ndim=1] zp not None, prisms, dtype=DTYPE):
+    """
+    Calculates the :math:`g_{yy}` gravity gradient tensor component.
+
+    .. note:: The coordinate system of the input parameters is to be x -> North,
+        y -> East and z -> Down.
+
+    .. note:: All input values in SI units and output in Eotvos!
+
+    Parameters:
+
+    * xp, yp, zp : arrays
+        The x, y, and z coordinates of the computation points.
+    * prisms : list of :class:`fatiando.mesher.PolygonalPrism`
+        The model used to calculate the field.
+        Prisms must have the physical property ``'density'`` will be
+        ignored.
+    * dtype : numpy dtype
+        The type of the output array. Can be ``numpy.float64`` or
+        ``numpy.float32``. The calculations are always done in double
+        precision, so single precision only rounds the result (relative error
+        smaller than 1e-7).
+
+    Returns:
+
+    * res : array
+        The effect calculated on the computation points.
+
+    """
+    return _gravity(xp, yp, zp, prisms, 'gyy', dtype)
+
+def gyz(numpy.ndarray[DTYPE_T, ndim=1] xp not None,
+        numpy.ndarray[DTYPE_T, ndim=1] yp not None,
+        numpy.ndarray[DTYPE_T, ndim=1] zp not None, prisms, dtype=DTYPE):
+    """
+    Calculates the :math:`g_{yz}` gravity gradient tensor component.
+
+    .. note:: The coordinate system of the input parameters is to be x -> North,
+        y -> East and z -> Down.
+
+    .. note:: All input values in SI units and output in Eotvos!
+
+    Parameters:
+
+    * xp, yp, zp : arrays
+        The x, y, and z coordinates of the computation points.
+    * prisms : list of :class:`fatiando.mesher.PolygonalPrism`
+        The model used to calculate the field.
+        Prisms must have the physical property ``'density'`` will be
+        ignored.
+    * dtype : numpy dtype
+        The type of the output array. Can be ``numpy.float64`` or
+        ``numpy.float32``. The calculations are always done in double
+        precision, so single precision only rounds the result (relative error
+        smaller than 1e-7).
+
+    Returns:
+
+    * res : array
+        The effect calculated on the computation points.
+
+    """
+    return _gravity(xp, yp, zp, prisms, 'gyz', dtype)
+
+def gzz(numpy.ndarray[DTYPE_T, ndim=1] xp not None,
+        numpy.ndarray[DTYPE_T, ndim=1] yp not None,
+        numpy.ndarray[DTYPE_T, ndim=1] zp not None, prisms, dtype=DTYPE):
+    """
+    Calculates the :math:`g_{zz}` gravity gradient tensor component.
+
+    .. note:: The coordinate system of the input parameters is to be x -> North,
+        y -> East and z -> Down.
+
+    .. note:: All input values in SI units and output in Eotvos!
+
+    Parameters:
+
+    * xp, yp, zp : arrays
+        The x, y, and z coordinates of the computation points.
+    * prisms : list of :class:`fatiando.mesher.PolygonalPrism`
+        The model used to calculate the field.
+        Prisms must have the physical property ``'density'`` will be
+        ignored.
+    * dtype : numpy dtype
+        The type of the output array. Can be ``numpy.float64`` or
+        ``numpy.float32``. The calculations are always done in double
+        precision, so single precision only rounds the result (relative error
+        smaller than 1e-7).
+
+    Returns:
+
+    * res : array
+        The effect calculated on the computation points.
+
+    """
+    return _gravity(xp, yp, zp, prisms, 'gzz', dtype)
+
+@cython.boundscheck(False)
+@cython.wraparound(False)
+def fields(numpy.ndarray[DTYPE_T, ndim=1] xp not None,
+           numpy.ndarray[DTYPE_T, ndim=1] yp not None,
+           numpy.ndarray[DTYPE_T, ndim=1] zp not None, prisms,
+           components=None, dtype=DTYPE):
+    """
+    Calculate several gravitational field components in a single pass.
+
+    Each edge of the polygons is visited once for all requested components.
+    The edge geometry and the logarithms and arctangents are shared by the
+    gradient tensor components, so the full tensor costs little more than a
+    single component.
+
+    The results are the same as given by
+    :func:`~fatiando.gravmag.polyprism.gz`,
+    :func:`~fatiando.gravmag.polyprism.gxx`, etc.
+
+    .. note:: The coordinate system of the input parameters is to be x -> North,
+        y -> East and z -> Down.
+
+    .. note:: All input values in SI units. gz is returned in mGal and the
+        gradient tensor components in Eotvos!
+
+    Parameters:
+
+    * xp, yp, zp : arrays
+        The x, y, and z coordinates of the computation points.
+    * prisms : list of :class:`fatiando.mesher.PolygonalPrism`
+        The model used to calculate the field.
+        Prisms must have the physical property ``'density'`` will be
+        ignored.
+    * components : list of str or None
+        The components to calculate. Can be any of ``'gz'``, ``'gxx'``,
+        ``'gxy'``, ``'gxz'``, ``'gyy'``, ``'gyz'``, ``'gzz'``. If None, will
+        calculate all of them (in this order).
+    * dtype : numpy dtype
+        The type of the output array. Can be ``numpy.float64`` or
+        ``numpy.float32``. The calculations are always done in double
+        precision, so single precision only rounds the result (relative error
+        smaller than 1e-7).
+
+    Returns:
+
+    * res : list of arrays
+        The fields calculated on xp, yp, zp. One array for each element of
+        *components*, in the same order.
+
+    """
+    cdef Py_ssize_t l, m, size
+    cdef unsigned int c, ncomps
+    cdef bint dogz, dotensor
+    cdef DTYPE_T values[7]
+    cdef DTYPE_T[:, ::1] res
+    cdef DTYPE_T[::1] x, y, z1, z2, density
+    cdef long[::1] offsets
+    cdef int[::1] codes
+    if len(xp) != len(yp) != len(zp):
+        raise ValueError("Input arrays xp, yp, and zp must have same length!")
+    dtype = _check_dtype(dtype)
+    components = _check_components(components)
+    ncomps = len(components)
+    codes = numpy.array([_FIELDS.index(comp) for comp in components],
+                        dtype=numpy.intc)
+    dogz = 'gz' in components
+    dotensor = any(comp != 'gz' for comp in components)
+    size = len(xp)
+    result = numpy.zeros((ncomps, size), dtype=DTYPE)
+    res = result
+    use, x, y, offsets, z1, z2, density = _polyprisms2array(prisms, 'density')
+    with nogil:
+        for l in range(size):
+            for m in range(density.shape[0]):
+                _prism_fields(xp[l], yp[l], zp[l], x, y, offsets[m],
+                              offsets[m + 1] - offsets[m], z1[m], z2[m], dogz,
+                              dotensor, values)
+                for c in range(ncomps):
+                    res[c, l] += density[m]*values[codes[c]]
+    # Now all that is left is to multiply by the gravitational constant and
+    # convert to the units of each component
+    for c in range(ncomps):
+        result[c] *= _SCALE[components[c]]
+    return [result[c].astype(dtype, copy=False) for c in range(ncomps)]
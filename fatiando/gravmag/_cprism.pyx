@@ -7,21 +7,521 @@ from libc.math cimport log, atan2, sqrt
 # Import Cython definitions for numpy
 cimport numpy
 cimport cython
+from cython.parallel cimport prange
 
 DTYPE = numpy.float
 ctypedef numpy.float_t DTYPE_T
 
 from fatiando.constants import SI2EOTVOS, SI2MGAL, G, CM, T2NT
+from fatiando.mesher import prisms2array
 from fatiando import utils
+from fatiando.gravmag._prism import (_FIELDS, _SCALE, _TERMS,
+                                     _check_components, _check_dtype,
+                                     _check_magnetic)
 
 __all__ = ['potential', 'gx', 'gy', 'gz', 'gxx', 'gxy', 'gxz', 'gyy', 'gyz',
-    'gzz', 'tf']
+    'gzz', 'tf', 'magnetic', 'fields', 'kernel_matrix']
+
+# The types of the sensitivity matrices built by kernel_matrix
+ctypedef fused MATRIX_T:
+    numpy.float32_t
+    numpy.float64_t
+
+# The kernels of the gravitational fields. They are evaluated on each corner
+# of the prism with the corner coordinates x, y, z relative to the computation
+# point and r the distance between them.
+ctypedef DTYPE_T (*kernel_func)(DTYPE_T, DTYPE_T, DTYPE_T, DTYPE_T) nogil
+
+cdef inline DTYPE_T _kernel_potential(DTYPE_T x, DTYPE_T y, DTYPE_T z,
+        DTYPE_T r) nogil:
+    return (x*y*log(z + r)
+            + y*z*log(x + r)
+            + x*z*log(y + r)
+            - 0.5*x**2*atan2(z*y, x*r)
+            - 0.5*y**2*atan2(z*x, y*r)
+            - 0.5*z**2*atan2(x*y, z*r))
+
+cdef inline DTYPE_T _kernel_gx(DTYPE_T x, DTYPE_T y, DTYPE_T z,
+        DTYPE_T r) nogil:
+    # Minus because Nagy et al (2000) give the formula for the
+    # gradient of the potential. Gravity is -grad(V)
+    return -(y*log(z + r) + z*log(y + r) - x*atan2(z*y, x*r))
+
+cdef inline DTYPE_T _kernel_gy(DTYPE_T x, DTYPE_T y, DTYPE_T z,
+        DTYPE_T r) nogil:
+    # Minus because Nagy et al (2000) give the formula for the
+    # gradient of the potential. Gravity is -grad(V)
+    return -(z*log(x + r) + x*log(z + r) - y*atan2(x*z, y*r))
+
+cdef inline DTYPE_T _kernel_gz(DTYPE_T x, DTYPE_T y, DTYPE_T z,
+        DTYPE_T r) nogil:
+    # Minus because Nagy et al (2000) give the formula for the
+    # gradient of the potential. Gravity is -grad(V)
+    return -(x*log(y + r) + y*log(x + r) - z*atan2(x*y, z*r))
+
+cdef inline DTYPE_T _kernel_gxx(DTYPE_T x, DTYPE_T y, DTYPE_T z,
+        DTYPE_T r) nogil:
+    return -atan2(z*y, x*r)
+
+cdef inline DTYPE_T _kernel_gxy(DTYPE_T x, DTYPE_T y, DTYPE_T z,
+        DTYPE_T r) nogil:
+    return log(z + r)
+
+cdef inline DTYPE_T _kernel_gxz(DTYPE_T x, DTYPE_T y, DTYPE_T z,
+        DTYPE_T r) nogil:
+    return log(y + r)
+
+cdef inline DTYPE_T _kernel_gyy(DTYPE_T x, DTYPE_T y, DTYPE_T z,
+        DTYPE_T r) nogil:
+    return -atan2(z*x, y*r)
+
+cdef inline DTYPE_T _kernel_gyz(DTYPE_T x, DTYPE_T y, DTYPE_T z,
+        DTYPE_T r) nogil:
+    return log(x + r)
+
+cdef inline DTYPE_T _kernel_gzz(DTYPE_T x, DTYPE_T y, DTYPE_T z,
+        DTYPE_T r) nogil:
+    return -atan2(x*y, z*r)
+
+# The fields of the multipole expansion of a prism (monopole + quadrupole;
+# the dipole vanishes about the center). Used for prisms that are far from the
+# computation point. dx, dy, dz are the coordinates of the center of the prism
+# relative to the computation point, r is the distance between them and sx,
+# sy, sz are the second moments of the prism per unit mass (size**2/12 in
+# each direction).
+ctypedef DTYPE_T (*multipole_func)(DTYPE_T, DTYPE_T, DTYPE_T, DTYPE_T, DTYPE_T,
+                                   DTYPE_T, DTYPE_T, DTYPE_T, DTYPE_T) nogil
+
+cdef inline DTYPE_T _quadrupole(DTYPE_T dx, DTYPE_T dy, DTYPE_T dz,
+        DTYPE_T r_sqr, DTYPE_T sx, DTYPE_T sy, DTYPE_T sz) nogil:
+    # The quadrupole term of the potential is q/(2*r**5)
+    return 3*(sx*dx**2 + sy*dy**2 + sz*dz**2) - r_sqr*(sx + sy + sz)
+
+cdef inline DTYPE_T _multipole_g(DTYPE_T d, DTYPE_T s, DTYPE_T dx, DTYPE_T dy,
+        DTYPE_T dz, DTYPE_T r_sqr, DTYPE_T r, DTYPE_T sx, DTYPE_T sy,
+        DTYPE_T sz) nogil:
+    # The gravity component along d (with second moment s) for unit mass
+    cdef DTYPE_T q = _quadrupole(dx, dy, dz, r_sqr, sx, sy, sz)
+    cdef DTYPE_T r5 = r_sqr**2*r
+    return d*(1./(r_sqr*r) + 2.5*q/(r5*r_sqr)
+              - (3*s - (sx + sy + sz))/r5)
+
+cdef inline DTYPE_T _multipole_gg(DTYPE_T da, DTYPE_T sa, DTYPE_T db,
+        DTYPE_T sb, bint diagonal, DTYPE_T dx, DTYPE_T dy, DTYPE_T dz,
+        DTYPE_T r_sqr, DTYPE_T r, DTYPE_T sx, DTYPE_T sy, DTYPE_T sz) nogil:
+    # The gradient tensor component ab for unit mass
+    cdef DTYPE_T q = _quadrupole(dx, dy, dz, r_sqr, sx, sy, sz)
+    cdef DTYPE_T t = sx + sy + sz
+    cdef DTYPE_T r5 = r_sqr**2*r
+    cdef DTYPE_T r7 = r5*r_sqr
+    cdef DTYPE_T res
+    res = (3*da*db/r5 + 17.5*da*db*q/(r7*r_sqr)
+           - 5*da*db*(3*sa + 3*sb - 2*t)/r7)
+    if diagonal:
+        res += -1./(r_sqr*r) + (3*sa - t)/r5 - 2.5*q/r7
+    return res
+
+cdef inline DTYPE_T _multipole_potential(DTYPE_T mass, DTYPE_T dx,
+        DTYPE_T dy, DTYPE_T dz, DTYPE_T r_sqr, DTYPE_T r, DTYPE_T sx,
+        DTYPE_T sy, DTYPE_T sz) nogil:
+    return mass*(1./r + 0.5*_quadrupole(dx, dy, dz, r_sqr, sx, sy, sz)
+                 /(r_sqr**2*r))
+
+cdef inline DTYPE_T _multipole_gx(DTYPE_T mass, DTYPE_T dx, DTYPE_T dy,
+        DTYPE_T dz, DTYPE_T r_sqr, DTYPE_T r, DTYPE_T sx, DTYPE_T sy,
+        DTYPE_T sz) nogil:
+    return mass*_multipole_g(dx, sx, dx, dy, dz, r_sqr, r, sx, sy, sz)
+
+cdef inline DTYPE_T _multipole_gy(DTYPE_T mass, DTYPE_T dx, DTYPE_T dy,
+        DTYPE_T dz, DTYPE_T r_sqr, DTYPE_T r, DTYPE_T sx, DTYPE_T sy,
+        DTYPE_T sz) nogil:
+    return mass*_multipole_g(dy, sy, dx, dy, dz, r_sqr, r, sx, sy, sz)
+
+cdef inline DTYPE_T _multipole_gz(DTYPE_T mass, DTYPE_T dx, DTYPE_T dy,
+        DTYPE_T dz, DTYPE_T r_sqr, DTYPE_T r, DTYPE_T sx, DTYPE_T sy,
+        DTYPE_T sz) nogil:
+    return mass*_multipole_g(dz, sz, dx, dy, dz, r_sqr, r, sx, sy, sz)
+
+cdef inline DTYPE_T _multipole_gxx(DTYPE_T mass, DTYPE_T dx, DTYPE_T dy,
+        DTYPE_T dz, DTYPE_T r_sqr, DTYPE_T r, DTYPE_T sx, DTYPE_T sy,
+        DTYPE_T sz) nogil:
+    return mass*_multipole_gg(dx, sx, dx, sx, 1, dx, dy, dz, r_sqr, r, sx, sy,
+                              sz)
+
+cdef inline DTYPE_T _multipole_gxy(DTYPE_T mass, DTYPE_T dx, DTYPE_T dy,
+        DTYPE_T dz, DTYPE_T r_sqr, DTYPE_T r, DTYPE_T sx, DTYPE_T sy,
+        DTYPE_T sz) nogil:
+    return mass*_multipole_gg(dx, sx, dy, sy, 0, dx, dy, dz, r_sqr, r, sx, sy,
+                              sz)
+
+cdef inline DTYPE_T _multipole_gxz(DTYPE_T mass, DTYPE_T dx, DTYPE_T dy,
+        DTYPE_T dz, DTYPE_T r_sqr, DTYPE_T r, DTYPE_T sx, DTYPE_T sy,
+        DTYPE_T sz) nogil:
+    return mass*_multipole_gg(dx, sx, dz, sz, 0, dx, dy, dz, r_sqr, r, sx, sy,
+                              sz)
+
+cdef inline DTYPE_T _multipole_gyy(DTYPE_T mass, DTYPE_T dx, DTYPE_T dy,
+        DTYPE_T dz, DTYPE_T r_sqr, DTYPE_T r, DTYPE_T sx, DTYPE_T sy,
+        DTYPE_T sz) nogil:
+    return mass*_multipole_gg(dy, sy, dy, sy, 1, dx, dy, dz, r_sqr, r, sx, sy,
+                              sz)
+
+cdef inline DTYPE_T _multipole_gyz(DTYPE_T mass, DTYPE_T dx, DTYPE_T dy,
+        DTYPE_T dz, DTYPE_T r_sqr, DTYPE_T r, DTYPE_T sx, DTYPE_T sy,
+        DTYPE_T sz) nogil:
+    return mass*_multipole_gg(dy, sy, dz, sz, 0, dx, dy, dz, r_sqr, r, sx, sy,
+                              sz)
+
+cdef inline DTYPE_T _multipole_gzz(DTYPE_T mass, DTYPE_T dx, DTYPE_T dy,
+        DTYPE_T dz, DTYPE_T r_sqr, DTYPE_T r, DTYPE_T sx, DTYPE_T sy,
+        DTYPE_T sz) nogil:
+    return mass*_multipole_gg(dz, sz, dz, sz, 1, dx, dy, dz, r_sqr, r, sx, sy,
+                              sz)
+
+cdef inline bint _far_field(DTYPE_T xp, DTYPE_T yp, DTYPE_T zp, DTYPE_T x1,
+        DTYPE_T x2, DTYPE_T y1, DTYPE_T y2, DTYPE_T z1, DTYPE_T z2,
+        DTYPE_T density, DTYPE_T ratio_sqr, multipole_func multipole,
+        DTYPE_T *value) nogil:
+    """
+    Check if the prism is farther than ratio times its size from the point. If
+    it is, put the effect of the multipole expansion of the prism in *value*.
+    """
+    cdef DTYPE_T dx, dy, dz, r_sqr, size_sqr, mass
+    dx = 0.5*(x1 + x2) - xp
+    dy = 0.5*(y1 + y2) - yp
+    dz = 0.5*(z1 + z2) - zp
+    size_sqr = (x2 - x1)**2 + (y2 - y1)**2 + (z2 - z1)**2
+    r_sqr = dx**2 + dy**2 + dz**2
+    if r_sqr <= ratio_sqr*size_sqr:
+        return 0
+    mass = density*((x2 - x1)*(y2 - y1)*(z2 - z1))
+    value[0] = multipole(mass, dx, dy, dz, r_sqr, sqrt(r_sqr),
+                         (x2 - x1)**2/12., (y2 - y1)**2/12.,
+                         (z2 - z1)**2/12.)
+    return 1
+
+cdef inline DTYPE_T _shared_kernel(int component, DTYPE_T x, DTYPE_T y,
+        DTYPE_T z, DTYPE_T *logs, DTYPE_T *atans) nogil:
+    # The component codes are the positions in _FIELDS
+    if component == 0:
+        return (x*y*logs[2] + y*z*logs[0] + x*z*logs[1]
+                - 0.5*x**2*atans[0] - 0.5*y**2*atans[1] - 0.5*z**2*atans[2])
+    # Minus because Nagy et al (2000) give the formula for the
+    # gradient of the potential. Gravity is -grad(V)
+    if component == 1:
+        return -(y*logs[2] + z*logs[1] - x*atans[0])
+    if component == 2:
+        return -(z*logs[0] + x*logs[2] - y*atans[1])
+    if component == 3:
+        return -(x*logs[1] + y*logs[0] - z*atans[2])
+    if component == 4:
+        return -atans[0]
+    if component == 5:
+        return logs[2]
+    if component == 6:
+        return logs[1]
+    if component == 7:
+        return -atans[1]
+    if component == 8:
+        return logs[0]
+    return -atans[2]
+
+cdef kernel_func _get_kernel(field) except NULL:
+    """
+    Get the kernel function of a gravitational field component.
+    """
+    if field == 'potential':
+        return _kernel_potential
+    if field == 'gx':
+        return _kernel_gx
+    if field == 'gy':
+        return _kernel_gy
+    if field == 'gz':
+        return _kernel_gz
+    if field == 'gxx':
+        return _kernel_gxx
+    if field == 'gxy':
+        return _kernel_gxy
+    if field == 'gxz':
+        return _kernel_gxz
+    if field == 'gyy':
+        return _kernel_gyy
+    if field == 'gyz':
+        return _kernel_gyz
+    if field == 'gzz':
+        return _kernel_gzz
+    raise ValueError("Invalid field '%s'. Use one of %s"
+                     % (field, ', '.join(_FIELDS)))
+
+cdef multipole_func _get_multipole(field) except NULL:
+    """
+    Get the multipole function of a gravitational field component.
+    """
+    if field == 'potential':
+        return _multipole_potential
+    if field == 'gx':
+        return _multipole_gx
+    if field == 'gy':
+        return _multipole_gy
+    if field == 'gz':
+        return _multipole_gz
+    if field == 'gxx':
+        return _multipole_gxx
+    if field == 'gxy':
+        return _multipole_gxy
+    if field == 'gxz':
+        return _multipole_gxz
+    if field == 'gyy':
+        return _multipole_gyy
+    if field == 'gyz':
+        return _multipole_gyz
+    if field == 'gzz':
+        return _multipole_gzz
+    raise ValueError("Invalid field '%s'. Use one of %s"
+                     % (field, ', '.join(_FIELDS)))
+
+def _check_ratio(ratio):
+    """
+    Check the distance/size ratio and return its square (0 if None).
+    """
+    if ratio is None:
+        return 0.
+    if ratio <= 0:
+        raise ValueError("Invalid ratio '%s'. Must be > 0" % (ratio))
+    return float(ratio)**2
 
+def _get_prop(array, prop, value):
+    """
+    Find the prisms in *array* that have physical property *prop* and get the
+    values of the property. If *value* is not None, use it for all prisms.
+
+    Returns a boolean array that is True for the prisms that have the property
+    and an array with the property values of those prisms.
+    """
+    if value is not None:
+        keep = numpy.ones(array.size, dtype=numpy.bool)
+        return keep, value*numpy.ones(array.size, dtype=DTYPE)
+    if prop not in array.props:
+        keep = numpy.zeros(array.size, dtype=numpy.bool)
+        return keep, numpy.zeros(0, dtype=DTYPE)
+    keep = ~numpy.isnan(array.props[prop])
+    return keep, array.props[prop][keep]
+
+def _get_borders(array, keep):
+    """
+    Get the borders of the prisms in *array* for which *keep* is True.
+    """
+    return [b[keep] for b in [array.x1, array.x2, array.y1, array.y2,
+                              array.z1, array.z2]]
 
+def _get_magdir(array, keep, fx, fy, fz, pinc, pdec):
+    """
+    Get the 3 components of the unit vector in the direction of the
+    magnetization of the prisms in *array* for which *keep* is True.
+    """
+    size = numpy.sum(keep)
+    # 1) given by the function
+    if pinc is not None and pdec is not None:
+        return [d*numpy.ones(size, dtype=DTYPE)
+                for d in utils.dircos(pinc, pdec)]
+    # 3) Use in the direction of the regional field
+    mx, my, mz = [f*numpy.ones(size, dtype=DTYPE) for f in [fx, fy, fz]]
+    # 2) given by the prism
+    if 'inclination' in array.props and 'declination' in array.props:
+        inc = array.props['inclination'][keep]
+        dec = array.props['declination'][keep]
+        given = ~numpy.isnan(inc) & ~numpy.isnan(dec)
+        mx[given], my[given], mz[given] = utils.dircos(inc[given], dec[given])
+    return mx, my, mz
+
+def _check_njobs(njobs):
+    """
+    Check if the number of threads is valid.
+    """
+    if njobs < 1:
+        raise ValueError("Invalid number of jobs '%s'. Must be >= 1" % (njobs))
+    return int(njobs)
+
+@cython.boundscheck(False)
+@cython.wraparound(False)
+cdef inline DTYPE_T _gravity_point(DTYPE_T xp, DTYPE_T yp, DTYPE_T zp,
+        DTYPE_T[::1] x1, DTYPE_T[::1] x2, DTYPE_T[::1] y1, DTYPE_T[::1] y2,
+        DTYPE_T[::1] z1, DTYPE_T[::1] z2, DTYPE_T[::1] density,
+        kernel_func kernel, multipole_func multipole,
+        DTYPE_T ratio_sqr) nogil:
+    """
+    Integrate a gravitational kernel over all prisms on a single point.
+    If *ratio_sqr* > 0, use a multipole expansion for the prisms that are far
+    away.
+    """
+    cdef unsigned int m, i, j, k
+    cdef DTYPE_T x[2]
+    cdef DTYPE_T y[2]
+    cdef DTYPE_T z[2]
+    cdef DTYPE_T r, value, res = 0
+    for m in range(density.shape[0]):
+        if ratio_sqr > 0 and _far_field(xp, yp, zp, x1[m], x2[m], y1[m],
+                                        y2[m], z1[m], z2[m], density[m],
+                                        ratio_sqr, multipole, &value):
+            res += value
+            continue
+        # First thing to do is make the computation point P the origin of
+        # the coordinate system
+        x[0] = x2[m] - xp
+        x[1] = x1[m] - xp
+        y[0] = y2[m] - yp
+        y[1] = y1[m] - yp
+        z[0] = z2[m] - zp
+        z[1] = z1[m] - zp
+        # Evaluate the integration limits
+        for k in range(2):
+            for j in range(2):
+                for i in range(2):
+                    r = sqrt(x[i]**2 + y[j]**2 + z[k]**2)
+                    res += ((-1.)**(i + j + k))*kernel(
+                        x[i], y[j], z[k], r)*density[m]
+    return res
+
+@cython.boundscheck(False)
+@cython.wraparound(False)
+cdef _gravity(DTYPE_T[:] xp, DTYPE_T[:] yp, DTYPE_T[:] zp, prisms, dens,
+              field, njobs, ratio, dtype):
+    """
+    Integrate the kernel of a gravitational field over all prisms on all
+    computation points. Returns the field converted to the units of *field*
+    (e.g., mGal) and type *dtype*.
+
+    Each point is computed independently by one of the *njobs* threads.
+    """
+    cdef Py_ssize_t l, size
+    cdef int nthreads
+    cdef kernel_func kernel = _get_kernel(field)
+    cdef multipole_func multipole = _get_multipole(field)
+    cdef DTYPE_T ratio_sqr = _check_ratio(ratio)
+    cdef DTYPE_T[::1] res, density, x1, x2, y1, y2, z1, z2
+    if len(xp) != len(yp) != len(zp):
+        raise ValueError("Input arrays xp, yp, and zp must have same length!")
+    nthreads = _check_njobs(njobs)
+    dtype = _check_dtype(dtype)
+    size = len(xp)
+    result = numpy.zeros(size, dtype=DTYPE)
+    res = result
+    array = prisms2array(prisms)
+    keep, density = _get_prop(array, 'density', dens)
+    x1, x2, y1, y2, z1, z2 = _get_borders(array, keep)
+    for l in prange(size, nogil=True, schedule='static',
+                    num_threads=nthreads):
+        res[l] = _gravity_point(xp[l], yp[l], zp[l], x1, x2, y1, y2, z1, z2,
+                                density, kernel, multipole, ratio_sqr)
+    # Now all that is left is to multiply by the gravitational constant and
+    # convert to the units of the field
+    result *= _SCALE[field]
+    return result.astype(dtype, copy=False)
+
+@cython.boundscheck(False)
+@cython.wraparound(False)
+cdef inline DTYPE_T _tf_point(DTYPE_T xp, DTYPE_T yp, DTYPE_T zp,
+        DTYPE_T[::1] x1, DTYPE_T[::1] x2, DTYPE_T[::1] y1, DTYPE_T[::1] y2,
+        DTYPE_T[::1] z1, DTYPE_T[::1] z2, DTYPE_T[::1] mag, DTYPE_T[::1] mx,
+        DTYPE_T[::1] my, DTYPE_T[::1] mz, DTYPE_T fx, DTYPE_T fy,
+        DTYPE_T fz) nogil:
+    """
+    Calculate the total-field anomaly of all prisms on a single point.
+    """
+    cdef unsigned int m, i, j, k
+    cdef DTYPE_T x[2]
+    cdef DTYPE_T y[2]
+    cdef DTYPE_T z[2]
+    cdef DTYPE_T magnetization, r, r_sqr, res = 0
+    for m in range(mag.shape[0]):
+        # First thing to do is make the computation point P the origin of
+        # the coordinate system
+        x[0] = x2[m] - xp
+        x[1] = x1[m] - xp
+        y[0] = y2[m] - yp
+        y[1] = y1[m] - yp
+        z[0] = z2[m] - zp
+        z[1] = z1[m] - zp
+        magnetization = mag[m]
+        for k in range(2):
+            magnetization *= -1.
+            for j in range(2):
+                for i in range(2):
+                    r_sqr = x[i]**2 + y[j]**2 + z[k]**2
+                    r = sqrt(r_sqr)
+                    res += ((-1.)**(i + j))*magnetization*(
+                          0.5*(my[m]*fz + mz[m]*fy)*log(
+                            (r - x[i])/(r + x[i]))
+                        + 0.5*(mx[m]*fz + mz[m]*fx)*log(
+                            (r - y[j])/(r + y[j]))
+                        - (mx[m]*fy + my[m]*fx)*log(r + z[k])
+                        - mx[m]*fx*atan2(x[i]*y[j],
+                            x[i]**2 + z[k]*r + z[k]**2)
+                        - my[m]*fy*atan2(x[i]*y[j],
+                            r_sqr + z[k]*r - x[i]**2)
+                        + mz[m]*fz*atan2(x[i]*y[j], z[k]*r))
+    return res
+
+@cython.boundscheck(False)
+@cython.wraparound(False)
+cdef void _fields_point(DTYPE_T xp, DTYPE_T yp, DTYPE_T zp,
+        DTYPE_T[::1] x1, DTYPE_T[::1] x2, DTYPE_T[::1] y1, DTYPE_T[::1] y2,
+        DTYPE_T[::1] z1, DTYPE_T[::1] z2, DTYPE_T[::1] density,
+        int[::1] codes, int[::1] uselog, int[::1] useatan,
+        DTYPE_T[:] res) nogil:
+    """
+    Calculate several components on a single point using the shared terms.
+    The result for each component is stored in *res*.
+    """
+    cdef unsigned int m, i, j, k, c
+    cdef DTYPE_T x[2]
+    cdef DTYPE_T y[2]
+    cdef DTYPE_T z[2]
+    cdef DTYPE_T logs[3]
+    cdef DTYPE_T atans[3]
+    cdef DTYPE_T r, sign
+    for i in range(3):
+        logs[i] = 0
+        atans[i] = 0
+    for m in range(density.shape[0]):
+        # First thing to do is make the computation point P the origin of
+        # the coordinate system
+        x[0] = x2[m] - xp
+        x[1] = x1[m] - xp
+        y[0] = y2[m] - yp
+        y[1] = y1[m] - yp
+        z[0] = z2[m] - zp
+        z[1] = z1[m] - zp
+        # Evaluate the integration limits
+        for k in range(2):
+            for j in range(2):
+                for i in range(2):
+                    r = sqrt(x[i]**2 + y[j]**2 + z[k]**2)
+                    if uselog[0]:
+                        logs[0] = log(x[i] + r)
+                    if uselog[1]:
+                        logs[1] = log(y[j] + r)
+                    if uselog[2]:
+                        logs[2] = log(z[k] + r)
+                    if useatan[0]:
+                        atans[0] = atan2(z[k]*y[j], x[i]*r)
+                    if useatan[1]:
+                        atans[1] = atan2(z[k]*x[i], y[j]*r)
+                    if useatan[2]:
+                        atans[2] = atan2(x[i]*y[j], z[k]*r)
+                    sign = (-1.)**(i + j + k)
+                    for c in range(codes.shape[0]):
+                        res[c] += sign*_shared_kernel(
+                            codes[c], x[i], y[j], z[k], logs,
+                            atans)*density[m]
+
+@cython.boundscheck(False)
+@cython.wraparound(False)
 def tf(numpy.ndarray[DTYPE_T, ndim=1] xp not None,
        numpy.ndarray[DTYPE_T, ndim=1] yp not None,
        numpy.ndarray[DTYPE_T, ndim=1] zp not None, prisms,
-       double inc, double dec, pmag=None, pinc=None, pdec=None):
+       double inc, double dec, pmag=None, pinc=None, pdec=None,
+       njobs=1, dtype=DTYPE):
     """
     Calculate the total-field anomaly of prisms.
 
@@ -40,7 +540,8 @@ def tf(numpy.ndarray[DTYPE_T, ndim=1] xp not None,
         ignored. If the physical properties ``'inclination'`` and
         ``'declination'`` are not present, will use the values of *inc* and
         *dec* instead (regional field).
-        *prisms* can also be a :class:`~fatiando.mesher.PrismMesh`.
+        *prisms* can also be a :class:`~fatiando.mesher.PrismMesh` or a
+        :class:`~fatiando.mesher.PrismArray`.
     * inc : float
         The inclination of the regional field (in degrees)
     * dec : float
@@ -54,6 +555,14 @@ def tf(numpy.ndarray[DTYPE_T, ndim=1] xp not None,
     * pdec : float or None
         If not None, will use this value instead of the ``'declination'``
         property of the prisms. Use this, e.g., for sensitivity matrix building.
+    * njobs : int
+        Number of threads used to compute the points in parallel (with
+        OpenMP). The results are the same regardless of the number of threads.
+    * dtype : numpy dtype
+        The type of the output array. Can be ``numpy.float64`` or
+        ``numpy.float32``. The calculations are always done in double
+        precision, so single precision only rounds the result (relative error
+        smaller than 1e-7).
 
     Returns:
 
@@ -61,73 +570,187 @@ def tf(numpy.ndarray[DTYPE_T, ndim=1] xp not None,
         The field calculated on xp, yp, zp
 
     """
-    cdef unsigned int l, size, i, j, k
-    cdef numpy.ndarray[DTYPE_T, ndim=1] res, x, y, z
-    cdef DTYPE_T magnetization, kernel, r, r_sqr
-    cdef DTYPE_T x1, x2, y1, y2, z1, z2
-    cdef DTYPE_T fx, fy, fz, mx, my, mz
+    cdef Py_ssize_t l, size
+    cdef int nthreads
+    cdef DTYPE_T[::1] res, mag, mx, my, mz, x1, x2, y1, y2, z1, z2
+    cdef DTYPE_T fx, fy, fz
     if len(xp) != len(yp) != len(zp):
         raise ValueError("Input arrays xp, yp, and zp must have same length!")
+    nthreads = _check_njobs(njobs)
+    dtype = _check_dtype(dtype)
     size = len(xp)
-    res = numpy.zeros(size, dtype=DTYPE)
+    result = numpy.zeros(size, dtype=DTYPE)
+    res = result
     # Calculate the 3 components of the unit vector in the direction of the
     # regional field
     fx, fy, fz = utils.dircos(inc, dec)
-    x = numpy.zeros(2, dtype=DTYPE)
-    y = numpy.zeros(2, dtype=DTYPE)
-    z = numpy.zeros(2, dtype=DTYPE)
-    for prism in prisms:
-        if (prism is None or
-            ('magnetization' not in prism.props and pmag is None)):
-            continue
-        if pmag is None:
-            magnetization = prism.props['magnetization']
-        else:
-            magnetization = pmag
-        # Get the 3 components of the unit vector in the direction of the
-        # magnetization from the inclination and declination
-        # 1) given by the function
-        if pinc is not None and pdec is not None:
-            mx, my, mz = utils.dircos(pinc, pdec)
-        # 2) given by the prism
-        elif 'inclination' in prism.props and 'declination' in prism.props:
-            mx, my, mz = utils.dircos(prism.props['inclination'],
-                                      prism.props['declination'])
-        # 3) Use in the direction of the regional field
-        else:
-            mx, my, mz = fx, fy, fz
-        # Calculate on all computation points
-        x1, x2 = prism.x1, prism.x2
-        y1, y2 = prism.y1, prism.y2
-        z1, z2 = prism.z1, prism.z2
-        for l in xrange(size):
-            # First thing to do is make the computation point P the origin of
-            # the coordinate system
-            x[0] = x2 - xp[l]
-            x[1] = x1 - xp[l]
-            y[0] = y2 - yp[l]
-            y[1] = y1 - yp[l]
-            z[0] = z2 - zp[l]
-            z[1] = z1 - zp[l]
-            for k in range(2):
-                magnetization *= -1.
-                for j in range(2):
-                    for i in range(2):
-                        r_sqr = x[i]**2 + y[j]**2 + z[k]**2
-                        r = sqrt(r_sqr)
-                        res[l] += ((-1.)**(i + j))*magnetization*(
-                              0.5*(my*fz + mz*fy)*log((r - x[i])/(r + x[i]))
-                            + 0.5*(mx*fz + mz*fx)*log((r - y[j])/(r + y[j]))
-                            - (mx*fy + my*fx)*log(r + z[k])
-                            - mx*fx*atan2(x[i]*y[j], x[i]**2 + z[k]*r + z[k]**2)
-                            - my*fy*atan2(x[i]*y[j], r_sqr + z[k]*r - x[i]**2)
-                            + mz*fz*atan2(x[i]*y[j], z[k]*r))
-    res *= CM*T2NT
-    return res
+    array = prisms2array(prisms)
+    keep, mag = _get_prop(array, 'magnetization', pmag)
+    x1, x2, y1, y2, z1, z2 = _get_borders(array, keep)
+    # Get the 3 components of the unit vector in the direction of the
+    # magnetization from the inclination and declination
+    mx, my, mz = _get_magdir(array, keep, fx, fy, fz, pinc, pdec)
+    for l in prange(size, nogil=True, schedule='static',
+                    num_threads=nthreads):
+        res[l] = _tf_point(xp[l], yp[l], zp[l], x1, x2, y1, y2, z1, z2, mag,
+                           mx, my, mz, fx, fy, fz)
+    result *= CM*T2NT
+    return result.astype(dtype, copy=False)
+
+@cython.boundscheck(False)
+@cython.wraparound(False)
+cdef void _magnetic_point(DTYPE_T xp, DTYPE_T yp, DTYPE_T zp,
+        DTYPE_T[::1] x1, DTYPE_T[::1] x2, DTYPE_T[::1] y1, DTYPE_T[::1] y2,
+        DTYPE_T[::1] z1, DTYPE_T[::1] z2, DTYPE_T[::1] mx, DTYPE_T[::1] my,
+        DTYPE_T[::1] mz, DTYPE_T[:] res) nogil:
+    """
+    Calculate the 3 components of the magnetic induction of all prisms on a
+    single point. The result is stored in *res*.
+    """
+    cdef unsigned int m, i, j, k
+    cdef DTYPE_T x[2]
+    cdef DTYPE_T y[2]
+    cdef DTYPE_T z[2]
+    cdef DTYPE_T r, r_sqr, xy, zr, sign, vxx, vxy, vxz, vyy, vyz, vzz
+    for m in range(mx.shape[0]):
+        # First thing to do is make the computation point P the origin of
+        # the coordinate system
+        x[0] = x2[m] - xp
+        x[1] = x1[m] - xp
+        y[0] = y2[m] - yp
+        y[1] = y1[m] - yp
+        z[0] = z2[m] - zp
+        z[1] = z1[m] - zp
+        for k in range(2):
+            for j in range(2):
+                for i in range(2):
+                    xy = x[i]*y[j]
+                    r_sqr = x[i]**2 + y[j]**2 + z[k]**2
+                    r = sqrt(r_sqr)
+                    zr = z[k]*r
+                    # The terms of the symmetric tensor that gives the
+                    # magnetic induction from the magnetization vector
+                    vxx = -atan2(xy, x[i]**2 + zr + z[k]**2)
+                    vyy = -atan2(xy, r_sqr + zr - x[i]**2)
+                    vzz = atan2(xy, zr)
+                    vxy = -log(r + z[k])
+                    vxz = 0.5*log((r - y[j])/(r + y[j]))
+                    vyz = 0.5*log((r - x[i])/(r + x[i]))
+                    sign = (-1.)**(i + j + k + 1)
+                    res[0] += sign*(vxx*mx[m] + vxy*my[m] + vxz*mz[m])
+                    res[1] += sign*(vxy*mx[m] + vyy*my[m] + vyz*mz[m])
+                    res[2] += sign*(vxz*mx[m] + vyz*my[m] + vzz*mz[m])
+
+@cython.boundscheck(False)
+@cython.wraparound(False)
+def magnetic(numpy.ndarray[DTYPE_T, ndim=1] xp not None,
+             numpy.ndarray[DTYPE_T, ndim=1] yp not None,
+             numpy.ndarray[DTYPE_T, ndim=1] zp not None, prisms,
+             double inc, double dec, components=None, magvec=None, njobs=1,
+             dtype=DTYPE):
+    """
+    Calculate the total-field anomaly and the 3 components of the magnetic
+    induction of prisms in a single pass.
+
+    The terms of the formula of Bhattacharyya (1964) are evaluated once for
+    each prism and computation point and shared between all components. The
+    magnetization of each prism can be given as an array of magnetization
+    vectors (e.g., for magnetization vector inversion with remanence).
+
+    The total-field anomaly is the same as given by
+    :func:`~fatiando.gravmag._prism.tf`.
+
+    .. note:: Input units are SI. Output is in nT
+
+    .. note:: The coordinate system of the input parameters is to be x -> North,
+        y -> East and z -> Down.
+
+    Parameters:
+
+    * xp, yp, zp : arrays
+        Arrays with the x, y, and z coordinates of the computation points.
+    * prisms : list of :class:`~fatiando.mesher.Prism`
+        The model used to calculate the fields. If *magvec* is None, prisms
+        must have the physical property ``'magnetization'``. Those that don't
+        will be ignored. If the physical properties ``'inclination'`` and
+        ``'declination'`` are not present, will use the values of *inc* and
+        *dec* instead (regional field).
+        *prisms* can also be a :class:`~fatiando.mesher.PrismMesh` or a
+        :class:`~fatiando.mesher.PrismArray`.
+    * inc : float
+        The inclination of the regional field (in degrees)
+    * dec : float
+        The declination of the regional field (in degrees)
+    * components : list of str or None
+        The components to calculate. Can be any of ``'tf'``, ``'bx'``,
+        ``'by'``, ``'bz'``. If None, will calculate all of them (in this
+        order).
+    * magvec : 2D array or None
+        If not None, will use these magnetization vectors instead of the
+        physical properties of the prisms. Each row has the x, y, and z
+        components of the magnetization (in A/m) of a prism. Must have one row
+        for each element of *prisms* that is not None (e.g., for each cell of
+        :func:`~fatiando.mesher.prisms2array`), in the same order.
+    * njobs : int
+        Number of threads used to compute the points in parallel (with
+        OpenMP). The results are the same regardless of the number of threads.
+    * dtype : numpy dtype
+        The type of the output array. Can be ``numpy.float64`` or
+        ``numpy.float32``. The calculations are always done in double
+        precision, so single precision only rounds the result (relative error
+        smaller than 1e-7).
+
+    Returns:
+
+    * res : list of arrays
+        The fields calculated on xp, yp, zp. One array for each element of
+        *components*, in the same order.
+
+    """
+    cdef Py_ssize_t l, size
+    cdef int nthreads
+    cdef DTYPE_T[:, ::1] res
+    cdef DTYPE_T[::1] mx, my, mz, x1, x2, y1, y2, z1, z2
+    cdef DTYPE_T fx, fy, fz
+    if len(xp) != len(yp) != len(zp):
+        raise ValueError("Input arrays xp, yp, and zp must have same length!")
+    nthreads = _check_njobs(njobs)
+    dtype = _check_dtype(dtype)
+    components = _check_magnetic(components)
+    size = len(xp)
+    result = numpy.zeros((3, size), dtype=DTYPE)
+    res = result
+    # Calculate the 3 components of the unit vector in the direction of the
+    # regional field
+    fx, fy, fz = utils.dircos(inc, dec)
+    array = prisms2array(prisms)
+    if magvec is not None:
+        magvec = numpy.asarray(magvec, dtype=DTYPE)
+        if magvec.shape != (array.size, 3):
+            raise ValueError("magvec must have shape (%d, 3) but got %s"
+                             % (array.size, str(magvec.shape)))
+        keep = numpy.ones(array.size, dtype=numpy.bool)
+        mx, my, mz = [numpy.ascontiguousarray(m) for m in magvec.T]
+    else:
+        keep, mag = _get_prop(array, 'magnetization', None)
+        # Multiply the intensity by the unit vector in the direction of the
+        # magnetization of each prism
+        mx, my, mz = [mag*m for m in _get_magdir(array, keep, fx, fy, fz,
+                                                 None, None)]
+    x1, x2, y1, y2, z1, z2 = _get_borders(array, keep)
+    for l in prange(size, nogil=True, schedule='static',
+                    num_threads=nthreads):
+        _magnetic_point(xp[l], yp[l], zp[l], x1, x2, y1, y2, z1, z2, mx, my,
+                        mz, res[:, l])
+    bx, by, bz = result
+    fields = {'bx':bx, 'by':by, 'bz':bz, 'tf':fx*bx + fy*by + fz*bz}
+    return [(CM*T2NT*fields[c]).astype(dtype, copy=False)
+            for c in components]
 
 def potential(numpy.ndarray[DTYPE_T, ndim=1] xp not None,
               numpy.ndarray[DTYPE_T, ndim=1] yp not None,
-              numpy.ndarray[DTYPE_T, ndim=1] zp not None, prisms, dens=None):
+              numpy.ndarray[DTYPE_T, ndim=1] zp not None, prisms, dens=None,
+              njobs=1, ratio=None, dtype=DTYPE):
     """
     Calculates the gravitational potential.
 
@@ -145,7 +768,8 @@ def potential(numpy.ndarray[DTYPE_T, ndim=1] xp not None,
         Prisms must have the property ``'density'``. Prisms that don't have this
         property will be ignored in the computations. Elements of *prisms* that
         are None will also be ignored. *prisms* can also be a
-        :class:`~fatiando.mesher.PrismMesh`.
+        :class:`~fatiando.mesher.PrismMesh` or a
+        :class:`~fatiando.mesher.PrismArray`.
     * dens : float or None
         If not None, will use this value instead of the ``'density'`` property
         of the prisms. Use this, e.g., for sensitivity matrix building.
@@ -153,59 +777,34 @@ def potential(numpy.ndarray[DTYPE_T, ndim=1] xp not None,
         .. warning:: Uses this value for **all** prisms! Not only the ones that
             have ``'density'`` as a property.
 
+    * njobs : int
+        Number of threads used to compute the points in parallel (with
+        OpenMP). The results are the same regardless of the number of threads.
+    * ratio : float or None
+        If not None, prisms that are farther than *ratio* times their size
+        (the length of their diagonal) from a computation point are
+        approximated by their multipole expansion (a point mass at their
+        center plus the quadrupole term). This is faster and the error
+        decreases with the fourth power of the distance. If None, will always
+        use the exact formula.
+    * dtype : numpy dtype
+        The type of the output array. Can be ``numpy.float64`` or
+        ``numpy.float32``. The calculations are always done in double
+        precision, so single precision only rounds the result (relative error
+        smaller than 1e-7).
+
     Returns:
 
     * res : array
         The field calculated on xp, yp, zp
 
     """
-    cdef unsigned int l, size, i, j, k
-    cdef numpy.ndarray[DTYPE_T, ndim=1] res, x, y, z
-    cdef DTYPE_T density, kernel, r
-    cdef DTYPE_T x1, x2, y1, y2, z1, z2
-    size = len(xp)
-    res = numpy.zeros(size, dtype=DTYPE)
-    x = numpy.zeros(2, dtype=DTYPE)
-    y = numpy.zeros(2, dtype=DTYPE)
-    z = numpy.zeros(2, dtype=DTYPE)
-    for prism in prisms:
-        if prism is None or ('density' not in prism.props and dens is None):
-            continue
-        if dens is None:
-            density = prism.props['density']
-        else:
-            density = dens
-        x1, x2 = prism.x1, prism.x2
-        y1, y2 = prism.y1, prism.y2
-        z1, z2 = prism.z1, prism.z2
-        for l in xrange(size):
-            # First thing to do is make the computation point P the origin of
-            # the coordinate system
-            x[0] = x2 - xp[l]
-            x[1] = x1 - xp[l]
-            y[0] = y2 - yp[l]
-            y[1] = y1 - yp[l]
-            z[0] = z2 - zp[l]
-            z[1] = z1 - zp[l]
-            # Evaluate the integration limits
-            for k in range(2):
-                for j in range(2):
-                    for i in range(2):
-                        r = sqrt(x[i]**2 + y[j]**2 + z[k]**2)
-                        kernel = (x[i]*y[j]*log(z[k] + r)
-                                  + y[j]*z[k]*log(x[i] + r)
-                                  + x[i]*z[k]*log(y[j] + r)
-                                  - 0.5*x[i]**2*atan2(z[k]*y[j], x[i]*r)
-                                  - 0.5*y[j]**2*atan2(z[k]*x[i], y[j]*r)
-                                  - 0.5*z[k]**2*atan2(x[i]*y[j], z[k]*r))
-                        res[l] += ((-1.)**(i + j + k))*kernel*density
-    # Now all that is left is to multiply res by the gravitational constant
-    res *= G
-    return res
+    return _gravity(xp, yp, zp, prisms, dens, 'potential', njobs, ratio, dtype)
 
 def gx(numpy.ndarray[DTYPE_T, ndim=1] xp not None,
        numpy.ndarray[DTYPE_T, ndim=1] yp not None,
-       numpy.ndarray[DTYPE_T, ndim=1] zp not None, prisms, dens=None):
+       numpy.ndarray[DTYPE_T, ndim=1] zp not None, prisms, dens=None,
+       njobs=1, ratio=None, dtype=DTYPE):
     """
     Calculates the :math:`g_x` gravity acceleration component.
 
@@ -223,10 +822,26 @@ def gx(numpy.ndarray[DTYPE_T, ndim=1] xp not None,
         Prisms must have the property ``'density'``. Prisms that don't have this
         property will be ignored in the computations. Elements of *prisms* that
         are None will also be ignored. *prisms* can also be a
-        :class:`~fatiando.mesher.PrismMesh`.
+        :class:`~fatiando.mesher.PrismMesh` or a
+        :class:`~fatiando.mesher.PrismArray`.
     * dens : float or None
         If not None, will use this value instead of the ``'density'`` property
         of the prisms. Use this, e.g., for sensitivity matrix building.
+    * njobs : int
+        Number of threads used to compute the points in parallel (with
+        OpenMP). The results are the same regardless of the number of threads.
+    * ratio : float or None
+        If not None, prisms that are farther than *ratio* times their size
+        (the length of their diagonal) from a computation point are
+        approximated by their multipole expansion (a point mass at their
+        center plus the quadrupole term). This is faster and the error
+        decreases with the fourth power of the distance. If None, will always
+        use the exact formula.
+    * dtype : numpy dtype
+        The type of the output array. Can be ``numpy.float64`` or
+        ``numpy.float32``. The calculations are always done in double
+        precision, so single precision only rounds the result (relative error
+        smaller than 1e-7).
 
     Returns:
 
@@ -234,53 +849,12 @@ def gx(numpy.ndarray[DTYPE_T, ndim=1] xp not None,
         The field calculated on xp, yp, zp
 
     """
-    cdef unsigned int l, size, i, j, k
-    cdef numpy.ndarray[DTYPE_T, ndim=1] res, x, y, z
-    cdef DTYPE_T density, kernel, r
-    cdef DTYPE_T x1, x2, y1, y2, z1, z2
-    size = len(xp)
-    res = numpy.zeros(size, dtype=DTYPE)
-    x = numpy.zeros(2, dtype=DTYPE)
-    y = numpy.zeros(2, dtype=DTYPE)
-    z = numpy.zeros(2, dtype=DTYPE)
-    for prism in prisms:
-        if prism is None or ('density' not in prism.props and dens is None):
-            continue
-        if dens is None:
-            density = prism.props['density']
-        else:
-            density = dens
-        x1, x2 = prism.x1, prism.x2
-        y1, y2 = prism.y1, prism.y2
-        z1, z2 = prism.z1, prism.z2
-        for l in xrange(size):
-            # First thing to do is make the computation point P the origin of
-            # the coordinate system
-            x[0] = x2 - xp[l]
-            x[1] = x1 - xp[l]
-            y[0] = y2 - yp[l]
-            y[1] = y1 - yp[l]
-            z[0] = z2 - zp[l]
-            z[1] = z1 - zp[l]
-            # Evaluate the integration limits
-            for k in range(2):
-                for j in range(2):
-                    for i in range(2):
-                        r = sqrt(x[i]**2 + y[j]**2 + z[k]**2)
-                        # Minus because Nagy et al (2000) give the formula for the
-                        # gradient of the potential. Gravity is -grad(V)
-                        kernel = -(y[j]*log(z[k] + r)
-                                   + z[k]*log(y[j] + r)
-                                   - x[i]*atan2(z[k]*y[j], x[i]*r))
-                        res[l] += ((-1.)**(i + j + k))*kernel*density
-    # Now all that is left is to multiply res by the gravitational constant and
-    # convert it to mGal units
-    res *= G*SI2MGAL
-    return res
+    return _gravity(xp, yp, zp, prisms, dens, 'gx', njobs, ratio, dtype)
 
 def gy(numpy.ndarray[DTYPE_T, ndim=1] xp not None,
        numpy.ndarray[DTYPE_T, ndim=1] yp not None,
-       numpy.ndarray[DTYPE_T, ndim=1] zp not None, prisms, dens=None):
+       numpy.ndarray[DTYPE_T, ndim=1] zp not None, prisms, dens=None,
+       njobs=1, ratio=None, dtype=DTYPE):
     """
     Calculates the :math:`g_y` gravity acceleration component.
 
@@ -298,10 +872,26 @@ def gy(numpy.ndarray[DTYPE_T, ndim=1] xp not None,
         Prisms must have the property ``'density'``. Prisms that don't have this
         property will be ignored in the computations. Elements of *prisms* that
         are None will also be ignored. *prisms* can also be a
-        :class:`~fatiando.mesher.PrismMesh`.
+        :class:`~fatiando.mesher.PrismMesh` or a
+        :class:`~fatiando.mesher.PrismArray`.
     * dens : float or None
         If not None, will use this value instead of the ``'density'`` property
         of the prisms. Use this, e.g., for sensitivity matrix building.
+    * njobs : int
+        Number of threads used to compute the points in parallel (with
+        OpenMP). The results are the same regardless of the number of threads.
+    * ratio : float or None
+        If not None, prisms that are farther than *ratio* times their size
+        (the length of their diagonal) from a computation point are
+        approximated by their multipole expansion (a point mass at their
+        center plus the quadrupole term). This is faster and the error
+        decreases with the fourth power of the distance. If None, will always
+        use the exact formula.
+    * dtype : numpy dtype
+        The type of the output array. Can be ``numpy.float64`` or
+        ``numpy.float32``. The calculations are always done in double
+        precision, so single precision only rounds the result (relative error
+        smaller than 1e-7).
 
     Returns:
 
@@ -309,53 +899,12 @@ def gy(numpy.ndarray[DTYPE_T, ndim=1] xp not None,
         The field calculated on xp, yp, zp
 
     """
-    cdef unsigned int l, size, i, j, k
-    cdef numpy.ndarray[DTYPE_T, ndim=1] res, x, y, z
-    cdef DTYPE_T density, kernel, r
-    cdef DTYPE_T x1, x2, y1, y2, z1, z2
-    size = len(xp)
-    res = numpy.zeros(size, dtype=DTYPE)
-    x = numpy.zeros(2, dtype=DTYPE)
-    y = numpy.zeros(2, dtype=DTYPE)
-    z = numpy.zeros(2, dtype=DTYPE)
-    for prism in prisms:
-        if prism is None or ('density' not in prism.props and dens is None):
-            continue
-        if dens is None:
-            density = prism.props['density']
-        else:
-            density = dens
-        x1, x2 = prism.x1, prism.x2
-        y1, y2 = prism.y1, prism.y2
-        z1, z2 = prism.z1, prism.z2
-        for l in xrange(size):
-            # First thing to do is make the computation point P the origin of
-            # the coordinate system
-            x[0] = x2 - xp[l]
-            x[1] = x1 - xp[l]
-            y[0] = y2 - yp[l]
-            y[1] = y1 - yp[l]
-            z[0] = z2 - zp[l]
-            z[1] = z1 - zp[l]
-            # Evaluate the integration limits
-            for k in range(2):
-                for j in range(2):
-                    for i in range(2):
-                        r = sqrt(x[i]**2 + y[j]**2 + z[k]**2)
-                        # Minus because Nagy et al (2000) give the formula for the
-                        # gradient of the potential. Gravity is -grad(V)
-                        kernel = -(z[k]*log(x[i] + r)
-                                   + x[i]*log(z[k] + r)
-                                   - y[j]*atan2(x[i]*z[k], y[j]*r))
-                        res[l] += ((-1.)**(i + j + k))*kernel*density
-    # Now all that is left is to multiply res by the gravitational constant and
-    # convert it to mGal units
-    res *= G*SI2MGAL
-    return res
+    return _gravity(xp, yp, zp, prisms, dens, 'gy', njobs, ratio, dtype)
 
 def gz(numpy.ndarray[DTYPE_T, ndim=1] xp not None,
        numpy.ndarray[DTYPE_T, ndim=1] yp not None,
-       numpy.ndarray[DTYPE_T, ndim=1] zp not None, prisms, dens=None):
+       numpy.ndarray[DTYPE_T, ndim=1] zp not None, prisms, dens=None,
+       njobs=1, ratio=None, dtype=DTYPE):
     """
     Calculates the :math:`g_z` gravity acceleration component.
 
@@ -373,10 +922,26 @@ def gz(numpy.ndarray[DTYPE_T, ndim=1] xp not None,
         Prisms must have the property ``'density'``. Prisms that don't have this
         property will be ignored in the computations. Elements of *prisms* that
         are None will also be ignored. *prisms* can also be a
-        :class:`~fatiando.mesher.PrismMesh`.
+        :class:`~fatiando.mesher.PrismMesh` or a
+        :class:`~fatiando.mesher.PrismArray`.
     * dens : float or None
         If not None, will use this value instead of the ``'density'`` property
         of the prisms. Use this, e.g., for sensitivity matrix building.
+    * njobs : int
+        Number of threads used to compute the points in parallel (with
+        OpenMP). The results are the same regardless of the number of threads.
+    * ratio : float or None
+        If not None, prisms that are farther than *ratio* times their size
+        (the length of their diagonal) from a computation point are
+        approximated by their multipole expansion (a point mass at their
+        center plus the quadrupole term). This is faster and the error
+        decreases with the fourth power of the distance. If None, will always
+        use the exact formula.
+    * dtype : numpy dtype
+        The type of the output array. Can be ``numpy.float64`` or
+        ``numpy.float32``. The calculations are always done in double
+        precision, so single precision only rounds the result (relative error
+        smaller than 1e-7).
 
     Returns:
 
@@ -384,53 +949,12 @@ def gz(numpy.ndarray[DTYPE_T, ndim=1] xp not None,
         The field calculated on xp, yp, zp
 
     """
-    cdef unsigned int l, size, i, j, k
-    cdef numpy.ndarray[DTYPE_T, ndim=1] res, x, y, z
-    cdef DTYPE_T density, kernel, r
-    cdef DTYPE_T x1, x2, y1, y2, z1, z2
-    size = len(xp)
-    res = numpy.zeros(size, dtype=DTYPE)
-    x = numpy.zeros(2, dtype=DTYPE)
-    y = numpy.zeros(2, dtype=DTYPE)
-    z = numpy.zeros(2, dtype=DTYPE)
-    for prism in prisms:
-        if prism is None or ('density' not in prism.props and dens is None):
-            continue
-        if dens is None:
-            density = prism.props['density']
-        else:
-            density = dens
-        x1, x2 = prism.x1, prism.x2
-        y1, y2 = prism.y1, prism.y2
-        z1, z2 = prism.z1, prism.z2
-        for l in xrange(size):
-            # First thing to do is make the computation point P the origin of
-            # the coordinate system
-            x[0] = x2 - xp[l]
-            x[1] = x1 - xp[l]
-            y[0] = y2 - yp[l]
-            y[1] = y1 - yp[l]
-            z[0] = z2 - zp[l]
-            z[1] = z1 - zp[l]
-            # Evaluate the integration limits
-            for k in range(2):
-                for j in range(2):
-                    for i in range(2):
-                        r = sqrt(x[i]**2 + y[j]**2 + z[k]**2)
-                        # Minus because Nagy et al (2000) give the formula for the
-                        # gradient of the potential. Gravity is -grad(V)
-                        kernel = -(x[i]*log(y[j] + r)
-                                   + y[j]*log(x[i] + r)
-                                   - z[k]*atan2(x[i]*y[j], z[k]*r))
-                        res[l] += ((-1.)**(i + j + k))*kernel*density
-    # Now all that is left is to multiply res by the gravitational constant and
-    # convert it to mGal units
-    res *= G*SI2MGAL
-    return res
+    return _gravity(xp, yp, zp, prisms, dens, 'gz', njobs, ratio, dtype)
 
 def gxx(numpy.ndarray[DTYPE_T, ndim=1] xp not None,
         numpy.ndarray[DTYPE_T, ndim=1] yp not None,
-        numpy.ndarray[DTYPE_T, ndim=1] zp not None, prisms, dens=None):
+        numpy.ndarray[DTYPE_T, ndim=1] zp not None, prisms, dens=None,
+        njobs=1, ratio=None, dtype=DTYPE):
     """
     Calculates the :math:`g_{xx}` gravity gradient tensor component.
 
@@ -448,10 +972,26 @@ def gxx(numpy.ndarray[DTYPE_T, ndim=1] xp not None,
         Prisms must have the property ``'density'``. Prisms that don't have this
         property will be ignored in the computations. Elements of *prisms* that
         are None will also be ignored. *prisms* can also be a
-        :class:`~fatiando.mesher.PrismMesh`.
+        :class:`~fatiando.mesher.PrismMesh` or a
+        :class:`~fatiando.mesher.PrismArray`.
     * dens : float or None
         If not None, will use this value instead of the ``'density'`` property
         of the prisms. Use this, e.g., for sensitivity matrix building.
+    * njobs : int
+        Number of threads used to compute the points in parallel (with
+        OpenMP). The results are the same regardless of the number of threads.
+    * ratio : float or None
+        If not None, prisms that are farther than *ratio* times their size
+        (the length of their diagonal) from a computation point are
+        approximated by their multipole expansion (a point mass at their
+        center plus the quadrupole term). This is faster and the error
+        decreases with the fourth power of the distance. If None, will always
+        use the exact formula.
+    * dtype : numpy dtype
+        The type of the output array. Can be ``numpy.float64`` or
+        ``numpy.float32``. The calculations are always done in double
+        precision, so single precision only rounds the result (relative error
+        smaller than 1e-7).
 
     Returns:
 
@@ -459,49 +999,12 @@ def gxx(numpy.ndarray[DTYPE_T, ndim=1] xp not None,
         The field calculated on xp, yp, zp
 
     """
-    cdef unsigned int l, size, i, j, k
-    cdef numpy.ndarray[DTYPE_T, ndim=1] res, x, y, z
-    cdef DTYPE_T density, kernel, r
-    cdef DTYPE_T x1, x2, y1, y2, z1, z2
-    size = len(xp)
-    res = numpy.zeros(size, dtype=DTYPE)
-    x = numpy.zeros(2, dtype=DTYPE)
-    y = numpy.zeros(2, dtype=DTYPE)
-    z = numpy.zeros(2, dtype=DTYPE)
-    for prism in prisms:
-        if prism is None or ('density' not in prism.props and dens is None):
-            continue
-        if dens is None:
-            density = prism.props['density']
-        else:
-            density = dens
-        x1, x2 = prism.x1, prism.x2
-        y1, y2 = prism.y1, prism.y2
-        z1, z2 = prism.z1, prism.z2
-        for l in xrange(size):
-            # First thing to do is make the computation point P the origin of
-            # the coordinate system
-            x[0] = x2 - xp[l]
-            x[1] = x1 - xp[l]
-            y[0] = y2 - yp[l]
-            y[1] = y1 - yp[l]
-            z[0] = z2 - zp[l]
-            z[1] = z1 - zp[l]
-            # Evaluate the integration limits
-            for k in range(2):
-                for j in range(2):
-                    for i in range(2):
-                        r = sqrt(x[i]**2 + y[j]**2 + z[k]**2)
-                        kernel = -atan2(z[k]*y[j], x[i]*r)
-                        res[l] += ((-1.)**(i + j + k))*kernel*density
-    # Now all that is left is to multiply res by the gravitational constant and
-    # convert it to Eotvos units
-    res *= G*SI2EOTVOS
-    return res
+    return _gravity(xp, yp, zp, prisms, dens, 'gxx', njobs, ratio, dtype)
 
 def gxy(numpy.ndarray[DTYPE_T, ndim=1] xp not None,
         numpy.ndarray[DTYPE_T, ndim=1] yp not None,
-        numpy.ndarray[DTYPE_T, ndim=1] zp not None, prisms, dens=None):
+        numpy.ndarray[DTYPE_T, ndim=1] zp not None, prisms, dens=None,
+        njobs=1, ratio=None, dtype=DTYPE):
     """
     Calculates the :math:`g_{xy}` gravity gradient tensor component.
 
@@ -519,10 +1022,26 @@ def gxy(numpy.ndarray[DTYPE_T, ndim=1] xp not None,
         Prisms must have the property ``'density'``. Prisms that don't have this
         property will be ignored in the computations. Elements of *prisms* that
         are None will also be ignored. *prisms* can also be a
-        :class:`~fatiando.mesher.PrismMesh`.
+        :class:`~fatiando.mesher.PrismMesh` or a
+        :class:`~fatiando.mesher.PrismArray`.
     * dens : float or None
         If not None, will use this value instead of the ``'density'`` property
         of the prisms. Use this, e.g., for sensitivity matrix building.
+    * njobs : int
+        Number of threads used to compute the points in parallel (with
+        OpenMP). The results are the same regardless of the number of threads.
+    * ratio : float or None
+        If not None, prisms that are farther than *ratio* times their size
+        (the length of their diagonal) from a computation point are
+        approximated by their multipole expansion (a point mass at their
+        center plus the quadrupole term). This is faster and the error
+        decreases with the fourth power of the distance. If None, will always
+        use the exact formula.
+    * dtype : numpy dtype
+        The type of the output array. Can be ``numpy.float64`` or
+        ``numpy.float32``. The calculations are always done in double
+        precision, so single precision only rounds the result (relative error
+        smaller than 1e-7).
 
     Returns:
 
@@ -530,49 +1049,12 @@ def gxy(numpy.ndarray[DTYPE_T, ndim=1] xp not None,
         The field calculated on xp, yp, zp
 
     """
-    cdef unsigned int l, size, i, j, k
-    cdef numpy.ndarray[DTYPE_T, ndim=1] res, x, y, z
-    cdef DTYPE_T density, kernel, r
-    cdef DTYPE_T x1, x2, y1, y2, z1, z2
-    size = len(xp)
-    res = numpy.zeros(size, dtype=DTYPE)
-    x = numpy.zeros(2, dtype=DTYPE)
-    y = numpy.zeros(2, dtype=DTYPE)
-    z = numpy.zeros(2, dtype=DTYPE)
-    for prism in prisms:
-        if prism is None or ('density' not in prism.props and dens is None):
-            continue
-        if dens is None:
-            density = prism.props['density']
-        else:
-            density = dens
-        x1, x2 = prism.x1, prism.x2
-        y1, y2 = prism.y1, prism.y2
-        z1, z2 = prism.z1, prism.z2
-        for l in xrange(size):
-            # First thing to do is make the computation point P the origin of
-            # the coordinate system
-            x[0] = x2 - xp[l]
-            x[1] = x1 - xp[l]
-            y[0] = y2 - yp[l]
-            y[1] = y1 - yp[l]
-            z[0] = z2 - zp[l]
-            z[1] = z1 - zp[l]
-            # Evaluate the integration limits
-            for k in range(2):
-                for j in range(2):
-                    for i in range(2):
-                        r = sqrt(x[i]**2 + y[j]**2 + z[k]**2)
-                        kernel = log(z[k] + r)
-                        res[l] += ((-1.)**(i + j + k))*kernel*density
-    # Now all that is left is to multiply res by the gravitational constant and
-    # convert it to Eotvos units
-    res *= G*SI2EOTVOS
-    return res
+    return _gravity(xp, yp, zp, prisms, dens, 'gxy', njobs, ratio, dtype)
 
 def gxz(numpy.ndarray[DTYPE_T, ndim=1] xp not None,
         numpy.ndarray[DTYPE_T, ndim=1] yp not None,
-        numpy.ndarray[DTYPE_T, ndim=1] zp not None, prisms, dens=None):
+        numpy.ndarray[DTYPE_T, ndim=1] zp not None, prisms, dens=None,
+        njobs=1, ratio=None, dtype=DTYPE):
     """
     Calculates the :math:`g_{xz}` gravity gradient tensor component.
 
@@ -590,10 +1072,26 @@ def gxz(numpy.ndarray[DTYPE_T, ndim=1] xp not None,
         Prisms must have the property ``'density'``. Prisms that don't have this
         property will be ignored in the computations. Elements of *prisms* that
         are None will also be ignored. *prisms* can also be a
-        :class:`~fatiando.mesher.PrismMesh`.
+        :class:`~fatiando.mesher.PrismMesh` or a
+        :class:`~fatiando.mesher.PrismArray`.
     * dens : float or None
         If not None, will use this value instead of the ``'density'`` property
         of the prisms. Use this, e.g., for sensitivity matrix building.
+    * njobs : int
+        Number of threads used to compute the points in parallel (with
+        OpenMP). The results are the same regardless of the number of threads.
+    * ratio : float or None
+        If not None, prisms that are farther than *ratio* times their size
+        (the length of their diagonal) from a computation point are
+        approximated by their multipole expansion (a point mass at their
+        center plus the quadrupole term). This is faster and the error
+        decreases with the fourth power of the distance. If None, will always
+        use the exact formula.
+    * dtype : numpy dtype
+        The type of the output array. Can be ``numpy.float64`` or
+        ``numpy.float32``. The calculations are always done in double
+        precision, so single precision only rounds the result (relative error
+        smaller than 1e-7).
 
     Returns:
 
@@ -601,49 +1099,12 @@ def gxz(numpy.ndarray[DTYPE_T, ndim=1] xp not None,
         The field calculated on xp, yp, zp
 
     """
-    cdef unsigned int l, size, i, j, k
-    cdef numpy.ndarray[DTYPE_T, ndim=1] res, x, y, z
-    cdef DTYPE_T density, kernel, r
-    cdef DTYPE_T x1, x2, y1, y2, z1, z2
-    size = len(xp)
-    res = numpy.zeros(size, dtype=DTYPE)
-    x = numpy.zeros(2, dtype=DTYPE)
-    y = numpy.zeros(2, dtype=DTYPE)
-    z = numpy.zeros(2, dtype=DTYPE)
-    for prism in prisms:
-        if prism is None or ('density' not in prism.props and dens is None):
-            continue
-        if dens is None:
-            density = prism.props['density']
-        else:
-            density = dens
-        x1, x2 = prism.x1, prism.x2
-        y1, y2 = prism.y1, prism.y2
-        z1, z2 = prism.z1, prism.z2
-        for l in xrange(size):
-            # First thing to do is make the computation point P the origin of
-            # the coordinate system
-            x[0] = x2 - xp[l]
-            x[1] = x1 - xp[l]
-            y[0] = y2 - yp[l]
-            y[1] = y1 - yp[l]
-            z[0] = z2 - zp[l]
-            z[1] = z1 - zp[l]
-            # Evaluate the integration limits
-            for k in range(2):
-                for j in range(2):
-                    for i in range(2):
-                        r = sqrt(x[i]**2 + y[j]**2 + z[k]**2)
-                        kernel = log(y[j] + r)
-                        res[l] += ((-1.)**(i + j + k))*kernel*density
-    # Now all that is left is to multiply res by the gravitational constant and
-    # convert it to Eotvos units
-    res *= G*SI2EOTVOS
-    return res
+    return _gravity(xp, yp, zp, prisms, dens, 'gxz', njobs, ratio, dtype)
 
 def gyy(numpy.ndarray[DTYPE_T, ndim=1] xp not None,
         numpy.ndarray[DTYPE_T, ndim=1] yp not None,
-        numpy.ndarray[DTYPE_T, ndim=1] zp not None, prisms, dens=None):
+        numpy.ndarray[DTYPE_T, ndim=1] zp not None, prisms, dens=None,
+        njobs=1, ratio=None, dtype=DTYPE):
     """
     Calculates the :math:`g_{yy}` gravity gradient tensor component.
 
@@ -661,10 +1122,26 @@ def gyy(numpy.ndarray[DTYPE_T, ndim=1] xp not None,
         Prisms must have the property ``'density'``. Prisms that don't have this
         property will be ignored in the computations. Elements of *prisms* that
         are None will also be ignored. *prisms* can also be a
-        :class:`~fatiando.mesher.PrismMesh`.
+        :class:`~fatiando.mesher.PrismMesh` or a
+        :class:`~fatiando.mesher.PrismArray`.
     * dens : float or None
         If not None, will use this value instead of the ``'density'`` property
         of the prisms. Use this, e.g., for sensitivity matrix building.
+    * njobs : int
+        Number of threads used to compute the points in parallel (with
+        OpenMP). The results are the same regardless of the number of threads.
+    * ratio : float or None
+        If not None, prisms that are farther than *ratio* times their size
+        (the length of their diagonal) from a computation point are
+        approximated by their multipole expansion (a point mass at their
+        center plus the quadrupole term). This is faster and the error
+        decreases with the fourth power of the distance. If None, will always
+        use the exact formula.
+    * dtype : numpy dtype
+        The type of the output array. Can be ``numpy.float64`` or
+        ``numpy.float32``. The calculations are always done in double
+        precision, so single precision only rounds the result (relative error
+        smaller than 1e-7).
 
     Returns:
 
@@ -672,49 +1149,12 @@ def gyy(numpy.ndarray[DTYPE_T, ndim=1] xp not None,
         The field calculated on xp, yp, zp
 
     """
-    cdef unsigned int l, size, i, j, k
-    cdef numpy.ndarray[DTYPE_T, ndim=1] res, x, y, z
-    cdef DTYPE_T density, kernel, r
-    cdef DTYPE_T x1, x2, y1, y2, z1, z2
-    size = len(xp)
-    res = numpy.zeros(size, dtype=DTYPE)
-    x = numpy.zeros(2, dtype=DTYPE)
-    y = numpy.zeros(2, dtype=DTYPE)
-    z = numpy.zeros(2, dtype=DTYPE)
-    for prism in prisms:
-        if prism is None or ('density' not in prism.props and dens is None):
-            continue
-        if dens is None:
-            density = prism.props['density']
-        else:
-            density = dens
-        x1, x2 = prism.x1, prism.x2
-        y1, y2 = prism.y1, prism.y2
-        z1, z2 = prism.z1, prism.z2
-        for l in xrange(size):
-            # First thing to do is make the computation point P the origin of
-            # the coordinate system
-            x[0] = x2 - xp[l]
-            x[1] = x1 - xp[l]
-            y[0] = y2 - yp[l]
-            y[1] = y1 - yp[l]
-            z[0] = z2 - zp[l]
-            z[1] = z1 - zp[l]
-            # Evaluate the integration limits
-            for k in range(2):
-                for j in range(2):
-                    for i in range(2):
-                        r = sqrt(x[i]**2 + y[j]**2 + z[k]**2)
-                        kernel = -atan2(z[k]*x[i], y[j]*r)
-                        res[l] += ((-1.)**(i + j + k))*kernel*density
-    # Now all that is left is to multiply res by the gravitational constant and
-    # convert it to Eotvos units
-    res *= G*SI2EOTVOS
-    return res
+    return _gravity(xp, yp, zp, prisms, dens, 'gyy', njobs, ratio, dtype)
 
 def gyz(numpy.ndarray[DTYPE_T, ndim=1] xp not None,
         numpy.ndarray[DTYPE_T, ndim=1] yp not None,
-        numpy.ndarray[DTYPE_T, ndim=1] zp not None, prisms, dens=None):
+        numpy.ndarray[DTYPE_T, ndim=1] zp not None, prisms, dens=None,
+        njobs=1, ratio=None, dtype=DTYPE):
     """
     Calculates the :math:`g_{yz}` gravity gradient tensor component.
 
@@ -732,10 +1172,26 @@ def gyz(numpy.ndarray[DTYPE_T, ndim=1] xp not None,
         Prisms must have the property ``'density'``. Prisms that don't have this
         property will be ignored in the computations. Elements of *prisms* that
         are None will also be ignored. *prisms* can also be a
-        :class:`~fatiando.mesher.PrismMesh`.
+        :class:`~fatiando.mesher.PrismMesh` or a
+        :class:`~fatiando.mesher.PrismArray`.
     * dens : float or None
         If not None, will use this value instead of the ``'density'`` property
         of the prisms. Use this, e.g., for sensitivity matrix building.
+    * njobs : int
+        Number of threads used to compute the points in parallel (with
+        OpenMP). The results are the same regardless of the number of threads.
+    * ratio : float or None
+        If not None, prisms that are farther than *ratio* times their size
+        (the length of their diagonal) from a computation point are
+        approximated by their multipole expansion (a point mass at their
+        center plus the quadrupole term). This is faster and the error
+        decreases with the fourth power of the distance. If None, will always
+        use the exact formula.
+    * dtype : numpy dtype
+        The type of the output array. Can be ``numpy.float64`` or
+        ``numpy.float32``. The calculations are always done in double
+        precision, so single precision only rounds the result (relative error
+        smaller than 1e-7).
 
     Returns:
 
@@ -743,49 +1199,12 @@ def gyz(numpy.ndarray[DTYPE_T, ndim=1] xp not None,
         The field calculated on xp, yp, zp
 
     """
-    cdef unsigned int l, size, i, j, k
-    cdef numpy.ndarray[DTYPE_T, ndim=1] res, x, y, z
-    cdef DTYPE_T density, kernel, r
-    cdef DTYPE_T x1, x2, y1, y2, z1, z2
-    size = len(xp)
-    res = numpy.zeros(size, dtype=DTYPE)
-    x = numpy.zeros(2, dtype=DTYPE)
-    y = numpy.zeros(2, dtype=DTYPE)
-    z = numpy.zeros(2, dtype=DTYPE)
-    for prism in prisms:
-        if prism is None or ('density' not in prism.props and dens is None):
-            continue
-        if dens is None:
-            density = prism.props['density']
-        else:
-            density = dens
-        x1, x2 = prism.x1, prism.x2
-        y1, y2 = prism.y1, prism.y2
-        z1, z2 = prism.z1, prism.z2
-        for l in xrange(size):
-            # First thing to do is make the computation point P the origin of
-            # the coordinate system
-            x[0] = x2 - xp[l]
-            x[1] = x1 - xp[l]
-            y[0] = y2 - yp[l]
-            y[1] = y1 - yp[l]
-            z[0] = z2 - zp[l]
-            z[1] = z1 - zp[l]
-            # Evaluate the integration limits
-            for k in range(2):
-                for j in range(2):
-                    for i in range(2):
-                        r = sqrt(x[i]**2 + y[j]**2 + z[k]**2)
-                        kernel = log(x[i] + r)
-                        res[l] += ((-1.)**(i + j + k))*kernel*density
-    # Now all that is left is to multiply res by the gravitational constant and
-    # convert it to Eotvos units
-    res *= G*SI2EOTVOS
-    return res
+    return _gravity(xp, yp, zp, prisms, dens, 'gyz', njobs, ratio, dtype)
 
 def gzz(numpy.ndarray[DTYPE_T, ndim=1] xp not None,
         numpy.ndarray[DTYPE_T, ndim=1] yp not None,
-        numpy.ndarray[DTYPE_T, ndim=1] zp not None, prisms, dens=None):
+        numpy.ndarray[DTYPE_T, ndim=1] zp not None, prisms, dens=None,
+        njobs=1, ratio=None, dtype=DTYPE):
     """
     Calculates the :math:`g_{zz}` gravity gradient tensor component.
 
@@ -803,10 +1222,26 @@ def gzz(numpy.ndarray[DTYPE_T, ndim=1] xp not None,
         Prisms must have the property ``'density'``. Prisms that don't have this
         property will be ignored in the computations. Elements of *prisms* that
         are None will also be ignored. *prisms* can also be a
-        :class:`~fatiando.mesher.PrismMesh`.
+        :class:`~fatiando.mesher.PrismMesh` or a
+        :class:`~fatiando.mesher.PrismArray`.
     * dens : float or None
         If not None, will use this value instead of the ``'density'`` property
         of the prisms. Use this, e.g., for sensitivity matrix building.
+    * njobs : int
+        Number of threads used to compute the points in parallel (with
+        OpenMP). The results are the same regardless of the number of threads.
+    * ratio : float or None
+        If not None, prisms that are farther than *ratio* times their size
+        (the length of their diagonal) from a computation point are
+        approximated by their multipole expansion (a point mass at their
+        center plus the quadrupole term). This is faster and the error
+        decreases with the fourth power of the distance. If None, will always
+        use the exact formula.
+    * dtype : numpy dtype
+        The type of the output array. Can be ``numpy.float64`` or
+        ``numpy.float32``. The calculations are always done in double
+        precision, so single precision only rounds the result (relative error
+        smaller than 1e-7).
 
     Returns:
 
@@ -814,42 +1249,238 @@ def gzz(numpy.ndarray[DTYPE_T, ndim=1] xp not None,
         The field calculated on xp, yp, zp
 
     """
-    cdef unsigned int l, size, i, j, k
-    cdef numpy.ndarray[DTYPE_T, ndim=1] res, x, y, z
-    cdef DTYPE_T density, kernel, r
-    cdef DTYPE_T x1, x2, y1, y2, z1, z2
+    return _gravity(xp, yp, zp, prisms, dens, 'gzz', njobs, ratio, dtype)
+
+@cython.boundscheck(False)
+@cython.wraparound(False)
+def fields(numpy.ndarray[DTYPE_T, ndim=1] xp not None,
+           numpy.ndarray[DTYPE_T, ndim=1] yp not None,
+           numpy.ndarray[DTYPE_T, ndim=1] zp not None, prisms,
+           components=None, dens=None, njobs=1, dtype=DTYPE):
+    """
+    Calculate several gravitational field components in a single pass.
+
+    The corner terms of the kernels (distances, logarithms and arctangents) are
+    shared between the components. They are evaluated once for each prism and
+    computation point and reused for all requested components. This is much
+    faster than calling each function separately, e.g. for full tensor
+    gradiometry.
+
+    The results are the same as given by
+    :func:`~fatiando.gravmag._prism.potential`,
+    :func:`~fatiando.gravmag._prism.gx`, etc.
+
+    .. note:: The coordinate system of the input parameters is to be x -> North,
+        y -> East and z -> Down.
+
+    .. note:: All input values in **SI** units(!). Gravity components are
+        returned in **mGal** and gradient tensor components in **Eotvos**!
+
+    Parameters:
+
+    * xp, yp, zp : arrays
+        Arrays with the x, y, and z coordinates of the computation points.
+    * prisms : list of :class:`~fatiando.mesher.Prism`
+        The density model used to calculate the gravitational effect.
+        Prisms must have the property ``'density'``. Prisms that don't have this
+        property will be ignored in the computations. Elements of *prisms* that
+        are None will also be ignored. *prisms* can also be a
+        :class:`~fatiando.mesher.PrismMesh` or a
+        :class:`~fatiando.mesher.PrismArray`.
+    * components : list of str or None
+        The components to calculate. Can be any of ``'potential'``, ``'gx'``,
+        ``'gy'``, ``'gz'``, ``'gxx'``, ``'gxy'``, ``'gxz'``, ``'gyy'``,
+        ``'gyz'``, ``'gzz'``. If None, will calculate all of them (in this
+        order).
+    * dens : float or None
+        If not None, will use this value instead of the ``'density'`` property
+        of the prisms. Use this, e.g., for sensitivity matrix building.
+
+        .. warning:: Uses this value for **all** prisms! Not only the ones that
+            have ``'density'`` as a property.
+
+    * njobs : int
+        Number of threads used to compute the points in parallel (with
+        OpenMP). The results are the same regardless of the number of threads.
+    * dtype : numpy dtype
+        The type of the output array. Can be ``numpy.float64`` or
+        ``numpy.float32``. The calculations are always done in double
+        precision, so single precision only rounds the result (relative error
+        smaller than 1e-7).
+
+    Returns:
+
+    * res : list of arrays
+        The fields calculated on xp, yp, zp. One array for each element of
+        *components*, in the same order.
+
+    """
+    cdef Py_ssize_t l, size
+    cdef unsigned int i, c, ncomps
+    cdef int nthreads
+    cdef DTYPE_T[:, ::1] res
+    cdef DTYPE_T[::1] density, x1, x2, y1, y2, z1, z2
+    cdef int[::1] codes, uselog, useatan
+    if len(xp) != len(yp) != len(zp):
+        raise ValueError("Input arrays xp, yp, and zp must have same length!")
+    nthreads = _check_njobs(njobs)
+    dtype = _check_dtype(dtype)
+    components = _check_components(components)
+    ncomps = len(components)
+    codes = numpy.array([_FIELDS.index(comp) for comp in components],
+                        dtype=numpy.intc)
+    uselog = numpy.zeros(3, dtype=numpy.intc)
+    useatan = numpy.zeros(3, dtype=numpy.intc)
+    for comp in components:
+        for i in _TERMS[comp][0]:
+            uselog[i] = 1
+        for i in _TERMS[comp][1]:
+            useatan[i] = 1
     size = len(xp)
-    res = numpy.zeros(size, dtype=DTYPE)
-    x = numpy.zeros(2, dtype=DTYPE)
-    y = numpy.zeros(2, dtype=DTYPE)
-    z = numpy.zeros(2, dtype=DTYPE)
-    for prism in prisms:
-        if prism is None or ('density' not in prism.props and dens is None):
+    result = numpy.zeros((ncomps, size), dtype=DTYPE)
+    res = result
+    array = prisms2array(prisms)
+    keep, density = _get_prop(array, 'density', dens)
+    x1, x2, y1, y2, z1, z2 = _get_borders(array, keep)
+    for l in prange(size, nogil=True, schedule='static',
+                    num_threads=nthreads):
+        _fields_point(xp[l], yp[l], zp[l], x1, x2, y1, y2, z1, z2, density,
+                      codes, uselog, useatan, res[:, l])
+    # Now all that is left is to multiply by the gravitational constant and
+    # convert to the units of each component
+    for c in range(ncomps):
+        result[c] *= _SCALE[components[c]]
+    return [result[c].astype(dtype, copy=False) for c in range(ncomps)]
+
+@cython.boundscheck(False)
+@cython.wraparound(False)
+cdef void _kernel_row(DTYPE_T xp, DTYPE_T yp, DTYPE_T zp,
+        DTYPE_T[::1] x1, DTYPE_T[::1] x2, DTYPE_T[::1] y1, DTYPE_T[::1] y2,
+        DTYPE_T[::1] z1, DTYPE_T[::1] z2, kernel_func kernel,
+        multipole_func multipole, DTYPE_T ratio_sqr, DTYPE_T scale,
+        MATRIX_T[::1] row) nogil:
+    """
+    Calculate the effect of each prism with unit density on a single point.
+    The result for each prism is stored in *row*.
+    If *ratio_sqr* > 0, use a multipole expansion for the prisms that are far
+    away.
+    """
+    cdef unsigned int m, i, j, k
+    cdef DTYPE_T x[2]
+    cdef DTYPE_T y[2]
+    cdef DTYPE_T z[2]
+    cdef DTYPE_T r, res
+    for m in range(row.shape[0]):
+        if ratio_sqr > 0 and _far_field(xp, yp, zp, x1[m], x2[m], y1[m],
+                                        y2[m], z1[m], z2[m], 1., ratio_sqr,
+                                        multipole, &res):
+            row[m] = res*scale
             continue
-        if dens is None:
-            density = prism.props['density']
-        else:
-            density = dens
-        x1, x2 = prism.x1, prism.x2
-        y1, y2 = prism.y1, prism.y2
-        z1, z2 = prism.z1, prism.z2
-        for l in xrange(size):
-            # First thing to do is make the computation point P the origin of
-            # the coordinate system
-            x[0] = x2 - xp[l]
-            x[1] = x1 - xp[l]
-            y[0] = y2 - yp[l]
-            y[1] = y1 - yp[l]
-            z[0] = z2 - zp[l]
-            z[1] = z1 - zp[l]
-            # Evaluate the integration limits
-            for k in range(2):
-                for j in range(2):
-                    for i in range(2):
-                        r = sqrt(x[i]**2 + y[j]**2 + z[k]**2)
-                        kernel = -atan2(x[i]*y[j], z[k]*r)
-                        res[l] += ((-1.)**(i + j + k))*kernel*density
-    # Now all that is left is to multiply res by the gravitational constant and
-    # convert it to Eotvos units
-    res *= G*SI2EOTVOS
-    return res
+        # First thing to do is make the computation point P the origin of
+        # the coordinate system
+        x[0] = x2[m] - xp
+        x[1] = x1[m] - xp
+        y[0] = y2[m] - yp
+        y[1] = y1[m] - yp
+        z[0] = z2[m] - zp
+        z[1] = z1[m] - zp
+        res = 0
+        # Evaluate the integration limits
+        for k in range(2):
+            for j in range(2):
+                for i in range(2):
+                    r = sqrt(x[i]**2 + y[j]**2 + z[k]**2)
+                    res += ((-1.)**(i + j + k))*kernel(x[i], y[j], z[k], r)
+        row[m] = res*scale
+
+@cython.boundscheck(False)
+@cython.wraparound(False)
+def kernel_matrix(numpy.ndarray[DTYPE_T, ndim=1] xp not None,
+                  numpy.ndarray[DTYPE_T, ndim=1] yp not None,
+                  numpy.ndarray[DTYPE_T, ndim=1] zp not None, prisms,
+                  field='gz', dtype=DTYPE, njobs=1, ratio=None):
+    """
+    Build the sensitivity (Jacobian) matrix of a gravitational field.
+
+    Element (i, j) of the matrix is the effect of the j-th prism with unit
+    density on the i-th computation point. So the predicted data of a density
+    model is ``numpy.dot(matrix, densities)``.
+
+    Prisms that are None (e.g., masked cells of a
+    :class:`~fatiando.mesher.PrismMesh`) don't get a column in the matrix. Use
+    the ``index`` attribute of :func:`~fatiando.mesher.prisms2array` to know
+    which prism corresponds to each column.
+
+    .. note:: The coordinate system of the input parameters is to be x -> North,
+        y -> East and z -> Down.
+
+    .. note:: All input values in **SI** units(!). Gravity components are
+        in **mGal** and gradient tensor components in **Eotvos**!
+
+    Parameters:
+
+    * xp, yp, zp : arrays
+        Arrays with the x, y, and z coordinates of the computation points.
+    * prisms : list of :class:`~fatiando.mesher.Prism`
+        The prisms of the model. Their physical properties are ignored.
+        *prisms* can also be a :class:`~fatiando.mesher.PrismMesh` or a
+        :class:`~fatiando.mesher.PrismArray`.
+    * field : str
+        The field component. Can be any of ``'potential'``, ``'gx'``,
+        ``'gy'``, ``'gz'``, ``'gxx'``, ``'gxy'``, ``'gxz'``, ``'gyy'``,
+        ``'gyz'``, ``'gzz'``.
+    * dtype : numpy dtype
+        The type of the matrix. Can be ``numpy.float64`` or ``numpy.float32``.
+        The calculations are always done in double precision.
+    * njobs : int
+        Number of threads used to compute the points in parallel (with
+        OpenMP). The results are the same regardless of the number of threads.
+    * ratio : float or None
+        If not None, prisms that are farther than *ratio* times their size
+        (the length of their diagonal) from a computation point are
+        approximated by their multipole expansion (a point mass at their
+        center plus the quadrupole term). This is faster and the error
+        decreases with the fourth power of the distance. If None, will always
+        use the exact formula.
+
+    Returns:
+
+    * matrix : 2D array
+        The sensitivity matrix with shape (len(xp), number of prisms)
+
+    """
+    cdef Py_ssize_t l, size
+    cdef int nthreads
+    cdef DTYPE_T scale
+    cdef kernel_func kernel
+    cdef multipole_func multipole
+    cdef DTYPE_T ratio_sqr
+    cdef DTYPE_T[::1] x1, x2, y1, y2, z1, z2
+    cdef numpy.float32_t[:, ::1] single
+    cdef numpy.float64_t[:, ::1] double
+    if len(xp) != len(yp) != len(zp):
+        raise ValueError("Input arrays xp, yp, and zp must have same length!")
+    nthreads = _check_njobs(njobs)
+    kernel = _get_kernel(field)
+    multipole = _get_multipole(field)
+    ratio_sqr = _check_ratio(ratio)
+    scale = _SCALE[field]
+    dtype = _check_dtype(dtype)
+    size = len(xp)
+    array = prisms2array(prisms)
+    x1, x2, y1, y2, z1, z2 = array.x1, array.x2, array.y1, array.y2, \
+                             array.z1, array.z2
+    matrix = numpy.empty((size, array.size), dtype=dtype)
+    if dtype == numpy.float32:
+        single = matrix
+        for l in prange(size, nogil=True, schedule='static',
+                        num_threads=nthreads):
+            _kernel_row(xp[l], yp[l], zp[l], x1, x2, y1, y2, z1, z2, kernel,
+                        multipole, ratio_sqr, scale, single[l])
+    else:
+        double = matrix
+        for l in prange(size, nogil=True, schedule='static',
+                        num_threads=nthreads):
+            _kernel_row(xp[l], yp[l], zp[l], x1, x2, y1, y2, z1, z2, kernel,
+                        multipole, ratio_sqr, scale, double[l])
+    return matrix
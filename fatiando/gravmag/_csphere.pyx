@@ -0,0 +1,778 @@
+"""
+Cython implementation of the potential fields of spheres
+"""
+import numpy
+
+from libc.math cimport sqrt
+# Import Cython definitions for numpy
+cimport numpy
+cimport cython
+from cython.parallel cimport prange
+
+DTYPE = numpy.float
+ctypedef numpy.float_t DTYPE_T
+
+from fatiando.constants import CM, T2NT
+from fatiando.mesher import spheres2array
+from fatiando import utils
+from fatiando.gravmag._prism import (_FIELDS, _SCALE, _check_components,
+                                     _check_dtype)
+from fatiando.gravmag._cprism import _get_prop, _get_magdir, _check_njobs
+
+__all__ = ['potential', 'gx', 'gy', 'gz', 'gxx', 'gxy', 'gxz', 'gyy', 'gyz',
+    'gzz', 'tf', 'fields', 'kernel_matrix']
+
+# The types of the sensitivity matrices built by kernel_matrix
+ctypedef fused MATRIX_T:
+    numpy.float32_t
+    numpy.float64_t
+
+@cython.cdivision(True)
+cdef inline DTYPE_T _kernel(int code, DTYPE_T dx, DTYPE_T dy, DTYPE_T dz,
+        DTYPE_T r_sqr, DTYPE_T inv_r, DTYPE_T inv_r3, DTYPE_T inv_r5) nogil:
+    """
+    The field of a point mass with unit mass (without the gravitational
+    constant). dx, dy, dz are the coordinates of the point mass relative to the
+    computation point. *code* is the index of the field in _FIELDS.
+    """
+    if code == 0:
+        return inv_r
+    if code == 1:
+        return dx*inv_r3
+    if code == 2:
+        return dy*inv_r3
+    if code == 3:
+        return dz*inv_r3
+    if code == 4:
+        return (3*dx**2 - r_sqr)*inv_r5
+    if code == 5:
+        return 3*dx*dy*inv_r5
+    if code == 6:
+        return 3*dx*dz*inv_r5
+    if code == 7:
+        return (3*dy**2 - r_sqr)*inv_r5
+    if code == 8:
+        return 3*dy*dz*inv_r5
+    return (3*dz**2 - r_sqr)*inv_r5
+
+def _get_centers(array, keep):
+    """
+    Get the centers of the spheres in *array* for which *keep* is True.
+    """
+    return [c[keep] for c in [array.x, array.y, array.z]]
+
+def _get_field_code(field):
+    """
+    Get the index of *field* in _FIELDS. Raises ValueError if it is invalid.
+    """
+    if field not in _SCALE:
+        raise ValueError("Invalid field '%s'. Use one of %s"
+                         % (field, ', '.join(_FIELDS)))
+    return _FIELDS.index(field)
+
+@cython.boundscheck(False)
+@cython.wraparound(False)
+@cython.cdivision(True)
+cdef void _fields_point(DTYPE_T xp, DTYPE_T yp, DTYPE_T zp, DTYPE_T[::1] x,
+        DTYPE_T[::1] y, DTYPE_T[::1] z, DTYPE_T[::1] mass, int[::1] codes,
+        DTYPE_T[:] res) nogil:
+    """
+    Calculate several components of all spheres on a single point. The
+    distance to each sphere is calculated once for all components. The result
+    for each component is stored in *res*.
+    """
+    cdef unsigned int m, c
+    cdef DTYPE_T dx, dy, dz, r_sqr, inv_r, inv_r3, inv_r5
+    for m in range(mass.shape[0]):
+        # First thing to do is make the computation point P the origin of
+        # the coordinate system
+        dx = x[m] - xp
+        dy = y[m] - yp
+        dz = z[m] - zp
+        r_sqr = dx**2 + dy**2 + dz**2
+        inv_r = 1./sqrt(r_sqr)
+        inv_r3 = inv_r/r_sqr
+        inv_r5 = inv_r3/r_sqr
+        for c in range(codes.shape[0]):
+            res[c] += mass[m]*_kernel(codes[c], dx, dy, dz, r_sqr, inv_r,
+                                      inv_r3, inv_r5)
+
+@cython.boundscheck(False)
+@cython.wraparound(False)
+@cython.cdivision(True)
+cdef inline DTYPE_T _tf_point(DTYPE_T xp, DTYPE_T yp, DTYPE_T zp,
+        DTYPE_T[::1] x, DTYPE_T[::1] y, DTYPE_T[::1] z, DTYPE_T[::1] moment,
+        DTYPE_T[::1] mx, DTYPE_T[::1] my, DTYPE_T[::1] mz, DTYPE_T fx,
+        DTYPE_T fy, DTYPE_T fz) nogil:
+    """
+    Calculate the total-field anomaly of all spheres on a single point.
+    """
+    cdef unsigned int m
+    cdef DTYPE_T dx, dy, dz, r_sqr, inv_r5, dotprod, bx, by, bz, res = 0
+    for m in range(moment.shape[0]):
+        dx = x[m] - xp
+        dy = y[m] - yp
+        dz = z[m] - zp
+        # Calculate the 3 components of B
+        dotprod = mx[m]*dx + my[m]*dy + mz[m]*dz
+        r_sqr = dx**2 + dy**2 + dz**2
+        inv_r5 = 1./(r_sqr**2*sqrt(r_sqr))
+        bx = (3*dotprod*dx - r_sqr*mx[m])
+        by = (3*dotprod*dy - r_sqr*my[m])
+        bz = (3*dotprod*dz - r_sqr*mz[m])
+        res += moment[m]*(fx*bx + fy*by + fz*bz)*inv_r5
+    return res
+
+@cython.boundscheck(False)
+@cython.wraparound(False)
+@cython.cdivision(True)
+cdef void _kernel_row(DTYPE_T xp, DTYPE_T yp, DTYPE_T zp, DTYPE_T[::1] x,
+        DTYPE_T[::1] y, DTYPE_T[::1] z, DTYPE_T[::1] volume, int code,
+        DTYPE_T scale, MATRIX_T[::1] row) nogil:
+    """
+    Calculate the effect of each sphere with unit density on a single point.
+    The result for each sphere is stored in *row*.
+    """
+    cdef unsigned int m
+    cdef DTYPE_T dx, dy, dz, r_sqr, inv_r, inv_r3, inv_r5
+    for m in range(row.shape[0]):
+        dx = x[m] - xp
+        dy = y[m] - yp
+        dz = z[m] - zp
+        r_sqr = dx**2 + dy**2 + dz**2
+        inv_r = 1./sqrt(r_sqr)
+        inv_r3 = inv_r/r_sqr
+        inv_r5 = inv_r3/r_sqr
+        row[m] = volume[m]*scale*_kernel(code, dx, dy, dz, r_sqr, inv_r,
+                                         inv_r3, inv_r5)
+
+@cython.boundscheck(False)
+@cython.wraparound(False)
+def tf(numpy.ndarray[DTYPE_T, ndim=1] xp not None,
+       numpy.ndarray[DTYPE_T, ndim=1] yp not None,
+       numpy.ndarray[DTYPE_T, ndim=1] zp not None, spheres,
+       double inc, double dec, njobs=1, dtype=DTYPE):
+    """
+    Calculate the total-field anomaly of spheres.
+
+    .. note:: Input units are SI. Output is in nT
+
+    Parameters:
+
+    * xp, yp, zp : arrays
+        The x, y, and z coordinates where the anomaly will be calculated
+    * spheres : list of :class:`fatiando.mesher.Sphere`
+        The spheres. Spheres must have the properties ``'magnetization'``,
+        ``'inclination'`` and ``'declination'``. If ``'inclination'`` and
+        ``'declination'`` are not present, will use the values of *inc* and
+        *dec* instead. Those without ``'magnetization'`` will be ignored.
+        *spheres* can also be a :class:`~fatiando.mesher.SphereArray`.
+    * inc : float
+        The inclination of the regional field (in degrees)
+    * dec : float
+        The declination of the regional field (in degrees)
+    * njobs : int
+        Number of threads used to compute the points in parallel (with
+        OpenMP). The results are the same regardless of the number of threads.
+    * dtype : numpy dtype
+        The type of the output array. Can be ``numpy.float64`` or
+        ``numpy.float32``. The calculations are always done in double
+        precision, so single precision only rounds the result (relative error
+        smaller than 1e-7).
+
+    Returns:
+
+    * tf : array
+        The total-field anomaly
+
+    """
+    cdef Py_ssize_t l, size
+    cdef int nthreads
+    cdef DTYPE_T[::1] res, moment, mx, my, mz, x, y, z
+    cdef DTYPE_T fx, fy, fz
+    if len(xp) != len(yp) != len(zp):
+        raise ValueError("Input arrays xp, yp, and zp must have same length!")
+    nthreads = _check_njobs(njobs)
+    dtype = _check_dtype(dtype)
+    size = len(xp)
+    result = numpy.zeros(size, dtype=DTYPE)
+    res = result
+    # Calculate the 3 components of the unit vector in the direction of the
+    # regional field
+    fx, fy, fz = utils.dircos(inc, dec)
+    array = spheres2array(spheres)
+    keep, mag = _get_prop(array, 'magnetization', None)
+    moment = mag*4.*numpy.pi*array.radius[keep]**3/3.
+    x, y, z = _get_centers(array, keep)
+    # Get the 3 components of the unit vector in the direction of the
+    # magnetization from the inclination and declination
+    mx, my, mz = _get_magdir(array, keep, fx, fy, fz, None, None)
+    for l in prange(size, nogil=True, schedule='static',
+                    num_threads=nthreads):
+        res[l] = _tf_point(xp[l], yp[l], zp[l], x, y, z, moment, mx, my, mz,
+                           fx, fy, fz)
+    result *= CM*T2NT
+    return result.astype(dtype, copy=False)
+
+def potential(numpy.ndarray[DTYPE_T, ndim=1] xp not None,
+              numpy.ndarray[DTYPE_T, ndim=1] yp not None,
+              numpy.ndarray[DTYPE_T, ndim=1] zp not None, spheres, dens=None,
+              njobs=1, dtype=DTYPE):
+    """
+    Calculates the gravitational potential.
+
+    .. note:: The coordinate system of the input parameters is to be x -> North,
+        y -> East and z -> Down.
+
+    .. note:: All input and output values in SI!
+
+    Parameters:
+
+    * xp, yp, zp : arrays
+        The x, y, and z coordinates where the field will be calculated
+    * spheres : list of :class:`fatiando.mesher.Sphere`
+        The spheres. Spheres must have the property ``'density'``. Those without
+        will be ignored. *spheres* can also be a
+        :class:`~fatiando.mesher.SphereArray`.
+    * dens : float or None
+        If not None, will use this value instead of the ``'density'`` property
+        of the spheres. Use this, e.g., for sensitivity matrix building.
+    * njobs : int
+        Number of threads used to compute the points in parallel (with
+        OpenMP). The results are the same regardless of the number of threads.
+    * dtype : numpy dtype
+        The type of the output array. Can be ``numpy.float64`` or
+        ``numpy.float32``. The calculations are always done in double
+        precision, so single precision only rounds the result (relative error
+        smaller than 1e-7).
+
+    Returns:
+
+    * res : array
+        The field calculated on xp, yp, zp
+
+    """
+    return fields(xp, yp, zp, spheres, ['potential'], dens, njobs, dtype)[0]
+
+def gx(numpy.ndarray[DTYPE_T, ndim=1] xp not None,
+       numpy.ndarray[DTYPE_T, ndim=1] yp not None,
+       numpy.ndarray[DTYPE_T, ndim=1] zp not None, spheres, dens=None,
+       njobs=1, dtype=DTYPE):
+    """
+    Calculates the :math:`g_x` gravity acceleration component.
+
+    .. note:: The coordinate system of the input parameters is to be x -> North,
+        y -> East and z -> Down.
+
+    .. note:: All input values in SI and output in mGal!
+
+    Parameters:
+
+    * xp, yp, zp : arrays
+        The x, y, and z coordinates where the field will be calculated
+    * spheres : list of :class:`fatiando.mesher.Sphere`
+        The spheres. Spheres must have the property ``'density'``. Those without
+        will be ignored. *spheres* can also be a
+        :class:`~fatiando.mesher.SphereArray`.
+    * dens : float or None
+        If not None, will use this value instead of the ``'density'`` property
+        of the spheres. Use this, e.g., for sensitivity matrix building.
+    * njobs : int
+        Number of threads used to compute the points in parallel (with
+        OpenMP). The results are the same regardless of the number of threads.
+    * dtype : numpy dtype
+        The type of the output array. Can be ``numpy.float64`` or
+        ``numpy.float32``. The calculations are always done in double
+        precision, so single precision only rounds the result (relative error
+        smaller than 1e-7).
+
+    Returns:
+
+    * res : array
+        The field calculated on xp, yp, zp
+
+    """
+    return fields(xp, yp, zp, spheres, ['gx'], dens, njobs, dtype)[0]
+
+def gy(numpy.ndarray[DTYPE_T, ndim=1] xp not None,
+       numpy.ndarray[DTYPE_T, ndim=1] yp not None,
+       numpy.ndarray[DTYPE_T, ndim=1] zp not None, spheres, dens=None,
+       njobs=1, dtype=DTYPE):
+    """
+    Calculates the :math:`g_y` gravity acceleration component.
+
+    .. note:: The coordinate system of the input parameters is to be x -> North,
+        y -> East and z -> Down.
+
+    .. note:: All input values in SI and output in mGal!
+
+    Parameters:
+
+    * xp, yp, zp : arrays
+        The x, y, and z coordinates where the field will be calculated
+    * spheres : list of :class:`fatiando.mesher.Sphere`
+        The spheres. Spheres must have the property ``'density'``. Those without
+        will be ignored. *spheres* can also be a
+        :class:`~fatiando.mesher.SphereArray`.
+    * dens : float or None
+        If not None, will use this value instead of the ``'density'`` property
+        of the spheres. Use this, e.g., for sensitivity matrix building.
+    * njobs : int
+        Number of threads used to compute the points in parallel (with
+        OpenMP). The results are the same regardless of the number of threads.
+    * dtype : numpy dtype
+        The type of the output array. Can be ``numpy.float64`` or
+        ``numpy.float32``. The calculations are always done in double
+        precision, so single precision only rounds the result (relative error
+        smaller than 1e-7).
+
+    Returns:
+
+    * res : array
+        The field calculated on xp, yp, zp
+
+    """
+    return fields(xp, yp, zp, spheres, ['gy'], dens, njobs, dtype)[0]
+
+def gz(numpy.ndarray[DTYPE_T, ndim=1] xp not None,
+       numpy.ndarray[DTYPE_T, ndim=1] yp not None,
+       numpy.ndarray[DTYPE_T, ndim=1] zp not None, spheres, dens=None,
+       njobs=1, dtype=DTYPE):
+    """
+    Calculates the :math:`g_z` gravity acceleration component.
+
+    .. note:: The coordinate system of the input parameters is to be x -> North,
+        y -> East and z -> Down.
+
+    .. note:: All input values in SI and output in mGal!
+
+    Parameters:
+
+    * xp, yp, zp : arrays
+        The x, y, and z coordinates where the field will be calculated
+    * spheres : list of :class:`fatiando.mesher.Sphere`
+        The spheres. Spheres must have the property ``'density'``. Those without
+        will be ignored. *spheres* can also be a
+        :class:`~fatiando.mesher.SphereArray`.
+    * dens : float or None
+        If not None, will use this value instead of the ``'density'`` property
+        of the spheres. Use this, e.g., for sensitivity matrix building.
+    * njobs : int
+        Number of threads used to compute the points in parallel (with
+        OpenMP). The results are the same regardless of the number of threads.
+    * dtype : numpy dtype
+        The type of the output array. Can be ``numpy.float64`` or
+        ``numpy.float32``. The calculations are always done in double
+        precision, so single precision only rounds the result (relative error
+        smaller than 1e-7).
+
+    Returns:
+
+    * res : array
+        The field calculated on xp, yp, zp
+
+    """
+    return fields(xp, yp, zp, spheres, ['gz'], dens, njobs, dtype)[0]
+
+def gxx(numpy.ndarray[DTYPE_T, ndim=1] xp not None,
+        numpy.ndarray[DTYPE_T, ndim=1] yp not None,
+        numpy.ndarray[DTYPE_T, ndim=1] zp not None, spheres, dens=None,
+        njobs=1, dtype=DTYPE):
+    """
+    Calculates the :math:`g_{xx}` gravity gradient tensor component.
+
+    .. note:: The coordinate system of the input parameters is to be x -> North,
+        y -> East and z -> Down.
+
+    .. note:: All input values in SI and output in Eotvos!
+
+    Parameters:
+
+    * xp, yp, zp : arrays
+        The x, y, and z coordinates where the field will be calculated
+    * spheres : list of :class:`fatiando.mesher.Sphere`
+        The spheres. Spheres must have the property ``'density'``. Those without
+        will be ignored. *spheres* can also be a
+        :class:`~fatiando.mesher.SphereArray`.
+    * dens : float or None
+        If not None, will use this value instead of the ``'density'`` property
+        of the spheres. Use this, e.g., for sensitivity matrix building.
+    * njobs : int
+        Number of threads used to compute the points in parallel (with
+        OpenMP). The results are the same regardless of the number of threads.
+    * dtype : numpy dtype
+        The type of the output array. Can be ``numpy.float64`` or
+        ``numpy.float32``. The calculations are always done in double
+        precision, so single precision only rounds the result (relative error
+        smaller than 1e-7).
+
+    Returns:
+
+    * res : array
+        The field calculated on xp, yp, zp
+
+    """
+    return fields(xp, yp, zp, spheres, ['gxx'], dens, njobs, dtype)[0]
+
+def gxy(numpy.ndarray[DTYPE_T, ndim=1] xp not None,
+        numpy.ndarray[DTYPE_T, ndim=1] yp not None,
+        numpy.ndarray[DTYPE_T, ndim=1] zp not None, spheres, dens=None,
+        njobs=1, dtype=DTYPE):
+    """
+    Calculates the :math:`g_{xy}` gravity gradient tensor component.
+
+    .. note:: The coordinate system of the input parameters is to be x -> North,
+        y -> East and z -> Down.
+
+    .. note:: All input values in SI and output in Eotvos!
+
+    Parameters:
+
+    * xp, yp, zp : arrays
+        The x, y, and z coordinates where the field will be calculated
+    * spheres : list of :class:`fatiando.mesher.Sphere`
+        The spheres. Spheres must have the property ``'density'``. Those without
+        will be ignored. *spheres* can also be a
+        :class:`~fatiando.mesher.SphereArray`.
+    * dens : float or None
+        If not None, will use this value instead of the ``'density'`` property
+        of the spheres. Use this, e.g., for sensitivity matrix building.
+    * njobs : int
+        Number of threads used to compute the points in parallel (with
+        OpenMP). The results are the same regardless of the number of threads.
+    * dtype : numpy dtype
+        The type of the output array. Can be ``numpy.float64`` or
+        ``numpy.float32``. The calculations are always done in double
+        precision, so single precision only rounds the result (relative error
+        smaller than 1e-7).
+
+    Returns:
+
+    * res : array
+        The field calculated on xp, yp, zp
+
+    """
+    return fields(xp, yp, zp, spheres, ['gxy'], dens, njobs, dtype)[0]
+
+def gxz(numpy.ndarray[DTYPE_T, ndim=1] xp not None,
+        numpy.ndarray[DTYPE_T, ndim=1] yp not None,
+        numpy.ndarray[DTYPE_T, ndim=1] zp not None, spheres, dens=None,
+        njobs=1, dtype=DTYPE):
+    """
+    Calculates the :math:`g_{xz}` gravity gradient tensor component.
+
+    .. note:: The coordinate system of the input parameters is to be x -> North,
+        y -> East and z -> Down.
+
+    .. note:: All input values in SI and output in Eotvos!
+
+    Parameters:
+
+    * xp, yp, zp : arrays
+        The x, y, and z coordinates where the field will be calculated
+    * spheres : list of :class:`fatiando.mesher.Sphere`
+        The spheres. Spheres must have the property ``'density'``. Those without
+        will be ignored. *spheres* can also be a
+        :class:`~fatiando.mesher.SphereArray`.
+    * dens : float or None
+        If not None, will use this value instead of the ``'density'`` property
+        of the spheres. Use this, e.g., for sensitivity matrix building.
+    * njobs : int
+        Number of threads used to compute the points in parallel (with
+        OpenMP). The results are the same regardless of the number of threads.
+    * dtype : numpy dtype
+        The type of the output array. Can be ``numpy.float64`` or
+        ``numpy.float32``. The calculations are always done in double
+        precision, so single precision only rounds the result (relative error
+        smaller than 1e-7).
+
+    Returns:
+
+    * res : array
+        The field calculated on xp, yp, zp
+
+    """
+    return fields(xp, yp, zp, spheres, ['gxz'], dens, njobs, dtype)[0]
+
+def gyy(numpy.ndarray[DTYPE_T, ndim=1] xp not None,
+        numpy.ndarray[DTYPE_T, ndim=1] yp not None,
+        numpy.ndarray[DTYPE_T, ndim=1] zp not None, spheres, dens=None,
+        njobs=1, dtype=DTYPE):
+    """
+    Calculates the :math:`g_{yy}` gravity gradient tensor component.
+
+    .. note:: The coordinate system of the input parameters is to be x -> North,
+        y -> East and z -> Down.
+
+    .. note:: All input values in SI and output in Eotvos!
+
+    Parameters:
+
+    * xp, yp, zp : arrays
+        The x, y, and z coordinates where the field will be calculated
+    * spheres : list of :class:`fatiando.mesher.Sphere`
+        The spheres. Spheres must have the property ``'density'``. Those without
+        will be ignored. *spheres* can also be a
+        :class:`~fatiando.mesher.SphereArray`.
+    * dens : float or None
+        If not None, will use this value instead of the ``'density'`` property
+        of the spheres. Use this, e.g., for sensitivity matrix building.
+    * njobs : int
+        Number of threads used to compute the points in parallel (with
+        OpenMP). The results are the same regardless of the number of threads.
+    * dtype : numpy dtype
+        The type of the output array. Can be ``numpy.float64`` or
+        ``numpy.float32``. The calculations are always done in double
+        precision, so single precision only rounds the result (relative error
+        smaller than 1e-7).
+
+    Returns:
+
+    * res : array
+        The field calculated on xp, yp, zp
+
+    """
+    return fields(xp, yp, zp, spheres, ['gyy'], dens, njobs, dtype)[0]
+
+def gyz(numpy.ndarray[DTYPE_T, ndim=1] xp not None,
+        numpy.ndarray[DTYPE_T, ndim=1] yp not None,
+        numpy.ndarray[DTYPE_T, ndim=1] zp not None, spheres, dens=None,
+        njobs=1, dtype=DTYPE):
+    """
+    Calculates the :math:`g_{yz}` gravity gradient tensor component.
+
+    .. note:: The coordinate system of the input parameters is to be x -> North,
+        y -> East and z -> Down.
+
+    .. note:: All input values in SI and output in Eotvos!
+
+    Parameters:
+
+    * xp, yp, zp : arrays
+        The x, y, and z coordinates where the field will be calculated
+    * spheres : list of :class:`fatiando.mesher.Sphere`
+        The spheres. Spheres must have the property ``'density'``. Those without
+        will be ignored. *spheres* can also be a
+        :class:`~fatiando.mesher.SphereArray`.
+    * dens : float or None
+        If not None, will use this value instead of the ``'density'`` property
+        of the spheres. Use this, e.g., for sensitivity matrix building.
+    * njobs : int
+        Number of threads used to compute the points in parallel (with
+        OpenMP). The results are the same regardless of the number of threads.
+    * dtype : numpy dtype
+        The type of the output array. Can be ``numpy.float64`` or
+        ``numpy.float32``. The calculations are always done in double
+        precision, so single precision only rounds the result (relative error
+        smaller than 1e-7).
+
+    Returns:
+
+    * res : array
+        The field calculated on xp, yp, zp
+
+    """
+    return fields(xp, yp, zp, spheres, ['gyz'], dens, njobs, dtype)[0]
+
+def gzz(numpy.ndarray[DTYPE_T, ndim=1] xp not None,
+        numpy.ndarray[DTYPE_T, ndim=1] yp not None,
+        numpy.ndarray[DTYPE_T, ndim=1] zp not None, spheres, dens=None,
+        njobs=1, dtype=DTYPE):
+    """
+    Calculates the :math:`g_{zz}` gravity gradient tensor component.
+
+    .. note:: The coordinate system of the input parameters is to be x -> North,
+        y -> East and z -> Down.
+
+    .. note:: All input values in SI and output in Eotvos!
+
+    Parameters:
+
+    * xp, yp, zp : arrays
+        The x, y, and z coordinates where the field will be calculated
+    * spheres : list of :class:`fatiando.mesher.Sphere`
+        The spheres. Spheres must have the property ``'density'``. Those without
+        will be ignored. *spheres* can also be a
+        :class:`~fatiando.mesher.SphereArray`.
+    * dens : float or None
+        If not None, will use this value instead of the ``'density'`` property
+        of the spheres. Use this, e.g., for sensitivity matrix building.
+    * njobs : int
+        Number of threads used to compute the points in parallel (with
+        OpenMP). The results are the same regardless of the number of threads.
+    * dtype : numpy dtype
+        The type of the output array. Can be ``numpy.float64`` or
+        ``numpy.float32``. The calculations are always done in double
+        precision, so single precision only rounds the result (relative error
+        smaller than 1e-7).
+
+    Returns:
+
+    * res : array
+        The field calculated on xp, yp, zp
+
+    """
+    return fields(xp, yp, zp, spheres, ['gzz'], dens, njobs, dtype)[0]
+
+@cython.boundscheck(False)
+@cython.wraparound(False)
+def fields(numpy.ndarray[DTYPE_T, ndim=1] xp not None,
+           numpy.ndarray[DTYPE_T, ndim=1] yp not None,
+           numpy.ndarray[DTYPE_T, ndim=1] zp not None, spheres,
+           components=None, dens=None, njobs=1, dtype=DTYPE):
+    """
+    Calculate several gravitational field components in a single pass.
+
+    The distance between each sphere and computation point is calculated once
+    and reused for all requested components. This is faster than calling each
+    function separately, e.g. for full tensor gradiometry.
+
+    The spheres are treated as point masses at their centers, which is exact
+    outside of them.
+
+    .. note:: The coordinate system of the input parameters is to be x -> North,
+        y -> East and z -> Down.
+
+    .. note:: All input values in **SI** units(!). Gravity components are
+        returned in **mGal** and gradient tensor components in **Eotvos**!
+
+    Parameters:
+
+    * xp, yp, zp : arrays
+        Arrays with the x, y, and z coordinates of the computation points.
+    * spheres : list of :class:`fatiando.mesher.Sphere`
+        The spheres. Spheres must have the property ``'density'``. Those without
+        will be ignored. *spheres* can also be a
+        :class:`~fatiando.mesher.SphereArray`.
+    * components : list of str or None
+        The components to calculate. Can be any of ``'potential'``, ``'gx'``,
+        ``'gy'``, ``'gz'``, ``'gxx'``, ``'gxy'``, ``'gxz'``, ``'gyy'``,
+        ``'gyz'``, ``'gzz'``. If None, will calculate all of them (in this
+        order).
+    * dens : float or None
+        If not None, will use this value instead of the ``'density'`` property
+        of the spheres. Use this, e.g., for sensitivity matrix building.
+    * njobs : int
+        Number of threads used to compute the points in parallel (with
+        OpenMP). The results are the same regardless of the number of threads.
+    * dtype : numpy dtype
+        The type of the output array. Can be ``numpy.float64`` or
+        ``numpy.float32``. The calculations are always done in double
+        precision, so single precision only rounds the result (relative error
+        smaller than 1e-7).
+
+    Returns:
+
+    * res : list of arrays
+        The fields calculated on xp, yp, zp. One array for each element of
+        *components*, in the same order.
+
+    """
+    cdef Py_ssize_t l, size
+    cdef unsigned int c, ncomps
+    cdef int nthreads
+    cdef DTYPE_T[:, ::1] res
+    cdef DTYPE_T[::1] mass, x, y, z
+    cdef int[::1] codes
+    if len(xp) != len(yp) != len(zp):
+        raise ValueError("Input arrays xp, yp, and zp must have same length!")
+    nthreads = _check_njobs(njobs)
+    dtype = _check_dtype(dtype)
+    components = _check_components(components)
+    ncomps = len(components)
+    codes = numpy.array([_FIELDS.index(comp) for comp in components],
+                        dtype=numpy.intc)
+    size = len(xp)
+    result = numpy.zeros((ncomps, size), dtype=DTYPE)
+    res = result
+    array = spheres2array(spheres)
+    keep, density = _get_prop(array, 'density', dens)
+    mass = density*4.*numpy.pi*array.radius[keep]**3/3.
+    x, y, z = _get_centers(array, keep)
+    for l in prange(size, nogil=True, schedule='static',
+                    num_threads=nthreads):
+        _fields_point(xp[l], yp[l], zp[l], x, y, z, mass, codes, res[:, l])
+    # Now all that is left is to multiply by the gravitational constant and
+    # convert to the units of each component
+    for c in range(ncomps):
+        result[c] *= _SCALE[components[c]]
+    return [result[c].astype(dtype, copy=False) for c in range(ncomps)]
+
+@cython.boundscheck(False)
+@cython.wraparound(False)
+def kernel_matrix(numpy.ndarray[DTYPE_T, ndim=1] xp not None,
+                  numpy.ndarray[DTYPE_T, ndim=1] yp not None,
+                  numpy.ndarray[DTYPE_T, ndim=1] zp not None, spheres,
+                  field='gz', dtype=DTYPE, njobs=1):
+    """
+    Build the sensitivity (Jacobian) matrix of a gravitational field.
+
+    Element (i, j) of the matrix is the effect of the j-th sphere with unit
+    density on the i-th computation point. So the predicted data of a density
+    model is ``numpy.dot(matrix, densities)``. Use it, e.g., to build the
+    equivalent layer of point masses.
+
+    Spheres that are None don't get a column in the matrix. Use the ``index``
+    attribute of :func:`~fatiando.mesher.spheres2array` to know which sphere
+    corresponds to each column.
+
+    .. note:: The coordinate system of the input parameters is to be x -> North,
+        y -> East and z -> Down.
+
+    .. note:: All input values in **SI** units(!). Gravity components are
+        in **mGal** and gradient tensor components in **Eotvos**!
+
+    Parameters:
+
+    * xp, yp, zp : arrays
+        Arrays with the x, y, and z coordinates of the computation points.
+    * spheres : list of :class:`fatiando.mesher.Sphere`
+        The spheres of the model. Their physical properties are ignored.
+        *spheres* can also be a :class:`~fatiando.mesher.SphereArray`.
+    * field : str
+        The field component. Can be any of ``'potential'``, ``'gx'``,
+        ``'gy'``, ``'gz'``, ``'gxx'``, ``'gxy'``, ``'gxz'``, ``'gyy'``,
+        ``'gyz'``, ``'gzz'``.
+    * dtype : numpy dtype
+        The type of the matrix. Can be ``numpy.float64`` or ``numpy.float32``.
+        The calculations are always done in double precision.
+    * njobs : int
+        Number of threads used to compute the points in parallel (with
+        OpenMP). The results are the same regardless of the number of threads.
+
+    Returns:
+
+    * matrix : 2D array
+        The sensitivity matrix with shape (len(xp), number of spheres)
+
+    """
+    cdef Py_ssize_t l, size
+    cdef int nthreads, code
+    cdef DTYPE_T scale
+    cdef DTYPE_T[::1] x, y, z, volume
+    cdef numpy.float32_t[:, ::1] single
+    cdef numpy.float64_t[:, ::1] double
+    if len(xp) != len(yp) != len(zp):
+        raise ValueError("Input arrays xp, yp, and zp must have same length!")
+    nthreads = _check_njobs(njobs)
+    code = _get_field_code(field)
+    scale = _SCALE[field]
+    dtype = _check_dtype(dtype)
+    size = len(xp)
+    array = spheres2array(spheres)
+    x, y, z = array.x, array.y, array.z
+    volume = 4.*numpy.pi*array.radius**3/3.
+    matrix = numpy.empty((size, array.size), dtype=dtype)
+    if dtype == numpy.float32:
+        single = matrix
+        for l in prange(size, nogil=True, schedule='static',
+                        num_threads=nthreads):
+            _kernel_row(xp[l], yp[l], zp[l], x, y, z, volume, code, scale,
+                        single[l])
+    else:
+        double = matrix
+        for l in prange(size, nogil=True, schedule='static',
+                        num_threads=nthreads):
+            _kernel_row(xp[l], yp[l], zp[l], x, y, z, volume, code, scale,
+                        double[l])
+    return matrix
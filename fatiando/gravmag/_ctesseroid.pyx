@@ -1,424 +1,480 @@
 """
-Pure Python implementations of functions in fatiando.gravmag.tesseroid.
-Used instead of Cython versions if those are not available.
+Cython implementation of the potential fields of tesseroids.
+
+The adaptive discretization of the tesseroids is done for each computation
+point over arrays of tesseroid bounds, using a stack of fixed size. No Python
+objects are created while dividing the tesseroids.
 """
 import numpy
+
+from libc.math cimport sin, cos, sqrt, log, ceil
 # Import Cython definitions for numpy
 cimport numpy
+cimport cython
+from cython.parallel cimport prange
 
 DTYPE = numpy.float
 ctypedef numpy.float_t DTYPE_T
 
-from libc.math cimport sin, cos, sqrt
+from fatiando.constants import MEAN_EARTH_RADIUS, G
 
-from fatiando.constants import MEAN_EARTH_RADIUS
+cdef:
+    DTYPE_T d2r = numpy.pi/180.
+    DTYPE_T earth_radius = MEAN_EARTH_RADIUS
 
+# The maximum number of tesseroids in the stack of the adaptive
+# discretization. Each division adds 7 tesseroids to the stack, so this allows
+# 36 levels of division (the size of the tesseroids is divided by 2**36).
+# MAX_ORDER is the maximum number of GLQ nodes. NFIELDS is the number of
+# fields in _FIELDS.
+cdef enum:
+    STACK_SIZE = 256
+    MAX_ORDER = 32
+    NFIELDS = 10
 
-def _scale_nodes(tesseroid, nodes):
-    d2r = numpy.pi/180.
-    dlon = tesseroid.e - tesseroid.w
-    dlat = tesseroid.n - tesseroid.s
-    dr = tesseroid.top - tesseroid.bottom
-    # Scale the GLQ nodes to the integration limits
-    nodes_lon = d2r*(0.5*dlon*nodes + 0.5*(tesseroid.e + tesseroid.w))
-    nodes_lat = d2r*(0.5*dlat*nodes + 0.5*(tesseroid.n + tesseroid.s))
-    nodes_r = (0.5*dr*nodes +
-        0.5*(tesseroid.top + tesseroid.bottom + 2.*MEAN_EARTH_RADIUS))
-    scale = d2r*dlon*d2r*dlat*dr*0.125
-    return nodes_lon, nodes_lat, nodes_r, scale
+# The error codes returned by the adaptive discretization. STACK_OVERFLOW if
+# the tesseroid had to be divided too many times and ZERO_DISTANCE if a GLQ
+# node coincides with the computation point (or the distance between them is
+# lost to roundoff).
+cdef enum:
+    STACK_OVERFLOW = -1
+    ZERO_DISTANCE = -2
 
-def potential(tesseroid,
-    numpy.ndarray[DTYPE_T, ndim=1] lons,
-    numpy.ndarray[DTYPE_T, ndim=1] lats,
-    numpy.ndarray[DTYPE_T, ndim=1] radii,
-    numpy.ndarray[DTYPE_T, ndim=1] nodes,
-    numpy.ndarray[DTYPE_T, ndim=1] weights):
-    """
-    Integrate potential using the Gauss-Legendre Quadrature
-    """
-    cdef unsigned int order = len(nodes), ndata = len(lons), i, j, k, l
-    cdef numpy.ndarray[DTYPE_T, ndim=1] lonc, latc, rc, sinlatc, coslatc
-    cdef numpy.ndarray[DTYPE_T, ndim=1] result
-    cdef DTYPE_T scale, kappa, sinlat, coslat, radii_sqr, coslon, l_sqr
-    # Put the nodes in the corrent range
-    lonc, latc, rc, scale = _scale_nodes(tesseroid, nodes)
-    result = numpy.zeros(ndata, DTYPE)
-    # Pre-compute sines, cossines and powers
-    sinlatc = numpy.sin(latc)
-    coslatc = numpy.cos(latc)
-    # Start the numerical integration
-    for l in xrange(ndata):
-        sinlat = sin(lats[l])
-        coslat = cos(lats[l])
-        radii_sqr = radii[l]**2
-        for i in xrange(order):
-            coslon = cos(lons[l] - lonc[i])
-            for j in xrange(order):
-                for k in xrange(order):
-                    l_sqr = (radii_sqr + rc[k]**2 -
-                             2.*radii[l]*rc[k]*(
-                                sinlat*sinlatc[j] + coslat*coslatc[j]*coslon))
-                    kappa = (rc[k]**2)*coslatc[j]
-                    result[l] = result[l] + (weights[i]*weights[j]*weights[k]*
-                        kappa/sqrt(l_sqr))
-        result[l] = result[l]*scale
-    return result
+# The index used to identify each field in _integrand
+_FIELDS = {'potential':0, 'gx':1, 'gy':2, 'gz':3, 'gxx':4, 'gxy':5, 'gxz':6,
+           'gyy':7, 'gyz':8, 'gzz':9}
 
-def gx(tesseroid,
-    numpy.ndarray[DTYPE_T, ndim=1] lons,
-    numpy.ndarray[DTYPE_T, ndim=1] lats,
-    numpy.ndarray[DTYPE_T, ndim=1] radii,
-    numpy.ndarray[DTYPE_T, ndim=1] nodes,
-    numpy.ndarray[DTYPE_T, ndim=1] weights):
-    """
-    Integrate gx using the Gauss-Legendre Quadrature
-    """
-    cdef unsigned int order = len(nodes), ndata = len(lons), i, j, k, l
-    cdef numpy.ndarray[DTYPE_T, ndim=1] lonc, latc, rc, sinlatc, coslatc
-    cdef numpy.ndarray[DTYPE_T, ndim=1] result
-    cdef DTYPE_T scale, kappa, sinlat, coslat, radii_sqr, coslon, l_sqr
-    cdef DTYPE_T kphi
-    # Put the nodes in the corrent range
-    lonc, latc, rc, scale = _scale_nodes(tesseroid, nodes)
-    result = numpy.zeros(ndata, DTYPE)
-    # Pre-compute sines, cossines and powers
-    sinlatc = numpy.sin(latc)
-    coslatc = numpy.cos(latc)
-    # Start the numerical integration
-    for l in xrange(ndata):
-        sinlat = sin(lats[l])
-        coslat = cos(lats[l])
-        radii_sqr = radii[l]**2
-        for i in xrange(order):
-            coslon = cos(lons[l] - lonc[i])
-            for j in xrange(order):
-                kphi = coslat*sinlatc[j] - sinlat*coslatc[j]*coslon
-                for k in xrange(order):
-                    l_sqr = (radii_sqr + rc[k]**2 -
-                             2.*radii[l]*rc[k]*(
-                                sinlat*sinlatc[j] + coslat*coslatc[j]*coslon))
-                    kappa = (rc[k]**2)*coslatc[j]
-                    result[l] = result[l] + (weights[i]*weights[j]*weights[k]*
-                        kappa*rc[k]*kphi/(l_sqr**1.5))
-        result[l] = result[l]*scale
-    return result
 
-def gy(tesseroid,
-    numpy.ndarray[DTYPE_T, ndim=1] lons,
-    numpy.ndarray[DTYPE_T, ndim=1] lats,
-    numpy.ndarray[DTYPE_T, ndim=1] radii,
-    numpy.ndarray[DTYPE_T, ndim=1] nodes,
-    numpy.ndarray[DTYPE_T, ndim=1] weights):
+@cython.cdivision(True)
+cdef inline DTYPE_T _integrand(int field, DTYPE_T kappa, DTYPE_T deltax,
+        DTYPE_T deltay, DTYPE_T deltaz, DTYPE_T l_sqr, DTYPE_T l) nogil:
     """
-    Integrate gy using the Gauss-Legendre Quadrature
+    The integrand of *field* (without the GLQ weights) on a node.
+
+    The terms shared by all fields (*kappa*, the deltas, the squared distance
+    *l_sqr* and the distance *l*) are calculated only once per node by _glq.
     """
-    cdef unsigned int order = len(nodes), ndata = len(lons), i, j, k, l
-    cdef numpy.ndarray[DTYPE_T, ndim=1] lonc, latc, rc, sinlatc, coslatc
-    cdef numpy.ndarray[DTYPE_T, ndim=1] result
-    cdef DTYPE_T scale, kappa, sinlat, coslat, radii_sqr, coslon, l_sqr
-    cdef DTYPE_T sinlon
-    # Put the nodes in the corrent range
-    lonc, latc, rc, scale = _scale_nodes(tesseroid, nodes)
-    result = numpy.zeros(ndata, DTYPE)
-    # Pre-compute sines, cossines and powers
-    sinlatc = numpy.sin(latc)
-    coslatc = numpy.cos(latc)
-    # Start the numerical integration
-    for l in xrange(ndata):
-        sinlat = sin(lats[l])
-        coslat = cos(lats[l])
-        radii_sqr = radii[l]**2
-        for i in xrange(order):
-            coslon = cos(lons[l] - lonc[i])
-            sinlon = sin(lonc[i] - lons[l])
-            for j in xrange(order):
-                for k in xrange(order):
-                    l_sqr = (radii_sqr + rc[k]**2 -
-                             2.*radii[l]*rc[k]*(
-                                sinlat*sinlatc[j] + coslat*coslatc[j]*coslon))
-                    kappa = (rc[k]**2)*coslatc[j]
-                    result[l] = result[l] + (weights[i]*weights[j]*weights[k]*
-                        kappa*rc[k]*coslatc[j]*sinlon/(l_sqr**1.5))
-        result[l] = result[l]*scale
-    return result
+    if field == 0:
+        return kappa/l
+    if field == 1:
+        return kappa*deltax/(l_sqr*l)
+    if field == 2:
+        return kappa*deltay/(l_sqr*l)
+    if field == 3:
+        return kappa*deltaz/(l_sqr*l)
+    if field == 4:
+        return kappa*(3.*deltax*deltax - l_sqr)/(l_sqr*l_sqr*l)
+    if field == 5:
+        return kappa*3.*deltax*deltay/(l_sqr*l_sqr*l)
+    if field == 6:
+        return kappa*3.*deltax*deltaz/(l_sqr*l_sqr*l)
+    if field == 7:
+        return kappa*(3.*deltay*deltay - l_sqr)/(l_sqr*l_sqr*l)
+    if field == 8:
+        return kappa*3.*deltay*deltaz/(l_sqr*l_sqr*l)
+    return kappa*(3.*deltaz*deltaz - l_sqr)/(l_sqr*l_sqr*l)
 
-def gz(tesseroid,
-    numpy.ndarray[DTYPE_T, ndim=1] lons,
-    numpy.ndarray[DTYPE_T, ndim=1] lats,
-    numpy.ndarray[DTYPE_T, ndim=1] radii,
-    numpy.ndarray[DTYPE_T, ndim=1] nodes,
-    numpy.ndarray[DTYPE_T, ndim=1] weights):
+@cython.cdivision(True)
+cdef inline int _glq(int *fields, int nfields, DTYPE_T density,
+        DTYPE_T *tess, DTYPE_T lon, DTYPE_T sinlat, DTYPE_T coslat,
+        DTYPE_T radius, DTYPE_T *nodes, DTYPE_T *weights, int *order,
+        DTYPE_T *result) nogil:
     """
-    Integrate gz using the Gauss-Legendre Quadrature
+    Integrate the *nfields* *fields* of a single tesseroid (bounds in *tess*)
+    on a single point using the Gauss-Legendre Quadrature. Adds *density*
+    times the integral of fields[c] to result[c].
+
+    *nodes* and *weights* are tables with the GLQ nodes and weights of each
+    order (see tesseroid._glq_table). *order* has the number of nodes in
+    longitude, latitude, and radius.
+
+    Returns ZERO_DISTANCE if a node coincides with the point (the integrands
+    are singular there) and 0 otherwise.
     """
-    cdef unsigned int order = len(nodes), ndata = len(lons), i, j, k, l
-    cdef numpy.ndarray[DTYPE_T, ndim=1] lonc, latc, rc, sinlatc, coslatc
-    cdef numpy.ndarray[DTYPE_T, ndim=1] result
-    cdef DTYPE_T scale, kappa, sinlat, coslat, radii_sqr, coslon, l_sqr
-    cdef DTYPE_T cospsi
-    # Put the nodes in the corrent range
-    lonc, latc, rc, scale = _scale_nodes(tesseroid, nodes)
-    result = numpy.zeros(ndata, DTYPE)
-    # Pre-compute sines, cossines and powers
-    sinlatc = numpy.sin(latc)
-    coslatc = numpy.cos(latc)
-    # Start the numerical integration
-    for l in xrange(ndata):
-        sinlat = sin(lats[l])
-        coslat = cos(lats[l])
-        radii_sqr = radii[l]**2
-        for i in xrange(order):
-            coslon = cos(lons[l] - lonc[i])
-            for j in xrange(order):
-                cospsi = sinlat*sinlatc[j] + coslat*coslatc[j]*coslon
-                for k in xrange(order):
-                    l_sqr = (radii_sqr + rc[k]**2 -
-                             2.*radii[l]*rc[k]*(
-                                sinlat*sinlatc[j] + coslat*coslatc[j]*coslon))
-                    kappa = (rc[k]**2)*coslatc[j]
-                    result[l] = result[l] + (weights[i]*weights[j]*weights[k]*
-                        kappa*(rc[k]*cospsi - radii[l])/(l_sqr**1.5))
-        result[l] = result[l]*scale
-    return result
+    cdef:
+        int i, j, k, c
+        DTYPE_T w, e, s, n, top, bottom, scale, weight
+        DTYPE_T coslon, sinlon, cospsi, kphi, l_sqr, rc, radius_sqr, latc
+        DTYPE_T kappa, deltax, deltay, deltaz, l
+        DTYPE_T *nlon = nodes + order[0]*MAX_ORDER
+        DTYPE_T *nlat = nodes + order[1]*MAX_ORDER
+        DTYPE_T *nr = nodes + order[2]*MAX_ORDER
+        DTYPE_T *wlon = weights + order[0]*MAX_ORDER
+        DTYPE_T *wlat = weights + order[1]*MAX_ORDER
+        DTYPE_T *wr = weights + order[2]*MAX_ORDER
+        DTYPE_T lonc[MAX_ORDER]
+        DTYPE_T sinlatc[MAX_ORDER]
+        DTYPE_T coslatc[MAX_ORDER]
+        DTYPE_T rcs[MAX_ORDER]
+        DTYPE_T values[NFIELDS]
+    w, e, s, n, top, bottom = tess[0], tess[1], tess[2], tess[3], tess[4], \
+        tess[5]
+    # Scale the GLQ nodes to the integration limits
+    for i in range(order[0]):
+        lonc[i] = d2r*(0.5*(e - w)*nlon[i] + 0.5*(e + w))
+    for j in range(order[1]):
+        latc = d2r*(0.5*(n - s)*nlat[j] + 0.5*(n + s))
+        sinlatc[j] = sin(latc)
+        coslatc[j] = cos(latc)
+    for k in range(order[2]):
+        rcs[k] = (0.5*(top - bottom)*nr[k] +
+                  0.5*(top + bottom + 2.*earth_radius))
+    scale = d2r*(e - w)*d2r*(n - s)*(top - bottom)*0.125
+    radius_sqr = radius*radius
+    for c in range(nfields):
+        values[c] = 0
+    for i in range(order[0]):
+        coslon = cos(lon - lonc[i])
+        sinlon = sin(lonc[i] - lon)
+        for j in range(order[1]):
+            cospsi = sinlat*sinlatc[j] + coslat*coslatc[j]*coslon
+            kphi = coslat*sinlatc[j] - sinlat*coslatc[j]*coslon
+            for k in range(order[2]):
+                rc = rcs[k]
+                l_sqr = radius_sqr + rc*rc - 2.*radius*rc*cospsi
+                if l_sqr <= 0:
+                    return ZERO_DISTANCE
+                l = sqrt(l_sqr)
+                kappa = rc*rc*coslatc[j]
+                deltax = rc*kphi
+                deltay = rc*coslatc[j]*sinlon
+                deltaz = rc*cospsi - radius
+                weight = wlon[i]*wlat[j]*wr[k]
+                for c in range(nfields):
+                    values[c] += weight*_integrand(fields[c], kappa, deltax,
+                                                   deltay, deltaz, l_sqr, l)
+    for c in range(nfields):
+        result[c] += density*(values[c]*scale)
+    return 0
 
-def gxx(tesseroid,
-    numpy.ndarray[DTYPE_T, ndim=1] lons,
-    numpy.ndarray[DTYPE_T, ndim=1] lats,
-    numpy.ndarray[DTYPE_T, ndim=1] radii,
-    numpy.ndarray[DTYPE_T, ndim=1] nodes,
-    numpy.ndarray[DTYPE_T, ndim=1] weights):
+@cython.cdivision(True)
+cdef inline bint _raise_order(DTYPE_T distance, DTYPE_T size, DTYPE_T ratio,
+        int *order, int maxorder, int *raised) nogil:
     """
-    Integrate gxx using the Gauss-Legendre Quadrature
+    Check if integrating a tesseroid that is too close to the point with a
+    higher GLQ order is cheaper than dividing it. If so, put the orders in
+    *raised*. See tesseroid._raise_order.
     """
-    cdef unsigned int order = len(nodes), ndata = len(lons), i, j, k, l
-    cdef numpy.ndarray[DTYPE_T, ndim=1] lonc, latc, rc, sinlatc, coslatc
-    cdef numpy.ndarray[DTYPE_T, ndim=1] result
-    cdef DTYPE_T scale, kappa, sinlat, coslat, radii_sqr, coslon, l_sqr
-    cdef DTYPE_T kphi
-    # Put the nodes in the corrent range
-    lonc, latc, rc, scale = _scale_nodes(tesseroid, nodes)
-    result = numpy.zeros(ndata, DTYPE)
-    # Pre-compute sines, cossines and powers
-    sinlatc = numpy.sin(latc)
-    coslatc = numpy.cos(latc)
-    # Start the numerical integration
-    for l in xrange(ndata):
-        sinlat = sin(lats[l])
-        coslat = cos(lats[l])
-        radii_sqr = radii[l]**2
-        for i in xrange(order):
-            coslon = cos(lons[l] - lonc[i])
-            for j in xrange(order):
-                kphi = coslat*sinlatc[j] - sinlat*coslatc[j]*coslon
-                for k in xrange(order):
-                    l_sqr = (radii_sqr + rc[k]**2 -
-                             2.*radii[l]*rc[k]*(
-                                sinlat*sinlatc[j] + coslat*coslatc[j]*coslon))
-                    kappa = (rc[k]**2)*coslatc[j]
-                    result[l] = result[l] + (weights[i]*weights[j]*weights[k]*
-                        kappa*(3.*((rc[k]*kphi)**2) - l_sqr)/(l_sqr**2.5))
-        result[l] = result[l]*scale
-    return result
+    cdef int d, cost = 1
+    cdef DTYPE_T factor
+    if maxorder == 0 or distance <= 0.5*size:
+        return False
+    factor = log(2.*ratio)/log(2.*distance/size)
+    for d in range(3):
+        raised[d] = <int>ceil(factor*order[d])
+        if raised[d] > maxorder:
+            return False
+        cost *= raised[d]
+    return cost < 8*order[0]*order[1]*order[2]
 
-def gxy(tesseroid,
-    numpy.ndarray[DTYPE_T, ndim=1] lons,
-    numpy.ndarray[DTYPE_T, ndim=1] lats,
-    numpy.ndarray[DTYPE_T, ndim=1] radii,
-    numpy.ndarray[DTYPE_T, ndim=1] nodes,
-    numpy.ndarray[DTYPE_T, ndim=1] weights):
+@cython.boundscheck(False)
+@cython.wraparound(False)
+@cython.cdivision(True)
+cdef inline int _adaptive_tesseroid(int *fields, int nfields,
+        DTYPE_T density, DTYPE_T *bounds, DTYPE_T *center, DTYPE_T lon,
+        DTYPE_T sinlon, DTYPE_T coslon, DTYPE_T sinlat, DTYPE_T coslat,
+        DTYPE_T radius, DTYPE_T *nodes, DTYPE_T *weights, int *order,
+        int maxorder, DTYPE_T ratio, DTYPE_T *result, long *count) nogil:
     """
-    Integrate gxy using the Gauss-Legendre Quadrature
+    Calculate the *nfields* *fields* of a single tesseroid (with *bounds*) on
+    a single point, dividing it if it's too close to the point (distance
+    smaller than *ratio* times the size of the tesseroid). All fields are
+    calculated with the same divisions. Adds the results to
+    result[0:nfields] and the number of GLQ nodes used (kernel evaluations
+    per field) to *count*.
+
+    *center* has the sin and cos of the latitude and longitude of the center
+    of the tesseroid, so the distance to the undivided tesseroid needs no
+    trigonometric functions.
+
+    Returns STACK_OVERFLOW if the stack overflowed, ZERO_DISTANCE if the point
+    coincides with a GLQ node and 0 otherwise.
     """
-    cdef unsigned int order = len(nodes), ndata = len(lons), i, j, k, l
-    cdef numpy.ndarray[DTYPE_T, ndim=1] lonc, latc, rc, sinlatc, coslatc
-    cdef numpy.ndarray[DTYPE_T, ndim=1] result
-    cdef DTYPE_T scale, kappa, sinlat, coslat, radii_sqr, coslon, l_sqr
-    cdef DTYPE_T kphi, sinlon
-    # Put the nodes in the corrent range
-    lonc, latc, rc, scale = _scale_nodes(tesseroid, nodes)
-    result = numpy.zeros(ndata, DTYPE)
-    # Pre-compute sines, cossines and powers
-    sinlatc = numpy.sin(latc)
-    coslatc = numpy.cos(latc)
-    # Start the numerical integration
-    for l in xrange(ndata):
-        sinlat = sin(lats[l])
-        coslat = cos(lats[l])
-        radii_sqr = radii[l]**2
-        for i in xrange(order):
-            coslon = cos(lons[l] - lonc[i])
-            sinlon = sin(lonc[i] - lons[l])
-            for j in xrange(order):
-                kphi = coslat*sinlatc[j] - sinlat*coslatc[j]*coslon
-                for k in xrange(order):
-                    l_sqr = (radii_sqr + rc[k]**2 -
-                             2.*radii[l]*rc[k]*(
-                                sinlat*sinlatc[j] + coslat*coslatc[j]*coslon))
-                    kappa = (rc[k]**2)*coslatc[j]
-                    result[l] = result[l] + (weights[i]*weights[j]*weights[k]*
-                        kappa*3.*(rc[k]**2)*kphi*coslatc[j]*sinlon/(l_sqr**2.5))
-        result[l] = result[l]*scale
-    return result
+    cdef:
+        int top, i, j, k, b, error
+        int raised[3]
+        bint divided = False
+        DTYPE_T distance, size, cospsi, tess_radius, latc
+        DTYPE_T dlon, dlat, dr
+        DTYPE_T tess[6]
+        DTYPE_T stack[STACK_SIZE][6]
+    for b in range(6):
+        stack[0][b] = bounds[b]
+    top = 1
+    while top > 0:
+        top -= 1
+        for b in range(6):
+            tess[b] = stack[top][b]
+        dlon = tess[1] - tess[0]
+        dlat = tess[3] - tess[2]
+        dr = tess[4] - tess[5]
+        size = earth_radius*d2r*dlon
+        if earth_radius*d2r*dlat > size:
+            size = earth_radius*d2r*dlat
+        if dr > size:
+            size = dr
+        # The distance to the center of the top of the tesseroid
+        tess_radius = tess[4] + earth_radius
+        if divided:
+            latc = d2r*(tess[2] + 0.5*dlat)
+            cospsi = (sinlat*sin(latc) + coslat*cos(latc)*
+                      cos(lon - d2r*(tess[0] + 0.5*dlon)))
+        else:
+            cospsi = (sinlat*center[0] + coslat*center[1]*
+                      (coslon*center[3] + sinlon*center[2]))
+        distance = sqrt(radius*radius + tess_radius*tess_radius -
+                        2.*radius*tess_radius*cospsi)
+        if distance <= 0 or distance >= ratio*size:
+            error = _glq(fields, nfields, density, tess, lon, sinlat, coslat,
+                         radius, nodes, weights, order, result)
+            if error != 0:
+                return error
+            count[0] += order[0]*order[1]*order[2]
+        elif _raise_order(distance, size, ratio, order, maxorder, raised):
+            error = _glq(fields, nfields, density, tess, lon, sinlat, coslat,
+                         radius, nodes, weights, raised, result)
+            if error != 0:
+                return error
+            count[0] += raised[0]*raised[1]*raised[2]
+        else:
+            if top + 8 > STACK_SIZE:
+                return STACK_OVERFLOW
+            divided = True
+            # Divide the tesseroid in 8 by halving each dimension
+            for i in range(2):
+                for j in range(2):
+                    for k in range(2):
+                        stack[top][0] = tess[0] + i*0.5*dlon
+                        stack[top][1] = tess[0] + (i + 1)*0.5*dlon
+                        stack[top][2] = tess[2] + j*0.5*dlat
+                        stack[top][3] = tess[2] + (j + 1)*0.5*dlat
+                        stack[top][4] = tess[5] + (k + 1)*0.5*dr
+                        stack[top][5] = tess[5] + k*0.5*dr
+                        top += 1
+    return 0
 
-def gxz(tesseroid,
-    numpy.ndarray[DTYPE_T, ndim=1] lons,
-    numpy.ndarray[DTYPE_T, ndim=1] lats,
-    numpy.ndarray[DTYPE_T, ndim=1] radii,
-    numpy.ndarray[DTYPE_T, ndim=1] nodes,
-    numpy.ndarray[DTYPE_T, ndim=1] weights):
+@cython.boundscheck(False)
+@cython.wraparound(False)
+cdef inline int _adaptive_point(int *fields, int nfields, DTYPE_T lon,
+        DTYPE_T sinlon, DTYPE_T coslon, DTYPE_T sinlat, DTYPE_T coslat,
+        DTYPE_T radius, DTYPE_T[:, ::1] bounds, DTYPE_T[:, ::1] centers,
+        DTYPE_T[::1] density, DTYPE_T *nodes, DTYPE_T *weights, int *order,
+        int maxorder, DTYPE_T ratio, DTYPE_T *result, long *count) nogil:
     """
-    Integrate gxz using the Gauss-Legendre Quadrature
+    Calculate the *nfields* *fields* of all tesseroids on a single point (see
+    _adaptive_tesseroid). The results are put in result[0:nfields] and the
+    number of GLQ nodes used in *count*.
+
+    The sines and cossines of the point coordinates are calculated only once
+    for all tesseroids.
+
+    Returns the error code of _adaptive_tesseroid if it fails and 0 otherwise.
     """
-    cdef unsigned int order = len(nodes), ndata = len(lons), i, j, k, l
-    cdef numpy.ndarray[DTYPE_T, ndim=1] lonc, latc, rc, sinlatc, coslatc
-    cdef numpy.ndarray[DTYPE_T, ndim=1] result
-    cdef DTYPE_T scale, kappa, sinlat, coslat, radii_sqr, coslon, l_sqr
-    cdef DTYPE_T kphi, cospsi
-    # Put the nodes in the corrent range
-    lonc, latc, rc, scale = _scale_nodes(tesseroid, nodes)
-    result = numpy.zeros(ndata, DTYPE)
-    # Pre-compute sines, cossines and powers
-    sinlatc = numpy.sin(latc)
-    coslatc = numpy.cos(latc)
-    # Start the numerical integration
-    for l in xrange(ndata):
-        sinlat = sin(lats[l])
-        coslat = cos(lats[l])
-        radii_sqr = radii[l]**2
-        for i in xrange(order):
-            coslon = cos(lons[l] - lonc[i])
-            for j in xrange(order):
-                kphi = coslat*sinlatc[j] - sinlat*coslatc[j]*coslon
-                cospsi = sinlat*sinlatc[j] + coslat*coslatc[j]*coslon
-                for k in xrange(order):
-                    l_sqr = (radii_sqr + rc[k]**2 -
-                             2.*radii[l]*rc[k]*(
-                                sinlat*sinlatc[j] + coslat*coslatc[j]*coslon))
-                    kappa = (rc[k]**2)*coslatc[j]
-                    result[l] = result[l] + (weights[i]*weights[j]*weights[k]*
-                        kappa*3.*rc[k]*kphi*(rc[k]*cospsi - radii[l])/
-                        (l_sqr**2.5))
-        result[l] = result[l]*scale
-    return result
+    cdef:
+        unsigned int t, ntess = bounds.shape[0]
+        int c, error
+    for c in range(nfields):
+        result[c] = 0
+    count[0] = 0
+    for t in range(ntess):
+        error = _adaptive_tesseroid(fields, nfields, density[t],
+                                    &bounds[t, 0], &centers[t, 0], lon, sinlon,
+                                    coslon, sinlat, coslat, radius, nodes,
+                                    weights, order, maxorder, ratio, result,
+                                    count)
+        if error != 0:
+            return error
+    return 0
 
-def gyy(tesseroid,
-    numpy.ndarray[DTYPE_T, ndim=1] lons,
-    numpy.ndarray[DTYPE_T, ndim=1] lats,
-    numpy.ndarray[DTYPE_T, ndim=1] radii,
-    numpy.ndarray[DTYPE_T, ndim=1] nodes,
-    numpy.ndarray[DTYPE_T, ndim=1] weights):
+def _check_status(status):
     """
-    Integrate gyy using the Gauss-Legendre Quadrature
+    Raise a ValueError if the adaptive discretization failed for any of the
+    computation points. *status* has the error code of each point.
     """
-    cdef unsigned int order = len(nodes), ndata = len(lons), i, j, k, l
-    cdef numpy.ndarray[DTYPE_T, ndim=1] lonc, latc, rc, sinlatc, coslatc
-    cdef numpy.ndarray[DTYPE_T, ndim=1] result
-    cdef DTYPE_T scale, kappa, sinlat, coslat, radii_sqr, coslon, l_sqr
-    cdef DTYPE_T sinlon, deltay
-    # Put the nodes in the corrent range
-    lonc, latc, rc, scale = _scale_nodes(tesseroid, nodes)
-    result = numpy.zeros(ndata, DTYPE)
-    # Pre-compute sines, cossines and powers
-    sinlatc = numpy.sin(latc)
-    coslatc = numpy.cos(latc)
-    # Start the numerical integration
-    for l in xrange(ndata):
-        sinlat = sin(lats[l])
-        coslat = cos(lats[l])
-        radii_sqr = radii[l]**2
-        for i in xrange(order):
-            coslon = cos(lons[l] - lonc[i])
-            sinlon = sin(lonc[i] - lons[l])
-            for j in xrange(order):
-                for k in xrange(order):
-                    l_sqr = (radii_sqr + rc[k]**2 -
-                             2.*radii[l]*rc[k]*(
-                                sinlat*sinlatc[j] + coslat*coslatc[j]*coslon))
-                    kappa = (rc[k]**2)*coslatc[j]
-                    deltay = rc[k]*coslatc[j]*sinlon
-                    result[l] = result[l] + (weights[i]*weights[j]*weights[k]*
-                        kappa*(3.*(deltay**2) - l_sqr)/(l_sqr**2.5))
-        result[l] = result[l]*scale
-    return result
+    status = numpy.asarray(status)
+    failed = numpy.flatnonzero(status)
+    if len(failed) == 0:
+        return
+    if status[failed[0]] == STACK_OVERFLOW:
+        raise ValueError(
+            "Stack overflow in the adaptive discretization of the "
+            + "tesseroids. Computation point %d is too close to a "
+            % (failed[0]) + "tesseroid.")
+    raise ValueError(
+        "Singular integrand in the adaptive discretization of the "
+        + "tesseroids. Computation point %d is too close to a "
+        % (failed[0]) + "tesseroid.")
 
-def gyz(tesseroid,
-    numpy.ndarray[DTYPE_T, ndim=1] lons,
-    numpy.ndarray[DTYPE_T, ndim=1] lats,
-    numpy.ndarray[DTYPE_T, ndim=1] radii,
-    numpy.ndarray[DTYPE_T, ndim=1] nodes,
-    numpy.ndarray[DTYPE_T, ndim=1] weights):
+@cython.boundscheck(False)
+@cython.wraparound(False)
+def adaptive(fields, numpy.ndarray[DTYPE_T, ndim=2] bounds,
+             numpy.ndarray[DTYPE_T, ndim=1] density,
+             numpy.ndarray[DTYPE_T, ndim=1] lons,
+             numpy.ndarray[DTYPE_T, ndim=1] sinlons,
+             numpy.ndarray[DTYPE_T, ndim=1] coslons,
+             numpy.ndarray[DTYPE_T, ndim=1] sinlats,
+             numpy.ndarray[DTYPE_T, ndim=1] coslats,
+             numpy.ndarray[DTYPE_T, ndim=1] radii, order, int maxorder,
+             numpy.ndarray[DTYPE_T, ndim=2] nodes,
+             numpy.ndarray[DTYPE_T, ndim=2] weights, DTYPE_T ratio,
+             int njobs=1, counts=None):
     """
-    Integrate gyz using the Gauss-Legendre Quadrature
+    Calculate the *fields* (a list with the names of the fields) of the
+    tesseroids with the adaptive discretization. The tesseroids are divided
+    only once for all fields and the terms of the integrands shared by them
+    are calculated once per GLQ node.
+
+    *bounds* is an array with the ``[w, e, s, n, top, bottom]`` of each
+    tesseroid. The computation points are given by their longitudes (in
+    radians), the sines and cossines of their longitudes and latitudes, and
+    their *radii* (in meters), as calculated by tesseroid._Points. The result
+    is an array with one row for each field, in SI units.
+
+    *order* is the number of GLQ nodes in longitude, latitude and radius.
+    Tesseroids are integrated with up to *maxorder* nodes in each dimension
+    instead of dividing them when that is cheaper (0 to never do that).
+    *nodes* and *weights* are tables with the GLQ nodes (weights) of order n
+    in row n. They must have MAX_ORDER columns.
+
+    Each point is computed independently by one of the *njobs* threads, so the
+    result doesn't depend on the number of threads.
+
+    If *counts* is an array of ints (numpy.int_), the number of kernel
+    evaluations (GLQ nodes) used for each point is put in it.
     """
-    cdef unsigned int order = len(nodes), ndata = len(lons), i, j, k, l
-    cdef numpy.ndarray[DTYPE_T, ndim=1] lonc, latc, rc, sinlatc, coslatc
-    cdef numpy.ndarray[DTYPE_T, ndim=1] result
-    cdef DTYPE_T scale, kappa, sinlat, coslat, radii_sqr, coslon, l_sqr
-    cdef DTYPE_T sinlon, deltay, deltaz, cospsi
-    # Put the nodes in the corrent range
-    lonc, latc, rc, scale = _scale_nodes(tesseroid, nodes)
-    result = numpy.zeros(ndata, DTYPE)
-    # Pre-compute sines, cossines and powers
-    sinlatc = numpy.sin(latc)
-    coslatc = numpy.cos(latc)
-    # Start the numerical integration
-    for l in xrange(ndata):
-        sinlat = sin(lats[l])
-        coslat = cos(lats[l])
-        radii_sqr = radii[l]**2
-        for i in xrange(order):
-            coslon = cos(lons[l] - lonc[i])
-            sinlon = sin(lonc[i] - lons[l])
-            for j in xrange(order):
-                cospsi = sinlat*sinlatc[j] + coslat*coslatc[j]*coslon
-                for k in xrange(order):
-                    l_sqr = (radii_sqr + rc[k]**2 -
-                             2.*radii[l]*rc[k]*(
-                                sinlat*sinlatc[j] + coslat*coslatc[j]*coslon))
-                    kappa = (rc[k]**2)*coslatc[j]
-                    deltay = rc[k]*coslatc[j]*sinlon
-                    deltaz = rc[k]*cospsi - radii[l]
-                    result[l] = result[l] + (weights[i]*weights[j]*weights[k]*
-                        kappa*3.*deltay*deltaz/(l_sqr**2.5))
-        result[l] = result[l]*scale
-    return result
+    cdef:
+        Py_ssize_t l, ndata = len(lons)
+        int c, nfields = len(fields)
+        int components[NFIELDS]
+        int order_[3]
+        int[::1] status = numpy.zeros(ndata, dtype=numpy.intc)
+        long[::1] counts_view
+        DTYPE_T[::1] lons_view = numpy.ascontiguousarray(lons)
+        DTYPE_T[::1] sinlons_view = numpy.ascontiguousarray(sinlons)
+        DTYPE_T[::1] coslons_view = numpy.ascontiguousarray(coslons)
+        DTYPE_T[::1] sinlats_view = numpy.ascontiguousarray(sinlats)
+        DTYPE_T[::1] coslats_view = numpy.ascontiguousarray(coslats)
+        DTYPE_T[::1] radii_view = numpy.ascontiguousarray(radii)
+        DTYPE_T[:, ::1] res
+        DTYPE_T[:, ::1] bounds_view = numpy.ascontiguousarray(bounds)
+        DTYPE_T[:, ::1] centers
+        DTYPE_T[::1] density_view = numpy.ascontiguousarray(density)
+        DTYPE_T[:, ::1] nodes_view = numpy.ascontiguousarray(nodes)
+        DTYPE_T[:, ::1] weights_view = numpy.ascontiguousarray(weights)
+        numpy.ndarray[DTYPE_T, ndim=2] result = numpy.zeros((ndata, nfields),
+                                                            DTYPE)
+    if nodes.shape[1] != MAX_ORDER or weights.shape[1] != MAX_ORDER:
+        raise ValueError("GLQ tables must have %d columns" % (MAX_ORDER))
+    if (max(max(order), maxorder) >= nodes.shape[0]
+            or max(max(order), maxorder) >= weights.shape[0]):
+        raise ValueError("Invalid GLQ order %d. Maximum is %d"
+                         % (max(max(order), maxorder), nodes.shape[0] - 1))
+    if njobs < 1:
+        raise ValueError("Invalid number of jobs '%s'. Must be >= 1" % (njobs))
+    if nfields > NFIELDS:
+        raise ValueError("Can't calculate more than %d fields at once"
+                         % (NFIELDS))
+    for c in range(nfields):
+        if fields[c] not in _FIELDS:
+            raise ValueError("Invalid field '%s'" % (fields[c]))
+        components[c] = _FIELDS[fields[c]]
+    if counts is None:
+        counts = numpy.empty(ndata, dtype=numpy.int_)
+    counts_view = counts
+    counts_view[:] = 0
+    if len(bounds) == 0 or nfields == 0:
+        return result.T.copy()
+    for l in range(3):
+        order_[l] = order[l]
+    latc = d2r*0.5*(bounds[:, 2] + bounds[:, 3])
+    lonc = d2r*0.5*(bounds[:, 0] + bounds[:, 1])
+    centers = numpy.transpose([numpy.sin(latc), numpy.cos(latc),
+                               numpy.sin(lonc), numpy.cos(lonc)]).copy()
+    res = result
+    for l in prange(ndata, nogil=True, schedule='dynamic', num_threads=njobs):
+        status[l] = _adaptive_point(components, nfields, lons_view[l],
+                                    sinlons_view[l],
+                                    coslons_view[l], sinlats_view[l],
+                                    coslats_view[l], radii_view[l],
+                                    bounds_view, centers, density_view,
+                                    &nodes_view[0, 0], &weights_view[0, 0],
+                                    order_, maxorder, ratio, &res[l, 0],
+                                    &counts_view[l])
+    _check_status(status)
+    return G*result.T
 
-def gzz(tesseroid,
-    numpy.ndarray[DTYPE_T, ndim=1] lons,
-    numpy.ndarray[DTYPE_T, ndim=1] lats,
-    numpy.ndarray[DTYPE_T, ndim=1] radii,
-    numpy.ndarray[DTYPE_T, ndim=1] nodes,
-    numpy.ndarray[DTYPE_T, ndim=1] weights):
+@cython.boundscheck(False)
+@cython.wraparound(False)
+def kernel_matrix(field, numpy.ndarray[DTYPE_T, ndim=2] bounds,
+                  numpy.ndarray[DTYPE_T, ndim=1] lons,
+                  numpy.ndarray[DTYPE_T, ndim=1] sinlons,
+                  numpy.ndarray[DTYPE_T, ndim=1] coslons,
+                  numpy.ndarray[DTYPE_T, ndim=1] sinlats,
+                  numpy.ndarray[DTYPE_T, ndim=1] coslats,
+                  numpy.ndarray[DTYPE_T, ndim=1] radii, order, int maxorder,
+                  numpy.ndarray[DTYPE_T, ndim=2] nodes,
+                  numpy.ndarray[DTYPE_T, ndim=2] weights, DTYPE_T ratio,
+                  int njobs=1):
     """
-    Integrate gzz using the Gauss-Legendre Quadrature
+    Calculate the sensitivity matrix of *field*: element (i, j) is the effect
+    of tesseroid j with unit density on point i (in SI units).
+
+    The arguments are the same as for adaptive. The matrix is calculated in a
+    single pass over the points (in parallel with *njobs* threads), using the
+    same adaptive discretization.
     """
-    cdef unsigned int order = len(nodes), ndata = len(lons), i, j, k, l
-    cdef numpy.ndarray[DTYPE_T, ndim=1] lonc, latc, rc, sinlatc, coslatc
-    cdef numpy.ndarray[DTYPE_T, ndim=1] result
-    cdef DTYPE_T scale, kappa, sinlat, coslat, radii_sqr, coslon, l_sqr
-    cdef DTYPE_T cospsi, deltaz
-    # Put the nodes in the corrent range
-    lonc, latc, rc, scale = _scale_nodes(tesseroid, nodes)
-    result = numpy.zeros(ndata, DTYPE)
-    # Pre-compute sines, cossines and powers
-    sinlatc = numpy.sin(latc)
-    coslatc = numpy.cos(latc)
-    # Start the numerical integration
-    for l in xrange(ndata):
-        sinlat = sin(lats[l])
-        coslat = cos(lats[l])
-        radii_sqr = radii[l]**2
-        for i in xrange(order):
-            coslon = cos(lons[l] - lonc[i])
-            for j in xrange(order):
-                cospsi = sinlat*sinlatc[j] + coslat*coslatc[j]*coslon
-                for k in xrange(order):
-                    l_sqr = (radii_sqr + rc[k]**2 -
-                             2.*radii[l]*rc[k]*(
-                                sinlat*sinlatc[j] + coslat*coslatc[j]*coslon))
-                    kappa = (rc[k]**2)*coslatc[j]
-                    deltaz = rc[k]*cospsi - radii[l]
-                    result[l] = result[l] + (weights[i]*weights[j]*weights[k]*
-                        kappa*(3.*deltaz**2 - l_sqr)/(l_sqr**2.5))
-        result[l] = result[l]*scale
-    return result
+    cdef:
+        Py_ssize_t l, t, ndata = len(lons), ntess = len(bounds)
+        int component[1]
+        int order_[3]
+        int error
+        long count
+        int[::1] status = numpy.zeros(ndata, dtype=numpy.intc)
+        DTYPE_T[::1] lons_view = numpy.ascontiguousarray(lons)
+        DTYPE_T[::1] sinlons_view = numpy.ascontiguousarray(sinlons)
+        DTYPE_T[::1] coslons_view = numpy.ascontiguousarray(coslons)
+        DTYPE_T[::1] sinlats_view = numpy.ascontiguousarray(sinlats)
+        DTYPE_T[::1] coslats_view = numpy.ascontiguousarray(coslats)
+        DTYPE_T[::1] radii_view = numpy.ascontiguousarray(radii)
+        DTYPE_T[:, ::1] bounds_view = numpy.ascontiguousarray(bounds)
+        DTYPE_T[:, ::1] centers
+        DTYPE_T[:, ::1] nodes_view = numpy.ascontiguousarray(nodes)
+        DTYPE_T[:, ::1] weights_view = numpy.ascontiguousarray(weights)
+        DTYPE_T[:, ::1] res
+        numpy.ndarray[DTYPE_T, ndim=2] matrix = numpy.zeros((ndata, ntess),
+                                                            DTYPE)
+    if nodes.shape[1] != MAX_ORDER or weights.shape[1] != MAX_ORDER:
+        raise ValueError("GLQ tables must have %d columns" % (MAX_ORDER))
+    if (max(max(order), maxorder) >= nodes.shape[0]
+            or max(max(order), maxorder) >= weights.shape[0]):
+        raise ValueError("Invalid GLQ order %d. Maximum is %d"
+                         % (max(max(order), maxorder), nodes.shape[0] - 1))
+    if njobs < 1:
+        raise ValueError("Invalid number of jobs '%s'. Must be >= 1" % (njobs))
+    if field not in _FIELDS:
+        raise ValueError("Invalid field '%s'" % (field))
+    component[0] = _FIELDS[field]
+    if ntess == 0:
+        return matrix
+    for l in range(3):
+        order_[l] = order[l]
+    latc = d2r*0.5*(bounds[:, 2] + bounds[:, 3])
+    lonc = d2r*0.5*(bounds[:, 0] + bounds[:, 1])
+    centers = numpy.transpose([numpy.sin(latc), numpy.cos(latc),
+                               numpy.sin(lonc), numpy.cos(lonc)]).copy()
+    res = matrix
+    for l in prange(ndata, nogil=True, schedule='dynamic', num_threads=njobs):
+        for t in range(ntess):
+            count = 0
+            error = _adaptive_tesseroid(component, 1, 1., &bounds_view[t, 0],
+                                        &centers[t, 0], lons_view[l],
+                                        sinlons_view[l], coslons_view[l],
+                                        sinlats_view[l], coslats_view[l],
+                                        radii_view[l], &nodes_view[0, 0],
+                                        &weights_view[0, 0], order_, maxorder,
+                                        ratio, &res[l, t], &count)
+            if error != 0:
+                status[l] = error
+    _check_status(status)
+    matrix *= G
+    return matrix
@@ -0,0 +1,216 @@
+"""
+.. note::
+
+    Forward modeling of regular prism meshes on regular grids using the FFT.
+    Functions are loaded into :mod:`fatiando.gravmag.prism`.
+
+----
+"""
+import numpy
+import scipy.sparse.linalg
+
+from fatiando.mesher import Prism
+try:
+    from fatiando.gravmag._cprism import kernel_matrix
+except ImportError:
+    from fatiando.gravmag._prism import kernel_matrix
+
+__all__ = ['fft', 'FFTOperator']
+
+
+def fft(xp, yp, zp, shape, mesh, field='gz', dens=None):
+    """
+    Calculate a gravitational field of a prism mesh on a regular grid using the
+    FFT.
+
+    If the computation points are on a regular grid at a constant height with
+    the same spacing as the mesh cells, the effect of each cell only depends on
+    the horizontal offset between the cell and the point. So the field of each
+    layer of the mesh is a 2D convolution of the densities with the effect of a
+    single cell. This function calculates it with zero-padded FFTs, which is
+    much faster than direct summation for large meshes.
+
+    The result is the same as given by the direct functions (e.g.,
+    :func:`~fatiando.gravmag._prism.gz`), apart from floating point round-off.
+
+    .. note:: The grid must be in the order given by
+        :func:`fatiando.gridder.regular` (x varies first, then y) and have the
+        same horizontal spacing as the cells of *mesh*. The grid and mesh don't
+        need to cover the same area.
+
+    .. note:: The coordinate system of the input parameters is to be x -> North,
+        y -> East and z -> Down.
+
+    .. note:: All input values in **SI** units(!). Gravity components are
+        returned in **mGal** and gradient tensor components in **Eotvos**!
+
+    Parameters:
+
+    * xp, yp, zp : arrays
+        Arrays with the x, y, and z coordinates of the computation points.
+    * shape : tuple = (ny, nx)
+        The shape of the grid
+    * mesh : :class:`~fatiando.mesher.PrismMesh`
+        The density model. Masked cells are ignored.
+    * field : str
+        The field component. Can be any of ``'potential'``, ``'gx'``,
+        ``'gy'``, ``'gz'``, ``'gxx'``, ``'gxy'``, ``'gxz'``, ``'gyy'``,
+        ``'gyz'``, ``'gzz'``.
+    * dens : array or None
+        The density of each cell of the mesh. If None, will use the
+        ``'density'`` property of the mesh.
+
+    Returns:
+
+    * res : array
+        The field calculated on xp, yp, zp
+
+    """
+    if dens is None:
+        dens = mesh.props['density']
+    return FFTOperator(xp, yp, zp, shape, mesh, field).matvec(dens)
+
+class FFTOperator(object):
+    """
+    The sensitivity matrix of a prism mesh on a regular grid applied with FFTs.
+
+    Calculates the FFT of the effect of one cell of each layer of the mesh
+    when created. Then :meth:`~fatiando.gravmag._fftprism.FFTOperator.matvec`
+    and :meth:`~fatiando.gravmag._fftprism.FFTOperator.rmatvec` are 2D
+    convolutions and correlations with these kernels. Use it for inversion
+    without ever building the sensitivity matrix.
+
+    See :func:`~fatiando.gravmag._fftprism.fft` for the restrictions on the
+    grid.
+
+    Parameters:
+
+    * xp, yp, zp : arrays
+        Arrays with the x, y, and z coordinates of the computation points.
+    * shape : tuple = (ny, nx)
+        The shape of the grid
+    * mesh : :class:`~fatiando.mesher.PrismMesh`
+        The mesh. Masked cells are considered as having zero density.
+    * field : str
+        The field component. Can be any of ``'potential'``, ``'gx'``,
+        ``'gy'``, ``'gz'``, ``'gxx'``, ``'gxy'``, ``'gxz'``, ``'gyy'``,
+        ``'gyz'``, ``'gzz'``.
+
+    """
+
+    def __init__(self, xp, yp, zp, shape, mesh, field='gz'):
+        ny, nx = shape
+        if len(xp) != nx*ny or len(yp) != nx*ny or len(zp) != nx*ny:
+            raise ValueError("Input arrays xp, yp, and zp must have nx*ny "
+                             + "elements")
+        xgrid = numpy.reshape(xp, shape)
+        ygrid = numpy.reshape(yp, shape)
+        if not numpy.allclose(zp, zp[0]):
+            raise ValueError("Computation points must be at a constant height")
+        dx, dy, dz = mesh.dims
+        if ((nx > 1 and not numpy.allclose(numpy.diff(xgrid, axis=1), dx))
+            or (ny > 1 and not numpy.allclose(numpy.diff(ygrid, axis=0), dy))
+            or not numpy.allclose(xgrid, xgrid[0])
+            or not numpy.allclose(ygrid.T, ygrid[:, 0])):
+            raise ValueError("Computation points must be a regular grid with "
+                             + "the same spacing as the mesh cells")
+        self.shape = (nx*ny, mesh.size)
+        self.gridshape = (ny, nx)
+        self.meshshape = mesh.shape
+        self.mask = numpy.array(mesh.mask, dtype=numpy.int)
+        mz, my, mx = mesh.shape
+        # Size of the zero-padded grids so that the circular convolutions are
+        # equal to the linear convolutions
+        self.fftshape = (ny + 2*(my - 1), nx + 2*(mx - 1))
+        # The effect of the first cell of each layer on a grid extended so that
+        # it covers all offsets between cells and points
+        x1, x2, y1, y2, z1, z2 = mesh.bounds
+        xk = xp[0] + dx*numpy.arange(-(mx - 1), nx)
+        yk = yp[0] + dy*numpy.arange(-(my - 1), ny)
+        xk, yk = [i.ravel() for i in numpy.meshgrid(xk, yk)]
+        zk = zp[0]*numpy.ones_like(xk)
+        kshape = (ny + my - 1, nx + mx - 1)
+        self.kernels = []
+        for k in xrange(mz):
+            cell = Prism(x1, x1 + dx, y1, y1 + dy, z1 + dz*k, z1 + dz*(k + 1))
+            kernel = kernel_matrix(xk, yk, zk, [cell], field)
+            self.kernels.append(numpy.fft.rfft2(kernel.reshape(kshape),
+                                                s=self.fftshape))
+
+    def matvec(self, dens):
+        """
+        Calculate the field of a density model (multiply the sensitivity matrix
+        by the density vector).
+
+        Parameters:
+
+        * dens : array
+            The density of each cell of the mesh
+
+        Returns:
+
+        * res : array
+            The field on the grid points
+
+        """
+        mz, my, mx = self.meshshape
+        ny, nx = self.gridshape
+        dens = numpy.array(dens, dtype=numpy.float).ravel()
+        if len(dens) != self.shape[1]:
+            raise ValueError("Need %d densities but got %d"
+                             % (self.shape[1], len(dens)))
+        dens[self.mask] = 0
+        dens = dens.reshape(self.meshshape)
+        transform = 0
+        for kernel, layer in zip(self.kernels, dens):
+            transform += kernel*numpy.fft.rfft2(layer, s=self.fftshape)
+        res = numpy.fft.irfft2(transform, s=self.fftshape)
+        return res[my - 1:my - 1 + ny, mx - 1:mx - 1 + nx].ravel()
+
+    def rmatvec(self, data):
+        """
+        Multiply the transpose of the sensitivity matrix by a data vector.
+
+        Parameters:
+
+        * data : array
+            One value per grid point
+
+        Returns:
+
+        * res : array
+            One value per mesh cell (zero for masked cells)
+
+        """
+        mz, my, mx = self.meshshape
+        ny, nx = self.gridshape
+        data = numpy.asarray(data, dtype=numpy.float).ravel()
+        if len(data) != self.shape[0]:
+            raise ValueError("Need %d data but got %d"
+                             % (self.shape[0], len(data)))
+        padded = numpy.zeros(self.fftshape)
+        padded[my - 1:my - 1 + ny, mx - 1:mx - 1 + nx] = data.reshape(
+            self.gridshape)
+        transform = numpy.fft.rfft2(padded)
+        res = numpy.empty(self.meshshape)
+        for k, kernel in enumerate(self.kernels):
+            layer = numpy.fft.irfft2(numpy.conj(kernel)*transform,
+                                     s=self.fftshape)
+            res[k] = layer[:my, :mx]
+        res = res.ravel()
+        res[self.mask] = 0
+        return res
+
+    def aslinearoperator(self):
+        """
+        Get a :class:`scipy.sparse.linalg.LinearOperator` for this matrix.
+
+        Use it with the iterative solvers of :mod:`scipy.sparse.linalg`.
+
+        Returns:
+
+        * operator : :class:`scipy.sparse.linalg.LinearOperator`
+
+        """
+        return scipy.sparse.linalg.LinearOperator(self.shape,
+            matvec=self.matvec, rmatvec=self.rmatvec, dtype=numpy.float)
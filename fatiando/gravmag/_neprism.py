@@ -1,15 +1,21 @@
 """
-Testing numexpr to speedup prism computations
+Implementation of the prism forward modeling functions using numexpr. Use
+:func:`fatiando.gravmag.prism.set_backend` to make the functions of
+:mod:`fatiando.gravmag.prism` use these versions.
 """
-import numpy
+import contextlib
 
+import numpy
+import numexpr
 from numexpr import evaluate
 
 from fatiando.constants import SI2EOTVOS, SI2MGAL, G, CM, T2NT
 from fatiando import utils
+from fatiando.gravmag._prism import _far_field, _check_dtype
 
 
-def tf(xp, yp, zp, prisms, inc, dec, pmag=None, pinc=None, pdec=None):
+def tf(xp, yp, zp, prisms, inc, dec, pmag=None, pinc=None, pdec=None,
+       njobs=1, dtype=numpy.float):
     """
     Calculate the total-field anomaly of prisms.
 
@@ -28,7 +34,8 @@ def tf(xp, yp, zp, prisms, inc, dec, pmag=None, pinc=None, pdec=None):
         ignored. If the physical properties ``'inclination'`` and
         ``'declination'`` are not present, will use the values of *inc* and
         *dec* instead (regional field).
-        *prisms* can also be a :class:`~fatiando.mesher.PrismMesh`.
+        *prisms* can also be a :class:`~fatiando.mesher.PrismMesh` or a
+        :class:`~fatiando.mesher.PrismArray`.
     * inc : float
         The inclination of the regional field (in degrees)
     * dec : float
@@ -42,6 +49,13 @@ def tf(xp, yp, zp, prisms, inc, dec, pmag=None, pinc=None, pdec=None):
     * pdec : float or None
         If not None, will use this value instead of the ``'declination'``
         property of the prisms. Use this, e.g., for sensitivity matrix building.
+    * njobs : int
+        Number of threads used by numexpr.
+    * dtype : numpy dtype
+        The type of the output array. Can be ``numpy.float64`` or
+        ``numpy.float32``. The calculations are always done in double
+        precision, so single precision only rounds the result (relative error
+        smaller than 1e-7).
 
     Returns:
 
@@ -51,6 +65,7 @@ def tf(xp, yp, zp, prisms, inc, dec, pmag=None, pinc=None, pdec=None):
     """
     if xp.shape != yp.shape != zp.shape:
         raise ValueError("Input arrays xp, yp, and zp must have same shape!")
+    dtype = _check_dtype(dtype)
     kernel = ''.join([
         'res + ((-1.)**(i + j))*magnetization*(',
         '0.5*(my*fz + mz*fy)*log((r - x)/(r + x))',
@@ -63,52 +78,54 @@ def tf(xp, yp, zp, prisms, inc, dec, pmag=None, pinc=None, pdec=None):
     # Calculate the 3 components of the unit vector in the direction of the
     # regional field
     fx, fy, fz = utils.dircos(inc, dec)
-    for prism in prisms:
-        if (prism is None or
-            ('magnetization' not in prism.props and pmag is None)):
-            continue
-        if pmag is None:
-            magnetization = prism.props['magnetization']
-        else:
-            magnetization = pmag
-        # Get the 3 components of the unit vector in the direction of the
-        # magnetization from the inclination and declination
-        # 1) given by the function
-        if pinc is not None and pdec is not None:
-            mx, my, mz = utils.dircos(pinc, pdec)
-        # 2) given by the prism
-        elif 'inclination' in prism.props and 'declination' in prism.props:
-            mx, my, mz = utils.dircos(prism.props['inclination'],
-                                      prism.props['declination'])
-        # 3) Use in the direction of the regional field
-        else:
-            mx, my, mz = fx, fy, fz
-        # First thing to do is make the computation point P the origin of the
-        # coordinate system
-        x1, x2, y1, y2, z1, z2 = prism.get_bounds()
-        xs = [evaluate('x2 - xp'), evaluate('x1 - xp')]
-        ys = [evaluate('y2 - yp'), evaluate('y1 - yp')]
-        zs = [evaluate('z2 - zp'), evaluate('z1 - zp')]
-        # Now calculate the total field anomaly
-        for k in range(2):
-            magnetization *= -1
-            z = zs[k]
-            z_sqr = evaluate('z**2')
-            for j in range(2):
-                y = ys[j]
-                y_sqr = evaluate('y**2')
-                for i in range(2):
-                    x = xs[i]
-                    x_sqr = evaluate('x**2')
-                    xy = evaluate('x*y')
-                    r_sqr = evaluate('x_sqr + y_sqr + z_sqr')
-                    r = evaluate('sqrt(r_sqr)')
-                    zr = evaluate('z*r')
-                    res = evaluate(kernel)
+    with _threads(njobs):
+        for prism in prisms:
+            if (prism is None or
+                ('magnetization' not in prism.props and pmag is None)):
+                continue
+            if pmag is None:
+                magnetization = prism.props['magnetization']
+            else:
+                magnetization = pmag
+            # Get the 3 components of the unit vector in the direction of the
+            # magnetization from the inclination and declination
+            # 1) given by the function
+            if pinc is not None and pdec is not None:
+                mx, my, mz = utils.dircos(pinc, pdec)
+            # 2) given by the prism
+            elif 'inclination' in prism.props and 'declination' in prism.props:
+                mx, my, mz = utils.dircos(prism.props['inclination'],
+                                          prism.props['declination'])
+            # 3) Use in the direction of the regional field
+            else:
+                mx, my, mz = fx, fy, fz
+            # First thing to do is make the computation point P the origin of
+            # the coordinate system
+            x1, x2, y1, y2, z1, z2 = prism.get_bounds()
+            xs = [evaluate('x2 - xp'), evaluate('x1 - xp')]
+            ys = [evaluate('y2 - yp'), evaluate('y1 - yp')]
+            zs = [evaluate('z2 - zp'), evaluate('z1 - zp')]
+            # Now calculate the total field anomaly
+            for k in range(2):
+                magnetization *= -1
+                z = zs[k]
+                z_sqr = evaluate('z**2')
+                for j in range(2):
+                    y = ys[j]
+                    y_sqr = evaluate('y**2')
+                    for i in range(2):
+                        x = xs[i]
+                        x_sqr = evaluate('x**2')
+                        xy = evaluate('x*y')
+                        r_sqr = evaluate('x_sqr + y_sqr + z_sqr')
+                        r = evaluate('sqrt(r_sqr)')
+                        zr = evaluate('z*r')
+                        res = evaluate(kernel)
     res *= CM*T2NT
-    return res
+    return res.astype(dtype, copy=False)
 
-def potential(xp, yp, zp, prisms, dens=None):
+def potential(xp, yp, zp, prisms, dens=None, njobs=1, ratio=None,
+              dtype=numpy.float):
     """
     Calculates the gravitational potential.
 
@@ -126,7 +143,8 @@ def potential(xp, yp, zp, prisms, dens=None):
         Prisms must have the property ``'density'``. Prisms that don't have this
         property will be ignored in the computations. Elements of *prisms* that
         are None will also be ignored. *prisms* can also be a
-        :class:`~fatiando.mesher.PrismMesh`.
+        :class:`~fatiando.mesher.PrismMesh` or a
+        :class:`~fatiando.mesher.PrismArray`.
     * dens : float or None
         If not None, will use this value instead of the ``'density'`` property
         of the prisms. Use this, e.g., for sensitivity matrix building.
@@ -134,6 +152,21 @@ def potential(xp, yp, zp, prisms, dens=None):
         .. warning:: Uses this value for **all** prisms! Not only the ones that
             have ``'density'`` as a property.
 
+    * njobs : int
+        Number of threads used by numexpr.
+    * ratio : float or None
+        If not None, prisms that are farther than *ratio* times their size
+        (the length of their diagonal) from a computation point are
+        approximated by their multipole expansion (a point mass at their
+        center plus the quadrupole term). This is faster and the error
+        decreases with the fourth power of the distance. If None, will always
+        use the exact formula.
+    * dtype : numpy dtype
+        The type of the output array. Can be ``numpy.float64`` or
+        ``numpy.float32``. The calculations are always done in double
+        precision, so single precision only rounds the result (relative error
+        smaller than 1e-7).
+
     Returns:
 
     * res : array
@@ -142,40 +175,20 @@ def potential(xp, yp, zp, prisms, dens=None):
     """
     if xp.shape != yp.shape != zp.shape:
         raise ValueError("Input arrays xp, yp, and zp must have same shape!")
+    dtype = _check_dtype(dtype)
     kernel = ' '.join([
         'x*y*log(z + r) + y*z*log(x + r) + x*z*log(y + r)',
         '- 0.5*(x**2)*arctan2(z*y, x*r)',
         '- 0.5*(y**2)*arctan2(z*x, y*r)',
         '- 0.5*(z**2)*arctan2(x*y, z*r)'])
-    expr = 'res + ((-1.)**(i + j + k))*(%s)*density' % (kernel)
-    res = numpy.zeros_like(xp)
-    for prism in prisms:
-        if prism is None or ('density' not in prism.props and dens is None):
-            continue
-        if dens is None:
-            density = prism.props['density']
-        else:
-            density = dens
-        # First thing to do is make the computation point P the origin of the
-        # coordinate system
-        x1, x2, y1, y2, z1, z2 = prism.get_bounds()
-        xs = [evaluate('x2 - xp'), evaluate('x1 - xp')]
-        ys = [evaluate('y2 - yp'), evaluate('y1 - yp')]
-        zs = [evaluate('z2 - zp'), evaluate('z1 - zp')]
-        # Evaluate the integration limits
-        for k in range(2):
-            z = zs[k]
-            for j in range(2):
-                y = ys[j]
-                for i in range(2):
-                    x = xs[i]
-                    r = evaluate('sqrt(x**2 + y**2 + z**2)')
-                    res = evaluate(expr)
+    res = _integrate(xp, yp, zp, prisms, dens, 'potential', kernel, njobs,
+                     ratio)
     # Now all that is left is to multiply res by the gravitational constant
     res *= G
-    return res
+    return res.astype(dtype, copy=False)
 
-def gx(xp, yp, zp, prisms, dens=None):
+def gx(xp, yp, zp, prisms, dens=None, njobs=1, ratio=None,
+       dtype=numpy.float):
     """
     Calculates the :math:`g_x` gravity acceleration component.
 
@@ -193,7 +206,8 @@ def gx(xp, yp, zp, prisms, dens=None):
         Prisms must have the property ``'density'``. Prisms that don't have this
         property will be ignored in the computations. Elements of *prisms* that
         are None will also be ignored. *prisms* can also be a
-        :class:`~fatiando.mesher.PrismMesh`.
+        :class:`~fatiando.mesher.PrismMesh` or a
+        :class:`~fatiando.mesher.PrismArray`.
     * dens : float or None
         If not None, will use this value instead of the ``'density'`` property
         of the prisms. Use this, e.g., for sensitivity matrix building.
@@ -201,6 +215,21 @@ def gx(xp, yp, zp, prisms, dens=None):
         .. warning:: Uses this value for **all** prisms! Not only the ones that
             have ``'density'`` as a property.
 
+    * njobs : int
+        Number of threads used by numexpr.
+    * ratio : float or None
+        If not None, prisms that are farther than *ratio* times their size
+        (the length of their diagonal) from a computation point are
+        approximated by their multipole expansion (a point mass at their
+        center plus the quadrupole term). This is faster and the error
+        decreases with the fourth power of the distance. If None, will always
+        use the exact formula.
+    * dtype : numpy dtype
+        The type of the output array. Can be ``numpy.float64`` or
+        ``numpy.float32``. The calculations are always done in double
+        precision, so single precision only rounds the result (relative error
+        smaller than 1e-7).
+
     Returns:
 
     * res : array
@@ -209,39 +238,19 @@ def gx(xp, yp, zp, prisms, dens=None):
     """
     if xp.shape != yp.shape != zp.shape:
         raise ValueError("Input arrays xp, yp, and zp must have same shape!")
+    dtype = _check_dtype(dtype)
     # Minus because Nagy et al (2000) give the formula for the
     # gradient of the potential. Gravity is -grad(V)
     kernel = '-(y*log(z + r) + z*log(y + r) - x*arctan2(z*y, x*r))'
-    expr = 'res + ((-1.)**(i + j + k))*(%s)*density' % (kernel)
-    res = numpy.zeros_like(xp)
-    for prism in prisms:
-        if prism is None or ('density' not in prism.props and dens is None):
-            continue
-        if dens is None:
-            density = prism.props['density']
-        else:
-            density = dens
-        # First thing to do is make the computation point P the origin of the
-        # coordinate system
-        x1, x2, y1, y2, z1, z2 = prism.get_bounds()
-        xs = [evaluate('x2 - xp'), evaluate('x1 - xp')]
-        ys = [evaluate('y2 - yp'), evaluate('y1 - yp')]
-        zs = [evaluate('z2 - zp'), evaluate('z1 - zp')]
-        # Evaluate the integration limits
-        for k in range(2):
-            z = zs[k]
-            for j in range(2):
-                y = ys[j]
-                for i in range(2):
-                    x = xs[i]
-                    r = evaluate('sqrt(x**2 + y**2 + z**2)')
-                    res = evaluate(expr)
+    res = _integrate(xp, yp, zp, prisms, dens, 'gx', kernel, njobs,
+                     ratio)
     # Now all that is left is to multiply res by the gravitational constant and
     # convert it to mGal units
     res *= G*SI2MGAL
-    return res
+    return res.astype(dtype, copy=False)
 
-def gy(xp, yp, zp, prisms, dens=None):
+def gy(xp, yp, zp, prisms, dens=None, njobs=1, ratio=None,
+       dtype=numpy.float):
     """
     Calculates the :math:`g_y` gravity acceleration component.
 
@@ -259,7 +268,8 @@ def gy(xp, yp, zp, prisms, dens=None):
         Prisms must have the property ``'density'``. Prisms that don't have this
         property will be ignored in the computations. Elements of *prisms* that
         are None will also be ignored. *prisms* can also be a
-        :class:`~fatiando.mesher.PrismMesh`.
+        :class:`~fatiando.mesher.PrismMesh` or a
+        :class:`~fatiando.mesher.PrismArray`.
     * dens : float or None
         If not None, will use this value instead of the ``'density'`` property
         of the prisms. Use this, e.g., for sensitivity matrix building.
@@ -267,6 +277,21 @@ def gy(xp, yp, zp, prisms, dens=None):
         .. warning:: Uses this value for **all** prisms! Not only the ones that
             have ``'density'`` as a property.
 
+    * njobs : int
+        Number of threads used by numexpr.
+    * ratio : float or None
+        If not None, prisms that are farther than *ratio* times their size
+        (the length of their diagonal) from a computation point are
+        approximated by their multipole expansion (a point mass at their
+        center plus the quadrupole term). This is faster and the error
+        decreases with the fourth power of the distance. If None, will always
+        use the exact formula.
+    * dtype : numpy dtype
+        The type of the output array. Can be ``numpy.float64`` or
+        ``numpy.float32``. The calculations are always done in double
+        precision, so single precision only rounds the result (relative error
+        smaller than 1e-7).
+
     Returns:
 
     * res : array
@@ -275,39 +300,19 @@ def gy(xp, yp, zp, prisms, dens=None):
     """
     if xp.shape != yp.shape != zp.shape:
         raise ValueError("Input arrays xp, yp, and zp must have same shape!")
+    dtype = _check_dtype(dtype)
     # Minus because Nagy et al (2000) give the formula for the
     # gradient of the potential. Gravity is -grad(V)
     kernel = '-(z*log(x + r) + x*log(z + r) - y*arctan2(x*z, y*r))'
-    expr = 'res + ((-1.)**(i + j + k))*(%s)*density' % (kernel)
-    res = numpy.zeros_like(xp)
-    for prism in prisms:
-        if prism is None or ('density' not in prism.props and dens is None):
-            continue
-        if dens is None:
-            density = prism.props['density']
-        else:
-            density = dens
-        # First thing to do is make the computation point P the origin of the
-        # coordinate system
-        x1, x2, y1, y2, z1, z2 = prism.get_bounds()
-        xs = [evaluate('x2 - xp'), evaluate('x1 - xp')]
-        ys = [evaluate('y2 - yp'), evaluate('y1 - yp')]
-        zs = [evaluate('z2 - zp'), evaluate('z1 - zp')]
-        # Evaluate the integration limits
-        for k in range(2):
-            z = zs[k]
-            for j in range(2):
-                y = ys[j]
-                for i in range(2):
-                    x = xs[i]
-                    r = evaluate('sqrt(x**2 + y**2 + z**2)')
-                    res = evaluate(expr)
+    res = _integrate(xp, yp, zp, prisms, dens, 'gy', kernel, njobs,
+                     ratio)
     # Now all that is left is to multiply res by the gravitational constant and
     # convert it to mGal units
     res *= G*SI2MGAL
-    return res
+    return res.astype(dtype, copy=False)
 
-def gz(xp, yp, zp, prisms, dens=None):
+def gz(xp, yp, zp, prisms, dens=None, njobs=1, ratio=None,
+       dtype=numpy.float):
     """
     Calculates the :math:`g_z` gravity acceleration component.
 
@@ -325,7 +330,8 @@ def gz(xp, yp, zp, prisms, dens=None):
         Prisms must have the property ``'density'``. Prisms that don't have this
         property will be ignored in the computations. Elements of *prisms* that
         are None will also be ignored. *prisms* can also be a
-        :class:`~fatiando.mesher.PrismMesh`.
+        :class:`~fatiando.mesher.PrismMesh` or a
+        :class:`~fatiando.mesher.PrismArray`.
     * dens : float or None
         If not None, will use this value instead of the ``'density'`` property
         of the prisms. Use this, e.g., for sensitivity matrix building.
@@ -333,6 +339,21 @@ def gz(xp, yp, zp, prisms, dens=None):
         .. warning:: Uses this value for **all** prisms! Not only the ones that
             have ``'density'`` as a property.
 
+    * njobs : int
+        Number of threads used by numexpr.
+    * ratio : float or None
+        If not None, prisms that are farther than *ratio* times their size
+        (the length of their diagonal) from a computation point are
+        approximated by their multipole expansion (a point mass at their
+        center plus the quadrupole term). This is faster and the error
+        decreases with the fourth power of the distance. If None, will always
+        use the exact formula.
+    * dtype : numpy dtype
+        The type of the output array. Can be ``numpy.float64`` or
+        ``numpy.float32``. The calculations are always done in double
+        precision, so single precision only rounds the result (relative error
+        smaller than 1e-7).
+
     Returns:
 
     * res : array
@@ -341,39 +362,19 @@ def gz(xp, yp, zp, prisms, dens=None):
     """
     if xp.shape != yp.shape != zp.shape:
         raise ValueError("Input arrays xp, yp, and zp must have same shape!")
+    dtype = _check_dtype(dtype)
     # Minus because Nagy et al (2000) give the formula for the
     # gradient of the potential. Gravity is -grad(V)
     kernel = '-(x*log(y + r) + y*log(x + r) - z*arctan2(x*y, z*r))'
-    expr = 'res + ((-1.)**(i + j + k))*(%s)*density' % (kernel)
-    res = numpy.zeros_like(xp)
-    for prism in prisms:
-        if prism is None or ('density' not in prism.props and dens is None):
-            continue
-        if dens is None:
-            density = prism.props['density']
-        else:
-            density = dens
-        # First thing to do is make the computation point P the origin of the
-        # coordinate system
-        x1, x2, y1, y2, z1, z2 = prism.get_bounds()
-        xs = [evaluate('x2 - xp'), evaluate('x1 - xp')]
-        ys = [evaluate('y2 - yp'), evaluate('y1 - yp')]
-        zs = [evaluate('z2 - zp'), evaluate('z1 - zp')]
-        # Evaluate the integration limits
-        for k in range(2):
-            z = zs[k]
-            for j in range(2):
-                y = ys[j]
-                for i in range(2):
-                    x = xs[i]
-                    r = evaluate('sqrt(x**2 + y**2 + z**2)')
-                    res = evaluate(expr)
+    res = _integrate(xp, yp, zp, prisms, dens, 'gz', kernel, njobs,
+                     ratio)
     # Now all that is left is to multiply res by the gravitational constant and
     # convert it to mGal units
     res *= G*SI2MGAL
-    return res
+    return res.astype(dtype, copy=False)
 
-def gxx(xp, yp, zp, prisms, dens=None):
+def gxx(xp, yp, zp, prisms, dens=None, njobs=1, ratio=None,
+        dtype=numpy.float):
     """
     Calculates the :math:`g_{xx}` gravity gradient tensor component.
 
@@ -391,7 +392,8 @@ def gxx(xp, yp, zp, prisms, dens=None):
         Prisms must have the property ``'density'``. Prisms that don't have this
         property will be ignored in the computations. Elements of *prisms* that
         are None will also be ignored. *prisms* can also be a
-        :class:`~fatiando.mesher.PrismMesh`.
+        :class:`~fatiando.mesher.PrismMesh` or a
+        :class:`~fatiando.mesher.PrismArray`.
     * dens : float or None
         If not None, will use this value instead of the ``'density'`` property
         of the prisms. Use this, e.g., for sensitivity matrix building.
@@ -399,6 +401,21 @@ def gxx(xp, yp, zp, prisms, dens=None):
         .. warning:: Uses this value for **all** prisms! Not only the ones that
             have ``'density'`` as a property.
 
+    * njobs : int
+        Number of threads used by numexpr.
+    * ratio : float or None
+        If not None, prisms that are farther than *ratio* times their size
+        (the length of their diagonal) from a computation point are
+        approximated by their multipole expansion (a point mass at their
+        center plus the quadrupole term). This is faster and the error
+        decreases with the fourth power of the distance. If None, will always
+        use the exact formula.
+    * dtype : numpy dtype
+        The type of the output array. Can be ``numpy.float64`` or
+        ``numpy.float32``. The calculations are always done in double
+        precision, so single precision only rounds the result (relative error
+        smaller than 1e-7).
+
     Returns:
 
     * res : array
@@ -407,37 +424,17 @@ def gxx(xp, yp, zp, prisms, dens=None):
     """
     if xp.shape != yp.shape != zp.shape:
         raise ValueError("Input arrays xp, yp, and zp must have same shape!")
+    dtype = _check_dtype(dtype)
     kernel = '-arctan2(z*y, x*r)'
-    expr = 'res + ((-1.)**(i + j + k))*(%s)*density' % (kernel)
-    res = numpy.zeros_like(xp)
-    for prism in prisms:
-        if prism is None or ('density' not in prism.props and dens is None):
-            continue
-        if dens is None:
-            density = prism.props['density']
-        else:
-            density = dens
-        # First thing to do is make the computation point P the origin of the
-        # coordinate system
-        x1, x2, y1, y2, z1, z2 = prism.get_bounds()
-        xs = [evaluate('x2 - xp'), evaluate('x1 - xp')]
-        ys = [evaluate('y2 - yp'), evaluate('y1 - yp')]
-        zs = [evaluate('z2 - zp'), evaluate('z1 - zp')]
-        # Evaluate the integration limits
-        for k in range(2):
-            z = zs[k]
-            for j in range(2):
-                y = ys[j]
-                for i in range(2):
-                    x = xs[i]
-                    r = evaluate('sqrt(x**2 + y**2 + z**2)')
-                    res = evaluate(expr)
+    res = _integrate(xp, yp, zp, prisms, dens, 'gxx', kernel, njobs,
+                     ratio)
     # Now all that is left is to multiply res by the gravitational constant and
     # convert it to Eotvos units
     res *= G*SI2EOTVOS
-    return res
+    return res.astype(dtype, copy=False)
 
-def gxy(xp, yp, zp, prisms, dens=None):
+def gxy(xp, yp, zp, prisms, dens=None, njobs=1, ratio=None,
+        dtype=numpy.float):
     """
     Calculates the :math:`g_{xy}` gravity gradient tensor component.
 
@@ -455,7 +452,8 @@ def gxy(xp, yp, zp, prisms, dens=None):
         Prisms must have the property ``'density'``. Prisms that don't have this
         property will be ignored in the computations. Elements of *prisms* that
         are None will also be ignored. *prisms* can also be a
-        :class:`~fatiando.mesher.PrismMesh`.
+        :class:`~fatiando.mesher.PrismMesh` or a
+        :class:`~fatiando.mesher.PrismArray`.
     * dens : float or None
         If not None, will use this value instead of the ``'density'`` property
         of the prisms. Use this, e.g., for sensitivity matrix building.
@@ -463,6 +461,21 @@ def gxy(xp, yp, zp, prisms, dens=None):
         .. warning:: Uses this value for **all** prisms! Not only the ones that
             have ``'density'`` as a property.
 
+    * njobs : int
+        Number of threads used by numexpr.
+    * ratio : float or None
+        If not None, prisms that are farther than *ratio* times their size
+        (the length of their diagonal) from a computation point are
+        approximated by their multipole expansion (a point mass at their
+        center plus the quadrupole term). This is faster and the error
+        decreases with the fourth power of the distance. If None, will always
+        use the exact formula.
+    * dtype : numpy dtype
+        The type of the output array. Can be ``numpy.float64`` or
+        ``numpy.float32``. The calculations are always done in double
+        precision, so single precision only rounds the result (relative error
+        smaller than 1e-7).
+
     Returns:
 
     * res : array
@@ -471,37 +484,17 @@ def gxy(xp, yp, zp, prisms, dens=None):
     """
     if xp.shape != yp.shape != zp.shape:
         raise ValueError("Input arrays xp, yp, and zp must have same shape!")
+    dtype = _check_dtype(dtype)
     kernel = 'log(z + r)'
-    expr = 'res + ((-1.)**(i + j + k))*(%s)*density' % (kernel)
-    res = numpy.zeros_like(xp)
-    for prism in prisms:
-        if prism is None or ('density' not in prism.props and dens is None):
-            continue
-        if dens is None:
-            density = prism.props['density']
-        else:
-            density = dens
-        # First thing to do is make the computation point P the origin of the
-        # coordinate system
-        x1, x2, y1, y2, z1, z2 = prism.get_bounds()
-        xs = [evaluate('x2 - xp'), evaluate('x1 - xp')]
-        ys = [evaluate('y2 - yp'), evaluate('y1 - yp')]
-        zs = [evaluate('z2 - zp'), evaluate('z1 - zp')]
-        # Evaluate the integration limits
-        for k in range(2):
-            z = zs[k]
-            for j in range(2):
-                y = ys[j]
-                for i in range(2):
-                    x = xs[i]
-                    r = evaluate('sqrt(x**2 + y**2 + z**2)')
-                    res = evaluate(expr)
+    res = _integrate(xp, yp, zp, prisms, dens, 'gxy', kernel, njobs,
+                     ratio)
     # Now all that is left is to multiply res by the gravitational constant and
     # convert it to Eotvos units
     res *= G*SI2EOTVOS
-    return res
+    return res.astype(dtype, copy=False)
 
-def gxz(xp, yp, zp, prisms, dens=None):
+def gxz(xp, yp, zp, prisms, dens=None, njobs=1, ratio=None,
+        dtype=numpy.float):
     """
     Calculates the :math:`g_{xz}` gravity gradient tensor component.
 
@@ -519,7 +512,8 @@ def gxz(xp, yp, zp, prisms, dens=None):
         Prisms must have the property ``'density'``. Prisms that don't have this
         property will be ignored in the computations. Elements of *prisms* that
         are None will also be ignored. *prisms* can also be a
-        :class:`~fatiando.mesher.PrismMesh`.
+        :class:`~fatiando.mesher.PrismMesh` or a
+        :class:`~fatiando.mesher.PrismArray`.
     * dens : float or None
         If not None, will use this value instead of the ``'density'`` property
         of the prisms. Use this, e.g., for sensitivity matrix building.
@@ -527,6 +521,21 @@ def gxz(xp, yp, zp, prisms, dens=None):
         .. warning:: Uses this value for **all** prisms! Not only the ones that
             have ``'density'`` as a property.
 
+    * njobs : int
+        Number of threads used by numexpr.
+    * ratio : float or None
+        If not None, prisms that are farther than *ratio* times their size
+        (the length of their diagonal) from a computation point are
+        approximated by their multipole expansion (a point mass at their
+        center plus the quadrupole term). This is faster and the error
+        decreases with the fourth power of the distance. If None, will always
+        use the exact formula.
+    * dtype : numpy dtype
+        The type of the output array. Can be ``numpy.float64`` or
+        ``numpy.float32``. The calculations are always done in double
+        precision, so single precision only rounds the result (relative error
+        smaller than 1e-7).
+
     Returns:
 
     * res : array
@@ -535,37 +544,17 @@ def gxz(xp, yp, zp, prisms, dens=None):
     """
     if xp.shape != yp.shape != zp.shape:
         raise ValueError("Input arrays xp, yp, and zp must have same shape!")
+    dtype = _check_dtype(dtype)
     kernel = 'log(y + r)'
-    expr = 'res + ((-1.)**(i + j + k))*(%s)*density' % (kernel)
-    res = numpy.zeros_like(xp)
-    for prism in prisms:
-        if prism is None or ('density' not in prism.props and dens is None):
-            continue
-        if dens is None:
-            density = prism.props['density']
-        else:
-            density = dens
-        # First thing to do is make the computation point P the origin of the
-        # coordinate system
-        x1, x2, y1, y2, z1, z2 = prism.get_bounds()
-        xs = [evaluate('x2 - xp'), evaluate('x1 - xp')]
-        ys = [evaluate('y2 - yp'), evaluate('y1 - yp')]
-        zs = [evaluate('z2 - zp'), evaluate('z1 - zp')]
-        # Evaluate the integration limits
-        for k in range(2):
-            z = zs[k]
-            for j in range(2):
-                y = ys[j]
-                for i in range(2):
-                    x = xs[i]
-                    r = evaluate('sqrt(x**2 + y**2 + z**2)')
-                    res = evaluate(expr)
+    res = _integrate(xp, yp, zp, prisms, dens, 'gxz', kernel, njobs,
+                     ratio)
     # Now all that is left is to multiply res by the gravitational constant and
     # convert it to Eotvos units
     res *= G*SI2EOTVOS
-    return res
+    return res.astype(dtype, copy=False)
 
-def gyy(xp, yp, zp, prisms, dens=None):
+def gyy(xp, yp, zp, prisms, dens=None, njobs=1, ratio=None,
+        dtype=numpy.float):
     """
     Calculates the :math:`g_{yy}` gravity gradient tensor component.
 
@@ -583,7 +572,8 @@ def gyy(xp, yp, zp, prisms, dens=None):
         Prisms must have the property ``'density'``. Prisms that don't have this
         property will be ignored in the computations. Elements of *prisms* that
         are None will also be ignored. *prisms* can also be a
-        :class:`~fatiando.mesher.PrismMesh`.
+        :class:`~fatiando.mesher.PrismMesh` or a
+        :class:`~fatiando.mesher.PrismArray`.
     * dens : float or None
         If not None, will use this value instead of the ``'density'`` property
         of the prisms. Use this, e.g., for sensitivity matrix building.
@@ -591,6 +581,21 @@ def gyy(xp, yp, zp, prisms, dens=None):
         .. warning:: Uses this value for **all** prisms! Not only the ones that
             have ``'density'`` as a property.
 
+    * njobs : int
+        Number of threads used by numexpr.
+    * ratio : float or None
+        If not None, prisms that are farther than *ratio* times their size
+        (the length of their diagonal) from a computation point are
+        approximated by their multipole expansion (a point mass at their
+        center plus the quadrupole term). This is faster and the error
+        decreases with the fourth power of the distance. If None, will always
+        use the exact formula.
+    * dtype : numpy dtype
+        The type of the output array. Can be ``numpy.float64`` or
+        ``numpy.float32``. The calculations are always done in double
+        precision, so single precision only rounds the result (relative error
+        smaller than 1e-7).
+
     Returns:
 
     * res : array
@@ -599,37 +604,17 @@ def gyy(xp, yp, zp, prisms, dens=None):
     """
     if xp.shape != yp.shape != zp.shape:
         raise ValueError("Input arrays xp, yp, and zp must have same shape!")
+    dtype = _check_dtype(dtype)
     kernel = '-arctan2(z*x, y*r)'
-    expr = 'res + ((-1.)**(i + j + k))*(%s)*density' % (kernel)
-    res = numpy.zeros_like(xp)
-    for prism in prisms:
-        if prism is None or ('density' not in prism.props and dens is None):
-            continue
-        if dens is None:
-            density = prism.props['density']
-        else:
-            density = dens
-        # First thing to do is make the computation point P the origin of the
-        # coordinate system
-        x1, x2, y1, y2, z1, z2 = prism.get_bounds()
-        xs = [evaluate('x2 - xp'), evaluate('x1 - xp')]
-        ys = [evaluate('y2 - yp'), evaluate('y1 - yp')]
-        zs = [evaluate('z2 - zp'), evaluate('z1 - zp')]
-        # Evaluate the integration limits
-        for k in range(2):
-            z = zs[k]
-            for j in range(2):
-                y = ys[j]
-                for i in range(2):
-                    x = xs[i]
-                    r = evaluate('sqrt(x**2 + y**2 + z**2)')
-                    res = evaluate(expr)
+    res = _integrate(xp, yp, zp, prisms, dens, 'gyy', kernel, njobs,
+                     ratio)
     # Now all that is left is to multiply res by the gravitational constant and
     # convert it to Eotvos units
     res *= G*SI2EOTVOS
-    return res
+    return res.astype(dtype, copy=False)
 
-def gyz(xp, yp, zp, prisms, dens=None):
+def gyz(xp, yp, zp, prisms, dens=None, njobs=1, ratio=None,
+        dtype=numpy.float):
     """
     Calculates the :math:`g_{yz}` gravity gradient tensor component.
 
@@ -647,7 +632,8 @@ def gyz(xp, yp, zp, prisms, dens=None):
         Prisms must have the property ``'density'``. Prisms that don't have this
         property will be ignored in the computations. Elements of *prisms* that
         are None will also be ignored. *prisms* can also be a
-        :class:`~fatiando.mesher.PrismMesh`.
+        :class:`~fatiando.mesher.PrismMesh` or a
+        :class:`~fatiando.mesher.PrismArray`.
     * dens : float or None
         If not None, will use this value instead of the ``'density'`` property
         of the prisms. Use this, e.g., for sensitivity matrix building.
@@ -655,6 +641,21 @@ def gyz(xp, yp, zp, prisms, dens=None):
         .. warning:: Uses this value for **all** prisms! Not only the ones that
             have ``'density'`` as a property.
 
+    * njobs : int
+        Number of threads used by numexpr.
+    * ratio : float or None
+        If not None, prisms that are farther than *ratio* times their size
+        (the length of their diagonal) from a computation point are
+        approximated by their multipole expansion (a point mass at their
+        center plus the quadrupole term). This is faster and the error
+        decreases with the fourth power of the distance. If None, will always
+        use the exact formula.
+    * dtype : numpy dtype
+        The type of the output array. Can be ``numpy.float64`` or
+        ``numpy.float32``. The calculations are always done in double
+        precision, so single precision only rounds the result (relative error
+        smaller than 1e-7).
+
     Returns:
 
     * res : array
@@ -663,37 +664,17 @@ def gyz(xp, yp, zp, prisms, dens=None):
     """
     if xp.shape != yp.shape != zp.shape:
         raise ValueError("Input arrays xp, yp, and zp must have same shape!")
+    dtype = _check_dtype(dtype)
     kernel = 'log(x + r)'
-    expr = 'res + ((-1.)**(i + j + k))*(%s)*density' % (kernel)
-    res = numpy.zeros_like(xp)
-    for prism in prisms:
-        if prism is None or ('density' not in prism.props and dens is None):
-            continue
-        if dens is None:
-            density = prism.props['density']
-        else:
-            density = dens
-        # First thing to do is make the computation point P the origin of the
-        # coordinate system
-        x1, x2, y1, y2, z1, z2 = prism.get_bounds()
-        xs = [evaluate('x2 - xp'), evaluate('x1 - xp')]
-        ys = [evaluate('y2 - yp'), evaluate('y1 - yp')]
-        zs = [evaluate('z2 - zp'), evaluate('z1 - zp')]
-        # Evaluate the integration limits
-        for k in range(2):
-            z = zs[k]
-            for j in range(2):
-                y = ys[j]
-                for i in range(2):
-                    x = xs[i]
-                    r = evaluate('sqrt(x**2 + y**2 + z**2)')
-                    res = evaluate(expr)
+    res = _integrate(xp, yp, zp, prisms, dens, 'gyz', kernel, njobs,
+                     ratio)
     # Now all that is left is to multiply res by the gravitational constant and
     # convert it to Eotvos units
     res *= G*SI2EOTVOS
-    return res
+    return res.astype(dtype, copy=False)
 
-def gzz(xp, yp, zp, prisms, dens=None):
+def gzz(xp, yp, zp, prisms, dens=None, njobs=1, ratio=None,
+        dtype=numpy.float):
     """
     Calculates the :math:`g_{zz}` gravity gradient tensor component.
 
@@ -711,7 +692,8 @@ def gzz(xp, yp, zp, prisms, dens=None):
         Prisms must have the property ``'density'``. Prisms that don't have this
         property will be ignored in the computations. Elements of *prisms* that
         are None will also be ignored. *prisms* can also be a
-        :class:`~fatiando.mesher.PrismMesh`.
+        :class:`~fatiando.mesher.PrismMesh` or a
+        :class:`~fatiando.mesher.PrismArray`.
     * dens : float or None
         If not None, will use this value instead of the ``'density'`` property
         of the prisms. Use this, e.g., for sensitivity matrix building.
@@ -719,6 +701,21 @@ def gzz(xp, yp, zp, prisms, dens=None):
         .. warning:: Uses this value for **all** prisms! Not only the ones that
             have ``'density'`` as a property.
 
+    * njobs : int
+        Number of threads used by numexpr.
+    * ratio : float or None
+        If not None, prisms that are farther than *ratio* times their size
+        (the length of their diagonal) from a computation point are
+        approximated by their multipole expansion (a point mass at their
+        center plus the quadrupole term). This is faster and the error
+        decreases with the fourth power of the distance. If None, will always
+        use the exact formula.
+    * dtype : numpy dtype
+        The type of the output array. Can be ``numpy.float64`` or
+        ``numpy.float32``. The calculations are always done in double
+        precision, so single precision only rounds the result (relative error
+        smaller than 1e-7).
+
     Returns:
 
     * res : array
@@ -727,32 +724,64 @@ def gzz(xp, yp, zp, prisms, dens=None):
     """
     if xp.shape != yp.shape != zp.shape:
         raise ValueError("Input arrays xp, yp, and zp must have same shape!")
+    dtype = _check_dtype(dtype)
     kernel = '-arctan2(x*y, z*r)'
-    expr = 'res + ((-1.)**(i + j + k))*(%s)*density' % (kernel)
-    res = numpy.zeros_like(xp)
-    for prism in prisms:
-        if prism is None or ('density' not in prism.props and dens is None):
-            continue
-        if dens is None:
-            density = prism.props['density']
-        else:
-            density = dens
-        # First thing to do is make the computation point P the origin of the
-        # coordinate system
-        x1, x2, y1, y2, z1, z2 = prism.get_bounds()
-        xs = [evaluate('x2 - xp'), evaluate('x1 - xp')]
-        ys = [evaluate('y2 - yp'), evaluate('y1 - yp')]
-        zs = [evaluate('z2 - zp'), evaluate('z1 - zp')]
-        # Evaluate the integration limits
-        for k in range(2):
-            z = zs[k]
-            for j in range(2):
-                y = ys[j]
-                for i in range(2):
-                    x = xs[i]
-                    r = evaluate('sqrt(x**2 + y**2 + z**2)')
-                    res = evaluate(expr)
+    res = _integrate(xp, yp, zp, prisms, dens, 'gzz', kernel, njobs,
+                     ratio)
     # Now all that is left is to multiply res by the gravitational constant and
     # convert it to Eotvos units
     res *= G*SI2EOTVOS
+    return res.astype(dtype, copy=False)
+
+@contextlib.contextmanager
+def _threads(njobs):
+    """
+    Use *njobs* threads in numexpr inside a with block.
+    """
+    if njobs < 1:
+        raise ValueError("Invalid number of jobs '%s'. Must be >= 1" % (njobs))
+    previous = numexpr.set_num_threads(int(njobs))
+    try:
+        yield
+    finally:
+        numexpr.set_num_threads(previous)
+
+def _integrate(xp, yp, zp, prisms, dens, component, kernel, njobs, ratio):
+    """
+    Integrate the numexpr expression *kernel* (a function of x, y, z and r)
+    over all prisms. If *ratio* is not None, use a multipole expansion for the
+    prisms that are far away.
+    """
+    expr = 'partial + ((-1.)**(i + j + k))*(%s)*density' % (kernel)
+    res = numpy.zeros_like(xp)
+    with _threads(njobs):
+        for prism in prisms:
+            if (prism is None or
+                ('density' not in prism.props and dens is None)):
+                continue
+            if dens is None:
+                density = prism.props['density']
+            else:
+                density = dens
+            # Use a multipole expansion for the points far away from the prism
+            near = _far_field(component, prism, xp, yp, zp, density, ratio,
+                              res)
+            xn, yn, zn = xp[near], yp[near], zp[near]
+            partial = res[near]
+            # First thing to do is make the computation point P the origin of
+            # the coordinate system
+            x1, x2, y1, y2, z1, z2 = prism.get_bounds()
+            xs = [evaluate('x2 - xn'), evaluate('x1 - xn')]
+            ys = [evaluate('y2 - yn'), evaluate('y1 - yn')]
+            zs = [evaluate('z2 - zn'), evaluate('z1 - zn')]
+            # Evaluate the integration limits
+            for k in range(2):
+                z = zs[k]
+                for j in range(2):
+                    y = ys[j]
+                    for i in range(2):
+                        x = xs[i]
+                        r = evaluate('sqrt(x**2 + y**2 + z**2)')
+                        partial = evaluate(expr)
+            res[near] = partial
     return res
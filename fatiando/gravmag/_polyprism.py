@@ -0,0 +1,880 @@
+"""
+.. note::
+
+    This is a Python + Numpy implementation of the potential field effects of
+    prisms with polygonal crossection. There is a Cython implementation in
+    _cpolyprism.pyx It will be loaded automatically if it is compiled.
+
+----
+"""
+import numpy
+from numpy import arctan2, log, sqrt, arctan
+
+from fatiando import utils
+from fatiando.constants import SI2MGAL, SI2EOTVOS, G, CM, T2NT
+from fatiando.gravmag._prism import _check_dtype
+
+__all__ = ['gz', 'gxx', 'gxy', 'gxz', 'gyy', 'gyz', 'gzz', 'tf', 'fields']
+
+# The components that fields can calculate and the factor that converts each
+# one to the output units
+_FIELDS = ['gz', 'gxx', 'gxy', 'gxz', 'gyy', 'gyz', 'gzz']
+_SCALE = {'gz':G*SI2MGAL,
+          'gxx':G*SI2EOTVOS, 'gxy':G*SI2EOTVOS, 'gxz':G*SI2EOTVOS,
+          'gyy':G*SI2EOTVOS, 'gyz':G*SI2EOTVOS, 'gzz':G*SI2EOTVOS}
+
+def _check_components(components):
+    """
+    Check if the components passed to fields are valid.
+    """
+    if components is None:
+        return list(_FIELDS)
+    if isinstance(components, str):
+        components = [components]
+    for c in components:
+        if c not in _SCALE:
+            raise ValueError("Invalid field component '%s'. Use one of %s"
+                             % (c, ', '.join(_FIELDS)))
+    return list(components)
+
+
+def tf(xp, yp, zp, prisms, inc, dec, dtype=numpy.float):
+    """
+    Calculate the total-field anomaly of polygonal prisms.
+
+    .. note:: The coordinate system of the input parameters is to be x -> North,
+        y -> East and z -> Down.
+
+    .. note:: Input units are SI. Output is in nT
+
+    Parameters:
+
+    * xp, yp, zp : arrays
+        Arrays with the x, y, and z coordinates of the computation points.
+    * prisms : list of :class:`fatiando.mesher.PolygonalPrism`
+        The model used to calculate the total field anomaly.
+        Prisms must have the physical property ``'magnetization'`` will be
+        ignored. If the physical properties ``'inclination'`` and
+        ``'declination'`` are not present, will use the values of *inc* and
+        *dec* instead (regional field).
+    * inc : float
+        The inclination of the regional field (in degrees)
+    * dec : float
+        The declination of the regional field (in degrees)
+    * dtype : numpy dtype
+        The type of the output array. Can be ``numpy.float64`` or
+        ``numpy.float32``. The calculations are always done in double
+        precision, so single precision only rounds the result (relative error
+        smaller than 1e-7).
+
+    Returns:
+
+    * res : array
+        The field calculated on xp, yp, zp
+
+    """
+    if xp.shape != yp.shape != zp.shape:
+        raise ValueError("Input arrays xp, yp, and zp must have same shape!")
+    dtype = _check_dtype(dtype)
+    # Calculate the 3 components of the unit vector in the direction of the
+    # regional field
+    fx, fy, fz = utils.dircos(inc, dec)
+    res = numpy.zeros(len(xp), dtype=numpy.float)
+    for prism in prisms:
+        if prism is None or 'magnetization' not in prism.props:
+            continue
+        magnetization = prism.props['magnetization']
+        nverts = prism.nverts
+        x, y = prism.x, prism.y
+        z1, z2 = prism.z1, prism.z2
+        # Get the 3 components of the unit vector in the direction of the
+        # magnetization from the inclination and declination
+        # 1) given by the prism
+        if 'inclination' in prism.props and 'declination' in prism.props:
+            mx, my, mz = utils.dircos(prism.props['inclination'],
+                                      prism.props['declination'])
+        # 2) Use in the direction of the regional field
+        else:
+            mx, my, mz = fx, fy, fz
+        # Now calculate the total field anomaly
+        Z1 = z1 - zp
+        Z2 = z2 - zp
+        for k in range(nverts):
+            X1 = x[k] - xp
+            Y1 = y[k] - yp
+            X2 = x[(k + 1)%nverts] - xp
+            Y2 = y[(k + 1)%nverts] - yp
+            v1, v2, v3, v4, v5, v6 = _integrals(X1, X2, Y1, Y2, Z1, Z2)
+            res += magnetization*(
+                      mx*(v1*fx + v2*fy + v3*fz)
+                    + my*(v2*fx + v4*fy + v5*fz)
+                    + mz*(v3*fx + v5*fy + v6*fz))
+    res *= CM*T2NT
+    return res.astype(dtype, copy=False)
+
+def gz(xp, yp, zp, prisms, dtype=numpy.float):
+    """
+    Calculates the :math:`g_{z}` gravity acceleration component.
+
+    .. note:: The coordinate system of the input parameters is to be x -> North,
+        y -> East and z -> Down.
+
+    .. note:: All input values in SI units and output in mGal!
+
+    Parameters:
+
+    * xp, yp, zp : arrays
+        The x, y, and z coordinates of the computation points.
+    * prisms : list of :class:`fatiando.mesher.PolygonalPrism`
+        The model used to calculate the field.
+        Prisms must have the physical property ``'density'`` will be
+        ignored.
+    * dtype : numpy dtype
+        The type of the output array. Can be ``numpy.float64`` or
+        ``numpy.float32``. The calculations are always done in double
+        precision, so single precision only rounds the result (relative error
+        smaller than 1e-7).
+
+    Returns:
+
+    * res : array
+        The effect calculated on the computation points.
+
+    """
+    if xp.shape != yp.shape != zp.shape:
+        raise ValueError("Input arrays xp, yp, and zp must have same shape!")
+    dtype = _check_dtype(dtype)
+    res = numpy.zeros(len(xp), dtype=numpy.float)
+    for prism in prisms:
+        if prism is None or 'density' not in prism.props:
+            continue
+        density = prism.props['density']
+        nverts = prism.nverts
+        x, y = prism.x, prism.y
+        z1, z2 = prism.z1, prism.z2
+        # Calculate the effect of the prism
+        Z1 = z1 - zp
+        Z2 = z2 - zp
+        for k in range(nverts):
+            res += density*_integral_gz(x[k] - xp, x[(k + 1)%nverts] - xp,
+                y[k] - yp, y[(k + 1)%nverts] - yp, Z1, Z2)
+    res *= G*SI2MGAL
+    return res.astype(dtype, copy=False)
+
+def gxx(xp, yp, zp, prisms, dtype=numpy.float):
+    """
+    Calculates the :math:`g_{xx}` gravity gradient tensor component.
+
+    .. note:: The coordinate system of the input parameters is to be x -> North,
+        y -> East and z -> Down.
+
+    .. note:: All input values in SI units and output in Eotvos!
+
+    Parameters:
+
+    * xp, yp, zp : arrays
+        The x, y, and z coordinates of the computation points.
+    * prisms : list of :class:`fatiando.mesher.PolygonalPrism`
+        The model used to calculate the field.
+        Prisms must have the physical property ``'density'`` will be
+        ignored.
+    * dtype : numpy dtype
+        The type of the output array. Can be ``numpy.float64`` or
+        ``numpy.float32``. The calculations are always done in double
+        precision, so single precision only rounds the result (relative error
+        smaller than 1e-7).
+
+    Returns:
+
+    * res : array
+        The effect calculated on the computation points.
+
+    """
+    if xp.shape != yp.shape != zp.shape:
+        raise ValueError("Input arrays xp, yp, and zp must have same shape!")
+    dtype = _check_dtype(dtype)
+    res = numpy.zeros(len(xp), dtype=numpy.float)
+    for prism in prisms:
+        if prism is None or 'density' not in prism.props:
+            continue
+        density = prism.props['density']
+        nverts = prism.nverts
+        x, y = prism.x, prism.y
+        z1, z2 = prism.z1, prism.z2
+        # Calculate the effect of the prism
+        Z1 = z1 - zp
+        Z2 = z2 - zp
+        for k in range(nverts):
+            res += density*_integral_v1(x[k] - xp, x[(k + 1)%nverts] - xp,
+                y[k] - yp, y[(k + 1)%nverts] - yp, Z1, Z2)
+    res *= G*SI2EOTVOS
+    return res.astype(dtype, copy=False)
+
+def gxy(xp, yp, zp, prisms, dtype=numpy.float):
+    """
+    Calculates the :math:`g_{xy}` gravity gradient tensor component.
+
+    .. note:: The coordinate system of the input parameters is to be x -> North,
+        y -> East and z -> Down.
+
+    .. note:: All input values in SI units and output in Eotvos!
+
+    Parameters:
+
+    * xp, yp, zp : arrays
+        The x, y, and z coordinates of the computation points.
+    * prisms : list of :class:`fatiando.mesher.PolygonalPrism`
+        The model used to calculate the field.
+        Prisms must have the physical property ``'density'`` will be
+        ignored.
+    * dtype : numpy dtype
+        The type of the output array. Can be ``numpy.float64`` or
+        ``numpy.float32``. The calculations are always done in double
+        precision, so single precision only rounds the result (relative error
+        smaller than 1e-7).
+
+    Returns:
+
+    * res : array
+        The effect calculated on the computation points.
+
+    """
+    if xp.shape != yp.shape != zp.shape:
+        raise ValueError("Input arrays xp, yp, and zp must have same shape!")
+    dtype = _check_dtype(dtype)
+    res = numpy.zeros(len(xp), dtype=numpy.float)
+    for prism in prisms:
+        if prism is None or 'density' not in prism.props:
+            continue
+        density = prism.props['density']
+        nverts = prism.nverts
+        x, y = prism.x, prism.y
+        z1, z2 = prism.z1, prism.z2
+        # Calculate the effect of the prism
+        Z1 = z1 - zp
+        Z2 = z2 - zp
+        for k in range(nverts):
+            res += density*_integral_v2(x[k] - xp, x[(k + 1)%nverts] - xp,
+                y[k] - yp, y[(k + 1)%nverts] - yp, Z1, Z2)
+    res *= G*SI2EOTVOS
+    return res.astype(dtype, copy=False)
+
+def gxz(xp, yp, zp, prisms, dtype=numpy.float):
+    """
+    Calculates the :math:`g_{xz}` gravity gradient tensor component.
+
+    .. note:: The coordinate system of the input parameters is to be x -> North,
+        y -> East and z -> Down.
+
+    .. note:: All input values in SI units and output in Eotvos!
+
+    Parameters:
+
+    * xp, yp, zp : arrays
+        The x, y, and z coordinates of the computation points.
+    * prisms : list of :class:`fatiando.mesher.PolygonalPrism`
+        The model used to calculate the field.
+        Prisms must have the physical property ``'density'`` will be
+        ignored.
+    * dtype : numpy dtype
+        The type of the output array. Can be ``numpy.float64`` or
+        ``numpy.float32``. The calculations are always done in double
+        precision, so single precision only rounds the result (relative error
+        smaller than 1e-7).
+
+    Returns:
+
+    * res : array
+        The effect calculated on the computation points.
+
+    """
+    if xp.shape != yp.shape != zp.shape:
+        raise ValueError("Input arrays xp, yp, and zp must have same shape!")
+    dtype = _check_dtype(dtype)
+    res = numpy.zeros(len(xp), dtype=numpy.float)
+    for prism in prisms:
+        if prism is None or 'density' not in prism.props:
+            continue
+        density = prism.props['density']
+        nverts = prism.nverts
+        x, y = prism.x, prism.y
+        z1, z2 = prism.z1, prism.z2
+        # Calculate the effect of the prism
+        Z1 = z1 - zp
+        Z2 = z2 - zp
+        for k in range(nverts):
+            res += density*_integral_v3(x[k] - xp, x[(k + 1)%nverts] - xp,
+                y[k] - yp, y[(k + 1)%nverts] - yp, Z1, Z2)
+    res *= G*SI2EOTVOS
+    return res.astype(dtype, copy=False)
+
+def gyy(xp, yp, zp, prisms, dtype=numpy.float):
+    """
+    Calculates the :math:`g_{yy}` gravity gradient tensor component.
+
+    .. note:: The coordinate system of the input parameters is to be x -> North,
+        y -> East and z -> Down.
+
+    .. note:: All input values in SI units and output in Eotvos!
+
+    Parameters:
+
+    * xp, yp, zp : arrays
+        The x, y, and z coordinates of the computation points.
+    * prisms : list of :class:`fatiando.mesher.PolygonalPrism`
+        The model used to calculate the field.
+        Prisms must have the physical property ``'density'`` will be
+        ignored.
+    * dtype : numpy dtype
+        The type of the output array. Can be ``numpy.float64`` or
+        ``numpy.float32``. The calculations are always done in double
+        precision, so single precision only rounds the result (relative error
+        smaller than 1e-7).
+
+    Returns:
+
+    * res : array
+        The effect calculated on the computation points.
+
+    """
+    if xp.shape != yp.shape != zp.shape:
+        raise ValueError("Input arrays xp, yp, and zp must have same shape!")
+    dtype = _check_dtype(dtype)
+    res = numpy.zeros(len(xp), dtype=numpy.float)
+    for prism in prisms:
+        if prism is None or 'density' not in prism.props:
+            continue
+        density = prism.props['density']
+        nverts = prism.nverts
+        x, y = prism.x, prism.y
+        z1, z2 = prism.z1, prism.z2
+        # Calculate the effect of the prism
+        Z1 = z1 - zp
+        Z2 = z2 - zp
+        for k in range(nverts):
+            res += density*_integral_v4(x[k] - xp, x[(k + 1)%nverts] - xp,
+                y[k] - yp, y[(k + 1)%nverts] - yp, Z1, Z2)
+    res *= G*SI2EOTVOS
+    return res.astype(dtype, copy=False)
+
+def gyz(xp, yp, zp, prisms, dtype=numpy.float):
+    """
+    Calculates the :math:`g_{yz}` gravity gradient tensor component.
+
+    .. note:: The coordinate system of the input parameters is to be x -> North,
+        y -> East and z -> Down.
+
+    .. note:: All input values in SI units and output in Eotvos!
+
+    Parameters:
+
+    * xp, yp, zp : arrays
+        The x, y, and z coordinates of the computation points.
+    * prisms : list of :class:`fatiando.mesher.PolygonalPrism`
+        The model used to calculate the field.
+        Prisms must have the physical property ``'density'`` will be
+        ignored.
+    * dtype : numpy dtype
+        The type of the output array. Can be ``numpy.float64`` or
+        ``numpy.float32``. The calculations are always done in double
+        precision, so single precision only rounds the result (relative error
+        smaller than 1e-7).
+
+    Returns:
+
+    * res : array
+        The effect calculated on the computation points.
+
+    """
+    if xp.shape != yp.shape != zp.shape:
+        raise ValueError("Input arrays xp, yp, and zp must have same shape!")
+    dtype = _check_dtype(dtype)
+    res = numpy.zeros(len(xp), dtype=numpy.float)
+    for prism in prisms:
+        if prism is None or 'density' not in prism.props:
+            continue
+        density = prism.props['density']
+        nverts = prism.nverts
+        x, y = prism.x, prism.y
+        z1, z2 = prism.z1, prism.z2
+        # Calculate the effect of the prism
+        Z1 = z1 - zp
+        Z2 = z2 - zp
+        for k in range(nverts):
+            res += density*_integral_v5(x[k] - xp, x[(k + 1)%nverts] - xp,
+                y[k] - yp, y[(k + 1)%nverts] - yp, Z1, Z2)
+    res *= G*SI2EOTVOS
+    return res.astype(dtype, copy=False)
+
+def gzz(xp, yp, zp, prisms, dtype=numpy.float):
+    """
+    Calculates the :math:`g_{zz}` gravity gradient tensor component.
+
+    .. note:: The coordinate system of the input parameters is to be x -> North,
+        y -> East and z -> Down.
+
+    .. note:: All input values in SI units and output in Eotvos!
+
+    Parameters:
+
+    * xp, yp, zp : arrays
+        The x, y, and z coordinates of the computation points.
+    * prisms : list of :class:`fatiando.mesher.PolygonalPrism`
+        The model used to calculate the field.
+        Prisms must have the physical property ``'density'`` will be
+        ignored.
+    * dtype : numpy dtype
+        The type of the output array. Can be ``numpy.float64`` or
+        ``numpy.float32``. The calculations are always done in double
+        precision, so single precision only rounds the result (relative error
+        smaller than 1e-7).
+
+    Returns:
+
+    * res : array
+        The effect calculated on the computation points.
+
+    """
+    if xp.shape != yp.shape != zp.shape:
+        raise ValueError("Input arrays xp, yp, and zp must have same shape!")
+    dtype = _check_dtype(dtype)
+    res = numpy.zeros(len(xp), dtype=numpy.float)
+    for prism in prisms:
+        if prism is None or 'density' not in prism.props:
+            continue
+        density = prism.props['density']
+        nverts = prism.nverts
+        x, y = prism.x, prism.y
+        z1, z2 = prism.z1, prism.z2
+        # Calculate the effect of the prism
+        Z1 = z1 - zp
+        Z2 = z2 - zp
+        for k in range(nverts):
+            res += density*_integral_v6(x[k] - xp, x[(k + 1)%nverts] - xp,
+                y[k] - yp, y[(k + 1)%nverts] - yp, Z1, Z2)
+    res *= G*SI2EOTVOS
+    return res.astype(dtype, copy=False)
+
+def fields(xp, yp, zp, prisms, components=None, dtype=numpy.float):
+    """
+    Calculate several gravitational field components in a single pass.
+
+    Each edge of the polygons is visited once for all requested components.
+    The edge geometry and the logarithms and arctangents are shared by the
+    gradient tensor components, so the full tensor costs little more than a
+    single component.
+
+    The results are the same as given by
+    :func:`~fatiando.gravmag.polyprism.gz`,
+    :func:`~fatiando.gravmag.polyprism.gxx`, etc.
+
+    .. note:: The coordinate system of the input parameters is to be x -> North,
+        y -> East and z -> Down.
+
+    .. note:: All input values in SI units. gz is returned in mGal and the
+        gradient tensor components in Eotvos!
+
+    Parameters:
+
+    * xp, yp, zp : arrays
+        The x, y, and z coordinates of the computation points.
+    * prisms : list of :class:`fatiando.mesher.PolygonalPrism`
+        The model used to calculate the field.
+        Prisms must have the physical property ``'density'`` will be
+        ignored.
+    * components : list of str or None
+        The components to calculate. Can be any of ``'gz'``, ``'gxx'``,
+        ``'gxy'``, ``'gxz'``, ``'gyy'``, ``'gyz'``, ``'gzz'``. If None, will
+        calculate all of them (in this order).
+    * dtype : numpy dtype
+        The type of the output array. Can be ``numpy.float64`` or
+        ``numpy.float32``. The calculations are always done in double
+        precision, so single precision only rounds the result (relative error
+        smaller than 1e-7).
+
+    Returns:
+
+    * res : list of arrays
+        The fields calculated on xp, yp, zp. One array for each element of
+        *components*, in the same order.
+
+    """
+    if xp.shape != yp.shape != zp.shape:
+        raise ValueError("Input arrays xp, yp, and zp must have same shape!")
+    dtype = _check_dtype(dtype)
+    components = _check_components(components)
+    tensor = [c for c in components if c != 'gz']
+    res = [numpy.zeros(len(xp), dtype=numpy.float) for c in components]
+    for prism in prisms:
+        if prism is None or 'density' not in prism.props:
+            continue
+        density = prism.props['density']
+        nverts = prism.nverts
+        x, y = prism.x, prism.y
+        Z1 = prism.z1 - zp
+        Z2 = prism.z2 - zp
+        for k in range(nverts):
+            X1 = x[k] - xp
+            Y1 = y[k] - yp
+            X2 = x[(k + 1)%nverts] - xp
+            Y2 = y[(k + 1)%nverts] - yp
+            values = [None]
+            if 'gz' in components:
+                values[0] = _integral_gz(X1, X2, Y1, Y2, Z1, Z2)
+            if tensor:
+                values.extend(_integrals(X1, X2, Y1, Y2, Z1, Z2))
+            for c, field in zip(components, res):
+                field += density*values[_FIELDS.index(c)]
+    for c, field in zip(components, res):
+        field *= _SCALE[c]
+    return [field.astype(dtype, copy=False) for field in res]
+
+def _integral_gz(Xk1, Xk2, Yk1, Yk2, Z1, Z2):
+    """
+    Calculates the gz kernel of one edge of the polygon
+    """
+    dummy = 10**(-10)
+    Z1_sqr = Z1**2
+    Z2_sqr = Z2**2
+    p = Xk1*Yk2 - Xk2*Yk1
+    p_sqr = p**2
+    Qk1 = (Yk2 - Yk1)*Yk1 + (Xk2 - Xk1)*Xk1
+    Qk2 = (Yk2 - Yk1)*Yk2 + (Xk2 - Xk1)*Xk2
+    Ak1 = Xk1**2 + Yk1**2
+    Ak2 = Xk2**2 + Yk2**2
+    R1k1 = sqrt(Ak1 + Z1_sqr)
+    R1k2 = sqrt(Ak2 + Z1_sqr)
+    R2k1 = sqrt(Ak1 + Z2_sqr)
+    R2k2 = sqrt(Ak2 + Z2_sqr)
+    Ak1 = sqrt(Ak1)
+    Ak2 = sqrt(Ak2)
+    Bk1 = sqrt(Qk1**2 + p_sqr)
+    Bk2 = sqrt(Qk2**2 + p_sqr)
+    E1k1 = R1k1*Bk1
+    E1k2 = R1k2*Bk2
+    E2k1 = R2k1*Bk1
+    E2k2 = R2k2*Bk2
+    kernel = (Z2 - Z1)*(arctan2(Qk2, p) - arctan2(Qk1, p))
+    kernel += Z2*(arctan2(Z2*Qk1, R2k1*p) - arctan2(Z2*Qk2, R2k2*p))
+    kernel += Z1*(arctan2(Z1*Qk2, R1k2*p) - arctan2(Z1*Qk1, R1k1*p))
+    Ck1 = Qk1*Ak1
+    Ck2 = Qk2*Ak2
+    # dummy helps prevent zero division errors
+    kernel += 0.5*p*(Ak1/(Bk1 + dummy))*(
+        log((E1k1 - Ck1)/(E1k1 + Ck1 + dummy) + dummy) -
+        log((E2k1 - Ck1)/(E2k1 + Ck1 + dummy) + dummy))
+    kernel += 0.5*p*(Ak2/(Bk2 + dummy))*(
+        log((E2k2 - Ck2)/(E2k2 + Ck2 + dummy) + dummy) -
+        log((E1k2 - Ck2)/(E1k2 + Ck2 + dummy) + dummy))
+    return kernel
+
+def _integrals(X1, X2, Y1, Y2, Z1, Z2):
+    """
+    Calculates the 6 elements of the V matrix (gradient tensor components) of
+    one edge of the polygon at once, sharing the terms common to them.
+    """
+    dummy = 10.**(-10) # Used to avoid singularities
+    aux0 = X2 - X1 + dummy
+    aux1 = Y2 - Y1 + dummy
+    n = (aux0/aux1)
+    g = X1 - (Y1*n)
+    m = (aux1/aux0)
+    c = Y1 - (X1*m)
+    aux2 = sqrt((aux0*aux0) + (aux1*aux1))
+    p = ((X1*Y2) - (X2*Y1))/aux2 + dummy
+    d1 = ((aux0*X1) + (aux1*Y1))/aux2 + dummy
+    d2 = ((aux0*X2) + (aux1*Y2))/aux2 + dummy
+    aux6 = (X1*X1) + (Y1*Y1)
+    aux7 = (X2*X2) + (Y2*Y2)
+    aux8 = Z1*Z1
+    aux9 = Z2*Z2
+    R11 = sqrt(aux6 + aux8)
+    R12 = sqrt(aux6 + aux9)
+    R21 = sqrt(aux7 + aux8)
+    R22 = sqrt(aux7 + aux9)
+    # The arctangent terms of the two vertices
+    arc2 = arctan2((Z2*d2), (p*R22)) - arctan2((Z1*d2), (p*R21))
+    arc1 = arctan2((Z2*d1), (p*R12)) - arctan2((Z1*d1), (p*R11))
+    # The log(z + r) terms
+    logz = ((log(Z2 + R12 + dummy) - log(Z1 + R11 + dummy))
+            - (log(Z2 + R22 + dummy) - log(Z1 + R21 + dummy)))
+    # The log((r - d)/(r + d)) terms
+    logd2 = (log((R22 - d2)/(R22 + d2) + dummy)
+             - log((R21 - d2)/(R21 + d2) + dummy))/(2*d2)
+    logd1 = (log((R12 - d1)/(R12 + d1) + dummy)
+             - log((R11 - d1)/(R11 + d1) + dummy))/(2*d1)
+    n2 = 1.0 + n*n
+    m2 = 1.0 + m*m
+    v1 = -((g*Y2*arc2/(p*d2) + n*p*arc2/d2)
+           - (g*Y1*arc1/(p*d1) + n*p*arc1/d1) + n*logz)/n2
+    v2 = (((g*g + g*n*Y2)*arc2/(p*d2) - p*arc2/d2)
+          - ((g*g + g*n*Y1)*arc1/(p*d1) - p*arc1/d1) - logz)/n2
+    v3 = -((Y2*n2 + g*n)*logd2 - (Y1*n2 + g*n)*logd1)/n2
+    v4 = ((c*X2*arc2/(p*d2) + m*p*arc2/d2)
+          - (c*X1*arc1/(p*d1) + m*p*arc1/d1) + m*logz)/m2
+    v5 = ((X2*m2 + c*m)*logd2 - (X1*m2 + c*m)*logd1)/m2
+    v6 = arc2 - arc1
+    return v1, v2, v3, v4, v5, v6
+
+def _integral_v1(X1, X2, Y1, Y2, Z1, Z2):
+    """
+    Calculates the first element of the V matrix (gxx components)
+    """
+    dummy = 10.**(-10) # Used to avoid singularities
+    aux0 = X2 - X1 + dummy
+    aux1 = Y2 - Y1 + dummy
+    n = (aux0/aux1)
+    g = X1 - (Y1*n)
+    m = (aux1/aux0)
+    c = Y1 - (X1*m)
+    aux2 = sqrt((aux0*aux0) + (aux1*aux1))
+    aux3 = (X1*Y2) - (X2*Y1)
+    p = ((aux3/aux2)) + dummy
+    aux4 = (aux0*X1) + (aux1*Y1)
+    aux5 = (aux0*X2) + (aux1*Y2)
+    d1 = ((aux4/aux2)) + dummy
+    d2 = ((aux5/aux2)) + dummy
+    aux6 = (X1*X1) + (Y1*Y1)
+    aux7 = (X2*X2) + (Y2*Y2)
+    aux8 = Z1*Z1
+    aux9 = Z2*Z2
+    R11 = sqrt(aux6 + aux8)
+    R12 = sqrt(aux6 + aux9)
+    R21 = sqrt(aux7 + aux8)
+    R22 = sqrt(aux7 + aux9)
+    aux10 = arctan2((Z2*d2), (p*R22))
+    aux11 = arctan2((Z1*d2), (p*R21))
+    aux12 = aux10 - aux11
+    aux13 = (aux12/(p*d2))
+    aux14 = ((p*aux12)/d2)
+    res = (g*Y2*aux13) + (n*aux14)
+    aux10 = arctan2((Z2*d1), (p*R12))
+    aux11 = arctan2((Z1*d1), (p*R11))
+    aux12 = aux10 - aux11
+    aux13 = (aux12/(p*d1))
+    aux14 = ((p*aux12)/d1)
+    res -= (g*Y1*aux13) + (n*aux14)
+    aux10 = log(((Z2 + R22) + dummy))
+    aux11 = log(((Z1 + R21) + dummy))
+    aux12 = log(((Z2 + R12) + dummy))
+    aux13 = log(((Z1 + R11) + dummy))
+    aux14 = aux10 - aux11
+    aux15 = aux12 - aux13
+    res += (n*(aux15 - aux14))
+    aux0 = (1.0/(1.0 + (n*n)))
+    res *= -aux0
+    return res
+
+def _integral_v2(X1, X2, Y1, Y2, Z1, Z2):
+    """
+    Calculates the second element of the V matrix (gxy components)
+    """
+    dummy = 10.**(-10) # Used to avoid singularities
+    aux0 = X2 - X1 + dummy
+    aux1 = Y2 - Y1 + dummy
+    n = (aux0/aux1)
+    g = X1 - (Y1*n)
+    m = (aux1/aux0)
+    c = Y1 - (X1*m)
+    aux2 = sqrt((aux0*aux0) + (aux1*aux1))
+    aux3 = (X1*Y2) - (X2*Y1)
+    p = ((aux3/aux2)) + dummy
+    aux4 = (aux0*X1) + (aux1*Y1)
+    aux5 = (aux0*X2) + (aux1*Y2)
+    d1 = ((aux4/aux2)) + dummy
+    d2 = ((aux5/aux2)) + dummy
+    aux6 = (X1*X1) + (Y1*Y1)
+    aux7 = (X2*X2) + (Y2*Y2)
+    aux8 = Z1*Z1
+    aux9 = Z2*Z2
+    R11 = sqrt(aux6 + aux8)
+    R12 = sqrt(aux6 + aux9)
+    R21 = sqrt(aux7 + aux8)
+    R22 = sqrt(aux7 + aux9)
+    aux10 = arctan2((Z2*d2), (p*R22))
+    aux11 = arctan2((Z1*d2), (p*R21))
+    aux12 = aux10 - aux11
+    aux13 = (aux12/(p*d2))
+    aux14 = ((p*aux12)/d2)
+    res = (((g*g) + (g*n*Y2))*aux13) - aux14
+    aux10 = arctan2((Z2*d1), (p*R12))
+    aux11 = arctan2((Z1*d1), (p*R11))
+    aux12 = aux10 - aux11
+    aux13 = (aux12/(p*d1))
+    aux14 = ((p*aux12)/d1)
+    res -= (((g*g) + (g*n*Y1))*aux13) - aux14
+    aux10 = log(((Z2 + R22) + dummy))
+    aux11 = log(((Z1 + R21) + dummy))
+    aux12 = log(((Z2 + R12) + dummy))
+    aux13 = log(((Z1 + R11) + dummy))
+    aux14 = aux10 - aux11
+    aux15 = aux12 - aux13
+    res += (aux14 - aux15)
+    aux0 = (1.0/(1.0 + (n*n)))
+    res *= aux0
+    return res
+
+def _integral_v3(X1, X2, Y1, Y2, Z1, Z2):
+    """
+    Calculates the third element of the V matrix (gxz components)
+    """
+    dummy = 10.**(-10) # Used to avoid singularities
+    aux0 = X2 - X1 + dummy
+    aux1 = Y2 - Y1 + dummy
+    n = (aux0/aux1)
+    g = X1 - (Y1*n)
+    m = (aux1/aux0)
+    c = Y1 - (X1*m)
+    aux2 = sqrt((aux0*aux0) + (aux1*aux1))
+    aux3 = (X1*Y2) - (X2*Y1)
+    p = ((aux3/aux2)) + dummy
+    aux4 = (aux0*X1) + (aux1*Y1)
+    aux5 = (aux0*X2) + (aux1*Y2)
+    d1 = ((aux4/aux2)) + dummy
+    d2 = ((aux5/aux2)) + dummy
+    aux6 = (X1*X1) + (Y1*Y1)
+    aux7 = (X2*X2) + (Y2*Y2)
+    aux8 = Z1*Z1
+    aux9 = Z2*Z2
+    R11 = sqrt(aux6 + aux8)
+    R12 = sqrt(aux6 + aux9)
+    R21 = sqrt(aux7 + aux8)
+    R22 = sqrt(aux7 + aux9)
+    aux10 = log((((R11 - d1)/(R11 + d1)) + dummy))
+    aux11 = log((((R12 - d1)/(R12 + d1)) + dummy))
+    aux12 = log((((R21 - d2)/(R21 + d2)) + dummy))
+    aux13 = log((((R22 - d2)/(R22 + d2)) + dummy))
+    aux14 = (1.0/(2*d1))
+    aux15 = (1.0/(2*d2))
+    aux16 = aux15*(aux13 - aux12)
+    res = (Y2*(1.0 + (n*n)) + g*n)*aux16
+    aux16 = aux14*(aux11 - aux10)
+    res -= (Y1*(1.0 + (n*n)) + g*n)*aux16
+    aux0 = (1.0/(1.0 + (n*n)))
+    res *= -aux0
+    return res
+
+def _integral_v4(X1, X2, Y1, Y2, Z1, Z2):
+    """
+    Calculates the forth element of the V matrix (gyy components)
+    """
+    dummy = 10.**(-10) # Used to avoid singularities
+    aux0 = X2 - X1 + dummy
+    aux1 = Y2 - Y1 + dummy
+    n = (aux0/aux1)
+    g = X1 - (Y1*n)
+    m = (aux1/aux0)
+    c = Y1 - (X1*m)
+    aux2 = sqrt((aux0*aux0) + (aux1*aux1))
+    aux3 = (X1*Y2) - (X2*Y1)
+    p = ((aux3/aux2)) + dummy
+    aux4 = (aux0*X1) + (aux1*Y1)
+    aux5 = (aux0*X2) + (aux1*Y2)
+    d1 = ((aux4/aux2)) + dummy
+    d2 = ((aux5/aux2)) + dummy
+    aux6 = (X1*X1) + (Y1*Y1)
+    aux7 = (X2*X2) + (Y2*Y2)
+    aux8 = Z1*Z1
+    aux9 = Z2*Z2
+    R11 = sqrt(aux6 + aux8)
+    R12 = sqrt(aux6 + aux9)
+    R21 = sqrt(aux7 + aux8)
+    R22 = sqrt(aux7 + aux9)
+    aux10 = arctan2((Z2*d2), (p*R22))
+    aux11 = arctan2((Z1*d2), (p*R21))
+    aux12 = aux10 - aux11
+    aux13 = (aux12/(p*d2))
+    aux14 = ((p*aux12)/d2)
+    res = (c*X2*aux13) + (m*aux14)
+    aux10 = arctan2((Z2*d1), (p*R12))
+    aux11 = arctan2((Z1*d1), (p*R11))
+    aux12 = aux10 - aux11
+    aux13 = (aux12/(p*d1))
+    aux14 = ((p*aux12)/d1)
+    res -= (c*X1*aux13) + (m*aux14)
+    aux10 = log(((Z2 + R22) + dummy))
+    aux11 = log(((Z1 + R21) + dummy))
+    aux12 = log(((Z2 + R12) + dummy))
+    aux13 = log(((Z1 + R11) + dummy))
+    aux14 = aux10 - aux11
+    aux15 = aux12 - aux13
+    res += (m*(aux15 - aux14))
+    aux1 = (1.0/(1.0 + (m*m)))
+    res *= aux1
+    return res
+
+def _integral_v5(X1, X2, Y1, Y2, Z1, Z2):
+    """
+    Calculates the fith element of the V matrix (gyz components)
+    """
+    dummy = 10.**(-10) # Used to avoid singularities
+    aux0 = X2 - X1 + dummy
+    aux1 = Y2 - Y1 + dummy
+    n = (aux0/aux1)
+    g = X1 - (Y1*n)
+    m = (aux1/aux0)
+    c = Y1 - (X1*m)
+    aux2 = sqrt((aux0*aux0) + (aux1*aux1))
+    aux3 = (X1*Y2) - (X2*Y1)
+    p = ((aux3/aux2)) + dummy
+    aux4 = (aux0*X1) + (aux1*Y1)
+    aux5 = (aux0*X2) + (aux1*Y2)
+    d1 = ((aux4/aux2)) + dummy
+    d2 = ((aux5/aux2)) + dummy
+    aux6 = (X1*X1) + (Y1*Y1)
+    aux7 = (X2*X2) + (Y2*Y2)
+    aux8 = Z1*Z1
+    aux9 = Z2*Z2
+    R11 = sqrt(aux6 + aux8)
+    R12 = sqrt(aux6 + aux9)
+    R21 = sqrt(aux7 + aux8)
+    R22 = sqrt(aux7 + aux9)
+    aux10 = log((((R11 - d1)/(R11 + d1)) + dummy))
+    aux11 = log((((R12 - d1)/(R12 + d1)) + dummy))
+    aux12 = log((((R21 - d2)/(R21 + d2)) + dummy))
+    aux13 = log((((R22 - d2)/(R22 + d2)) + dummy))
+    aux14 = (1.0/(2*d1))
+    aux15 = (1.0/(2*d2))
+    aux16 = aux15*(aux13 - aux12)
+    res = (X2*(1.0 + (m*m)) + c*m)*aux16
+    aux16 = aux14*(aux11 - aux10)
+    res -= (X1*(1.0 + (m*m)) + c*m)*aux16
+    aux1 = (1.0/(1.0 + (m*m)))
+    res *= aux1
+    return res
+
+def _integral_v6(X1, X2, Y1, Y2, Z1, Z2):
+    """
+    Calculates the sixth element of the V matrix (gzz components)
+    """
+    dummy = 10.**(-10) # Used to avoid singularities
+    aux0 = X2 - X1 + dummy
+    aux1 = Y2 - Y1 + dummy
+    n = (aux0/aux1)
+    g = X1 - (Y1*n)
+    m = (aux1/aux0)
+    c = Y1 - (X1*m)
+    aux2 = sqrt((aux0*aux0) + (aux1*aux1))
+    aux3 = (X1*Y2) - (X2*Y1)
+    p = ((aux3/aux2)) + dummy
+    aux4 = (aux0*X1) + (aux1*Y1)
+    aux5 = (aux0*X2) + (aux1*Y2)
+    d1 = ((aux4/aux2)) + dummy
+    d2 = ((aux5/aux2)) + dummy
+    aux6 = (X1*X1) + (Y1*Y1)
+    aux7 = (X2*X2) + (Y2*Y2)
+    aux8 = Z1*Z1
+    aux9 = Z2*Z2
+    R11 = sqrt(aux6 + aux8)
+    R12 = sqrt(aux6 + aux9)
+    R21 = sqrt(aux7 + aux8)
+    R22 = sqrt(aux7 + aux9)
+    aux10 = arctan2((Z2*d2), (p*R22))
+    aux11 = arctan2((Z1*d2), (p*R21))
+    aux12 = aux10 - aux11
+    res = aux12
+    aux10 = arctan2((Z2*d1), (p*R12))
+    aux11 = arctan2((Z1*d1), (p*R11))
+    aux12 = aux10 - aux11
+    res -= aux12
+    return res
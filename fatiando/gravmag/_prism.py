@@ -14,10 +14,118 @@ from fatiando.constants import SI2EOTVOS, SI2MGAL, G, CM, T2NT
 from fatiando import utils
 
 __all__ = ['potential', 'gx', 'gy', 'gz', 'gxx', 'gxy', 'gxz', 'gyy', 'gyz',
-    'gzz', 'tf']
+    'gzz', 'tf', 'magnetic', 'fields', 'kernel_matrix']
+
+# The components that fields can calculate and the factor that converts each
+# one to the output units
+_FIELDS = ['potential', 'gx', 'gy', 'gz', 'gxx', 'gxy', 'gxz', 'gyy', 'gyz',
+           'gzz']
+_SCALE = {'potential':G,
+          'gx':G*SI2MGAL, 'gy':G*SI2MGAL, 'gz':G*SI2MGAL,
+          'gxx':G*SI2EOTVOS, 'gxy':G*SI2EOTVOS, 'gxz':G*SI2EOTVOS,
+          'gyy':G*SI2EOTVOS, 'gyz':G*SI2EOTVOS, 'gzz':G*SI2EOTVOS}
+# The terms of the kernels that are shared between the components.
+# The logs are log(x + r), log(y + r), log(z + r) and the arctangents are
+# arctan2(z*y, x*r), arctan2(z*x, y*r), arctan2(x*y, z*r)
+_TERMS = {'potential':([0, 1, 2], [0, 1, 2]),
+          'gx':([1, 2], [0]), 'gy':([0, 2], [1]), 'gz':([0, 1], [2]),
+          'gxx':([], [0]), 'gxy':([2], []), 'gxz':([1], []),
+          'gyy':([], [1]), 'gyz':([0], []), 'gzz':([], [2])}
+# The components that magnetic can calculate
+_MAGNETIC = ['tf', 'bx', 'by', 'bz']
+
+def _far_field(component, prism, xp, yp, zp, density, ratio, res):
+    """
+    Add the effect of *prism* as a multipole expansion (monopole + quadrupole)
+    to the points of *res* that are farther than *ratio* times the size of the
+    prism.
+
+    Returns the index of the points where the exact formula must be used.
+    """
+    if ratio is None:
+        return slice(None)
+    if ratio <= 0:
+        raise ValueError("Invalid ratio '%s'. Must be > 0" % (ratio))
+    xc, yc, zc = prism.center()
+    dx, dy, dz = xc - xp, yc - yp, zc - zp
+    size_sqr = ((prism.x2 - prism.x1)**2 + (prism.y2 - prism.y1)**2
+                + (prism.z2 - prism.z1)**2)
+    r_sqr = dx**2 + dy**2 + dz**2
+    far = r_sqr > (ratio**2)*size_sqr
+    if not numpy.any(far):
+        return slice(None)
+    mass = density*((prism.x2 - prism.x1)*(prism.y2 - prism.y1)
+                    *(prism.z2 - prism.z1))
+    # The second moments of the prism about its center. The dipole term
+    # vanishes about the center.
+    moment = numpy.diag([mass*(prism.x2 - prism.x1)**2/12.,
+                         mass*(prism.y2 - prism.y1)**2/12.,
+                         mass*(prism.z2 - prism.z1)**2/12.])
+    res[far] += _multipole(component, mass, moment, dx[far], dy[far], dz[far],
+                           r_sqr[far])
+    return ~far
+
+def _multipole(component, mass, moment, dx, dy, dz, r_sqr):
+    """
+    Calculate *component* of the monopole and quadrupole terms of the multipole
+    expansion of a mass distribution at (dx, dy, dz) from the points.
+
+    *moment* is the 3 x 3 matrix of second moments of the mass about the
+    center of the expansion (the sums of mass*x*x, mass*x*y, etc). The
+    quadrupole term of the potential is q/(2*r**5). The result is not
+    multiplied by G or converted to mGal or Eotvos.
+    """
+    r = sqrt(r_sqr)
+    r3 = r_sqr*r
+    r5 = r3*r_sqr
+    r7 = r5*r_sqr
+    delta = [dx, dy, dz]
+    trace = moment[0][0] + moment[1][1] + moment[2][2]
+    # The second moments times the vector from the points to the center
+    md = [moment[i][0]*dx + moment[i][1]*dy + moment[i][2]*dz
+          for i in xrange(3)]
+    q = 3*(dx*md[0] + dy*md[1] + dz*md[2]) - r_sqr*trace
+    if component == 'potential':
+        return mass/r + 0.5*q/r5
+    if component in ['gx', 'gy', 'gz']:
+        i = 'xyz'.index(component[1])
+        d = delta[i]
+        return mass*d/r3 + 2.5*q*d/r7 - (3*md[i] - trace*d)/r5
+    i, j = 'xyz'.index(component[1]), 'xyz'.index(component[2])
+    a, b = delta[i], delta[j]
+    res = (3*mass*a*b/r5 + 3*moment[i][j]/r5 + 17.5*q*a*b/(r7*r_sqr)
+           - (15*(b*md[i] + a*md[j]) - 10*trace*a*b)/r7)
+    if i == j:
+        res += -mass/r3 - trace/r5 - 2.5*q/r7
+    return res
+
+def _check_components(components):
+    """
+    Check if the components passed to fields are valid.
+    """
+    if components is None:
+        return list(_FIELDS)
+    if isinstance(components, str):
+        components = [components]
+    for c in components:
+        if c not in _SCALE:
+            raise ValueError("Invalid field component '%s'. Use one of %s"
+                             % (c, ', '.join(_FIELDS)))
+    return list(components)
+
+def _check_dtype(dtype):
+    """
+    Check if the type of the output is float32 or float64.
+    """
+    dtype = numpy.dtype(dtype)
+    if dtype != numpy.float32 and dtype != numpy.float64:
+        raise ValueError("Invalid dtype '%s'. Must be float32 or float64"
+                         % (str(dtype)))
+    return dtype
 
 
-def potential(xp, yp, zp, prisms, dens=None):
+def potential(xp, yp, zp, prisms, dens=None, njobs=1,
+              ratio=None, dtype=numpy.float):
     """
     Calculates the gravitational potential.
 
@@ -35,7 +143,8 @@ def potential(xp, yp, zp, prisms, dens=None):
         Prisms must have the property ``'density'``. Prisms that don't have this
         property will be ignored in the computations. Elements of *prisms* that
         are None will also be ignored. *prisms* can also be a
-        :class:`~fatiando.mesher.PrismMesh`.
+        :class:`~fatiando.mesher.PrismMesh` or a
+        :class:`~fatiando.mesher.PrismArray`.
     * dens : float or None
         If not None, will use this value instead of the ``'density'`` property
         of the prisms. Use this, e.g., for sensitivity matrix building.
@@ -43,6 +152,21 @@ def potential(xp, yp, zp, prisms, dens=None):
         .. warning:: Uses this value for **all** prisms! Not only the ones that
             have ``'density'`` as a property.
 
+    * njobs : int
+        Number of threads used by the Cython implementation. Ignored here.
+    * ratio : float or None
+        If not None, prisms that are farther than *ratio* times their size
+        (the length of their diagonal) from a computation point are
+        approximated by their multipole expansion (a point mass at their
+        center plus the quadrupole term). This is faster and the error
+        decreases with the fourth power of the distance. If None, will always
+        use the exact formula.
+    * dtype : numpy dtype
+        The type of the output array. Can be ``numpy.float64`` or
+        ``numpy.float32``. The calculations are always done in double
+        precision, so single precision only rounds the result (relative error
+        smaller than 1e-7).
+
     Returns:
 
     * res : array
@@ -51,6 +175,7 @@ def potential(xp, yp, zp, prisms, dens=None):
     """
     if xp.shape != yp.shape != zp.shape:
         raise ValueError("Input arrays xp, yp, and zp must have same shape!")
+    dtype = _check_dtype(dtype)
     res = numpy.zeros_like(xp)
     for prism in prisms:
         if prism is None or ('density' not in prism.props and dens is None):
@@ -59,11 +184,13 @@ def potential(xp, yp, zp, prisms, dens=None):
             density = prism.props['density']
         else:
             density = dens
+        # Use a multipole expansion for the points far away from the prism
+        near = _far_field('potential', prism, xp, yp, zp, density, ratio, res)
         # First thing to do is make the computation point P the origin of the
         # coordinate system
-        x = [prism.x2 - xp, prism.x1 - xp]
-        y = [prism.y2 - yp, prism.y1 - yp]
-        z = [prism.z2 - zp, prism.z1 - zp]
+        x = [prism.x2 - xp[near], prism.x1 - xp[near]]
+        y = [prism.y2 - yp[near], prism.y1 - yp[near]]
+        z = [prism.z2 - zp[near], prism.z1 - zp[near]]
         # Evaluate the integration limits
         for k in range(2):
             for j in range(2):
@@ -75,12 +202,13 @@ def potential(xp, yp, zp, prisms, dens=None):
                               - 0.5*x[i]**2*arctan2(z[k]*y[j], x[i]*r)
                               - 0.5*y[j]**2*arctan2(z[k]*x[i], y[j]*r)
                               - 0.5*z[k]**2*arctan2(x[i]*y[j], z[k]*r))
-                    res += ((-1.)**(i + j + k))*kernel*density
+                    res[near] += ((-1.)**(i + j + k))*kernel*density
     # Now all that is left is to multiply res by the gravitational constant
     res *= G
-    return res
+    return res.astype(dtype, copy=False)
 
-def gx(xp, yp, zp, prisms, dens=None):
+def gx(xp, yp, zp, prisms, dens=None, njobs=1,
+       ratio=None, dtype=numpy.float):
     """
     Calculates the :math:`g_x` gravity acceleration component.
 
@@ -98,7 +226,8 @@ def gx(xp, yp, zp, prisms, dens=None):
         Prisms must have the property ``'density'``. Prisms that don't have this
         property will be ignored in the computations. Elements of *prisms* that
         are None will also be ignored. *prisms* can also be a
-        :class:`~fatiando.mesher.PrismMesh`.
+        :class:`~fatiando.mesher.PrismMesh` or a
+        :class:`~fatiando.mesher.PrismArray`.
     * dens : float or None
         If not None, will use this value instead of the ``'density'`` property
         of the prisms. Use this, e.g., for sensitivity matrix building.
@@ -106,6 +235,21 @@ def gx(xp, yp, zp, prisms, dens=None):
         .. warning:: Uses this value for **all** prisms! Not only the ones that
             have ``'density'`` as a property.
 
+    * njobs : int
+        Number of threads used by the Cython implementation. Ignored here.
+    * ratio : float or None
+        If not None, prisms that are farther than *ratio* times their size
+        (the length of their diagonal) from a computation point are
+        approximated by their multipole expansion (a point mass at their
+        center plus the quadrupole term). This is faster and the error
+        decreases with the fourth power of the distance. If None, will always
+        use the exact formula.
+    * dtype : numpy dtype
+        The type of the output array. Can be ``numpy.float64`` or
+        ``numpy.float32``. The calculations are always done in double
+        precision, so single precision only rounds the result (relative error
+        smaller than 1e-7).
+
     Returns:
 
     * res : array
@@ -114,6 +258,7 @@ def gx(xp, yp, zp, prisms, dens=None):
     """
     if xp.shape != yp.shape != zp.shape:
         raise ValueError("Input arrays xp, yp, and zp must have same shape!")
+    dtype = _check_dtype(dtype)
     res = numpy.zeros_like(xp)
     for prism in prisms:
         if prism is None or ('density' not in prism.props and dens is None):
@@ -122,11 +267,13 @@ def gx(xp, yp, zp, prisms, dens=None):
             density = prism.props['density']
         else:
             density = dens
+        # Use a multipole expansion for the points far away from the prism
+        near = _far_field('gx', prism, xp, yp, zp, density, ratio, res)
         # First thing to do is make the computation point P the origin of the
         # coordinate system
-        x = [prism.x2 - xp, prism.x1 - xp]
-        y = [prism.y2 - yp, prism.y1 - yp]
-        z = [prism.z2 - zp, prism.z1 - zp]
+        x = [prism.x2 - xp[near], prism.x1 - xp[near]]
+        y = [prism.y2 - yp[near], prism.y1 - yp[near]]
+        z = [prism.z2 - zp[near], prism.z1 - zp[near]]
         # Evaluate the integration limits
         for k in range(2):
             for j in range(2):
@@ -137,13 +284,14 @@ def gx(xp, yp, zp, prisms, dens=None):
                     kernel = -(y[j]*log(z[k] + r)
                                + z[k]*log(y[j] + r)
                                - x[i]*arctan2(z[k]*y[j], x[i]*r))
-                    res += ((-1.)**(i + j + k))*kernel*density
+                    res[near] += ((-1.)**(i + j + k))*kernel*density
     # Now all that is left is to multiply res by the gravitational constant and
     # convert it to mGal units
     res *= G*SI2MGAL
-    return res
+    return res.astype(dtype, copy=False)
 
-def gy(xp, yp, zp, prisms, dens=None):
+def gy(xp, yp, zp, prisms, dens=None, njobs=1,
+       ratio=None, dtype=numpy.float):
     """
     Calculates the :math:`g_y` gravity acceleration component.
 
@@ -161,7 +309,8 @@ def gy(xp, yp, zp, prisms, dens=None):
         Prisms must have the property ``'density'``. Prisms that don't have this
         property will be ignored in the computations. Elements of *prisms* that
         are None will also be ignored. *prisms* can also be a
-        :class:`~fatiando.mesher.PrismMesh`.
+        :class:`~fatiando.mesher.PrismMesh` or a
+        :class:`~fatiando.mesher.PrismArray`.
     * dens : float or None
         If not None, will use this value instead of the ``'density'`` property
         of the prisms. Use this, e.g., for sensitivity matrix building.
@@ -169,6 +318,21 @@ def gy(xp, yp, zp, prisms, dens=None):
         .. warning:: Uses this value for **all** prisms! Not only the ones that
             have ``'density'`` as a property.
 
+    * njobs : int
+        Number of threads used by the Cython implementation. Ignored here.
+    * ratio : float or None
+        If not None, prisms that are farther than *ratio* times their size
+        (the length of their diagonal) from a computation point are
+        approximated by their multipole expansion (a point mass at their
+        center plus the quadrupole term). This is faster and the error
+        decreases with the fourth power of the distance. If None, will always
+        use the exact formula.
+    * dtype : numpy dtype
+        The type of the output array. Can be ``numpy.float64`` or
+        ``numpy.float32``. The calculations are always done in double
+        precision, so single precision only rounds the result (relative error
+        smaller than 1e-7).
+
     Returns:
 
     * res : array
@@ -177,6 +341,7 @@ def gy(xp, yp, zp, prisms, dens=None):
     """
     if xp.shape != yp.shape != zp.shape:
         raise ValueError("Input arrays xp, yp, and zp must have same shape!")
+    dtype = _check_dtype(dtype)
     res = numpy.zeros_like(xp)
     for prism in prisms:
         if prism is None or ('density' not in prism.props and dens is None):
@@ -185,11 +350,13 @@ def gy(xp, yp, zp, prisms, dens=None):
             density = prism.props['density']
         else:
             density = dens
+        # Use a multipole expansion for the points far away from the prism
+        near = _far_field('gy', prism, xp, yp, zp, density, ratio, res)
         # First thing to do is make the computation point P the origin of the
         # coordinate system
-        x = [prism.x2 - xp, prism.x1 - xp]
-        y = [prism.y2 - yp, prism.y1 - yp]
-        z = [prism.z2 - zp, prism.z1 - zp]
+        x = [prism.x2 - xp[near], prism.x1 - xp[near]]
+        y = [prism.y2 - yp[near], prism.y1 - yp[near]]
+        z = [prism.z2 - zp[near], prism.z1 - zp[near]]
         # Evaluate the integration limits
         for k in range(2):
             for j in range(2):
@@ -200,13 +367,14 @@ def gy(xp, yp, zp, prisms, dens=None):
                     kernel = -(z[k]*log(x[i] + r)
                                + x[i]*log(z[k] + r)
                                - y[j]*arctan2(x[i]*z[k], y[j]*r))
-                    res += ((-1.)**(i + j + k))*kernel*density
+                    res[near] += ((-1.)**(i + j + k))*kernel*density
     # Now all that is left is to multiply res by the gravitational constant and
     # convert it to mGal units
     res *= G*SI2MGAL
-    return res
+    return res.astype(dtype, copy=False)
 
-def gz(xp, yp, zp, prisms, dens=None):
+def gz(xp, yp, zp, prisms, dens=None, njobs=1,
+       ratio=None, dtype=numpy.float):
     """
     Calculates the :math:`g_z` gravity acceleration component.
 
@@ -224,7 +392,8 @@ def gz(xp, yp, zp, prisms, dens=None):
         Prisms must have the property ``'density'``. Prisms that don't have this
         property will be ignored in the computations. Elements of *prisms* that
         are None will also be ignored. *prisms* can also be a
-        :class:`~fatiando.mesher.PrismMesh`.
+        :class:`~fatiando.mesher.PrismMesh` or a
+        :class:`~fatiando.mesher.PrismArray`.
     * dens : float or None
         If not None, will use this value instead of the ``'density'`` property
         of the prisms. Use this, e.g., for sensitivity matrix building.
@@ -232,6 +401,21 @@ def gz(xp, yp, zp, prisms, dens=None):
         .. warning:: Uses this value for **all** prisms! Not only the ones that
             have ``'density'`` as a property.
 
+    * njobs : int
+        Number of threads used by the Cython implementation. Ignored here.
+    * ratio : float or None
+        If not None, prisms that are farther than *ratio* times their size
+        (the length of their diagonal) from a computation point are
+        approximated by their multipole expansion (a point mass at their
+        center plus the quadrupole term). This is faster and the error
+        decreases with the fourth power of the distance. If None, will always
+        use the exact formula.
+    * dtype : numpy dtype
+        The type of the output array. Can be ``numpy.float64`` or
+        ``numpy.float32``. The calculations are always done in double
+        precision, so single precision only rounds the result (relative error
+        smaller than 1e-7).
+
     Returns:
 
     * res : array
@@ -240,6 +424,7 @@ def gz(xp, yp, zp, prisms, dens=None):
     """
     if xp.shape != yp.shape != zp.shape:
         raise ValueError("Input arrays xp, yp, and zp must have same shape!")
+    dtype = _check_dtype(dtype)
     res = numpy.zeros_like(xp)
     for prism in prisms:
         if prism is None or ('density' not in prism.props and dens is None):
@@ -248,11 +433,13 @@ def gz(xp, yp, zp, prisms, dens=None):
             density = prism.props['density']
         else:
             density = dens
+        # Use a multipole expansion for the points far away from the prism
+        near = _far_field('gz', prism, xp, yp, zp, density, ratio, res)
         # First thing to do is make the computation point P the origin of the
         # coordinate system
-        x = [prism.x2 - xp, prism.x1 - xp]
-        y = [prism.y2 - yp, prism.y1 - yp]
-        z = [prism.z2 - zp, prism.z1 - zp]
+        x = [prism.x2 - xp[near], prism.x1 - xp[near]]
+        y = [prism.y2 - yp[near], prism.y1 - yp[near]]
+        z = [prism.z2 - zp[near], prism.z1 - zp[near]]
         # Evaluate the integration limits
         for k in range(2):
             for j in range(2):
@@ -263,13 +450,14 @@ def gz(xp, yp, zp, prisms, dens=None):
                     kernel = -(x[i]*log(y[j] + r)
                                + y[j]*log(x[i] + r)
                                - z[k]*arctan2(x[i]*y[j], z[k]*r))
-                    res += ((-1.)**(i + j + k))*kernel*density
+                    res[near] += ((-1.)**(i + j + k))*kernel*density
     # Now all that is left is to multiply res by the gravitational constant and
     # convert it to mGal units
     res *= G*SI2MGAL
-    return res
+    return res.astype(dtype, copy=False)
 
-def gxx(xp, yp, zp, prisms, dens=None):
+def gxx(xp, yp, zp, prisms, dens=None, njobs=1,
+        ratio=None, dtype=numpy.float):
     """
     Calculates the :math:`g_{xx}` gravity gradient tensor component.
 
@@ -287,7 +475,8 @@ def gxx(xp, yp, zp, prisms, dens=None):
         Prisms must have the property ``'density'``. Prisms that don't have this
         property will be ignored in the computations. Elements of *prisms* that
         are None will also be ignored. *prisms* can also be a
-        :class:`~fatiando.mesher.PrismMesh`.
+        :class:`~fatiando.mesher.PrismMesh` or a
+        :class:`~fatiando.mesher.PrismArray`.
     * dens : float or None
         If not None, will use this value instead of the ``'density'`` property
         of the prisms. Use this, e.g., for sensitivity matrix building.
@@ -295,6 +484,21 @@ def gxx(xp, yp, zp, prisms, dens=None):
         .. warning:: Uses this value for **all** prisms! Not only the ones that
             have ``'density'`` as a property.
 
+    * njobs : int
+        Number of threads used by the Cython implementation. Ignored here.
+    * ratio : float or None
+        If not None, prisms that are farther than *ratio* times their size
+        (the length of their diagonal) from a computation point are
+        approximated by their multipole expansion (a point mass at their
+        center plus the quadrupole term). This is faster and the error
+        decreases with the fourth power of the distance. If None, will always
+        use the exact formula.
+    * dtype : numpy dtype
+        The type of the output array. Can be ``numpy.float64`` or
+        ``numpy.float32``. The calculations are always done in double
+        precision, so single precision only rounds the result (relative error
+        smaller than 1e-7).
+
     Returns:
 
     * res : array
@@ -303,6 +507,7 @@ def gxx(xp, yp, zp, prisms, dens=None):
     """
     if xp.shape != yp.shape != zp.shape:
         raise ValueError("Input arrays xp, yp, and zp must have same shape!")
+    dtype = _check_dtype(dtype)
     res = numpy.zeros_like(xp)
     for prism in prisms:
         if prism is None or ('density' not in prism.props and dens is None):
@@ -311,24 +516,27 @@ def gxx(xp, yp, zp, prisms, dens=None):
             density = prism.props['density']
         else:
             density = dens
+        # Use a multipole expansion for the points far away from the prism
+        near = _far_field('gxx', prism, xp, yp, zp, density, ratio, res)
         # First thing to do is make the computation point P the origin of the
         # coordinate system
-        x = [prism.x2 - xp, prism.x1 - xp]
-        y = [prism.y2 - yp, prism.y1 - yp]
-        z = [prism.z2 - zp, prism.z1 - zp]
+        x = [prism.x2 - xp[near], prism.x1 - xp[near]]
+        y = [prism.y2 - yp[near], prism.y1 - yp[near]]
+        z = [prism.z2 - zp[near], prism.z1 - zp[near]]
         # Evaluate the integration limits
         for k in range(2):
             for j in range(2):
                 for i in range(2):
                     r = sqrt(x[i]**2 + y[j]**2 + z[k]**2)
                     kernel = -arctan2(z[k]*y[j], x[i]*r)
-                    res += ((-1.)**(i + j + k))*kernel*density
+                    res[near] += ((-1.)**(i + j + k))*kernel*density
     # Now all that is left is to multiply res by the gravitational constant and
     # convert it to Eotvos units
     res *= G*SI2EOTVOS
-    return res
+    return res.astype(dtype, copy=False)
 
-def gxy(xp, yp, zp, prisms, dens=None):
+def gxy(xp, yp, zp, prisms, dens=None, njobs=1,
+        ratio=None, dtype=numpy.float):
     """
     Calculates the :math:`g_{xy}` gravity gradient tensor component.
 
@@ -346,7 +554,8 @@ def gxy(xp, yp, zp, prisms, dens=None):
         Prisms must have the property ``'density'``. Prisms that don't have this
         property will be ignored in the computations. Elements of *prisms* that
         are None will also be ignored. *prisms* can also be a
-        :class:`~fatiando.mesher.PrismMesh`.
+        :class:`~fatiando.mesher.PrismMesh` or a
+        :class:`~fatiando.mesher.PrismArray`.
     * dens : float or None
         If not None, will use this value instead of the ``'density'`` property
         of the prisms. Use this, e.g., for sensitivity matrix building.
@@ -354,6 +563,21 @@ def gxy(xp, yp, zp, prisms, dens=None):
         .. warning:: Uses this value for **all** prisms! Not only the ones that
             have ``'density'`` as a property.
 
+    * njobs : int
+        Number of threads used by the Cython implementation. Ignored here.
+    * ratio : float or None
+        If not None, prisms that are farther than *ratio* times their size
+        (the length of their diagonal) from a computation point are
+        approximated by their multipole expansion (a point mass at their
+        center plus the quadrupole term). This is faster and the error
+        decreases with the fourth power of the distance. If None, will always
+        use the exact formula.
+    * dtype : numpy dtype
+        The type of the output array. Can be ``numpy.float64`` or
+        ``numpy.float32``. The calculations are always done in double
+        precision, so single precision only rounds the result (relative error
+        smaller than 1e-7).
+
     Returns:
 
     * res : array
@@ -362,6 +586,7 @@ def gxy(xp, yp, zp, prisms, dens=None):
     """
     if xp.shape != yp.shape != zp.shape:
         raise ValueError("Input arrays xp, yp, and zp must have same shape!")
+    dtype = _check_dtype(dtype)
     res = numpy.zeros_like(xp)
     for prism in prisms:
         if prism is None or ('density' not in prism.props and dens is None):
@@ -370,24 +595,27 @@ def gxy(xp, yp, zp, prisms, dens=None):
             density = prism.props['density']
         else:
             density = dens
+        # Use a multipole expansion for the points far away from the prism
+        near = _far_field('gxy', prism, xp, yp, zp, density, ratio, res)
         # First thing to do is make the computation point P the origin of the
         # coordinate system
-        x = [prism.x2 - xp, prism.x1 - xp]
-        y = [prism.y2 - yp, prism.y1 - yp]
-        z = [prism.z2 - zp, prism.z1 - zp]
+        x = [prism.x2 - xp[near], prism.x1 - xp[near]]
+        y = [prism.y2 - yp[near], prism.y1 - yp[near]]
+        z = [prism.z2 - zp[near], prism.z1 - zp[near]]
         # Evaluate the integration limits
         for k in range(2):
             for j in range(2):
                 for i in range(2):
                     r = sqrt(x[i]**2 + y[j]**2 + z[k]**2)
                     kernel = log(z[k] + r)
-                    res += ((-1.)**(i + j + k))*kernel*density
+                    res[near] += ((-1.)**(i + j + k))*kernel*density
     # Now all that is left is to multiply res by the gravitational constant and
     # convert it to Eotvos units
     res *= G*SI2EOTVOS
-    return res
+    return res.astype(dtype, copy=False)
 
-def gxz(xp, yp, zp, prisms, dens=None):
+def gxz(xp, yp, zp, prisms, dens=None, njobs=1,
+        ratio=None, dtype=numpy.float):
     """
     Calculates the :math:`g_{xz}` gravity gradient tensor component.
 
@@ -405,7 +633,8 @@ def gxz(xp, yp, zp, prisms, dens=None):
         Prisms must have the property ``'density'``. Prisms that don't have this
         property will be ignored in the computations. Elements of *prisms* that
         are None will also be ignored. *prisms* can also be a
-        :class:`~fatiando.mesher.PrismMesh`.
+        :class:`~fatiando.mesher.PrismMesh` or a
+        :class:`~fatiando.mesher.PrismArray`.
     * dens : float or None
         If not None, will use this value instead of the ``'density'`` property
         of the prisms. Use this, e.g., for sensitivity matrix building.
@@ -413,6 +642,21 @@ def gxz(xp, yp, zp, prisms, dens=None):
         .. warning:: Uses this value for **all** prisms! Not only the ones that
             have ``'density'`` as a property.
 
+    * njobs : int
+        Number of threads used by the Cython implementation. Ignored here.
+    * ratio : float or None
+        If not None, prisms that are farther than *ratio* times their size
+        (the length of their diagonal) from a computation point are
+        approximated by their multipole expansion (a point mass at their
+        center plus the quadrupole term). This is faster and the error
+        decreases with the fourth power of the distance. If None, will always
+        use the exact formula.
+    * dtype : numpy dtype
+        The type of the output array. Can be ``numpy.float64`` or
+        ``numpy.float32``. The calculations are always done in double
+        precision, so single precision only rounds the result (relative error
+        smaller than 1e-7).
+
     Returns:
 
     * res : array
@@ -421,6 +665,7 @@ def gxz(xp, yp, zp, prisms, dens=None):
     """
     if xp.shape != yp.shape != zp.shape:
         raise ValueError("Input arrays xp, yp, and zp must have same shape!")
+    dtype = _check_dtype(dtype)
     res = numpy.zeros_like(xp)
     for prism in prisms:
         if prism is None or ('density' not in prism.props and dens is None):
@@ -429,24 +674,27 @@ def gxz(xp, yp, zp, prisms, dens=None):
             density = prism.props['density']
         else:
             density = dens
+        # Use a multipole expansion for the points far away from the prism
+        near = _far_field('gxz', prism, xp, yp, zp, density, ratio, res)
         # First thing to do is make the computation point P the origin of the
         # coordinate system
-        x = [prism.x2 - xp, prism.x1 - xp]
-        y = [prism.y2 - yp, prism.y1 - yp]
-        z = [prism.z2 - zp, prism.z1 - zp]
+        x = [prism.x2 - xp[near], prism.x1 - xp[near]]
+        y = [prism.y2 - yp[near], prism.y1 - yp[near]]
+        z = [prism.z2 - zp[near], prism.z1 - zp[near]]
         # Evaluate the integration limits
         for k in range(2):
             for j in range(2):
                 for i in range(2):
                     r = sqrt(x[i]**2 + y[j]**2 + z[k]**2)
                     kernel = log(y[j] + r)
-                    res += ((-1.)**(i + j + k))*kernel*density
+                    res[near] += ((-1.)**(i + j + k))*kernel*density
     # Now all that is left is to multiply res by the gravitational constant and
     # convert it to Eotvos units
     res *= G*SI2EOTVOS
-    return res
+    return res.astype(dtype, copy=False)
 
-def gyy(xp, yp, zp, prisms, dens=None):
+def gyy(xp, yp, zp, prisms, dens=None, njobs=1,
+        ratio=None, dtype=numpy.float):
     """
     Calculates the :math:`g_{yy}` gravity gradient tensor component.
 
@@ -464,7 +712,8 @@ def gyy(xp, yp, zp, prisms, dens=None):
         Prisms must have the property ``'density'``. Prisms that don't have this
         property will be ignored in the computations. Elements of *prisms* that
         are None will also be ignored. *prisms* can also be a
-        :class:`~fatiando.mesher.PrismMesh`.
+        :class:`~fatiando.mesher.PrismMesh` or a
+        :class:`~fatiando.mesher.PrismArray`.
     * dens : float or None
         If not None, will use this value instead of the ``'density'`` property
         of the prisms. Use this, e.g., for sensitivity matrix building.
@@ -472,6 +721,21 @@ def gyy(xp, yp, zp, prisms, dens=None):
         .. warning:: Uses this value for **all** prisms! Not only the ones that
             have ``'density'`` as a property.
 
+    * njobs : int
+        Number of threads used by the Cython implementation. Ignored here.
+    * ratio : float or None
+        If not None, prisms that are farther than *ratio* times their size
+        (the length of their diagonal) from a computation point are
+        approximated by their multipole expansion (a point mass at their
+        center plus the quadrupole term). This is faster and the error
+        decreases with the fourth power of the distance. If None, will always
+        use the exact formula.
+    * dtype : numpy dtype
+        The type of the output array. Can be ``numpy.float64`` or
+        ``numpy.float32``. The calculations are always done in double
+        precision, so single precision only rounds the result (relative error
+        smaller than 1e-7).
+
     Returns:
 
     * res : array
@@ -480,6 +744,7 @@ def gyy(xp, yp, zp, prisms, dens=None):
     """
     if xp.shape != yp.shape != zp.shape:
         raise ValueError("Input arrays xp, yp, and zp must have same shape!")
+    dtype = _check_dtype(dtype)
     res = numpy.zeros_like(xp)
     for prism in prisms:
         if prism is None or ('density' not in prism.props and dens is None):
@@ -488,24 +753,27 @@ def gyy(xp, yp, zp, prisms, dens=None):
             density = prism.props['density']
         else:
             density = dens
+        # Use a multipole expansion for the points far away from the prism
+        near = _far_field('gyy', prism, xp, yp, zp, density, ratio, res)
         # First thing to do is make the computation point P the origin of the
         # coordinate system
-        x = [prism.x2 - xp, prism.x1 - xp]
-        y = [prism.y2 - yp, prism.y1 - yp]
-        z = [prism.z2 - zp, prism.z1 - zp]
+        x = [prism.x2 - xp[near], prism.x1 - xp[near]]
+        y = [prism.y2 - yp[near], prism.y1 - yp[near]]
+        z = [prism.z2 - zp[near], prism.z1 - zp[near]]
         # Evaluate the integration limits
         for k in range(2):
             for j in range(2):
                 for i in range(2):
                     r = sqrt(x[i]**2 + y[j]**2 + z[k]**2)
                     kernel = -arctan2(z[k]*x[i], y[j]*r)
-                    res += ((-1.)**(i + j + k))*kernel*density
+                    res[near] += ((-1.)**(i + j + k))*kernel*density
     # Now all that is left is to multiply res by the gravitational constant and
     # convert it to Eotvos units
     res *= G*SI2EOTVOS
-    return res
+    return res.astype(dtype, copy=False)
 
-def gyz(xp, yp, zp, prisms, dens=None):
+def gyz(xp, yp, zp, prisms, dens=None, njobs=1,
+        ratio=None, dtype=numpy.float):
     """
     Calculates the :math:`g_{yz}` gravity gradient tensor component.
 
@@ -523,7 +791,8 @@ def gyz(xp, yp, zp, prisms, dens=None):
         Prisms must have the property ``'density'``. Prisms that don't have this
         property will be ignored in the computations. Elements of *prisms* that
         are None will also be ignored. *prisms* can also be a
-        :class:`~fatiando.mesher.PrismMesh`.
+        :class:`~fatiando.mesher.PrismMesh` or a
+        :class:`~fatiando.mesher.PrismArray`.
     * dens : float or None
         If not None, will use this value instead of the ``'density'`` property
         of the prisms. Use this, e.g., for sensitivity matrix building.
@@ -531,6 +800,21 @@ def gyz(xp, yp, zp, prisms, dens=None):
         .. warning:: Uses this value for **all** prisms! Not only the ones that
             have ``'density'`` as a property.
 
+    * njobs : int
+        Number of threads used by the Cython implementation. Ignored here.
+    * ratio : float or None
+        If not None, prisms that are farther than *ratio* times their size
+        (the length of their diagonal) from a computation point are
+        approximated by their multipole expansion (a point mass at their
+        center plus the quadrupole term). This is faster and the error
+        decreases with the fourth power of the distance. If None, will always
+        use the exact formula.
+    * dtype : numpy dtype
+        The type of the output array. Can be ``numpy.float64`` or
+        ``numpy.float32``. The calculations are always done in double
+        precision, so single precision only rounds the result (relative error
+        smaller than 1e-7).
+
     Returns:
 
     * res : array
@@ -539,6 +823,7 @@ def gyz(xp, yp, zp, prisms, dens=None):
     """
     if xp.shape != yp.shape != zp.shape:
         raise ValueError("Input arrays xp, yp, and zp must have same shape!")
+    dtype = _check_dtype(dtype)
     res = numpy.zeros_like(xp)
     for prism in prisms:
         if prism is None or ('density' not in prism.props and dens is None):
@@ -547,24 +832,27 @@ def gyz(xp, yp, zp, prisms, dens=None):
             density = prism.props['density']
         else:
             density = dens
+        # Use a multipole expansion for the points far away from the prism
+        near = _far_field('gyz', prism, xp, yp, zp, density, ratio, res)
         # First thing to do is make the computation point P the origin of the
         # coordinate system
-        x = [prism.x2 - xp, prism.x1 - xp]
-        y = [prism.y2 - yp, prism.y1 - yp]
-        z = [prism.z2 - zp, prism.z1 - zp]
+        x = [prism.x2 - xp[near], prism.x1 - xp[near]]
+        y = [prism.y2 - yp[near], prism.y1 - yp[near]]
+        z = [prism.z2 - zp[near], prism.z1 - zp[near]]
         # Evaluate the integration limits
         for k in range(2):
             for j in range(2):
                 for i in range(2):
                     r = sqrt(x[i]**2 + y[j]**2 + z[k]**2)
                     kernel = log(x[i] + r)
-                    res += ((-1.)**(i + j + k))*kernel*density
+                    res[near] += ((-1.)**(i + j + k))*kernel*density
     # Now all that is left is to multiply res by the gravitational constant and
     # convert it to Eotvos units
     res *= G*SI2EOTVOS
-    return res
+    return res.astype(dtype, copy=False)
 
-def gzz(xp, yp, zp, prisms, dens=None):
+def gzz(xp, yp, zp, prisms, dens=None, njobs=1,
+        ratio=None, dtype=numpy.float):
     """
     Calculates the :math:`g_{zz}` gravity gradient tensor component.
 
@@ -582,7 +870,8 @@ def gzz(xp, yp, zp, prisms, dens=None):
         Prisms must have the property ``'density'``. Prisms that don't have this
         property will be ignored in the computations. Elements of *prisms* that
         are None will also be ignored. *prisms* can also be a
-        :class:`~fatiando.mesher.PrismMesh`.
+        :class:`~fatiando.mesher.PrismMesh` or a
+        :class:`~fatiando.mesher.PrismArray`.
     * dens : float or None
         If not None, will use this value instead of the ``'density'`` property
         of the prisms. Use this, e.g., for sensitivity matrix building.
@@ -590,6 +879,21 @@ def gzz(xp, yp, zp, prisms, dens=None):
         .. warning:: Uses this value for **all** prisms! Not only the ones that
             have ``'density'`` as a property.
 
+    * njobs : int
+        Number of threads used by the Cython implementation. Ignored here.
+    * ratio : float or None
+        If not None, prisms that are farther than *ratio* times their size
+        (the length of their diagonal) from a computation point are
+        approximated by their multipole expansion (a point mass at their
+        center plus the quadrupole term). This is faster and the error
+        decreases with the fourth power of the distance. If None, will always
+        use the exact formula.
+    * dtype : numpy dtype
+        The type of the output array. Can be ``numpy.float64`` or
+        ``numpy.float32``. The calculations are always done in double
+        precision, so single precision only rounds the result (relative error
+        smaller than 1e-7).
+
     Returns:
 
     * res : array
@@ -598,6 +902,7 @@ def gzz(xp, yp, zp, prisms, dens=None):
     """
     if xp.shape != yp.shape != zp.shape:
         raise ValueError("Input arrays xp, yp, and zp must have same shape!")
+    dtype = _check_dtype(dtype)
     res = numpy.zeros_like(xp)
     for prism in prisms:
         if prism is None or ('density' not in prism.props and dens is None):
@@ -606,24 +911,27 @@ def gzz(xp, yp, zp, prisms, dens=None):
             density = prism.props['density']
         else:
             density = dens
+        # Use a multipole expansion for the points far away from the prism
+        near = _far_field('gzz', prism, xp, yp, zp, density, ratio, res)
         # First thing to do is make the computation point P the origin of the
         # coordinate system
-        x = [prism.x2 - xp, prism.x1 - xp]
-        y = [prism.y2 - yp, prism.y1 - yp]
-        z = [prism.z2 - zp, prism.z1 - zp]
+        x = [prism.x2 - xp[near], prism.x1 - xp[near]]
+        y = [prism.y2 - yp[near], prism.y1 - yp[near]]
+        z = [prism.z2 - zp[near], prism.z1 - zp[near]]
         # Evaluate the integration limits
         for k in range(2):
             for j in range(2):
                 for i in range(2):
                     r = sqrt(x[i]**2 + y[j]**2 + z[k]**2)
                     kernel = -arctan2(x[i]*y[j], z[k]*r)
-                    res += ((-1.)**(i + j + k))*kernel*density
+                    res[near] += ((-1.)**(i + j + k))*kernel*density
     # Now all that is left is to multiply res by the gravitational constant and
     # convert it to Eotvos units
     res *= G*SI2EOTVOS
-    return res
+    return res.astype(dtype, copy=False)
 
-def tf(xp, yp, zp, prisms, inc, dec, pmag=None, pinc=None, pdec=None):
+def tf(xp, yp, zp, prisms, inc, dec, pmag=None, pinc=None, pdec=None,
+       njobs=1, dtype=numpy.float):
     """
     Calculate the total-field anomaly of prisms.
 
@@ -642,7 +950,8 @@ def tf(xp, yp, zp, prisms, inc, dec, pmag=None, pinc=None, pdec=None):
         ignored. If the physical properties ``'inclination'`` and
         ``'declination'`` are not present, will use the values of *inc* and
         *dec* instead (regional field).
-        *prisms* can also be a :class:`~fatiando.mesher.PrismMesh`.
+        *prisms* can also be a :class:`~fatiando.mesher.PrismMesh` or a
+        :class:`~fatiando.mesher.PrismArray`.
     * inc : float
         The inclination of the regional field (in degrees)
     * dec : float
@@ -656,6 +965,13 @@ def tf(xp, yp, zp, prisms, inc, dec, pmag=None, pinc=None, pdec=None):
     * pdec : float or None
         If not None, will use this value instead of the ``'declination'``
         property of the prisms. Use this, e.g., for sensitivity matrix building.
+    * njobs : int
+        Number of threads used by the Cython implementation. Ignored here.
+    * dtype : numpy dtype
+        The type of the output array. Can be ``numpy.float64`` or
+        ``numpy.float32``. The calculations are always done in double
+        precision, so single precision only rounds the result (relative error
+        smaller than 1e-7).
 
     Returns:
 
@@ -665,6 +981,7 @@ def tf(xp, yp, zp, prisms, inc, dec, pmag=None, pinc=None, pdec=None):
     """
     if xp.shape != yp.shape != zp.shape:
         raise ValueError("Input arrays xp, yp, and zp must have same shape!")
+    dtype = _check_dtype(dtype)
     res = numpy.zeros_like(xp)
     # Calculate the 3 components of the unit vector in the direction of the
     # regional field
@@ -714,5 +1031,352 @@ def tf(xp, yp, zp, prisms, inc, dec, pmag=None, pinc=None, pdec=None):
                         - my*fy*arctan2(xy, r_sqr + zr - x_sqr)
                         + mz*fz*arctan2(xy, zr))
     res *= CM*T2NT
-    return res
+    return res.astype(dtype, copy=False)
+
+
+def magnetic(xp, yp, zp, prisms, inc, dec, components=None, magvec=None,
+             njobs=1, dtype=numpy.float):
+    """
+    Calculate the total-field anomaly and the 3 components of the magnetic
+    induction of prisms in a single pass.
+
+    The terms of the formula of Bhattacharyya (1964) are evaluated once for
+    each prism and computation point and shared between all components. The
+    magnetization of each prism can be given as an array of magnetization
+    vectors (e.g., for magnetization vector inversion with remanence).
+
+    The total-field anomaly is the same as given by
+    :func:`~fatiando.gravmag._prism.tf`.
 
+    .. note:: Input units are SI. Output is in nT
+
+    .. note:: The coordinate system of the input parameters is to be x -> North,
+        y -> East and z -> Down.
+
+    Parameters:
+
+    * xp, yp, zp : arrays
+        Arrays with the x, y, and z coordinates of the computation points.
+    * prisms : list of :class:`~fatiando.mesher.Prism`
+        The model used to calculate the fields. If *magvec* is None, prisms
+        must have the physical property ``'magnetization'``. Those that don't
+        will be ignored. If the physical properties ``'inclination'`` and
+        ``'declination'`` are not present, will use the values of *inc* and
+        *dec* instead (regional field).
+        *prisms* can also be a :class:`~fatiando.mesher.PrismMesh` or a
+        :class:`~fatiando.mesher.PrismArray`.
+    * inc : float
+        The inclination of the regional field (in degrees)
+    * dec : float
+        The declination of the regional field (in degrees)
+    * components : list of str or None
+        The components to calculate. Can be any of ``'tf'``, ``'bx'``,
+        ``'by'``, ``'bz'``. If None, will calculate all of them (in this
+        order).
+    * magvec : 2D array or None
+        If not None, will use these magnetization vectors instead of the
+        physical properties of the prisms. Each row has the x, y, and z
+        components of the magnetization (in A/m) of a prism. Must have one row
+        for each element of *prisms* that is not None (e.g., for each cell of
+        :func:`~fatiando.mesher.prisms2array`), in the same order.
+    * njobs : int
+        Number of threads used by the Cython implementation. Ignored here.
+    * dtype : numpy dtype
+        The type of the output array. Can be ``numpy.float64`` or
+        ``numpy.float32``. The calculations are always done in double
+        precision, so single precision only rounds the result (relative error
+        smaller than 1e-7).
+
+    Returns:
+
+    * res : list of arrays
+        The fields calculated on xp, yp, zp. One array for each element of
+        *components*, in the same order.
+
+    """
+    if xp.shape != yp.shape != zp.shape:
+        raise ValueError("Input arrays xp, yp, and zp must have same shape!")
+    dtype = _check_dtype(dtype)
+    components = _check_magnetic(components)
+    # Calculate the 3 components of the unit vector in the direction of the
+    # regional field
+    fx, fy, fz = utils.dircos(inc, dec)
+    cells, magvec = _get_magvec(prisms, fx, fy, fz, magvec)
+    bx, by, bz = [numpy.zeros_like(xp) for i in xrange(3)]
+    for prism, (mx, my, mz) in zip(cells, magvec):
+        # First thing to do is make the computation point P the origin of the
+        # coordinate system
+        x = [prism.x2 - xp, prism.x1 - xp]
+        y = [prism.y2 - yp, prism.y1 - yp]
+        z = [prism.z2 - zp, prism.z1 - zp]
+        for k in range(2):
+            z_sqr = z[k]**2
+            for j in range(2):
+                y_sqr = y[j]**2
+                for i in range(2):
+                    x_sqr = x[i]**2
+                    xy = x[i]*y[j]
+                    r_sqr = x_sqr + y_sqr + z_sqr
+                    r = sqrt(r_sqr)
+                    zr = z[k]*r
+                    # The terms of the symmetric tensor that gives the
+                    # magnetic induction from the magnetization vector
+                    vxx = -arctan2(xy, x_sqr + zr + z_sqr)
+                    vyy = -arctan2(xy, r_sqr + zr - x_sqr)
+                    vzz = arctan2(xy, zr)
+                    vxy = -log(r + z[k])
+                    vxz = 0.5*log((r - y[j])/(r + y[j]))
+                    vyz = 0.5*log((r - x[i])/(r + x[i]))
+                    sign = (-1.)**(i + j + k + 1)
+                    bx += sign*(vxx*mx + vxy*my + vxz*mz)
+                    by += sign*(vxy*mx + vyy*my + vyz*mz)
+                    bz += sign*(vxz*mx + vyz*my + vzz*mz)
+    fields = {'bx':bx, 'by':by, 'bz':bz, 'tf':fx*bx + fy*by + fz*bz}
+    return [(CM*T2NT*fields[c]).astype(dtype, copy=False)
+            for c in components]
+
+def _check_magnetic(components):
+    """
+    Check if the components passed to magnetic are valid.
+    """
+    if components is None:
+        return list(_MAGNETIC)
+    if isinstance(components, str):
+        components = [components]
+    for c in components:
+        if c not in _MAGNETIC:
+            raise ValueError("Invalid magnetic component '%s'. Use one of %s"
+                             % (c, ', '.join(_MAGNETIC)))
+    return list(components)
+
+def _get_magvec(prisms, fx, fy, fz, magvec):
+    """
+    Get the prisms that are magnetized and their magnetization vectors (one
+    row per prism).
+    """
+    cells = [p for p in prisms if p is not None]
+    if magvec is not None:
+        magvec = numpy.asarray(magvec, dtype=numpy.float)
+        if magvec.shape != (len(cells), 3):
+            raise ValueError("magvec must have shape (%d, 3) but got %s"
+                             % (len(cells), str(magvec.shape)))
+        return cells, magvec
+    magnetized, vectors = [], []
+    for prism in cells:
+        if 'magnetization' not in prism.props:
+            continue
+        if 'inclination' in prism.props and 'declination' in prism.props:
+            direction = utils.dircos(prism.props['inclination'],
+                                     prism.props['declination'])
+        else:
+            direction = [fx, fy, fz]
+        magnetized.append(prism)
+        vectors.append([prism.props['magnetization']*d for d in direction])
+    return magnetized, numpy.reshape(vectors, (len(vectors), 3))
+
+
+def fields(xp, yp, zp, prisms, components=None, dens=None, njobs=1,
+           dtype=numpy.float):
+    """
+    Calculate several gravitational field components in a single pass.
+
+    The corner terms of the kernels (distances, logarithms and arctangents) are
+    shared between the components. They are evaluated once for each prism and
+    computation point and reused for all requested components. This is much
+    faster than calling each function separately, e.g. for full tensor
+    gradiometry.
+
+    The results are the same as given by
+    :func:`~fatiando.gravmag._prism.potential`,
+    :func:`~fatiando.gravmag._prism.gx`, etc.
+
+    .. note:: The coordinate system of the input parameters is to be x -> North,
+        y -> East and z -> Down.
+
+    .. note:: All input values in **SI** units(!). Gravity components are
+        returned in **mGal** and gradient tensor components in **Eotvos**!
+
+    Parameters:
+
+    * xp, yp, zp : arrays
+        Arrays with the x, y, and z coordinates of the computation points.
+    * prisms : list of :class:`~fatiando.mesher.Prism`
+        The density model used to calculate the gravitational effect.
+        Prisms must have the property ``'density'``. Prisms that don't have this
+        property will be ignored in the computations. Elements of *prisms* that
+        are None will also be ignored. *prisms* can also be a
+        :class:`~fatiando.mesher.PrismMesh` or a
+        :class:`~fatiando.mesher.PrismArray`.
+    * components : list of str or None
+        The components to calculate. Can be any of ``'potential'``, ``'gx'``,
+        ``'gy'``, ``'gz'``, ``'gxx'``, ``'gxy'``, ``'gxz'``, ``'gyy'``,
+        ``'gyz'``, ``'gzz'``. If None, will calculate all of them (in this
+        order).
+    * dens : float or None
+        If not None, will use this value instead of the ``'density'`` property
+        of the prisms. Use this, e.g., for sensitivity matrix building.
+
+        .. warning:: Uses this value for **all** prisms! Not only the ones that
+            have ``'density'`` as a property.
+
+    * njobs : int
+        Number of threads used by the Cython implementation. Ignored here.
+    * dtype : numpy dtype
+        The type of the output array. Can be ``numpy.float64`` or
+        ``numpy.float32``. The calculations are always done in double
+        precision, so single precision only rounds the result (relative error
+        smaller than 1e-7).
+
+    Returns:
+
+    * res : list of arrays
+        The fields calculated on xp, yp, zp. One array for each element of
+        *components*, in the same order.
+
+    """
+    if xp.shape != yp.shape != zp.shape:
+        raise ValueError("Input arrays xp, yp, and zp must have same shape!")
+    dtype = _check_dtype(dtype)
+    components = _check_components(components)
+    uselog, useatan = set(), set()
+    for c in components:
+        uselog.update(_TERMS[c][0])
+        useatan.update(_TERMS[c][1])
+    res = [numpy.zeros_like(xp) for c in components]
+    logs = [None, None, None]
+    atans = [None, None, None]
+    for prism in prisms:
+        if prism is None or ('density' not in prism.props and dens is None):
+            continue
+        if dens is None:
+            density = prism.props['density']
+        else:
+            density = dens
+        # First thing to do is make the computation point P the origin of the
+        # coordinate system
+        x = [prism.x2 - xp, prism.x1 - xp]
+        y = [prism.y2 - yp, prism.y1 - yp]
+        z = [prism.z2 - zp, prism.z1 - zp]
+        # Evaluate the integration limits
+        for k in range(2):
+            for j in range(2):
+                for i in range(2):
+                    r = sqrt(x[i]**2 + y[j]**2 + z[k]**2)
+                    if 0 in uselog:
+                        logs[0] = log(x[i] + r)
+                    if 1 in uselog:
+                        logs[1] = log(y[j] + r)
+                    if 2 in uselog:
+                        logs[2] = log(z[k] + r)
+                    if 0 in useatan:
+                        atans[0] = arctan2(z[k]*y[j], x[i]*r)
+                    if 1 in useatan:
+                        atans[1] = arctan2(z[k]*x[i], y[j]*r)
+                    if 2 in useatan:
+                        atans[2] = arctan2(x[i]*y[j], z[k]*r)
+                    for c, field in zip(components, res):
+                        kernel = _shared_kernel(c, x[i], y[j], z[k], logs,
+                                                atans)
+                        field += ((-1.)**(i + j + k))*kernel*density
+    # Now all that is left is to multiply by the gravitational constant and
+    # convert to the units of each component
+    for c, field in zip(components, res):
+        field *= _SCALE[c]
+    return [field.astype(dtype, copy=False) for field in res]
+
+def _shared_kernel(component, x, y, z, logs, atans):
+    """
+    Evaluate the kernel of a component using the shared terms.
+    """
+    if component == 'potential':
+        return (x*y*logs[2] + y*z*logs[0] + x*z*logs[1]
+                - 0.5*x**2*atans[0] - 0.5*y**2*atans[1] - 0.5*z**2*atans[2])
+    # Minus because Nagy et al (2000) give the formula for the gradient of the
+    # potential. Gravity is -grad(V)
+    if component == 'gx':
+        return -(y*logs[2] + z*logs[1] - x*atans[0])
+    if component == 'gy':
+        return -(z*logs[0] + x*logs[2] - y*atans[1])
+    if component == 'gz':
+        return -(x*logs[1] + y*logs[0] - z*atans[2])
+    if component == 'gxx':
+        return -atans[0]
+    if component == 'gxy':
+        return logs[2]
+    if component == 'gxz':
+        return logs[1]
+    if component == 'gyy':
+        return -atans[1]
+    if component == 'gyz':
+        return logs[0]
+    if component == 'gzz':
+        return -atans[2]
+
+# The functions that calculate each field for kernel_matrix
+_FUNCTIONS = {'potential':potential,
+              'gx':gx, 'gy':gy, 'gz':gz,
+              'gxx':gxx, 'gxy':gxy, 'gxz':gxz, 'gyy':gyy, 'gyz':gyz, 'gzz':gzz}
+
+def kernel_matrix(xp, yp, zp, prisms, field='gz', dtype=numpy.float, njobs=1,
+                  ratio=None):
+    """
+    Build the sensitivity (Jacobian) matrix of a gravitational field.
+
+    Element (i, j) of the matrix is the effect of the j-th prism with unit
+    density on the i-th computation point. So the predicted data of a density
+    model is ``numpy.dot(matrix, densities)``.
+
+    Prisms that are None (e.g., masked cells of a
+    :class:`~fatiando.mesher.PrismMesh`) don't get a column in the matrix. Use
+    the ``index`` attribute of :func:`~fatiando.mesher.prisms2array` to know
+    which prism corresponds to each column.
+
+    .. note:: The coordinate system of the input parameters is to be x -> North,
+        y -> East and z -> Down.
+
+    .. note:: All input values in **SI** units(!). Gravity components are
+        in **mGal** and gradient tensor components in **Eotvos**!
+
+    Parameters:
+
+    * xp, yp, zp : arrays
+        Arrays with the x, y, and z coordinates of the computation points.
+    * prisms : list of :class:`~fatiando.mesher.Prism`
+        The prisms of the model. Their physical properties are ignored.
+        *prisms* can also be a :class:`~fatiando.mesher.PrismMesh` or a
+        :class:`~fatiando.mesher.PrismArray`.
+    * field : str
+        The field component. Can be any of ``'potential'``, ``'gx'``,
+        ``'gy'``, ``'gz'``, ``'gxx'``, ``'gxy'``, ``'gxz'``, ``'gyy'``,
+        ``'gyz'``, ``'gzz'``.
+    * dtype : numpy dtype
+        The type of the matrix. Can be ``numpy.float64`` or ``numpy.float32``.
+        The calculations are always done in double precision.
+    * njobs : int
+        Number of threads used by the Cython implementation. Ignored here.
+    * ratio : float or None
+        If not None, prisms that are farther than *ratio* times their size
+        (the length of their diagonal) from a computation point are
+        approximated by their multipole expansion (a point mass at their
+        center plus the quadrupole term). This is faster and the error
+        decreases with the fourth power of the distance. If None, will always
+        use the exact formula.
+
+    Returns:
+
+    * matrix : 2D array
+        The sensitivity matrix with shape (len(xp), number of prisms)
+
+    """
+    if xp.shape != yp.shape != zp.shape:
+        raise ValueError("Input arrays xp, yp, and zp must have same shape!")
+    if field not in _SCALE:
+        raise ValueError("Invalid field '%s'. Use one of %s"
+                         % (field, ', '.join(_FIELDS)))
+    dtype = _check_dtype(dtype)
+    func = _FUNCTIONS[field]
+    cells = [p for p in prisms if p is not None]
+    matrix = numpy.empty((len(xp), len(cells)), dtype=dtype)
+    for j, cell in enumerate(cells):
+        matrix[:, j] = func(xp, yp, zp, [cell], dens=1., ratio=ratio)
+    return matrix
@@ -0,0 +1,608 @@
+"""
+.. note::
+
+    This is a Python + Numpy implementation of the potential fields of
+    spheres. There is a Cython implementation in _csphere.pyx It will be
+    loaded automatically if it is compiled.
+
+----
+"""
+import numpy
+
+from fatiando.constants import CM, T2NT
+from fatiando import utils
+from fatiando.gravmag._prism import (_FIELDS, _SCALE, _check_components,
+                                     _check_dtype)
+
+__all__ = ['potential', 'gx', 'gy', 'gz', 'gxx', 'gxy', 'gxz', 'gyy', 'gyz',
+    'gzz', 'tf', 'fields', 'kernel_matrix']
+
+
+def tf(xp, yp, zp, spheres, inc, dec, njobs=1, dtype=numpy.float):
+    """
+    Calculate the total-field anomaly of spheres.
+
+    .. note:: Input units are SI. Output is in nT
+
+    Parameters:
+
+    * xp, yp, zp : arrays
+        The x, y, and z coordinates where the anomaly will be calculated
+    * spheres : list of :class:`fatiando.mesher.Sphere`
+        The spheres. Spheres must have the properties ``'magnetization'``,
+        ``'inclination'`` and ``'declination'``. If ``'inclination'`` and
+        ``'declination'`` are not present, will use the values of *inc* and
+        *dec* instead. Those without ``'magnetization'`` will be ignored.
+        *spheres* can also be a :class:`~fatiando.mesher.SphereArray`.
+    * inc : float
+        The inclination of the regional field (in degrees)
+    * dec : float
+        The declination of the regional field (in degrees)
+    * njobs : int
+        Number of threads used by the Cython implementation. Ignored here.
+    * dtype : numpy dtype
+        The type of the output array. Can be ``numpy.float64`` or
+        ``numpy.float32``. The calculations are always done in double
+        precision, so single precision only rounds the result (relative error
+        smaller than 1e-7).
+
+    Returns:
+
+    * tf : array
+        The total-field anomaly
+
+    """
+    if xp.shape != yp.shape != zp.shape:
+        raise ValueError("Input arrays xp, yp, and zp must have same shape!")
+    dtype = _check_dtype(dtype)
+    tf = numpy.zeros_like(xp)
+    # Calculate the 3 components of the unit vector in the direction of the
+    # regional field
+    fx, fy, fz = utils.dircos(inc, dec)
+    for sphere in spheres:
+        if sphere is None or 'magnetization' not in sphere.props:
+            continue
+        radius = sphere.radius
+        mag = sphere.props['magnetization']
+        # Get the 3 components of the unit vector in the direction of the
+        # magnetization from the inclination and declination
+        if 'inclination' in sphere.props and 'declination' in sphere.props:
+            inclination = sphere.props['inclination']
+            declination = sphere.props['declination']
+            mx, my, mz = utils.dircos(inclination, declination)
+        # If not given, use in the direction of the regional field
+        else:
+            mx, my, mz = fx, fy, fz
+        # First thing to do is make the computation point P the origin of the
+        # coordinate system
+        x = sphere.x - xp
+        y = sphere.y - yp
+        z = sphere.z - zp
+        # Calculate the 3 components of B
+        dotprod = mx*x + my*y + mz*z
+        r_sqr = x**2 + y**2 + z**2
+        r5 = r_sqr**(2.5)
+        moment = mag*(4.*numpy.pi*(radius**3)/3.)
+        bx = moment*(3*dotprod*x - r_sqr*mx)/r5
+        by = moment*(3*dotprod*y - r_sqr*my)/r5
+        bz = moment*(3*dotprod*z - r_sqr*mz)/r5
+        tf = tf + (fx*bx + fy*by + fz*bz)
+    tf *= CM*T2NT
+    return tf.astype(dtype, copy=False)
+
+def potential(xp, yp, zp, spheres, dens=None, njobs=1, dtype=numpy.float):
+    """
+    Calculates the gravitational potential.
+
+    .. note:: The coordinate system of the input parameters is to be x -> North,
+        y -> East and z -> Down.
+
+    .. note:: All input and output values in SI!
+
+    Parameters:
+
+    * xp, yp, zp : arrays
+        The x, y, and z coordinates where the field will be calculated
+    * spheres : list of :class:`fatiando.mesher.Sphere`
+        The spheres. Spheres must have the property ``'density'``. Those without
+        will be ignored. *spheres* can also be a
+        :class:`~fatiando.mesher.SphereArray`.
+    * dens : float or None
+        If not None, will use this value instead of the ``'density'`` property
+        of the spheres. Use this, e.g., for sensitivity matrix building.
+    * njobs : int
+        Number of threads used by the Cython implementation. Ignored here.
+    * dtype : numpy dtype
+        The type of the output array. Can be ``numpy.float64`` or
+        ``numpy.float32``. The calculations are always done in double
+        precision, so single precision only rounds the result (relative error
+        smaller than 1e-7).
+
+    Returns:
+
+    * res : array
+        The field calculated on xp, yp, zp
+
+    """
+    return fields(xp, yp, zp, spheres, ['potential'], dens, njobs, dtype)[0]
+
+def gx(xp, yp, zp, spheres, dens=None, njobs=1, dtype=numpy.float):
+    """
+    Calculates the :math:`g_x` gravity acceleration component.
+
+    .. note:: The coordinate system of the input parameters is to be x -> North,
+        y -> East and z -> Down.
+
+    .. note:: All input values in SI and output in mGal!
+
+    Parameters:
+
+    * xp, yp, zp : arrays
+        The x, y, and z coordinates where the field will be calculated
+    * spheres : list of :class:`fatiando.mesher.Sphere`
+        The spheres. Spheres must have the property ``'density'``. Those without
+        will be ignored. *spheres* can also be a
+        :class:`~fatiando.mesher.SphereArray`.
+    * dens : float or None
+        If not None, will use this value instead of the ``'density'`` property
+        of the spheres. Use this, e.g., for sensitivity matrix building.
+    * njobs : int
+        Number of threads used by the Cython implementation. Ignored here.
+    * dtype : numpy dtype
+        The type of the output array. Can be ``numpy.float64`` or
+        ``numpy.float32``. The calculations are always done in double
+        precision, so single precision only rounds the result (relative error
+        smaller than 1e-7).
+
+    Returns:
+
+    * res : array
+        The field calculated on xp, yp, zp
+
+    """
+    return fields(xp, yp, zp, spheres, ['gx'], dens, njobs, dtype)[0]
+
+def gy(xp, yp, zp, spheres, dens=None, njobs=1, dtype=numpy.float):
+    """
+    Calculates the :math:`g_y` gravity acceleration component.
+
+    .. note:: The coordinate system of the input parameters is to be x -> North,
+        y -> East and z -> Down.
+
+    .. note:: All input values in SI and output in mGal!
+
+    Parameters:
+
+    * xp, yp, zp : arrays
+        The x, y, and z coordinates where the field will be calculated
+    * spheres : list of :class:`fatiando.mesher.Sphere`
+        The spheres. Spheres must have the property ``'density'``. Those without
+        will be ignored. *spheres* can also be a
+        :class:`~fatiando.mesher.SphereArray`.
+    * dens : float or None
+        If not None, will use this value instead of the ``'density'`` property
+        of the spheres. Use this, e.g., for sensitivity matrix building.
+    * njobs : int
+        Number of threads used by the Cython implementation. Ignored here.
+    * dtype : numpy dtype
+        The type of the output array. Can be ``numpy.float64`` or
+        ``numpy.float32``. The calculations are always done in double
+        precision, so single precision only rounds the result (relative error
+        smaller than 1e-7).
+
+    Returns:
+
+    * res : array
+        The field calculated on xp, yp, zp
+
+    """
+    return fields(xp, yp, zp, spheres, ['gy'], dens, njobs, dtype)[0]
+
+def gz(xp, yp, zp, spheres, dens=None, njobs=1, dtype=numpy.float):
+    """
+    Calculates the :math:`g_z` gravity acceleration component.
+
+    .. note:: The coordinate system of the input parameters is to be x -> North,
+        y -> East and z -> Down.
+
+    .. note:: All input values in SI and output in mGal!
+
+    Parameters:
+
+    * xp, yp, zp : arrays
+        The x, y, and z coordinates where the field will be calculated
+    * spheres : list of :class:`fatiando.mesher.Sphere`
+        The spheres. Spheres must have the property ``'density'``. Those without
+        will be ignored. *spheres* can also be a
+        :class:`~fatiando.mesher.SphereArray`.
+    * dens : float or None
+        If not None, will use this value instead of the ``'density'`` property
+        of the spheres. Use this, e.g., for sensitivity matrix building.
+    * njobs : int
+        Number of threads used by the Cython implementation. Ignored here.
+    * dtype : numpy dtype
+        The type of the output array. Can be ``numpy.float64`` or
+        ``numpy.float32``. The calculations are always done in double
+        precision, so single precision only rounds the result (relative error
+        smaller than 1e-7).
+
+    Returns:
+
+    * res : array
+        The field calculated on xp, yp, zp
+
+    """
+    return fields(xp, yp, zp, spheres, ['gz'], dens, njobs, dtype)[0]
+
+def gxx(xp, yp, zp, spheres, dens=None, njobs=1, dtype=numpy.float):
+    """
+    Calculates the :math:`g_{xx}` gravity gradient tensor component.
+
+    .. note:: The coordinate system of the input parameters is to be x -> North,
+        y -> East and z -> Down.
+
+    .. note:: All input values in SI and output in Eotvos!
+
+    Parameters:
+
+    * xp, yp, zp : arrays
+        The x, y, and z coordinates where the field will be calculated
+    * spheres : list of :class:`fatiando.mesher.Sphere`
+        The spheres. Spheres must have the property ``'density'``. Those without
+        will be ignored. *spheres* can also be a
+        :class:`~fatiando.mesher.SphereArray`.
+    * dens : float or None
+        If not None, will use this value instead of the ``'density'`` property
+        of the spheres. Use this, e.g., for sensitivity matrix building.
+    * njobs : int
+        Number of threads used by the Cython implementation. Ignored here.
+    * dtype : numpy dtype
+        The type of the output array. Can be ``numpy.float64`` or
+        ``numpy.float32``. The calculations are always done in double
+        precision, so single precision only rounds the result (relative error
+        smaller than 1e-7).
+
+    Returns:
+
+    * res : array
+        The field calculated on xp, yp, zp
+
+    """
+    return fields(xp, yp, zp, spheres, ['gxx'], dens, njobs, dtype)[0]
+
+def gxy(xp, yp, zp, spheres, dens=None, njobs=1, dtype=numpy.float):
+    """
+    Calculates the :math:`g_{xy}` gravity gradient tensor component.
+
+    .. note:: The coordinate system of the input parameters is to be x -> North,
+        y -> East and z -> Down.
+
+    .. note:: All input values in SI and output in Eotvos!
+
+    Parameters:
+
+    * xp, yp, zp : arrays
+        The x, y, and z coordinates where the field will be calculated
+    * spheres : list of :class:`fatiando.mesher.Sphere`
+        The spheres. Spheres must have the property ``'density'``. Those without
+        will be ignored. *spheres* can also be a
+        :class:`~fatiando.mesher.SphereArray`.
+    * dens : float or None
+        If not None, will use this value instead of the ``'density'`` property
+        of the spheres. Use this, e.g., for sensitivity matrix building.
+    * njobs : int
+        Number of threads used by the Cython implementation. Ignored here.
+    * dtype : numpy dtype
+        The type of the output array. Can be ``numpy.float64`` or
+        ``numpy.float32``. The calculations are always done in double
+        precision, so single precision only rounds the result (relative error
+        smaller than 1e-7).
+
+    Returns:
+
+    * res : array
+        The field calculated on xp, yp, zp
+
+    """
+    return fields(xp, yp, zp, spheres, ['gxy'], dens, njobs, dtype)[0]
+
+def gxz(xp, yp, zp, spheres, dens=None, njobs=1, dtype=numpy.float):
+    """
+    Calculates the :math:`g_{xz}` gravity gradient tensor component.
+
+    .. note:: The coordinate system of the input parameters is to be x -> North,
+        y -> East and z -> Down.
+
+    .. note:: All input values in SI and output in Eotvos!
+
+    Parameters:
+
+    * xp, yp, zp : arrays
+        The x, y, and z coordinates where the field will be calculated
+    * spheres : list of :class:`fatiando.mesher.Sphere`
+        The spheres. Spheres must have the property ``'density'``. Those without
+        will be ignored. *spheres* can also be a
+        :class:`~fatiando.mesher.SphereArray`.
+    * dens : float or None
+        If not None, will use this value instead of the ``'density'`` property
+        of the spheres. Use this, e.g., for sensitivity matrix building.
+    * njobs : int
+        Number of threads used by the Cython implementation. Ignored here.
+    * dtype : numpy dtype
+        The type of the output array. Can be ``numpy.float64`` or
+        ``numpy.float32``. The calculations are always done in double
+        precision, so single precision only rounds the result (relative error
+        smaller than 1e-7).
+
+    Returns:
+
+    * res : array
+        The field calculated on xp, yp, zp
+
+    """
+    return fields(xp, yp, zp, spheres, ['gxz'], dens, njobs, dtype)[0]
+
+def gyy(xp, yp, zp, spheres, dens=None, njobs=1, dtype=numpy.float):
+    """
+    Calculates the :math:`g_{yy}` gravity gradient tensor component.
+
+    .. note:: The coordinate system of the input parameters is to be x -> North,
+        y -> East and z -> Down.
+
+    .. note:: All input values in SI and output in Eotvos!
+
+    Parameters:
+
+    * xp, yp, zp : arrays
+        The x, y, and z coordinates where the field will be calculated
+    * spheres : list of :class:`fatiando.mesher.Sphere`
+        The spheres. Spheres must have the property ``'density'``. Those without
+        will be ignored. *spheres* can also be a
+        :class:`~fatiando.mesher.SphereArray`.
+    * dens : float or None
+        If not None, will use this value instead of the ``'density'`` property
+        of the spheres. Use this, e.g., for sensitivity matrix building.
+    * njobs : int
+        Number of threads used by the Cython implementation. Ignored here.
+    * dtype : numpy dtype
+        The type of the output array. Can be ``numpy.float64`` or
+        ``numpy.float32``. The calculations are always done in double
+        precision, so single precision only rounds the result (relative error
+        smaller than 1e-7).
+
+    Returns:
+
+    * res : array
+        The field calculated on xp, yp, zp
+
+    """
+    return fields(xp, yp, zp, spheres, ['gyy'], dens, njobs, dtype)[0]
+
+def gyz(xp, yp, zp, spheres, dens=None, njobs=1, dtype=numpy.float):
+    """
+    Calculates the :math:`g_{yz}` gravity gradient tensor component.
+
+    .. note:: The coordinate system of the input parameters is to be x -> North,
+        y -> East and z -> Down.
+
+    .. note:: All input values in SI and output in Eotvos!
+
+    Parameters:
+
+    * xp, yp, zp : arrays
+        The x, y, and z coordinates where the field will be calculated
+    * spheres : list of :class:`fatiando.mesher.Sphere`
+        The spheres. Spheres must have the property ``'density'``. Those without
+        will be ignored. *spheres* can also be a
+        :class:`~fatiando.mesher.SphereArray`.
+    * dens : float or None
+        If not None, will use this value instead of the ``'density'`` property
+        of the spheres. Use this, e.g., for sensitivity matrix building.
+    * njobs : int
+        Number of threads used by the Cython implementation. Ignored here.
+    * dtype : numpy dtype
+        The type of the output array. Can be ``numpy.float64`` or
+        ``numpy.float32``. The calculations are always done in double
+        precision, so single precision only rounds the result (relative error
+        smaller than 1e-7).
+
+    Returns:
+
+    * res : array
+        The field calculated on xp, yp, zp
+
+    """
+    return fields(xp, yp, zp, spheres, ['gyz'], dens, njobs, dtype)[0]
+
+def gzz(xp, yp, zp, spheres, dens=None, njobs=1, dtype=numpy.float):
+    """
+    Calculates the :math:`g_{zz}` gravity gradient tensor component.
+
+    .. note:: The coordinate system of the input parameters is to be x -> North,
+        y -> East and z -> Down.
+
+    .. note:: All input values in SI and output in Eotvos!
+
+    Parameters:
+
+    * xp, yp, zp : arrays
+        The x, y, and z coordinates where the field will be calculated
+    * spheres : list of :class:`fatiando.mesher.Sphere`
+        The spheres. Spheres must have the property ``'density'``. Those without
+        will be ignored. *spheres* can also be a
+        :class:`~fatiando.mesher.SphereArray`.
+    * dens : float or None
+        If not None, will use this value instead of the ``'density'`` property
+        of the spheres. Use this, e.g., for sensitivity matrix building.
+    * njobs : int
+        Number of threads used by the Cython implementation. Ignored here.
+    * dtype : numpy dtype
+        The type of the output array. Can be ``numpy.float64`` or
+        ``numpy.float32``. The calculations are always done in double
+        precision, so single precision only rounds the result (relative error
+        smaller than 1e-7).
+
+    Returns:
+
+    * res : array
+        The field calculated on xp, yp, zp
+
+    """
+    return fields(xp, yp, zp, spheres, ['gzz'], dens, njobs, dtype)[0]
+
+def fields(xp, yp, zp, spheres, components=None, dens=None, njobs=1,
+           dtype=numpy.float):
+    """
+    Calculate several gravitational field components in a single pass.
+
+    The distance between each sphere and computation point is calculated once
+    and reused for all requested components. This is faster than calling each
+    function separately, e.g. for full tensor gradiometry.
+
+    The spheres are treated as point masses at their centers, which is exact
+    outside of them.
+
+    .. note:: The coordinate system of the input parameters is to be x -> North,
+        y -> East and z -> Down.
+
+    .. note:: All input values in **SI** units(!). Gravity components are
+        returned in **mGal** and gradient tensor components in **Eotvos**!
+
+    Parameters:
+
+    * xp, yp, zp : arrays
+        Arrays with the x, y, and z coordinates of the computation points.
+    * spheres : list of :class:`fatiando.mesher.Sphere`
+        The spheres. Spheres must have the property ``'density'``. Those without
+        will be ignored. *spheres* can also be a
+        :class:`~fatiando.mesher.SphereArray`.
+    * components : list of str or None
+        The components to calculate. Can be any of ``'potential'``, ``'gx'``,
+        ``'gy'``, ``'gz'``, ``'gxx'``, ``'gxy'``, ``'gxz'``, ``'gyy'``,
+        ``'gyz'``, ``'gzz'``. If None, will calculate all of them (in this
+        order).
+    * dens : float or None
+        If not None, will use this value instead of the ``'density'`` property
+        of the spheres. Use this, e.g., for sensitivity matrix building.
+    * njobs : int
+        Number of threads used by the Cython implementation. Ignored here.
+    * dtype : numpy dtype
+        The type of the output array. Can be ``numpy.float64`` or
+        ``numpy.float32``. The calculations are always done in double
+        precision, so single precision only rounds the result (relative error
+        smaller than 1e-7).
+
+    Returns:
+
+    * res : list of arrays
+        The fields calculated on xp, yp, zp. One array for each element of
+        *components*, in the same order.
+
+    """
+    if xp.shape != yp.shape != zp.shape:
+        raise ValueError("Input arrays xp, yp, and zp must have same shape!")
+    dtype = _check_dtype(dtype)
+    components = _check_components(components)
+    res = [numpy.zeros(len(xp), dtype=numpy.float) for c in components]
+    for sphere in spheres:
+        if sphere is None or ('density' not in sphere.props and dens is None):
+            continue
+        if dens is None:
+            density = sphere.props['density']
+        else:
+            density = dens
+        mass = density*4.*numpy.pi*(sphere.radius**3)/3.
+        # First thing to do is make the computation point P the origin of the
+        # coordinate system
+        dx = sphere.x - xp
+        dy = sphere.y - yp
+        dz = sphere.z - zp
+        r_sqr = dx**2 + dy**2 + dz**2
+        r = numpy.sqrt(r_sqr)
+        for c, field in zip(components, res):
+            field += mass*_kernel(c, dx, dy, dz, r_sqr, r)
+    for c, field in zip(components, res):
+        field *= _SCALE[c]
+    return [field.astype(dtype, copy=False) for field in res]
+
+def kernel_matrix(xp, yp, zp, spheres, field='gz', dtype=numpy.float,
+                  njobs=1):
+    """
+    Build the sensitivity (Jacobian) matrix of a gravitational field.
+
+    Element (i, j) of the matrix is the effect of the j-th sphere with unit
+    density on the i-th computation point. So the predicted data of a density
+    model is ``numpy.dot(matrix, densities)``. Use it, e.g., to build the
+    equivalent layer of point masses.
+
+    Spheres that are None don't get a column in the matrix. Use the ``index``
+    attribute of :func:`~fatiando.mesher.spheres2array` to know which sphere
+    corresponds to each column.
+
+    .. note:: The coordinate system of the input parameters is to be x -> North,
+        y -> East and z -> Down.
+
+    .. note:: All input values in **SI** units(!). Gravity components are
+        in **mGal** and gradient tensor components in **Eotvos**!
+
+    Parameters:
+
+    * xp, yp, zp : arrays
+        Arrays with the x, y, and z coordinates of the computation points.
+    * spheres : list of :class:`fatiando.mesher.Sphere`
+        The spheres of the model. Their physical properties are ignored.
+        *spheres* can also be a :class:`~fatiando.mesher.SphereArray`.
+    * field : str
+        The field component. Can be any of ``'potential'``, ``'gx'``,
+        ``'gy'``, ``'gz'``, ``'gxx'``, ``'gxy'``, ``'gxz'``, ``'gyy'``,
+        ``'gyz'``, ``'gzz'``.
+    * dtype : numpy dtype
+        The type of the matrix. Can be ``numpy.float64`` or ``numpy.float32``.
+        The calculations are always done in double precision.
+    * njobs : int
+        Number of threads used by the Cython implementation. Ignored here.
+
+    Returns:
+
+    * matrix : 2D array
+        The sensitivity matrix with shape (len(xp), number of spheres)
+
+    """
+    if xp.shape != yp.shape != zp.shape:
+        raise ValueError("Input arrays xp, yp, and zp must have same shape!")
+    if field not in _SCALE:
+        raise ValueError("Invalid field '%s'. Use one of %s"
+                         % (field, ', '.join(_FIELDS)))
+    dtype = _check_dtype(dtype)
+    cells = [s for s in spheres if s is not None]
+    matrix = numpy.empty((len(xp), len(cells)), dtype=dtype)
+    for j, cell in enumerate(cells):
+        matrix[:, j] = fields(xp, yp, zp, [cell], [field], dens=1.)[0]
+    return matrix
+
+def _kernel(field, dx, dy, dz, r_sqr, r):
+    """
+    The field of a point mass with unit mass (without the gravitational
+    constant). dx, dy, dz are the coordinates of the point mass relative to the
+    computation point and r is the distance between them.
+    """
+    if field == 'potential':
+        return 1./r
+    if field == 'gx':
+        return dx/(r_sqr*r)
+    if field == 'gy':
+        return dy/(r_sqr*r)
+    if field == 'gz':
+        return dz/(r_sqr*r)
+    if field == 'gxx':
+        return (3*dx**2 - r_sqr)/(r_sqr**2*r)
+    if field == 'gxy':
+        return 3*dx*dy/(r_sqr**2*r)
+    if field == 'gxz':
+        return 3*dx*dz/(r_sqr**2*r)
+    if field == 'gyy':
+        return (3*dy**2 - r_sqr)/(r_sqr**2*r)
+    if field == 'gyz':
+        return 3*dy*dz/(r_sqr**2*r)
+    if field == 'gzz':
+        return (3*dz**2 - r_sqr)/(r_sqr**2*r)
@@ -0,0 +1,182 @@
+"""
+.. note::
+
+    Forward modeling of prisms on very large sets of computation points, one
+    chunk of points at a time. Functions are loaded into
+    :mod:`fatiando.gravmag.prism`.
+
+----
+"""
+import collections
+import multiprocessing
+
+import numpy
+
+from fatiando.gravmag._prism import _FIELDS
+try:
+    from fatiando.gravmag import _cprism as _engine
+except ImportError:
+    from fatiando.gravmag import _prism as _engine
+
+__all__ = ['stream']
+
+# The prism model used by the worker processes. Set once for each worker by
+# _init_worker so that the model isn't sent with every chunk.
+_worker_prisms = None
+
+
+def stream(points, prisms, field='gz', out=None, chunksize=10000,
+           processes=1, **kwargs):
+    """
+    Calculate a field of prisms on a very large number of points in chunks.
+
+    Only *chunksize* points are calculated at a time, so the memory used
+    depends on the size of the chunks and not on the number of points. The
+    coordinates can be memory-mapped arrays (see :func:`numpy.load` and
+    :class:`numpy.memmap`) or an iterator that reads the points from a file
+    one chunk at a time. The results are written into *out*, which can also be
+    a memory-mapped array.
+
+    The chunks can also be calculated in parallel by several worker processes.
+    The prism model is sent to each worker only once and at most 2 chunks per
+    worker are in memory at any time.
+
+    Parameters:
+
+    * points : tuple = (xp, yp, zp) or iterator
+        The x, y, and z coordinates of the computation points. Either a tuple
+        with 3 arrays or an iterator that yields tuples ``(xp, yp, zp)`` with
+        the coordinates of each chunk of points.
+    * prisms : list of :class:`~fatiando.mesher.Prism`
+        The model. Can also be a :class:`~fatiando.mesher.PrismMesh` or a
+        :class:`~fatiando.mesher.PrismArray`.
+    * field : str
+        The field to calculate. Can be any of ``'potential'``, ``'gx'``,
+        ``'gy'``, ``'gz'``, ``'gxx'``, ``'gxy'``, ``'gxz'``, ``'gyy'``,
+        ``'gyz'``, ``'gzz'``, ``'tf'``.
+    * out : array or None
+        The array where the results will be stored (in the same order as the
+        points). If None, will create a new array.
+    * chunksize : int
+        The number of points in each chunk. Ignored if *points* is an
+        iterator (the chunks given by the iterator are used instead).
+    * processes : int
+        The number of worker processes used to calculate the chunks in
+        parallel. If 1, will calculate everything in this process.
+    * kwargs
+        Other arguments passed on to the function that calculates *field*
+        (e.g., ``dens``, ``njobs``, ``ratio``, or ``inc`` and ``dec`` for
+        ``'tf'``).
+
+    Returns:
+
+    * out : array
+        The field calculated on the computation points
+
+    Examples:
+
+        >>> from fatiando.mesher import Prism
+        >>> from fatiando.gravmag import prism
+        >>> import numpy
+        >>> model = [Prism(-100, 100, -100, 100, 0, 200, {'density':1000})]
+        >>> xp = numpy.linspace(-500, 500, 25)
+        >>> yp = numpy.zeros(25)
+        >>> zp = -10*numpy.ones(25)
+        >>> res = stream((xp, yp, zp), model, 'gz', chunksize=10)
+        >>> print numpy.all(res == prism.gz(xp, yp, zp, model))
+        True
+        >>> chunks = ((xp[i:i + 5], yp[i:i + 5], zp[i:i + 5])
+        ...           for i in xrange(0, 25, 5))
+        >>> res = stream(chunks, model, 'gz')
+        >>> print numpy.all(res == prism.gz(xp, yp, zp, model))
+        True
+
+    """
+    if field not in _FIELDS and field != 'tf':
+        raise ValueError("Invalid field '%s'. Use one of %s"
+                         % (field, ', '.join(_FIELDS + ['tf'])))
+    if chunksize < 1:
+        raise ValueError("Invalid chunksize '%s'. Must be >= 1" % (chunksize))
+    if processes < 1:
+        raise ValueError("Invalid number of processes '%s'. Must be >= 1"
+                         % (processes))
+    if isinstance(points, tuple) and numpy.ndim(points[0]) == 1:
+        xp, yp, zp = points
+        if len(xp) != len(yp) or len(xp) != len(zp):
+            raise ValueError("Input arrays xp, yp, and zp must have same "
+                             + "length!")
+        if out is None:
+            out = numpy.empty(len(xp), dtype=kwargs.get('dtype', numpy.float))
+        chunks = ((xp[i:i + chunksize], yp[i:i + chunksize],
+                   zp[i:i + chunksize])
+                  for i in xrange(0, len(xp), chunksize))
+    else:
+        chunks = iter(points)
+    jobs = ((field, x, y, z, kwargs) for x, y, z in chunks)
+    if processes == 1:
+        out = _store((_calculate_chunk(job, prisms) for job in jobs), out)
+    else:
+        pool = multiprocessing.Pool(processes, initializer=_init_worker,
+                                    initargs=(prisms,))
+        try:
+            out = _store(_imap(pool, jobs, 2*processes), out)
+            pool.close()
+        finally:
+            pool.terminate()
+    if hasattr(out, 'flush'):
+        out.flush()
+    return out
+
+def _store(results, out):
+    """
+    Write the results of each chunk into *out* in order.
+    If *out* is None, return the results concatenated.
+    """
+    if out is None:
+        results = list(results)
+        if not results:
+            return numpy.zeros(0)
+        return numpy.concatenate(results)
+    start = 0
+    for res in results:
+        end = start + len(res)
+        if end > len(out):
+            raise ValueError("out has %d elements but there are more points"
+                             % (len(out)))
+        out[start:end] = res
+        start = end
+    if start != len(out):
+        raise ValueError("out has %d elements but there are only %d points"
+                         % (len(out), start))
+    return out
+
+def _imap(pool, jobs, maxpending):
+    """
+    Like pool.imap but with at most *maxpending* jobs in the queue at a time
+    (pool.imap would read all chunks into memory at once).
+    """
+    pending = collections.deque()
+    for job in jobs:
+        pending.append(pool.apply_async(_calculate_chunk, (job,)))
+        if len(pending) >= maxpending:
+            yield pending.popleft().get()
+    while pending:
+        yield pending.popleft().get()
+
+def _init_worker(prisms):
+    """
+    Store the prism model in the worker process.
+    """
+    global _worker_prisms
+    _worker_prisms = prisms
+
+def _calculate_chunk(job, prisms=None):
+    """
+    Calculate the field on one chunk of points.
+    If *prisms* is None, use the model stored in the worker process.
+    """
+    field, xp, yp, zp, kwargs = job
+    if prisms is None:
+        prisms = _worker_prisms
+    xp, yp, zp = [numpy.array(i, dtype=numpy.float) for i in [xp, yp, zp]]
+    return getattr(_engine, field)(xp, yp, zp, prisms, **kwargs)
@@ -0,0 +1,365 @@
+"""
+.. note::
+
+    Forward modeling of large prism models using an octree (Barnes-Hut
+    algorithm). Functions are loaded into :mod:`fatiando.gravmag.prism`.
+
+----
+"""
+import numpy
+
+from fatiando.mesher import PrismArray, prisms2array
+from fatiando.gravmag._prism import _SCALE, _FIELDS, _multipole
+try:
+    from fatiando.gravmag import _cprism as _engine
+except ImportError:
+    from fatiando.gravmag import _prism as _engine
+
+__all__ = ['PrismTree']
+
+
+class PrismTree(object):
+    """
+    An octree of prisms for fast forward modeling of very large models.
+
+    The prisms are grouped in the nodes of an octree (each node is divided in 8
+    until it has at most *leafsize* prisms). Each node stores the total mass
+    and the first (dipole) and second (quadrupole) mass moments of its prisms
+    with respect to its center. The fields are calculated with the Barnes-Hut
+    algorithm: nodes that are farther than *ratio* times their size from a
+    computation point are approximated by their multipole expansion (monopole
+    + dipole + quadrupole). The prisms of the leaf nodes that are close to the
+    point are calculated exactly with the functions of
+    :mod:`fatiando.gravmag.prism`.
+
+    The cost is roughly proportional to the number of points times the
+    logarithm of the number of prisms, instead of the number of points times
+    the number of prisms.
+
+    .. note:: The coordinate system of the input parameters is to be x -> North,
+        y -> East and z -> Down.
+
+    .. note:: All input values in **SI** units(!). Gravity components are
+        returned in **mGal** and gradient tensor components in **Eotvos**!
+
+    Parameters:
+
+    * prisms : list of :class:`~fatiando.mesher.Prism`
+        The density model. Prisms must have the property ``'density'``. Prisms
+        that don't have this property will be ignored. *prisms* can also be a
+        :class:`~fatiando.mesher.PrismMesh` or a
+        :class:`~fatiando.mesher.PrismArray`.
+    * dens : float or None
+        If not None, will use this value instead of the ``'density'`` property
+        of the prisms.
+    * leafsize : int
+        The maximum number of prisms in the leaf nodes of the tree.
+
+    Examples:
+
+        >>> from fatiando.mesher import PrismMesh
+        >>> from fatiando.gravmag import prism
+        >>> import numpy
+        >>> mesh = PrismMesh((0, 1000, 0, 1000, 0, 500), (5, 10, 10))
+        >>> mesh.addprop('density', 1000*numpy.ones(mesh.size))
+        >>> tree = PrismTree(mesh, leafsize=20)
+        >>> print tree.size
+        500
+        >>> xp = numpy.array([500., 5000.])
+        >>> yp = numpy.array([500., 500.])
+        >>> zp = numpy.array([-10., -10.])
+        >>> exact = prism.gz(xp, yp, zp, mesh)
+        >>> approx = tree.gz(xp, yp, zp)
+        >>> print numpy.all(abs(approx - exact) <= 0.0002*abs(exact))
+        True
+
+    """
+
+    def __init__(self, prisms, dens=None, leafsize=64):
+        array = prisms2array(prisms)
+        if dens is not None:
+            density = dens*numpy.ones(array.size)
+        elif 'density' in array.props:
+            density = array.props['density']
+        else:
+            density = numpy.nan*numpy.ones(array.size)
+        keep = ~numpy.isnan(density)
+        self.x1, self.x2 = array.x1[keep], array.x2[keep]
+        self.y1, self.y2 = array.y1[keep], array.y2[keep]
+        self.z1, self.z2 = array.z1[keep], array.z2[keep]
+        self.density = density[keep]
+        self.size = len(self.density)
+        self.leafsize = leafsize
+        self.mass = self.density*((self.x2 - self.x1)*(self.y2 - self.y1)
+                                  *(self.z2 - self.z1))
+        self.xc = 0.5*(self.x1 + self.x2)
+        self.yc = 0.5*(self.y1 + self.y2)
+        self.zc = 0.5*(self.z1 + self.z2)
+        # The prisms in each node are the ones in order[start:end]
+        self.order = numpy.arange(self.size)
+        self.root = None
+        if self.size > 0:
+            self.root = self._build(0, self.size)
+
+    def _build(self, start, end):
+        """
+        Build the node with prisms order[start:end] and all its children.
+        """
+        root = _Node(self, start, end)
+        stack = [root]
+        while stack:
+            node = stack.pop()
+            if node.end - node.start <= self.leafsize:
+                continue
+            index = self.order[node.start:node.end]
+            xc, yc, zc = self.xc[index], self.yc[index], self.zc[index]
+            octant = (4*(zc > 0.5*(zc.min() + zc.max()))
+                      + 2*(yc > 0.5*(yc.min() + yc.max()))
+                      + (xc > 0.5*(xc.min() + xc.max())))
+            # All prisms have the same center so can't divide any further
+            if numpy.all(octant == octant[0]):
+                continue
+            sort = numpy.argsort(octant, kind='mergesort')
+            self.order[node.start:node.end] = index[sort]
+            counts = numpy.bincount(octant, minlength=8)
+            start = node.start
+            for count in counts:
+                if count == 0:
+                    continue
+                child = _Node(self, start, start + count)
+                node.children.append(child)
+                stack.append(child)
+                start += count
+        return _Node.root(root, self)
+
+    def _calculate(self, xp, yp, zp, field, ratio):
+        """
+        Calculate *field* on the computation points using the tree.
+        """
+        if field not in _SCALE:
+            raise ValueError("Invalid field '%s'. Use one of %s"
+                             % (field, ', '.join(_FIELDS)))
+        if ratio <= 0:
+            raise ValueError("Invalid ratio '%s'. Must be > 0" % (ratio))
+        xp, yp, zp = [numpy.asarray(i, dtype=numpy.float) for i in [xp, yp, zp]]
+        if xp.shape != yp.shape != zp.shape:
+            raise ValueError("Input arrays xp, yp, and zp must have same shape!")
+        res = numpy.zeros(len(xp))
+        if self.root is None:
+            return res
+        func = getattr(_engine, field)
+        stack = [(self.root, numpy.arange(len(xp)))]
+        while stack:
+            node, points = stack.pop()
+            dx = node.center[0] - xp[points]
+            dy = node.center[1] - yp[points]
+            dz = node.center[2] - zp[points]
+            r_sqr = dx**2 + dy**2 + dz**2
+            far = r_sqr > (ratio**2)*node.size_sqr
+            if numpy.any(far):
+                dx, dy, dz, r_sqr = dx[far], dy[far], dz[far], r_sqr[far]
+                res[points[far]] += _SCALE[field]*(
+                    _multipole(field, node.mass, node.moment, dx, dy, dz, r_sqr)
+                    + _dipole(field, node.dipole, dx, dy, dz, r_sqr))
+            points = points[~far]
+            if len(points) == 0:
+                continue
+            if node.children:
+                stack.extend((child, points) for child in node.children)
+            else:
+                res[points] += func(xp[points], yp[points], zp[points],
+                                    node.prisms())
+        return res
+
+    def potential(self, xp, yp, zp, ratio=3):
+        """
+        Calculates the gravitational potential.
+
+        Parameters:
+
+        * xp, yp, zp : arrays
+            Arrays with the x, y, and z coordinates of the computation points.
+        * ratio : float
+            Nodes of the tree that are farther than *ratio* times their size
+            from a computation point are approximated by a multipole expansion.
+            The larger the ratio, the more accurate and slower the calculation.
+            The error of the expansion falls with the third power of the
+            distance divided by the node size, or faster if the mass of the
+            node is close to symmetric about its center (e.g., regular meshes).
+            Relative to the largest absolute value of the field, the error was
+            below 2e-4 for a ratio of 2 and below 2e-5 for a ratio of 3 on
+            regular meshes of up to 72000 cells.
+
+        Returns:
+
+        * res : array
+            The field calculated on xp, yp, zp
+
+        """
+        return self._calculate(xp, yp, zp, 'potential', ratio)
+
+    def gx(self, xp, yp, zp, ratio=3):
+        """
+        Calculates the :math:`g_x` gravity acceleration component.
+
+        See :meth:`~fatiando.gravmag._treeprism.PrismTree.potential` for the
+        parameters.
+        """
+        return self._calculate(xp, yp, zp, 'gx', ratio)
+
+    def gy(self, xp, yp, zp, ratio=3):
+        """
+        Calculates the :math:`g_y` gravity acceleration component.
+
+        See :meth:`~fatiando.gravmag._treeprism.PrismTree.potential` for the
+        parameters.
+        """
+        return self._calculate(xp, yp, zp, 'gy', ratio)
+
+    def gz(self, xp, yp, zp, ratio=3):
+        """
+        Calculates the :math:`g_z` gravity acceleration component.
+
+        See :meth:`~fatiando.gravmag._treeprism.PrismTree.potential` for the
+        parameters.
+        """
+        return self._calculate(xp, yp, zp, 'gz', ratio)
+
+    def gxx(self, xp, yp, zp, ratio=3):
+        """
+        Calculates the :math:`g_{xx}` gravity gradient tensor component.
+
+        See :meth:`~fatiando.gravmag._treeprism.PrismTree.potential` for the
+        parameters.
+        """
+        return self._calculate(xp, yp, zp, 'gxx', ratio)
+
+    def gxy(self, xp, yp, zp, ratio=3):
+        """
+        Calculates the :math:`g_{xy}` gravity gradient tensor component.
+
+        See :meth:`~fatiando.gravmag._treeprism.PrismTree.potential` for the
+        parameters.
+        """
+        return self._calculate(xp, yp, zp, 'gxy', ratio)
+
+    def gxz(self, xp, yp, zp, ratio=3):
+        """
+        Calculates the :math:`g_{xz}` gravity gradient tensor component.
+
+        See :meth:`~fatiando.gravmag._treeprism.PrismTree.potential` for the
+        parameters.
+        """
+        return self._calculate(xp, yp, zp, 'gxz', ratio)
+
+    def gyy(self, xp, yp, zp, ratio=3):
+        """
+        Calculates the :math:`g_{yy}` gravity gradient tensor component.
+
+        See :meth:`~fatiando.gravmag._treeprism.PrismTree.potential` for the
+        parameters.
+        """
+        return self._calculate(xp, yp, zp, 'gyy', ratio)
+
+    def gyz(self, xp, yp, zp, ratio=3):
+        """
+        Calculates the :math:`g_{yz}` gravity gradient tensor component.
+
+        See :meth:`~fatiando.gravmag._treeprism.PrismTree.potential` for the
+        parameters.
+        """
+        return self._calculate(xp, yp, zp, 'gyz', ratio)
+
+    def gzz(self, xp, yp, zp, ratio=3):
+        """
+        Calculates the :math:`g_{zz}` gravity gradient tensor component.
+
+        See :meth:`~fatiando.gravmag._treeprism.PrismTree.potential` for the
+        parameters.
+        """
+        return self._calculate(xp, yp, zp, 'gzz', ratio)
+
+class _Node(object):
+    """
+    A node of a :class:`~fatiando.gravmag._treeprism.PrismTree`.
+
+    Has the prisms tree.order[start:end]. Stores the center and size of the
+    bounding box of the prisms and their mass, dipole moment and second
+    moments with respect to the center.
+    """
+
+    def __init__(self, tree, start, end):
+        self.tree = tree
+        self.start = start
+        self.end = end
+        self.children = []
+        index = tree.order[start:end]
+        x1, x2 = tree.x1[index].min(), tree.x2[index].max()
+        y1, y2 = tree.y1[index].min(), tree.y2[index].max()
+        z1, z2 = tree.z1[index].min(), tree.z2[index].max()
+        self.center = (0.5*(x1 + x2), 0.5*(y1 + y2), 0.5*(z1 + z2))
+        self.size_sqr = (x2 - x1)**2 + (y2 - y1)**2 + (z2 - z1)**2
+        self._prisms = None
+
+    @staticmethod
+    def root(node, tree):
+        """
+        Calculate the moments of all nodes below *node* (after the tree is
+        built and the order of the prisms is final) and return it.
+        """
+        stack = [node]
+        while stack:
+            current = stack.pop()
+            index = tree.order[current.start:current.end]
+            mass = tree.mass[index]
+            current.mass = mass.sum()
+            delta = [tree.xc[index] - current.center[0],
+                     tree.yc[index] - current.center[1],
+                     tree.zc[index] - current.center[2]]
+            sides = [tree.x2[index] - tree.x1[index],
+                     tree.y2[index] - tree.y1[index],
+                     tree.z2[index] - tree.z1[index]]
+            current.dipole = [numpy.sum(mass*d) for d in delta]
+            # The second moments about the center are the moments of each
+            # prism about its own center plus the parallel axis terms
+            current.moment = numpy.empty((3, 3))
+            for i in xrange(3):
+                for j in xrange(i, 3):
+                    current.moment[i, j] = numpy.sum(mass*delta[i]*delta[j])
+                    current.moment[j, i] = current.moment[i, j]
+                current.moment[i, i] += numpy.sum(mass*sides[i]**2)/12.
+            stack.extend(current.children)
+        return node
+
+    def prisms(self):
+        """
+        Get a :class:`~fatiando.mesher.PrismArray` with the prisms of the node.
+        """
+        if self._prisms is None:
+            tree = self.tree
+            index = tree.order[self.start:self.end]
+            self._prisms = PrismArray(tree.x1[index], tree.x2[index],
+                tree.y1[index], tree.y2[index], tree.z1[index],
+                tree.z2[index], {'density':tree.density[index]})
+        return self._prisms
+
+def _dipole(field, dipole, dx, dy, dz, r_sqr):
+    """
+    Calculate *field* of a dipole at (dx, dy, dz) from the points.
+    The result is not multiplied by G or converted to mGal or Eotvos.
+    """
+    r = numpy.sqrt(r_sqr)
+    r3 = r_sqr*r
+    r5 = r3*r_sqr
+    d = {'x':dx, 'y':dy, 'z':dz}
+    moment = {'x':dipole[0], 'y':dipole[1], 'z':dipole[2]}
+    dot = dipole[0]*dx + dipole[1]*dy + dipole[2]*dz
+    if field == 'potential':
+        return -dot/r3
+    if len(field) == 2:
+        a = d[field[1]]
+        return -(3*a*dot - moment[field[1]]*r_sqr)/r5
+    a, b = d[field[1]], d[field[2]]
+    delta = float(field[1] == field[2])
+    return ((3*(moment[field[1]]*b + moment[field[2]]*a) + 3*delta*dot)/r5
+            - 15*a*b*dot/(r5*r_sqr))
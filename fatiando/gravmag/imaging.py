@@ -121,8 +121,8 @@ def migrate(x, y, z, gz, zmin, zmax, meshshape, power=0.5, scale=1):
     weights = numpy.abs(depths)**power/(2*G*numpy.sqrt(numpy.pi))
     density = []
     for l in xrange(nlayers):
-        sensibility_T = numpy.array(
-            [pot_prism.gz(x, y, z, [p], dens=1) for p in mesh.get_layer(l)])
+        sensibility_T = pot_prism.kernel_matrix(x, y, z, mesh.get_layer(l),
+                                                'gz').T
         density.extend(scale*weights[l]*numpy.dot(sensibility_T, gz))
     tend = time.clock()
     log.info("  total time for imaging: %s" % (utils.sec2hms(tend - tstart)))
@@ -5,22 +5,102 @@ Calculate the potential fields of the 3D right rectangular prism.
 
 The gravitational fields are calculated using the forumla of Nagy et al. (2000)
 
-* :func:`~fatiando.gravmag._prism.potential`
-* :func:`~fatiando.gravmag._prism.gx`
-* :func:`~fatiando.gravmag._prism.gy`
-* :func:`~fatiando.gravmag._prism.gz`
-* :func:`~fatiando.gravmag._prism.gxx`
-* :func:`~fatiando.gravmag._prism.gxy`
-* :func:`~fatiando.gravmag._prism.gxz`
-* :func:`~fatiando.gravmag._prism.gyy`
-* :func:`~fatiando.gravmag._prism.gyz`
-* :func:`~fatiando.gravmag._prism.gzz`
+* :func:`~fatiando.gravmag._autoprism.potential`
+* :func:`~fatiando.gravmag._autoprism.gx`
+* :func:`~fatiando.gravmag._autoprism.gy`
+* :func:`~fatiando.gravmag._autoprism.gz`
+* :func:`~fatiando.gravmag._autoprism.gxx`
+* :func:`~fatiando.gravmag._autoprism.gxy`
+* :func:`~fatiando.gravmag._autoprism.gxz`
+* :func:`~fatiando.gravmag._autoprism.gyy`
+* :func:`~fatiando.gravmag._autoprism.gyz`
+* :func:`~fatiando.gravmag._autoprism.gzz`
+
+Use :func:`~fatiando.gravmag._prism.fields` to calculate several of these
+components at once. The terms shared by the components are only evaluated once,
+which is much faster than calling each function separately.
+
+Use :func:`~fatiando.gravmag._prism.kernel_matrix` to build the sensitivity
+matrix of a mesh (the effect of each cell with unit density on each data point)
+in a single pass.
+
+**FFT for regular meshes**
+
+If the computation points are on a regular grid with the same spacing as the
+cells of a regular :class:`~fatiando.mesher.PrismMesh`, the fields can be
+calculated much faster using 2D convolutions and the FFT:
+
+* :func:`~fatiando.gravmag._fftprism.fft`: Calculate the field of a mesh
+* :class:`~fatiando.gravmag._fftprism.FFTOperator`: The sensitivity matrix of
+  a mesh applied with FFTs (for inversion)
 
 **Magnetic**
 
 The Total Field anomaly is calculated using the formula of Bhattacharyya (1964).
 
-* :func:`~fatiando.gravmag._prism.tf`
+* :func:`~fatiando.gravmag._autoprism.tf`
+
+To calculate the 3 components of the magnetic induction as well (in a single
+pass) or to give the magnetization vector of each prism as an array, use:
+
+* :func:`~fatiando.gravmag._prism.magnetic`
+
+**Far-field approximation**
+
+The gravitational functions have a *ratio* argument. If given, prisms that are
+farther than *ratio* times their size (the length of their diagonal) from a
+computation point are approximated by their multipole expansion up to the
+quadrupole term. This is much faster for large models and the error is
+controlled by *ratio*. Relative to the largest absolute value of the field,
+the error is below 2e-4 for a ratio of 2 and below 2e-5 for a ratio of 3, for
+all components, if the sides of the prisms differ by less than a factor of 3.
+The error grows with the elongation of the prisms and is largest for the
+horizontal components: prisms 10 times longer than thick give errors of about
+1e-3 for a ratio of 2. Where the field is close to zero (e.g., models with
+densities of random sign) the error relative to the local value of the field
+can be much larger.
+
+For models with millions of cells, group the prisms in an octree and use the
+Barnes-Hut algorithm. Whole groups of prisms that are far from a computation
+point are approximated by their multipole expansion:
+
+* :class:`~fatiando.gravmag._treeprism.PrismTree`: An octree of prisms with
+  methods to calculate the potential, gravity and gravity gradient tensor
+
+**Large models**
+
+All functions also accept a :class:`~fatiando.mesher.PrismArray` (see
+:func:`~fatiando.mesher.prisms2array` and
+:meth:`~fatiando.mesher.PrismMesh.toarray`). The compiled versions of the
+functions use the arrays of prism borders and physical properties directly,
+without creating a :class:`~fatiando.mesher.Prism` for each cell.
+
+The compiled functions can also use several threads (with OpenMP) to compute
+the fields on the computation points in parallel. Use the *njobs* argument to
+set the number of threads. The results do not depend on the number of threads
+used.
+
+For surveys with too many points to fit in memory, calculate the fields one
+chunk of points at a time (optionally with several processes):
+
+* :func:`~fatiando.gravmag._streamprism.stream`: Read the points from arrays,
+  memory-mapped files or an iterator and write the results to an array or
+  memory-mapped file
+
+**Backends**
+
+There are different implementations of the forward modeling functions: a
+compiled (Cython) version, a pure Python version using numpy, and a version
+that uses the `numexpr <https://github.com/pydata/numexpr>`_ package. Which one
+is fastest depends on the machine and on the size of the problem. Choose which
+one is used by :func:`~fatiando.gravmag._autoprism.potential`,
+:func:`~fatiando.gravmag._autoprism.gx` through
+:func:`~fatiando.gravmag._autoprism.gzz`, and
+:func:`~fatiando.gravmag._autoprism.tf` with:
+
+* :func:`~fatiando.gravmag._autoprism.set_backend`: Set the backend or let it
+  be chosen automatically by timing all of them
+* :func:`~fatiando.gravmag._autoprism.get_backend`: The current backend
 
 **References**
 
@@ -39,3 +119,7 @@ try:
     from fatiando.gravmag._cprism import *
 except ImportError:
     pass
+from fatiando.gravmag._fftprism import *
+from fatiando.gravmag._treeprism import *
+from fatiando.gravmag._streamprism import *
+from fatiando.gravmag._autoprism import *
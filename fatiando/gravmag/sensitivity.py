@@ -0,0 +1,596 @@
+"""
+Build and use large sensitivity (Jacobian) matrices of potential fields.
+
+The sensitivity matrices of 3D potential field inverse problems can easily be
+larger than the available memory (e.g., 50k data and 500k prisms take 100 GB in
+single precision). This module stores them on disk and operates on them block
+by block, using :func:`numpy.memmap`.
+
+**Out-of-core matrices**
+
+* :func:`~fatiando.gravmag.sensitivity.build`: Calculate the sensitivity matrix
+  of a prism model and store it in a file, one block of rows at a time
+* :func:`~fatiando.gravmag.sensitivity.load`: Open a sensitivity matrix stored
+  by :func:`~fatiando.gravmag.sensitivity.build`
+* :class:`~fatiando.gravmag.sensitivity.DiskMatrix`: A sensitivity matrix
+  stored on disk. Implements matrix-vector products that read the matrix in
+  blocks
+
+The matrix is stored as raw binary in the given file. The geometry of the
+problem (computation points, prisms, mesh bounds and shape, field, etc) is
+stored alongside it in a ``.meta.npz`` file.
+
+Use :meth:`~fatiando.gravmag.sensitivity.DiskMatrix.aslinearoperator` to solve
+the inverse problem with the iterative solvers of :mod:`scipy.sparse.linalg`
+(e.g., ``lsqr`` or ``cg``), which only need matrix-vector products.
+
+**Wavelet compression**
+
+* :func:`~fatiando.gravmag.sensitivity.compress`: Calculate the sensitivity
+  matrix of a prism mesh and compress each row with a 3D wavelet transform
+  (Li and Oldenburg, 2003)
+* :class:`~fatiando.gravmag.sensitivity.WaveletMatrix`: A compressed sensitivity
+  matrix stored as sparse wavelet coefficients. Implements matrix-vector
+  products that apply the wavelet transform implicitly
+
+The rows of sensitivity matrices are smooth, so most of their wavelet
+coefficients are very small. Usually less than 10% of the coefficients are
+needed for an error of 1%.
+
+**References**
+
+Li, Y., and D. W. Oldenburg (2003), Fast inversion of large-scale magnetic data
+using wavelet transforms and a logarithmic barrier method, Geophysical Journal
+International, 152(2), 251-265, doi:10.1046/j.1365-246X.2003.01766.x
+
+----
+
+"""
+import time
+
+import numpy
+import scipy.sparse
+import scipy.sparse.linalg
+
+from fatiando.mesher import PrismMesh, prisms2array
+from fatiando.gravmag import prism as pot_prism
+from fatiando import utils
+import fatiando.logger
+
+log = fatiando.logger.dummy('fatiando.gravmag.sensitivity')
+
+
+def build(fname, xp, yp, zp, prisms, field='gz', dtype=numpy.float32,
+          blocksize=1000, njobs=1):
+    """
+    Calculate a sensitivity matrix and store it on disk.
+
+    The matrix is calculated and written to the file one block of rows (data
+    points) at a time, so it never needs to fit in memory. Uses
+    :func:`~fatiando.gravmag._prism.kernel_matrix` to calculate each block.
+
+    Element (i, j) of the matrix is the effect of the j-th prism with unit
+    density on the i-th computation point.
+
+    Parameters:
+
+    * fname : str
+        Name of the file where the matrix will be stored. The metadata will be
+        stored in ``fname + '.meta.npz'``. Existing files are overwritten.
+    * xp, yp, zp : arrays
+        Arrays with the x, y, and z coordinates of the computation points.
+    * prisms : list of :class:`~fatiando.mesher.Prism`
+        The prisms of the model. Their physical properties are ignored.
+        *prisms* can also be a :class:`~fatiando.mesher.PrismMesh` or a
+        :class:`~fatiando.mesher.PrismArray`. Masked cells and None are not
+        included in the matrix.
+    * field : str
+        The field component. Can be any of ``'potential'``, ``'gx'``,
+        ``'gy'``, ``'gz'``, ``'gxx'``, ``'gxy'``, ``'gxz'``, ``'gyy'``,
+        ``'gyz'``, ``'gzz'``.
+    * dtype : numpy dtype
+        The type of the stored matrix. Can be ``numpy.float32`` or
+        ``numpy.float64``.
+    * blocksize : int
+        How many rows of the matrix are calculated and written at a time.
+    * njobs : int
+        Number of threads used to calculate each block.
+
+    Returns:
+
+    * matrix : :class:`~fatiando.gravmag.sensitivity.DiskMatrix`
+        The matrix stored on disk
+
+    """
+    if len(xp) != len(yp) != len(zp):
+        raise ValueError("Input arrays xp, yp, and zp must have same length!")
+    xp, yp, zp = [numpy.asarray(i, dtype=numpy.float) for i in [xp, yp, zp]]
+    array = prisms2array(prisms)
+    shape = (len(xp), array.size)
+    dtype = numpy.dtype(dtype)
+    log.info("Building sensitivity matrix on disk:")
+    log.info("  file: %s" % (fname))
+    log.info("  field: %s" % (field))
+    log.info("  shape: %s" % (str(shape)))
+    log.info("  type: %s" % (str(dtype)))
+    log.info("  size: %g MB" % (float(shape[0]*shape[1]*dtype.itemsize)/1e6))
+    tstart = time.time()
+    matrix = numpy.memmap(fname, dtype=dtype, mode='w+', shape=shape)
+    for start in xrange(0, shape[0], blocksize):
+        end = min(start + blocksize, shape[0])
+        matrix[start:end] = pot_prism.kernel_matrix(xp[start:end],
+            yp[start:end], zp[start:end], array, field, dtype=dtype,
+            njobs=njobs)
+        matrix.flush()
+    del matrix
+    if isinstance(prisms, PrismMesh):
+        meshbounds = numpy.array(prisms.bounds, dtype=numpy.float)
+        meshshape = numpy.array(prisms.shape, dtype=numpy.int)
+    else:
+        meshbounds = numpy.zeros(0)
+        meshshape = numpy.zeros(0, dtype=numpy.int)
+    numpy.savez(_metafile(fname), shape=numpy.array(shape),
+                dtype=numpy.array(dtype.str), field=numpy.array(field),
+                x=xp, y=yp, z=zp, prisms=array.get_bounds(),
+                index=array.index, meshbounds=meshbounds, meshshape=meshshape)
+    log.info("  time: %s" % (utils.sec2hms(time.time() - tstart)))
+    return DiskMatrix(fname, blocksize=blocksize)
+
+def load(fname, blocksize=1000):
+    """
+    Open a sensitivity matrix stored by
+    :func:`~fatiando.gravmag.sensitivity.build`.
+
+    Parameters:
+
+    * fname : str
+        Name of the file where the matrix is stored.
+    * blocksize : int
+        How many rows of the matrix are read at a time in the matrix-vector
+        products.
+
+    Returns:
+
+    * matrix : :class:`~fatiando.gravmag.sensitivity.DiskMatrix`
+        The matrix stored on disk
+
+    """
+    return DiskMatrix(fname, blocksize=blocksize)
+
+def _metafile(fname):
+    """
+    The name of the file with the metadata of matrix file *fname*.
+    """
+    return fname + '.meta.npz'
+
+class DiskMatrix(object):
+    """
+    A sensitivity matrix stored on disk.
+
+    Create one with :func:`~fatiando.gravmag.sensitivity.build` or
+    :func:`~fatiando.gravmag.sensitivity.load`.
+
+    The matrix is opened read-only as a :func:`numpy.memmap` and is only read
+    *blocksize* rows at a time. Each block is multiplied by the vector in the
+    precision of the matrix (so single precision blocks aren't copied to
+    double precision) and the products are accumulated in double precision.
+
+    Attributes:
+
+    * shape : tuple = (ndata, nprisms)
+        The shape of the matrix
+    * dtype : numpy dtype
+        The type of the matrix elements
+    * field : str
+        The field component
+    * x, y, z : arrays
+        The coordinates of the computation points (one per row)
+    * prisms : 2D array
+        The borders of the prisms (one per column) as
+        ``[[x1, x2, y1, y2, z1, z2], ...]``
+    * index : array
+        The index of each prism (column) in the list or mesh used to build the
+        matrix
+    * meshbounds, meshshape : tuples or None
+        The bounds and shape of the :class:`~fatiando.mesher.PrismMesh` used to
+        build the matrix. None if the model wasn't a mesh.
+
+    Parameters:
+
+    * fname : str
+        Name of the file where the matrix is stored.
+    * blocksize : int
+        How many rows of the matrix are read at a time in the matrix-vector
+        products.
+
+    """
+
+    def __init__(self, fname, blocksize=1000):
+        meta = numpy.load(_metafile(fname))
+        self.fname = fname
+        self.blocksize = blocksize
+        self.shape = tuple(int(i) for i in meta['shape'])
+        self.dtype = numpy.dtype(str(meta['dtype']))
+        self.field = str(meta['field'])
+        self.x, self.y, self.z = meta['x'], meta['y'], meta['z']
+        self.prisms = meta['prisms']
+        self.index = meta['index']
+        if len(meta['meshshape']) > 0:
+            self.meshbounds = tuple(meta['meshbounds'])
+            self.meshshape = tuple(int(i) for i in meta['meshshape'])
+        else:
+            self.meshbounds = None
+            self.meshshape = None
+        meta.close()
+        self.matrix = numpy.memmap(fname, dtype=self.dtype, mode='r',
+                                   shape=self.shape)
+
+    def blocks(self):
+        """
+        Iterate over the blocks of rows of the matrix.
+
+        Yields:
+
+        * start, end, block : int, int, 2D array
+            The block of the matrix with rows from *start* to *end - 1*
+
+        """
+        for start in xrange(0, self.shape[0], self.blocksize):
+            end = min(start + self.blocksize, self.shape[0])
+            yield start, end, self.matrix[start:end]
+
+    def matvec(self, vector):
+        """
+        Multiply the matrix by a vector (e.g., calculate the predicted data of
+        a density model).
+
+        Parameters:
+
+        * vector : array
+            Vector with one element per column (prism)
+
+        Returns:
+
+        * result : array
+            Vector with one element per row (data point)
+
+        """
+        vector = numpy.asarray(vector, dtype=numpy.float).ravel()
+        if len(vector) != self.shape[1]:
+            raise ValueError("Vector has %d elements but matrix has %d columns"
+                             % (len(vector), self.shape[1]))
+        vector = vector.astype(self.dtype)
+        result = numpy.zeros(self.shape[0], dtype=numpy.float)
+        for start, end, block in self.blocks():
+            result[start:end] = numpy.dot(block, vector)
+        return result
+
+    def rmatvec(self, vector):
+        """
+        Multiply the transpose of the matrix by a vector (e.g., the gradient of
+        the data-misfit function).
+
+        Parameters:
+
+        * vector : array
+            Vector with one element per row (data point)
+
+        Returns:
+
+        * result : array
+            Vector with one element per column (prism)
+
+        """
+        vector = numpy.asarray(vector, dtype=numpy.float).ravel()
+        if len(vector) != self.shape[0]:
+            raise ValueError("Vector has %d elements but matrix has %d rows"
+                             % (len(vector), self.shape[0]))
+        vector = vector.astype(self.dtype)
+        result = numpy.zeros(self.shape[1], dtype=numpy.float)
+        for start, end, block in self.blocks():
+            result += numpy.dot(vector[start:end], block)
+        return result
+
+    def aslinearoperator(self):
+        """
+        Get a :class:`scipy.sparse.linalg.LinearOperator` for this matrix.
+
+        Use it with the iterative solvers of :mod:`scipy.sparse.linalg`.
+
+        Returns:
+
+        * operator : :class:`scipy.sparse.linalg.LinearOperator`
+
+        """
+        return scipy.sparse.linalg.LinearOperator(self.shape,
+            matvec=self.matvec, rmatvec=self.rmatvec, dtype=numpy.float)
+
+def compress(xp, yp, zp, mesh, field='gz', tol=0.01, levels=None,
+             blocksize=1000, njobs=1):
+    """
+    Calculate a wavelet compressed sensitivity matrix of a prism mesh.
+
+    Each row of the sensitivity matrix is arranged in the 3D shape of the mesh
+    and transformed with a 3D discrete wavelet transform (orthonormal Haar
+    wavelets). Only the largest wavelet coefficients are kept, so that the
+    relative error of each row is at most *tol*. The coefficients are stored in
+    a sparse matrix. The rows are calculated *blocksize* at a time, so the full
+    dense matrix is never in memory.
+
+    See Li and Oldenburg (2003).
+
+    Parameters:
+
+    * xp, yp, zp : arrays
+        Arrays with the x, y, and z coordinates of the computation points.
+    * mesh : :class:`~fatiando.mesher.PrismMesh`
+        The mesh. Masked cells are not included in the matrix (they are
+        considered as zero in the wavelet transform).
+    * field : str
+        The field component. Can be any of ``'potential'``, ``'gx'``,
+        ``'gy'``, ``'gz'``, ``'gxx'``, ``'gxy'``, ``'gxz'``, ``'gyy'``,
+        ``'gyz'``, ``'gzz'``.
+    * tol : float
+        The maximum relative error (in the L2 norm) allowed for each row of the
+        matrix.
+    * levels : int or None
+        Number of levels of the wavelet transform. If None, will use as many
+        as the mesh shape allows.
+    * blocksize : int
+        How many rows of the matrix are calculated at a time.
+    * njobs : int
+        Number of threads used to calculate each block.
+
+    Returns:
+
+    * matrix : :class:`~fatiando.gravmag.sensitivity.WaveletMatrix`
+        The compressed matrix
+
+    References:
+
+    Li, Y., and D. W. Oldenburg (2003), Fast inversion of large-scale magnetic
+    data using wavelet transforms and a logarithmic barrier method, Geophysical
+    Journal International, 152(2), 251-265,
+    doi:10.1046/j.1365-246X.2003.01766.x
+
+    """
+    if not isinstance(mesh, PrismMesh):
+        raise ValueError("Wavelet compression only works with a PrismMesh")
+    if len(xp) != len(yp) != len(zp):
+        raise ValueError("Input arrays xp, yp, and zp must have same length!")
+    xp, yp, zp = [numpy.asarray(i, dtype=numpy.float) for i in [xp, yp, zp]]
+    array = mesh.toarray()
+    wavelet = WaveletMatrix(mesh.shape, array.index, len(xp), levels)
+    log.info("Wavelet compressed sensitivity matrix:")
+    log.info("  field: %s" % (field))
+    log.info("  shape: %s" % (str(wavelet.shape)))
+    log.info("  wavelet levels: %s" % (str(wavelet.levels)))
+    log.info("  relative error per row: %g" % (tol))
+    tstart = time.time()
+    blocks = []
+    for start in xrange(0, len(xp), blocksize):
+        end = min(start + blocksize, len(xp))
+        block = pot_prism.kernel_matrix(xp[start:end], yp[start:end],
+            zp[start:end], array, field, njobs=njobs)
+        coefs = wavelet.transform(block)
+        blocks.append(scipy.sparse.csr_matrix(_threshold(coefs, tol)))
+    wavelet.matrix = scipy.sparse.vstack(blocks, format='csr')
+    log.info("  compression: kept %g%% of the coefficients"
+             % (100.*wavelet.compression))
+    log.info("  time: %s" % (utils.sec2hms(time.time() - tstart)))
+    return wavelet
+
+def _threshold(coefs, tol):
+    """
+    Set to zero the smallest coefficients of each row of *coefs* so that the
+    norm of the removed coefficients is at most *tol* times the norm of the row.
+    """
+    sqr = coefs**2
+    order = numpy.argsort(sqr, axis=1)
+    rows = numpy.arange(len(coefs)).reshape((len(coefs), 1))
+    energy = numpy.cumsum(sqr[rows, order], axis=1)
+    allowed = (tol**2)*energy[:, -1:]
+    coefs[rows, order] = numpy.where(energy <= allowed, 0., coefs[rows, order])
+    return coefs
+
+def _haar_step(cubes, axis, n):
+    """
+    One level of the orthonormal Haar wavelet transform of the first *n*
+    elements of *cubes* along *axis*.
+    """
+    cubes = numpy.swapaxes(cubes, 0, axis)
+    even, odd = cubes[0:n:2].copy(), cubes[1:n:2].copy()
+    cubes[:n/2] = (even + odd)/numpy.sqrt(2)
+    cubes[n/2:n] = (even - odd)/numpy.sqrt(2)
+
+def _ihaar_step(cubes, axis, n):
+    """
+    Undo :func:`~fatiando.gravmag.sensitivity._haar_step`.
+    """
+    cubes = numpy.swapaxes(cubes, 0, axis)
+    approx, detail = cubes[:n/2].copy(), cubes[n/2:n].copy()
+    cubes[0:n:2] = (approx + detail)/numpy.sqrt(2)
+    cubes[1:n:2] = (approx - detail)/numpy.sqrt(2)
+
+class WaveletMatrix(object):
+    """
+    A sensitivity matrix compressed with a 3D wavelet transform.
+
+    Create one with :func:`~fatiando.gravmag.sensitivity.compress`.
+
+    The rows of the matrix are stored as sparse wavelet coefficients. The
+    matrix-vector products transform the vectors to (or from) the wavelet domain
+    implicitly, so the results are the same as with the dense matrix, apart
+    from the compression error.
+
+    Attributes:
+
+    * shape : tuple = (ndata, ncells)
+        The shape of the (uncompressed) matrix
+    * matrix : :class:`scipy.sparse.csr_matrix`
+        The wavelet coefficients of each row
+    * levels : tuple
+        Number of levels of the wavelet transform along each dimension of the
+        mesh
+    * index : array
+        The index in the mesh of each column of the matrix (non-masked cells)
+
+    Parameters:
+
+    * meshshape : tuple = (nz, ny, nx)
+        The shape of the mesh
+    * index : array
+        The index in the mesh of each column of the matrix
+    * ndata : int
+        The number of rows of the matrix
+    * levels : int or None
+        Number of levels of the wavelet transform. If None, will use as many
+        as the mesh shape allows.
+
+    """
+
+    def __init__(self, meshshape, index, ndata, levels=None):
+        self.meshshape = tuple(meshshape)
+        self.index = numpy.asarray(index)
+        self.shape = (ndata, len(self.index))
+        maxlevels = [int(numpy.log2(n)) for n in self.meshshape]
+        if levels is None:
+            self.levels = tuple(maxlevels)
+        else:
+            self.levels = tuple(min(levels, l) for l in maxlevels)
+        # Pad the mesh so that each dimension can be halved levels times
+        self.padshape = tuple(2**l*int(numpy.ceil(float(n)/2**l))
+                              for n, l in zip(self.meshshape, self.levels))
+        self.matrix = None
+
+    @property
+    def compression(self):
+        """
+        The fraction of the wavelet coefficients that are stored.
+        """
+        return float(self.matrix.nnz)/(self.shape[0]*numpy.prod(self.padshape))
+
+    def transform(self, vectors):
+        """
+        Calculate the wavelet coefficients of vectors with one element per
+        column of the matrix.
+
+        Parameters:
+
+        * vectors : 1D or 2D array
+            A vector or one vector per row
+
+        Returns:
+
+        * coefs : 1D or 2D array
+            The coefficients of each vector (same number of dimensions as
+            *vectors*)
+
+        """
+        vectors = numpy.asarray(vectors, dtype=numpy.float)
+        single = vectors.ndim == 1
+        vectors = numpy.atleast_2d(vectors)
+        nz, ny, nx = self.meshshape
+        cubes = numpy.zeros((len(vectors), nz*ny*nx), dtype=numpy.float)
+        cubes[:, self.index] = vectors
+        padded = numpy.zeros((len(vectors),) + self.padshape,
+                             dtype=numpy.float)
+        padded[:, :nz, :ny, :nx] = cubes.reshape((len(vectors), nz, ny, nx))
+        for level in xrange(max(self.levels)):
+            for axis in xrange(3):
+                if level < self.levels[axis]:
+                    _haar_step(padded, axis + 1,
+                               self.padshape[axis]/2**level)
+        coefs = padded.reshape((len(vectors), -1))
+        if single:
+            return coefs[0]
+        return coefs
+
+    def inverse(self, coefs):
+        """
+        Transform wavelet coefficients back to vectors with one element per
+        column of the matrix.
+
+        Parameters:
+
+        * coefs : 1D or 2D array
+            The coefficients of a vector or of one vector per row
+
+        Returns:
+
+        * vectors : 1D or 2D array
+            The vectors (same number of dimensions as *coefs*)
+
+        """
+        coefs = numpy.asarray(coefs, dtype=numpy.float)
+        single = coefs.ndim == 1
+        padded = numpy.atleast_2d(coefs).reshape((-1,) + self.padshape).copy()
+        for level in reversed(xrange(max(self.levels))):
+            for axis in reversed(xrange(3)):
+                if level < self.levels[axis]:
+                    _ihaar_step(padded, axis + 1,
+                                self.padshape[axis]/2**level)
+        nz, ny, nx = self.meshshape
+        vectors = padded[:, :nz, :ny, :nx].reshape((len(padded), -1))
+        vectors = vectors[:, self.index]
+        if single:
+            return vectors[0]
+        return vectors
+
+    def matvec(self, vector):
+        """
+        Multiply the matrix by a vector (e.g., calculate the predicted data of
+        a density model).
+
+        Parameters:
+
+        * vector : array
+            Vector with one element per column (non-masked cell)
+
+        Returns:
+
+        * result : array
+            Vector with one element per row (data point)
+
+        """
+        vector = numpy.asarray(vector, dtype=numpy.float).ravel()
+        if len(vector) != self.shape[1]:
+            raise ValueError("Vector has %d elements but matrix has %d columns"
+                             % (len(vector), self.shape[1]))
+        return self.matrix.dot(self.transform(vector))
+
+    def rmatvec(self, vector):
+        """
+        Multiply the transpose of the matrix by a vector (e.g., the gradient of
+        the data-misfit function).
+
+        Parameters:
+
+        * vector : array
+            Vector with one element per row (data point)
+
+        Returns:
+
+        * result : array
+            Vector with one element per column (non-masked cell)
+
+        """
+        vector = numpy.asarray(vector, dtype=numpy.float).ravel()
+        if len(vector) != self.shape[0]:
+            raise ValueError("Vector has %d elements but matrix has %d rows"
+                             % (len(vector), self.shape[0]))
+        return self.inverse(self.matrix.T.dot(vector))
+
+    def aslinearoperator(self):
+        """
+        Get a :class:`scipy.sparse.linalg.LinearOperator` for this matrix.
+
+        Use it with the iterative solvers of :mod:`scipy.sparse.linalg`.
+
+        Returns:
+
+        * operator : :class:`scipy.sparse.linalg.LinearOperator`
+
+        """
+        return scipy.sparse.linalg.LinearOperator(self.shape,
+            matvec=self.matvec, rmatvec=self.rmatvec, dtype=numpy.float)
@@ -41,118 +41,39 @@ Then the total-field anomaly caused by the sphere is
 
 **Gravity**
 
-
+Calculates the gravitational potential, acceleration and gradient tensor.
+The sphere is treated as a point mass at its center, which is exact outside of
+it.
+
+* :func:`~fatiando.gravmag.sphere.potential`
+* :func:`~fatiando.gravmag.sphere.gx`
+* :func:`~fatiando.gravmag.sphere.gy`
+* :func:`~fatiando.gravmag.sphere.gz`
+* :func:`~fatiando.gravmag.sphere.gxx`
+* :func:`~fatiando.gravmag.sphere.gxy`
+* :func:`~fatiando.gravmag.sphere.gxz`
+* :func:`~fatiando.gravmag.sphere.gyy`
+* :func:`~fatiando.gravmag.sphere.gyz`
+* :func:`~fatiando.gravmag.sphere.gzz`
+
+Use :func:`~fatiando.gravmag.sphere.fields` to calculate several components in
+a single pass and :func:`~fatiando.gravmag.sphere.kernel_matrix` to build the
+sensitivity matrix of a set of spheres (e.g., an equivalent layer of point
+masses).
+
+All functions also accept a :class:`~fatiando.mesher.SphereArray`. If the
+Cython module ``_csphere`` is compiled, the computations are done in compiled
+code and the points can be computed in parallel (argument *njobs*).
 
 **References**
 
+Blakely, R. J. (1995), Potential Theory in Gravity and Magnetic Applications,
+Cambridge University Press.
 
 ----
 """
-import numpy
-
-from fatiando.constants import SI2EOTVOS, SI2MGAL, G, CM, T2NT
-from fatiando import utils
-
-
-def tf(xp, yp, zp, spheres, inc, dec):
-    """
-    Calculate the total-field anomaly of spheres.
-
-    .. note:: Input units are SI. Output is in nT
-
-    Parameters:
-
-    * xp, yp, zp : arrays
-        The x, y, and z coordinates where the anomaly will be calculated
-    * spheres : list of :class:`fatiando.mesher.Sphere`
-        The spheres. Spheres must have the properties ``'magnetization'``,
-        ``'inclination'`` and ``'declination'``. If ``'inclination'`` and
-        ``'declination'`` are not present, will use the values of *inc* and
-        *dec* instead. Those without ``'magnetization'`` will be ignored.
-    * inc : float
-        The inclination of the regional field (in degrees)
-    * dec : float
-        The declination of the regional field (in degrees)
-
-    Returns:
-
-    * tf : array
-        The total-field anomaly
-
-    """
-    if xp.shape != yp.shape != zp.shape:
-        raise ValueError("Input arrays xp, yp, and zp must have same shape!")
-    tf = numpy.zeros_like(xp)
-    # Calculate the 3 components of the unit vector in the direction of the
-    # regional field
-    fx, fy, fz = utils.dircos(inc, dec)
-    for sphere in spheres:
-        if sphere is None or 'magnetization' not in sphere.props:
-            continue
-        radius = sphere.radius
-        mag = sphere.props['magnetization']
-        # Get the 3 components of the unit vector in the direction of the
-        # magnetization from the inclination and declination
-        if 'inclination' in sphere.props and 'declination' in sphere.props:
-            inclination = sphere.props['inclination']
-            declination = sphere.props['declination']
-            mx, my, mz = utils.dircos(inclination, declination)
-        # If not given, use in the direction of the regional field
-        else:
-            mx, my, mz = fx, fy, fz
-        # First thing to do is make the computation point P the origin of the
-        # coordinate system
-        x = sphere.x - xp
-        y = sphere.y - yp
-        z = sphere.z - zp
-        # Calculate the 3 components of B
-        dotprod = mx*x + my*y + mz*z
-        r_sqr = x**2 + y**2 + z**2
-        r5 = r_sqr**(2.5)
-        moment = mag*(4.*numpy.pi*(radius**3)/3.)
-        bx = moment*(3*dotprod*x - r_sqr*mx)/r5
-        by = moment*(3*dotprod*y - r_sqr*my)/r5
-        bz = moment*(3*dotprod*z - r_sqr*mz)/r5
-        tf = tf + (fx*bx + fy*by + fz*bz)
-    tf *= CM*T2NT
-    return tf
-
-def gz(xp, yp, zp, spheres):
-    """
-    Calculates the :math:`g_z` gravity acceleration component.
-
-    .. note:: The coordinate system of the input parameters is to be x -> North,
-        y -> East and z -> Down.
-
-    .. note:: All input values in SI and output in mGal!
-
-    Parameters:
-
-    * xp, yp, zp : arrays
-        The x, y, and z coordinates where the field will be calculated
-    * spheres : list of :class:`fatiando.mesher.Sphere`
-        The spheres. Spheres must have the property ``'density'``. Those without
-        will be ignored.
-
-    Returns:
-
-    * res : array
-        The field calculated on xp, yp, zp
-
-    """
-
-    if xp.shape != yp.shape != zp.shape:
-        raise ValueError("Input arrays xp, yp, and zp must have same shape!")
-    res = numpy.zeros_like(xp)
-    for sphere in spheres:
-        if sphere is None or 'density' not in sphere.props:
-            continue
-        radius = sphere.radius
-        density = sphere.props['density']
-        dx = sphere.x - xp
-        dy = sphere.y - yp
-        dz = sphere.z - zp
-        r_cb = (dx**2 + dy**2 + dz**2)**(1.5)
-        mass = density*4.*numpy.pi*(radius**3)/3.
-        res = res - mass*dz/r_cb
-    return G*SI2MGAL*res
+from fatiando.gravmag._sphere import *
+try:
+    from fatiando.gravmag._csphere import *
+except ImportError:
+    pass
@@ -1,120 +1,505 @@
 """
 Calculates the potential fields of a tesseroid.
+
+The fields are integrated numerically with the Gauss-Legendre Quadrature
+(GLQ). Tesseroids that are closer to a computation point than *ratio* times
+their size are divided into 8 smaller ones until they are far enough away. The
+*order* argument sets the number of GLQ nodes used in each dimension. It can
+be an int or a list with the orders in longitude, latitude and radius. Using
+more nodes makes the integration more accurate but slower. The nodes and
+weights of each order are calculated only once and cached.
+
+The default *ratio* (1 for the potential and gravity and 3 for the gradient
+tensor) is conservative. Use :func:`~fatiando.gravmag.tesseroid.calibrate` to
+find the cheapest *ratio* and *order* that give the accuracy you need for the
+size of your tesseroids and the heights of your computation points.
+
+If *maxorder* is given, a tesseroid that is too close to the point is
+integrated with a higher order (up to *maxorder* nodes in each dimension)
+instead of being divided when that takes fewer evaluations of the kernel. The
+order needed is estimated assuming that the GLQ error decays as
+``(size/(2*distance))**(2*order)``. This only happens for tesseroids farther
+than half their size from the point, so the closest ones are still divided.
+
+Use :func:`~fatiando.gravmag.tesseroid.fields` to calculate several
+components at once (e.g., the full gravity gradient tensor). The tesseroids
+are divided only once and the terms shared by the components are calculated
+only once for each GLQ node.
+
+If the computation points are on a regular grid with the same longitude
+spacing as the cells of a :class:`~fatiando.mesher.TesseroidMesh` (e.g., a
+global model), use :func:`~fatiando.gravmag.tesseroid.fft` or
+:class:`~fatiando.gravmag.tesseroid.FFTOperator`. They are much faster
+because the field of each row of the mesh is a convolution along longitude.
+
+Use :func:`~fatiando.gravmag.tesseroid.kernel_matrix` to build the
+sensitivity matrix of a tesseroid model for inversions.
+
+The functions have a *njobs* argument that sets the number of threads used to
+calculate the computation points in parallel (with OpenMP). The results are
+the same regardless of the number of threads. Only the compiled (Cython)
+version runs in parallel.
+
+The functions have a *dtype* argument that sets the type of the output array
+(``numpy.float64`` or ``numpy.float32``). The calculations are always done in
+double precision, so single precision only rounds the result (relative error
+smaller than 1e-7).
 """
+import timeit
+
 import numpy
+import scipy.sparse.linalg
 
-from fatiando.mesher import Tesseroid
+from fatiando.mesher import Tesseroid, TesseroidMesh
 from fatiando.constants import SI2MGAL, SI2EOTVOS, MEAN_EARTH_RADIUS, G
+from fatiando.gravmag._prism import _check_dtype, _check_components
+from fatiando.gravmag import half_sph_shell
 
 
+from fatiando.gravmag import _tesseroid
 try:
-    from fatiando.gravmag import _ctesseroid as _kernels
+    from fatiando.gravmag import _ctesseroid
 except ImportError:
-    from fatiando.gravmag import _tesseroid as _kernels
+    _ctesseroid = None
 
 
-_glq_nodes = numpy.array([-0.577350269, 0.577350269])
-_glq_weights = numpy.array([1., 1.])
+# The maximum GLQ order (number of nodes in each dimension) allowed. Must be
+# the same as MAX_ORDER in _ctesseroid.pyx.
+_MAX_ORDER = 32
+# Cache of the GLQ nodes and weights of each order and of the tables with all
+# orders used by the compiled code
+_glq_cache = {}
+_glq_table_cache = []
+# The unit conversions of each field. Multiply gz by -1 so that z is pointing
+# down
+_SCALE = {'potential':1., 'gx':SI2MGAL, 'gy':SI2MGAL, 'gz':-SI2MGAL,
+          'gxx':SI2EOTVOS, 'gxy':SI2EOTVOS, 'gxz':SI2EOTVOS, 'gyy':SI2EOTVOS,
+          'gyz':SI2EOTVOS, 'gzz':SI2EOTVOS}
 
 
-def potential(lons, lats, heights, tesseroids, dens=None, ratio=1.):
+def potential(lons, lats, heights, tesseroids, dens=None, ratio=1., order=2,
+              maxorder=None, njobs=1, dtype=numpy.float):
     """
     Calculate the gravitational potential due to a tesseroid model.
     """
-    return _optimal_discretize(tesseroids, lons, lats, heights,
-        _kernels.potential, ratio, dens)
+    dtype = _check_dtype(dtype)
+    result = _optimal_discretize(tesseroids, lons, lats, heights,
+        ['potential'], ratio, order, maxorder, dens, njobs)[0]
+    return result.astype(dtype, copy=False)
 
-def gx(lons, lats, heights, tesseroids, dens=None, ratio=1.):
+def gx(lons, lats, heights, tesseroids, dens=None, ratio=1., order=2,
+       maxorder=None, njobs=1, dtype=numpy.float):
     """
     Calculate the x (North) component of the gravitational attraction due to a
     tesseroid model.
     """
-    return SI2MGAL*_optimal_discretize(tesseroids, lons, lats, heights,
-        _kernels.gx, ratio, dens)
+    dtype = _check_dtype(dtype)
+    result = SI2MGAL*_optimal_discretize(tesseroids, lons, lats, heights,
+        ['gx'], ratio, order, maxorder, dens, njobs)[0]
+    return result.astype(dtype, copy=False)
 
-def gy(lons, lats, heights, tesseroids, dens=None, ratio=1.):
+def gy(lons, lats, heights, tesseroids, dens=None, ratio=1., order=2,
+       maxorder=None, njobs=1, dtype=numpy.float):
     """
     Calculate the y (East) component of the gravitational attraction due to a
     tesseroid model.
     """
-    return SI2MGAL*_optimal_discretize(tesseroids, lons, lats, heights,
-        _kernels.gy, ratio, dens)
+    dtype = _check_dtype(dtype)
+    result = SI2MGAL*_optimal_discretize(tesseroids, lons, lats, heights,
+        ['gy'], ratio, order, maxorder, dens, njobs)[0]
+    return result.astype(dtype, copy=False)
 
-def gz(lons, lats, heights, tesseroids, dens=None, ratio=1.):
+def gz(lons, lats, heights, tesseroids, dens=None, ratio=1., order=2,
+       maxorder=None, njobs=1, dtype=numpy.float):
     """
     Calculate the z (radial) component of the gravitational attraction due to a
     tesseroid model.
     """
+    dtype = _check_dtype(dtype)
     # Multiply by -1 so that z is pointing down for gz and the gravity anomaly
     # doesn't look inverted (ie, negative for positive density)
-    return -1*SI2MGAL*_optimal_discretize(tesseroids, lons, lats, heights,
-        _kernels.gz, ratio, dens)
+    result = -1*SI2MGAL*_optimal_discretize(tesseroids, lons, lats, heights,
+        ['gz'], ratio, order, maxorder, dens, njobs)[0]
+    return result.astype(dtype, copy=False)
 
-def gxx(lons, lats, heights, tesseroids, dens=None, ratio=3):
+def gxx(lons, lats, heights, tesseroids, dens=None, ratio=3, order=2,
+        maxorder=None, njobs=1, dtype=numpy.float):
     """
     Calculate the xx (North-North) component of the gravity gradient tensor
     due to a tesseroid model.
     """
-    return SI2EOTVOS*_optimal_discretize(tesseroids, lons, lats, heights,
-        _kernels.gxx, ratio, dens)
+    dtype = _check_dtype(dtype)
+    result = SI2EOTVOS*_optimal_discretize(tesseroids, lons, lats, heights,
+        ['gxx'], ratio, order, maxorder, dens, njobs)[0]
+    return result.astype(dtype, copy=False)
 
-def gxy(lons, lats, heights, tesseroids, dens=None, ratio=3):
+def gxy(lons, lats, heights, tesseroids, dens=None, ratio=3, order=2,
+        maxorder=None, njobs=1, dtype=numpy.float):
     """
     Calculate the xy (North-East) component of the gravity gradient tensor
     due to a tesseroid model.
     """
-    return SI2EOTVOS*_optimal_discretize(tesseroids, lons, lats, heights,
-        _kernels.gxy, ratio, dens)
+    dtype = _check_dtype(dtype)
+    result = SI2EOTVOS*_optimal_discretize(tesseroids, lons, lats, heights,
+        ['gxy'], ratio, order, maxorder, dens, njobs)[0]
+    return result.astype(dtype, copy=False)
 
-def gxz(lons, lats, heights, tesseroids, dens=None, ratio=3):
+def gxz(lons, lats, heights, tesseroids, dens=None, ratio=3, order=2,
+        maxorder=None, njobs=1, dtype=numpy.float):
     """
     Calculate the xz (North-radial) component of the gravity gradient tensor
     due to a tesseroid model.
     """
-    return SI2EOTVOS*_optimal_discretize(tesseroids, lons, lats, heights,
-        _kernels.gxz, ratio, dens)
+    dtype = _check_dtype(dtype)
+    result = SI2EOTVOS*_optimal_discretize(tesseroids, lons, lats, heights,
+        ['gxz'], ratio, order, maxorder, dens, njobs)[0]
+    return result.astype(dtype, copy=False)
 
-def gyy(lons, lats, heights, tesseroids, dens=None, ratio=3):
+def gyy(lons, lats, heights, tesseroids, dens=None, ratio=3, order=2,
+        maxorder=None, njobs=1, dtype=numpy.float):
     """
     Calculate the yy (East-East) component of the gravity gradient tensor
     due to a tesseroid model.
     """
-    return SI2EOTVOS*_optimal_discretize(tesseroids, lons, lats, heights,
-        _kernels.gyy, ratio, dens)
+    dtype = _check_dtype(dtype)
+    result = SI2EOTVOS*_optimal_discretize(tesseroids, lons, lats, heights,
+        ['gyy'], ratio, order, maxorder, dens, njobs)[0]
+    return result.astype(dtype, copy=False)
 
-def gyz(lons, lats, heights, tesseroids, dens=None, ratio=3):
+def gyz(lons, lats, heights, tesseroids, dens=None, ratio=3, order=2,
+        maxorder=None, njobs=1, dtype=numpy.float):
     """
     Calculate the yz (East-radial) component of the gravity gradient tensor
     due to a tesseroid model.
     """
-    return SI2EOTVOS*_optimal_discretize(tesseroids, lons, lats, heights,
-        _kernels.gyz, ratio, dens)
+    dtype = _check_dtype(dtype)
+    result = SI2EOTVOS*_optimal_discretize(tesseroids, lons, lats, heights,
+        ['gyz'], ratio, order, maxorder, dens, njobs)[0]
+    return result.astype(dtype, copy=False)
 
 
-def gzz(lons, lats, heights, tesseroids, dens=None, ratio=3):
+def gzz(lons, lats, heights, tesseroids, dens=None, ratio=3, order=2,
+        maxorder=None, njobs=1, dtype=numpy.float):
     """
     Calculate the zz (radial-radial) component of the gravity gradient tensor
     due to a tesseroid model.
     """
+    dtype = _check_dtype(dtype)
     result = SI2EOTVOS*_optimal_discretize(tesseroids, lons, lats, heights,
-        _kernels.gzz, ratio, dens)
-    return result
+        ['gzz'], ratio, order, maxorder, dens, njobs)[0]
+    return result.astype(dtype, copy=False)
+
+def fields(lons, lats, heights, tesseroids, components=None, dens=None,
+           ratio=None, order=2, maxorder=None, njobs=1, dtype=numpy.float):
+    """
+    Calculate several components of the gravitational field of a tesseroid
+    model in a single pass.
+
+    The tesseroids are divided only once for all components and the terms
+    shared by the integrands (distances, sines and cossines) are calculated
+    once per GLQ node. This is much faster than calling each function
+    separately, e.g., for the full gravity gradient tensor.
+
+    *components* is a list with any of ``'potential'``, ``'gx'``, ``'gy'``,
+    ``'gz'``, ``'gxx'``, ``'gxy'``, ``'gxz'``, ``'gyy'``, ``'gyz'``,
+    ``'gzz'`` (all of them if None). Returns a list with one array for each
+    component, in the same units as the single component functions. If
+    *ratio* is None, uses 3 if any of the components is of the gradient tensor
+    and 1 otherwise.
+    """
+    dtype = _check_dtype(dtype)
+    components = _check_components(components)
+    if ratio is None:
+        ratio = _default_ratio(components)
+    result = _optimal_discretize(tesseroids, lons, lats, heights, components,
+                                 ratio, order, maxorder, dens, njobs)
+    return [(_SCALE[c]*res).astype(dtype, copy=False)
+            for c, res in zip(components, result)]
+
+def fft(lons, lats, heights, shape, mesh, field='gz', dens=None, ratio=None,
+        order=2, maxorder=None, njobs=1):
+    """
+    Calculate a field of a regular tesseroid mesh on a regular grid using the
+    FFT along longitude.
+
+    If the computation points are on a regular grid with the same longitude
+    spacing as the mesh cells, the effect of a cell only depends on the
+    difference in longitude between the cell and the point. So, for each layer
+    and row of the mesh and each row of the grid, the field is a 1D
+    convolution along longitude. This function calculates the effect of a
+    single cell (a kernel ring) for each of these and applies them with FFTs.
+    If the mesh covers the whole globe in longitude, the convolutions are
+    circular. The result is the same as given by the direct functions (e.g.,
+    :func:`~fatiando.gravmag.tesseroid.gz`), apart from floating point
+    round-off.
+
+    The grid must be in the order given by :func:`fatiando.gridder.regular`
+    (longitude varies first, then latitude). Each row of the grid can have a
+    different latitude and height.
+
+    *shape* is the shape of the grid ``(nlat, nlon)``. *mesh* is a
+    :class:`~fatiando.mesher.TesseroidMesh` (masked cells are ignored). *dens*
+    is the density of each cell (if None, uses the ``'density'`` property of
+    the mesh). The other arguments are the same as for the direct functions.
+    """
+    if dens is None:
+        dens = mesh.props['density']
+    return FFTOperator(lons, lats, heights, shape, mesh, field, ratio, order,
+                       maxorder, njobs).matvec(dens)
 
-def _optimal_discretize(tesseroids, lons, lats, heights, kernel, ratio, dens):
+class FFTOperator(object):
     """
-    Calculate the effect of a given kernal in the most precise way by adaptively
-    discretizing the tesseroids into smaller ones.
+    The sensitivity matrix of a regular tesseroid mesh on a regular grid
+    applied with FFTs along longitude.
+
+    Calculates the FFT of the kernel rings (the effect of one cell of each
+    layer and row of the mesh on each row of the grid) when created. Then
+    :meth:`~fatiando.gravmag.tesseroid.FFTOperator.matvec` and
+    :meth:`~fatiando.gravmag.tesseroid.FFTOperator.rmatvec` are convolutions
+    and correlations with these kernels. Use it for inversion without ever
+    building the sensitivity matrix.
+
+    See :func:`~fatiando.gravmag.tesseroid.fft` for the restrictions on the
+    grid and the arguments.
     """
-    ndata = len(lons)
-    # Convert things to radians
+
+    def __init__(self, lons, lats, heights, shape, mesh, field='gz',
+                 ratio=None, order=2, maxorder=None, njobs=1):
+        ny, nx = shape
+        self.shape = (nx*ny, mesh.size)
+        self.gridshape = (ny, nx)
+        self.meshshape = mesh.shape
+        self.mask = numpy.array(mesh.mask, dtype=numpy.int)
+        rings, self.index = _kernel_rings(lons, lats, heights, shape, mesh,
+                                          field, ratio, order, maxorder, njobs)
+        self.fftsize = rings.shape[-1]
+        self.kernels = numpy.fft.rfft(rings, axis=-1)
+
+    def matvec(self, dens):
+        """
+        Calculate the field of a density model (multiply the sensitivity matrix
+        by the density vector).
+
+        *dens* is the density of each cell of the mesh. Returns the field on
+        the grid points.
+        """
+        dens = numpy.array(dens, dtype=numpy.float).ravel()
+        if len(dens) != self.shape[1]:
+            raise ValueError("Need %d densities but got %d"
+                             % (self.shape[1], len(dens)))
+        dens[self.mask] = 0
+        transform = numpy.fft.rfft(dens.reshape(self.meshshape),
+                                   n=self.fftsize, axis=-1)
+        res = numpy.fft.irfft(
+            numpy.einsum('kjrf,kjf->rf', self.kernels, transform),
+            n=self.fftsize, axis=-1)
+        return res[:, self.index].ravel()
+
+    def rmatvec(self, data):
+        """
+        Multiply the transpose of the sensitivity matrix by a data vector.
+
+        *data* has one value per grid point. Returns one value per mesh cell
+        (zero for masked cells).
+        """
+        mr, my, mx = self.meshshape
+        ny, nx = self.gridshape
+        data = numpy.asarray(data, dtype=numpy.float).ravel()
+        if len(data) != self.shape[0]:
+            raise ValueError("Need %d data but got %d"
+                             % (self.shape[0], len(data)))
+        padded = numpy.zeros((ny, self.fftsize))
+        for i, p in enumerate(self.index):
+            padded[:, p] += data.reshape(self.gridshape)[:, i]
+        transform = numpy.fft.rfft(padded, axis=-1)
+        res = numpy.fft.irfft(
+            numpy.einsum('kjrf,rf->kjf', numpy.conj(self.kernels), transform),
+            n=self.fftsize, axis=-1)[:, :, :mx].ravel()
+        res[self.mask] = 0
+        return res
+
+    def aslinearoperator(self):
+        """
+        Get a :class:`scipy.sparse.linalg.LinearOperator` for this matrix.
+
+        Use it with the iterative solvers of :mod:`scipy.sparse.linalg`.
+        """
+        return scipy.sparse.linalg.LinearOperator(self.shape,
+            matvec=self.matvec, rmatvec=self.rmatvec, dtype=numpy.float)
+
+def calibrate(heights, size, thickness, field='gz', tolerance=10**(-3),
+              ratios=None, orders=None, njobs=1):
+    """
+    Find the cheapest distance/size *ratio* and GLQ *order* that calculate a
+    field with a given accuracy.
+
+    Models half of a spherical shell with tesseroids of the given *size* and
+    *thickness* and compares the field calculated on top of it with the
+    analytical solution of :mod:`fatiando.gravmag.half_sph_shell`. For each
+    order, tries the ratios in increasing order until the maximum relative
+    error at *heights* is smaller than *tolerance*. Returns the combination
+    that needed the fewest kernel evaluations.
+
+    Use the size of the tesseroids of your model and the heights of your
+    computation points.
+
+    Parameters:
+
+    * heights : list
+        The heights of the computation points (in meters)
+    * size : float or tuple = (dlon, dlat)
+        The size of the tesseroids in degrees. Must divide 180.
+    * thickness : float
+        The thickness of the tesseroids (in meters)
+    * field : str
+        The field component. Can be ``'potential'``, ``'gz'``, ``'gxx'``,
+        ``'gyy'`` or ``'gzz'``.
+    * tolerance : float
+        The maximum relative error allowed
+    * ratios : list or None
+        The distance/size ratios to try. If None, uses 0.5 to 8.
+    * orders : list or None
+        The GLQ orders to try. If None, uses 2, 3 and 4.
+    * njobs : int
+        Number of threads used in the computations
+
+    Returns:
+
+    * [ratio, order, tried]
+        The best ratio and order and a list with a dict for every combination
+        tried. The dicts have keys ``'ratio'``, ``'order'``, ``'error'``
+        (maximum relative error), ``'kernels'`` (total number of kernel
+        evaluations) and ``'time'`` (in seconds).
+
+    """
+    if field not in ['potential', 'gz', 'gxx', 'gyy', 'gzz']:
+        raise ValueError("Can't calibrate field '%s'" % (field))
+    if ratios is None:
+        ratios = [0.5, 1, 1.5, 2, 3, 4, 5, 6, 8]
+    if orders is None:
+        orders = [2, 3, 4]
+    if numpy.ndim(size) == 0:
+        size = [size, size]
+    shape = [int(round(180./s)) for s in size]
+    if not numpy.allclose([180./n for n in shape], size):
+        raise ValueError("Invalid tesseroid size '%s'. Must divide 180"
+                         % (str(size)))
+    shell = TesseroidMesh((-90, 90, -90, 90, 0, -thickness),
+                          (1, shape[1], shape[0]))
+    heights = numpy.asarray(heights, dtype=numpy.float)
+    lons = numpy.zeros_like(heights)
+    true = getattr(half_sph_shell, field)(heights, 0, -thickness, 1.)
+    tried = []
+    for order in orders:
+        for ratio in sorted(ratios):
+            counts = numpy.empty(len(heights), dtype=numpy.int)
+            start = timeit.default_timer()
+            res = _SCALE[field]*_optimal_discretize(shell, lons, lons,
+                heights, [field], ratio, order, None, 1., njobs, counts)[0]
+            tried.append(dict(ratio=ratio, order=order,
+                              error=float(numpy.max(numpy.abs(res - true)/
+                                                    numpy.abs(true))),
+                              kernels=int(numpy.sum(counts)),
+                              time=timeit.default_timer() - start))
+            if tried[-1]['error'] <= tolerance:
+                break
+    good = [t for t in tried if t['error'] <= tolerance]
+    if not good:
+        raise ValueError("No ratio and order tried has a relative error "
+                         + "smaller than %g. Smallest error was %g"
+                         % (tolerance, min(t['error'] for t in tried)))
+    best = min(good, key=lambda t: (t['kernels'], t['time']))
+    return best['ratio'], best['order'], tried
+
+def kernel_matrix(lons, lats, heights, tesseroids, field='gz', ratio=None,
+                  order=2, maxorder=None, shape=None, dtype=numpy.float,
+                  njobs=1):
+    """
+    Build the sensitivity (Jacobian) matrix of a gravitational field of a
+    tesseroid model.
+
+    Element (i, j) of the matrix is the effect of the j-th tesseroid with unit
+    density on the i-th computation point. So the predicted data of a density
+    model is ``numpy.dot(matrix, densities)``. Tesseroids that are None (e.g.,
+    masked cells of a :class:`~fatiando.mesher.TesseroidMesh`) don't get a
+    column in the matrix.
+
+    The compiled version calculates the whole matrix in a single pass over the
+    computation points, in parallel with *njobs* threads.
+
+    If the computation points are on a regular grid with the same longitude
+    spacing as the cells of a :class:`~fatiando.mesher.TesseroidMesh` (see
+    :func:`~fatiando.gravmag.tesseroid.fft`), pass the *shape* of the grid
+    ``(nlat, nlon)``. Then only the effect of one cell of each layer and row
+    of the mesh is calculated. The other columns are the same values rotated
+    in longitude.
+
+    *dtype* is the type of the matrix (``numpy.float64`` or
+    ``numpy.float32``). The other arguments are the same as for the forward
+    modeling functions. Returns the matrix with shape (number of points,
+    number of tesseroids).
+    """
+    dtype = _check_dtype(dtype)
+    _check_components([field])
+    if ratio is None:
+        ratio = _default_ratio([field])
+    if shape is None:
+        cells = [t for t in tesseroids if t is not None]
+        return _kernel_columns(cells, lons, lats, heights, field, ratio,
+                               order, maxorder, njobs).astype(dtype,
+                                                              copy=False)
+    mesh = tesseroids
+    rings, index = _kernel_rings(lons, lats, heights, shape, mesh, field,
+                                 ratio, order, maxorder, njobs)
+    mr, my, mx = mesh.shape
+    ny, nx = shape
+    masked = numpy.zeros(mesh.size, dtype=numpy.bool)
+    masked[mesh.mask] = True
+    # The column of each cell in the matrix
+    columns = numpy.cumsum(~masked) - 1
+    # The element of the kernel ring for each point in a row and each cell in
+    # a row of the mesh
+    rotation = (index[:, None] - numpy.arange(mx)) % rings.shape[-1]
+    matrix = numpy.empty((ny*nx, mesh.size - numpy.sum(masked)), dtype=dtype)
+    for k in xrange(mr):
+        for j in xrange(my):
+            cells = (k*my + j)*mx + numpy.arange(mx)
+            use = ~masked[cells]
+            block = rings[k, j][:, rotation].reshape((ny*nx, mx))
+            matrix[:, columns[cells[use]]] = block[:, use]
+    return matrix
+
+def _optimal_discretize(tesseroids, lons, lats, heights, fields, ratio, order,
+                        maxorder, dens, njobs=1, counts=None):
+    """
+    Calculate the effect of the given fields in the most precise way by
+    adaptively discretizing the tesseroids into smaller ones.
+
+    The tesseroids are divided only once for all *fields*. Returns an array
+    with one row for each field (in SI units). If *counts* is an int array,
+    puts the number of kernel evaluations (GLQ nodes) for each point in it.
+    """
+    order, maxorder = _check_order(order, maxorder)
     d2r = numpy.pi/180.
-    rlons = d2r*lons
-    rlats = d2r*lats
-    # Transform the heights into radii
-    radii = MEAN_EARTH_RADIUS + heights
+    points = _Points(lons, lats, heights)
+    if _ctesseroid is not None:
+        bounds, density = _tesseroids2array(tesseroids, dens)
+        nodes, weights = _glq_table()
+        return _ctesseroid.adaptive(fields, bounds, density, points.lon,
+                                    points.sinlon, points.coslon,
+                                    points.sinlat, points.coslat,
+                                    points.radius, order, maxorder, nodes,
+                                    weights, ratio, njobs, counts)
+    if njobs < 1:
+        raise ValueError("Invalid number of jobs '%s'. Must be >= 1" % (njobs))
+    kernels = [getattr(_tesseroid, f) for f in fields]
+    nodes, weights = zip(*[_glq(n) for n in order])
+    ndata = len(points.radius)
     # Start the computations
-    result = numpy.zeros(ndata, numpy.float)
-    maxsize = 10000
+    result = numpy.zeros((len(fields), ndata), numpy.float)
+    if counts is None:
+        counts = numpy.empty(ndata, dtype=numpy.int)
+    counts[:] = 0
     for tesseroid in tesseroids:
         if (tesseroid is None or
             ('density' not in tesseroid.props and dens is None)):
@@ -129,23 +514,230 @@ def _optimal_discretize(tesseroids, lons, lats, heights, kernel, ratio, dens):
             size = max([MEAN_EARTH_RADIUS*d2r*(tess.e - tess.w),
                         MEAN_EARTH_RADIUS*d2r*(tess.n - tess.s),
                         tess.top - tess.bottom])
-            distances = _distance(tess, rlons, rlats, radii, points_to_calc)
+            distances = _distance(tess, points.subset(points_to_calc))
             too_close = (distances > 0) & (distances < ratio*size)
-            need_divide = points_to_calc[too_close]
+            raised = _raise_order(distances[too_close], size, ratio, order,
+                                  maxorder)
+            # Integrate with a higher order the points where that is cheaper
+            # than dividing the tesseroid
+            for orders in set(tuple(i) for i in raised if i[0]):
+                use = numpy.all(raised == orders, axis=1)
+                index = points_to_calc[too_close][use]
+                subset = points.subset(index)
+                glq = zip(*[_glq(n) for n in orders])
+                for i, kernel in enumerate(kernels):
+                    result[i, index] += G*density*kernel(tess, subset, *glq)
+                counts[index] += numpy.prod(orders)
+            need_divide = points_to_calc[too_close][raised[:, 0] == 0]
             dont_divide = points_to_calc[~too_close]
             if len(need_divide):
-                #if len(lifo) + 8 > maxsize:
-                #    log.warning("Maximum LIFO size reached")
-                #    dont_divide.extend(need_divide)
-                #else:
-                #    lifo.extend([need_divide, t] for t in _split(tess))
                 lifo.extend([need_divide, t] for t in _split(tess))
             if len(dont_divide):
-                result[dont_divide] += G*density*kernel(
-                    tess, rlons[dont_divide], rlats[dont_divide],
-                    radii[dont_divide], _glq_nodes, _glq_weights)
+                subset = points.subset(dont_divide)
+                for i, kernel in enumerate(kernels):
+                    result[i, dont_divide] += G*density*kernel(
+                        tess, subset, nodes, weights)
+                counts[dont_divide] += numpy.prod(order)
     return result
 
+def _default_ratio(fields):
+    """
+    The default distance/size ratio for calculating *fields*: 3 if any of
+    them is a component of the gradient tensor and 1 otherwise.
+    """
+    return max([1] + [3 for f in fields if len(f) == 3])
+
+def _kernel_columns(tesseroids, lons, lats, heights, field, ratio, order,
+                    maxorder, njobs):
+    """
+    The effect of each tesseroid with unit density on the points (one column
+    for each tesseroid).
+    """
+    if _ctesseroid is None:
+        matrix = numpy.empty((len(lons), len(tesseroids)))
+        for j, tesseroid in enumerate(tesseroids):
+            matrix[:, j] = _optimal_discretize([tesseroid], lons, lats,
+                heights, [field], ratio, order, maxorder, 1., njobs)[0]
+    else:
+        order, maxorder = _check_order(order, maxorder)
+        points = _Points(lons, lats, heights)
+        bounds, density = _tesseroids2array(tesseroids, 1.)
+        nodes, weights = _glq_table()
+        matrix = _ctesseroid.kernel_matrix(field, bounds, points.lon,
+                                           points.sinlon, points.coslon,
+                                           points.sinlat, points.coslat,
+                                           points.radius, order, maxorder,
+                                           nodes, weights, ratio, njobs)
+    matrix *= _SCALE[field]
+    return matrix
+
+def _kernel_rings(lons, lats, heights, shape, mesh, field, ratio, order,
+                  maxorder, njobs):
+    """
+    The effect of the first cell of each layer and row of a regular mesh on
+    each row of a regular grid, for all longitude offsets needed (kernel
+    rings).
+
+    Returns the rings (shape: mesh layers, mesh rows, grid rows, offsets) and
+    the index of the ring element of each grid column for the first cell of a
+    mesh row. For the other cells, the index is shifted by the cell number.
+
+    If the mesh goes around the globe, the offsets are periodic. If not, the
+    rings are long enough that the circular convolutions with them are equal
+    to the linear ones.
+    """
+    ny, nx = shape
+    if len(lons) != nx*ny or len(lats) != nx*ny or len(heights) != nx*ny:
+        raise ValueError("Input arrays lons, lats, and heights must have "
+                         + "nlon*nlat elements")
+    longrid, latgrid, hgrid = [numpy.reshape(numpy.asarray(i, numpy.float),
+                                             shape)
+                               for i in [lons, lats, heights]]
+    dlon, dlat, dr = mesh.dims
+    if ((nx > 1 and not numpy.allclose(numpy.diff(longrid, axis=1), dlon))
+        or not numpy.allclose(longrid, longrid[0])
+        or not numpy.allclose(latgrid.T, latgrid[:, 0])
+        or not numpy.allclose(hgrid.T, hgrid[:, 0])):
+        raise ValueError("Computation points must be a regular grid with "
+                         + "the same longitude spacing as the mesh cells "
+                         + "and constant height along longitude")
+    _check_components([field])
+    if ratio is None:
+        ratio = _default_ratio([field])
+    mr, my, mx = mesh.shape
+    w, e, s, n, top, bottom = mesh.bounds
+    if numpy.allclose(e - w, 360.):
+        offsets = numpy.arange(mx)
+        index = numpy.arange(nx) % mx
+    else:
+        offsets = numpy.arange(-(mx - 1), nx)
+        index = numpy.arange(nx) + mx - 1
+    klons = numpy.tile(longrid[0, 0] + dlon*offsets, ny)
+    klats = numpy.repeat(latgrid[:, 0], len(offsets))
+    kheights = numpy.repeat(hgrid[:, 0], len(offsets))
+    cells = [Tesseroid(w, w + dlon, s + dlat*j, s + dlat*(j + 1),
+                       top + dr*k, top + dr*(k + 1))
+             for k in xrange(mr) for j in xrange(my)]
+    columns = _kernel_columns(cells, klons, klats, kheights, field, ratio,
+                              order, maxorder, njobs)
+    rings = columns.T.reshape((mr, my, ny, len(offsets)))
+    return rings, index
+
+def _check_order(order, maxorder):
+    """
+    Get the GLQ order in each dimension as a list of 3 ints and maxorder as an
+    int (0 if None).
+    """
+    if numpy.ndim(order) == 0:
+        order = [order]*3
+    if len(order) != 3:
+        raise ValueError("Invalid GLQ order '%s'. Must be an int or a list "
+                         % (str(order)) + "of 3 ints")
+    order = [int(n) for n in order]
+    if maxorder is None:
+        maxorder = 0
+    for n in order + [maxorder]:
+        if n > _MAX_ORDER:
+            raise ValueError("Invalid GLQ order %d. Maximum is %d"
+                             % (n, _MAX_ORDER))
+    if min(order) < 1:
+        raise ValueError("Invalid GLQ order '%s'. Must be >= 1"
+                         % (str(order)))
+    return order, int(maxorder)
+
+def _glq(order):
+    """
+    The GLQ nodes and weights of the given order (cached).
+    """
+    if order not in _glq_cache:
+        _glq_cache[order] = numpy.polynomial.legendre.leggauss(order)
+    return _glq_cache[order]
+
+def _glq_table():
+    """
+    Tables with the GLQ nodes and weights of all orders for the compiled code.
+    Row n has the n nodes (weights) of order n.
+    """
+    if not _glq_table_cache:
+        nodes = numpy.zeros((_MAX_ORDER + 1, _MAX_ORDER))
+        weights = numpy.zeros((_MAX_ORDER + 1, _MAX_ORDER))
+        for n in xrange(1, _MAX_ORDER + 1):
+            nodes[n, :n], weights[n, :n] = _glq(n)
+        _glq_table_cache.extend([nodes, weights])
+    return _glq_table_cache
+
+def _raise_order(distance, size, ratio, order, maxorder):
+    """
+    Find the GLQ orders that integrate a tesseroid that is too close to the
+    computation points (at *distance*) as accurately as dividing it.
+
+    Assumes that the error decays as ``(size/(2*distance))**(2*order)``, so
+    the order is multiplied by ``log(2*ratio)/log(2*distance/size)``.
+
+    Returns an array with the orders for each point. The orders are 0 where
+    dividing the tesseroid is cheaper or needs more than *maxorder* nodes.
+    """
+    raised = numpy.zeros((len(distance), 3), dtype=numpy.int)
+    if maxorder == 0:
+        return raised
+    far = distance > 0.5*size
+    factor = numpy.log(2.*ratio)/numpy.log(2.*distance[far]/size)
+    orders = numpy.ceil(factor[:, None]*numpy.array(order)).astype(numpy.int)
+    cheaper = ((orders.max(axis=1) <= maxorder)
+               & (numpy.prod(orders, axis=1) < 8*numpy.prod(order)))
+    raised[numpy.flatnonzero(far)[cheaper]] = orders[cheaper]
+    return raised
+
+class _Points(object):
+    """
+    The computation points with the sines, cossines and powers of their
+    coordinates calculated only once and shared by all tesseroids.
+
+    Longitudes and latitudes are converted to radians and heights to radii.
+    """
+
+    def __init__(self, lons, lats, heights):
+        d2r = numpy.pi/180.
+        self.lon = d2r*numpy.asarray(lons, dtype=numpy.float)
+        lat = d2r*numpy.asarray(lats, dtype=numpy.float)
+        self.sinlon = numpy.sin(self.lon)
+        self.coslon = numpy.cos(self.lon)
+        self.sinlat = numpy.sin(lat)
+        self.coslat = numpy.cos(lat)
+        self.radius = (MEAN_EARTH_RADIUS +
+                       numpy.asarray(heights, dtype=numpy.float))
+        self.radius_sqr = self.radius**2
+
+    def subset(self, index):
+        """
+        The points in *index* (without calculating the sines and cossines
+        again).
+        """
+        points = _Points.__new__(_Points)
+        for name, values in self.__dict__.iteritems():
+            setattr(points, name, values[index])
+        return points
+
+def _tesseroids2array(tesseroids, dens):
+    """
+    Get the bounds ``[w, e, s, n, top, bottom]`` and the densities of the
+    tesseroids as arrays. Skips tesseroids that are None or have no density.
+    """
+    bounds = []
+    density = []
+    for tesseroid in tesseroids:
+        if (tesseroid is None or
+            ('density' not in tesseroid.props and dens is None)):
+            continue
+        bounds.append([tesseroid.w, tesseroid.e, tesseroid.s, tesseroid.n,
+                       tesseroid.top, tesseroid.bottom])
+        if dens is not None:
+            density.append(dens)
+        else:
+            density.append(tesseroid.props['density'])
+    bounds = numpy.array(bounds, dtype=numpy.float).reshape((len(bounds), 6))
+    return bounds, numpy.array(density, dtype=numpy.float)
+
 def _split(tesseroid):
     dlon = 0.5*(tesseroid.e - tesseroid.w)
     dlat = 0.5*(tesseroid.n - tesseroid.s)
@@ -158,18 +750,19 @@ def _split(tesseroid):
         for i in wests for j in souths for k in bottoms]
     return split
 
-def _distance(tesseroid, lon, lat, radius, points):
-    lons = lon[points]
-    lats = lat[points]
-    radii = radius[points]
+def _distance(tesseroid, points):
+    """
+    The distance between the *points* (a _Points) and the center of the top of
+    the tesseroid.
+    """
     d2r = numpy.pi/180.
     tes_radius = tesseroid.top + MEAN_EARTH_RADIUS
     tes_lat = d2r*0.5*(tesseroid.s + tesseroid.n)
     tes_lon = d2r*0.5*(tesseroid.w + tesseroid.e)
+    coslon = (points.coslon*numpy.cos(tes_lon) +
+              points.sinlon*numpy.sin(tes_lon))
     distance = numpy.sqrt(
-        radii**2 + tes_radius**2 - 2.*radii*tes_radius*(
-            numpy.sin(lats)*numpy.sin(tes_lat) +
-            numpy.cos(lats)*numpy.cos(tes_lat)*
-            numpy.cos(lons - tes_lon)
-        ))
+        points.radius_sqr + tes_radius**2 - 2.*points.radius*tes_radius*(
+            points.sinlat*numpy.sin(tes_lat) +
+            points.coslat*numpy.cos(tes_lat)*coslon))
     return distance
@@ -17,6 +17,11 @@ Generate and operate on various kinds of meshes and geometric elements
 * :class:`~fatiando.mesher.PrismRelief`
 * :class:`~fatiando.mesher.TesseroidMesh`
 
+**Arrays of geometric elements**
+
+* :class:`~fatiando.mesher.PrismArray`
+* :class:`~fatiando.mesher.SphereArray`
+
 **Utility functions**
 
 * :func:`~fatiando.mesher.extract`: Extract the values of a physicalr
@@ -25,6 +30,10 @@ Generate and operate on various kinds of meshes and geometric elements
   value falls outside a given range
 * :func:`~fatiando.mesher.vremove`: Remove the cells with a given physical
   property value
+* :func:`~fatiando.mesher.prisms2array`: Convert a list of prisms or a mesh
+  into a :class:`~fatiando.mesher.PrismArray`
+* :func:`~fatiando.mesher.spheres2array`: Convert a list of spheres into a
+  :class:`~fatiando.mesher.SphereArray`
 
 ----
 
@@ -470,6 +479,145 @@ class Prism(GeometricElement):
         zc = 0.5*(self.z1 + self.z2)
         return [xc, yc, zc]
 
+class PrismArray(object):
+    """
+    Store a set of 3D right rectangular prisms in contiguous arrays.
+
+    Instead of one :class:`~fatiando.mesher.Prism` object per cell, the
+    borders and physical properties of all prisms are kept in 1D arrays (one
+    for each of x1, x2, y1, y2, z1, z2 and one for each physical property).
+    The forward modeling functions in :mod:`fatiando.gravmag.prism` work
+    directly on these arrays, without creating any Python objects.
+
+    Use :func:`~fatiando.mesher.prisms2array` or
+    :meth:`~fatiando.mesher.PrismMesh.toarray` to create one from a list of
+    prisms or a mesh.
+
+    PrismArray can also be used as a list of prisms. Accessing an element or
+    iterating will return a :class:`~fatiando.mesher.Prism`.
+
+    .. note:: The coordinate system used is x -> North, y -> East and z -> Down
+
+    Parameters:
+
+    * x1, x2 : arrays
+        South and north borders of the prisms
+    * y1, y2 : arrays
+        West and east borders of the prisms
+    * z1, z2 : arrays
+        Top and bottom of the prisms
+    * props : dict
+        Physical properties of the prisms. Each key should be the name of a
+        physical property. The corresponding value should be an array with the
+        value of that property for each prism. Prisms that don't have the
+        property should have ``numpy.nan`` instead.
+    * index : array or None
+        The index of each prism in the list or mesh it came from. If None, will
+        be ``0, 1, ..., size - 1``.
+
+    Examples:
+
+        >>> prisms = PrismArray([0, 1], [1, 2], [0, 0], [1, 1], [0, 0], [2, 3],
+        ...                     {'density':[2000, 3000]})
+        >>> print len(prisms)
+        2
+        >>> print prisms.z2[1]
+        3.0
+        >>> for p in prisms:
+        ...     print p
+        x1:0 | x2:1 | y1:0 | y2:1 | z1:0 | z2:2 | density:2000
+        x1:1 | x2:2 | y1:0 | y2:1 | z1:0 | z2:3 | density:3000
+
+    """
+
+    def __init__(self, x1, x2, y1, y2, z1, z2, props=None, index=None):
+        object.__init__(self)
+        self.x1 = numpy.ascontiguousarray(x1, dtype=numpy.float)
+        self.x2 = numpy.ascontiguousarray(x2, dtype=numpy.float)
+        self.y1 = numpy.ascontiguousarray(y1, dtype=numpy.float)
+        self.y2 = numpy.ascontiguousarray(y2, dtype=numpy.float)
+        self.z1 = numpy.ascontiguousarray(z1, dtype=numpy.float)
+        self.z2 = numpy.ascontiguousarray(z2, dtype=numpy.float)
+        self.size = len(self.x1)
+        for a in [self.x2, self.y1, self.y2, self.z1, self.z2]:
+            if len(a) != self.size:
+                raise ValueError("Prism borders must all have the same length")
+        self.props = {}
+        if props is not None:
+            for p in props:
+                self.addprop(p, props[p])
+        if index is None:
+            index = numpy.arange(self.size)
+        self.index = numpy.asarray(index, dtype=numpy.int)
+        # The index of the current prism in an iteration. Needed when the array
+        # is used as an iterator
+        self.i = 0
+
+    def __len__(self):
+        return self.size
+
+    def __getitem__(self, index):
+        if index >= self.size or index < -self.size:
+            raise IndexError('prism array index out of range')
+        # To walk backwards in the list
+        if index < 0:
+            index = self.size + index
+        props = dict((p, self.props[p][index]) for p in self.props
+                     if not numpy.isnan(self.props[p][index]))
+        return Prism(self.x1[index], self.x2[index], self.y1[index],
+                     self.y2[index], self.z1[index], self.z2[index],
+                     props=props)
+
+    def __iter__(self):
+        self.i = 0
+        return self
+
+    def next(self):
+        if self.i >= self.size:
+            raise StopIteration
+        prism = self.__getitem__(self.i)
+        self.i += 1
+        return prism
+
+    def addprop(self, prop, values):
+        """
+        Add physical property values to the prisms.
+
+        Parameters:
+
+        * prop : str
+            Name of the physical property.
+        * values :  list or array
+            Value of this physical property in each prism. Use ``numpy.nan``
+            for prisms that don't have this property.
+
+        """
+        values = numpy.ascontiguousarray(values, dtype=numpy.float)
+        if len(values) != self.size:
+            raise ValueError(
+                "Property '%s' has %d values but there are %d prisms"
+                % (prop, len(values), self.size))
+        self.props[prop] = values
+
+    def get_bounds(self):
+        """
+        Get the borders of all prisms.
+
+        Returns:
+
+        * bounds : 2D array
+            Array with one ``[x1, x2, y1, y2, z1, z2]`` row for each prism
+
+        Examples:
+
+            >>> prisms = PrismArray([0], [1], [2], [3], [4], [5])
+            >>> print prisms.get_bounds().tolist()
+            [[0.0, 1.0, 2.0, 3.0, 4.0, 5.0]]
+
+        """
+        return numpy.transpose([self.x1, self.x2, self.y1, self.y2, self.z1,
+                                self.z2])
+
 class Tesseroid(GeometricElement):
     """
     Create a tesseroid (spherical prism).
@@ -588,6 +736,125 @@ class Sphere(GeometricElement):
         names.extend((p, self.props[p]) for p in sorted(self.props))
         return ' | '.join('%s:%g' % (n, v) for n, v in names)
 
+class SphereArray(object):
+    """
+    Store a set of spheres in contiguous arrays.
+
+    Instead of one :class:`~fatiando.mesher.Sphere` object per sphere, the
+    centers, radii and physical properties of all spheres are kept in 1D
+    arrays. The forward modeling functions in :mod:`fatiando.gravmag.sphere`
+    work directly on these arrays, without creating any Python objects. Use
+    this for large sets of sources, e.g. equivalent layers.
+
+    Use :func:`~fatiando.mesher.spheres2array` to create one from a list of
+    spheres.
+
+    SphereArray can also be used as a list of spheres. Accessing an element or
+    iterating will return a :class:`~fatiando.mesher.Sphere`.
+
+    .. note:: The coordinate system used is x -> North, y -> East and z -> Down
+
+    Parameters:
+
+    * x, y, z : arrays
+        The coordinates of the centers of the spheres
+    * radius : array or float
+        The radii of the spheres. If a float, all spheres will have the same
+        radius.
+    * props : dict
+        Physical properties of the spheres. Each key should be the name of a
+        physical property. The corresponding value should be an array with the
+        value of that property for each sphere. Spheres that don't have the
+        property should have ``numpy.nan`` instead.
+    * index : array or None
+        The index of each sphere in the list it came from. If None, will be
+        ``0, 1, ..., size - 1``.
+
+    Examples:
+
+        >>> spheres = SphereArray([0, 1], [2, 3], [10, 20], 5,
+        ...                       {'density':[2000, 3000]})
+        >>> print len(spheres)
+        2
+        >>> print spheres.radius.tolist()
+        [5.0, 5.0]
+        >>> for s in spheres:
+        ...     print s
+        x:0 | y:2 | z:10 | radius:5 | density:2000
+        x:1 | y:3 | z:20 | radius:5 | density:3000
+
+    """
+
+    def __init__(self, x, y, z, radius, props=None, index=None):
+        object.__init__(self)
+        self.x = numpy.ascontiguousarray(x, dtype=numpy.float)
+        self.y = numpy.ascontiguousarray(y, dtype=numpy.float)
+        self.z = numpy.ascontiguousarray(z, dtype=numpy.float)
+        self.size = len(self.x)
+        self.radius = numpy.ascontiguousarray(
+            radius*numpy.ones(self.size), dtype=numpy.float)
+        for a in [self.y, self.z, self.radius]:
+            if len(a) != self.size:
+                raise ValueError(
+                    "Sphere centers and radii must all have the same length")
+        self.props = {}
+        if props is not None:
+            for p in props:
+                self.addprop(p, props[p])
+        if index is None:
+            index = numpy.arange(self.size)
+        self.index = numpy.asarray(index, dtype=numpy.int)
+        # The index of the current sphere in an iteration. Needed when the
+        # array is used as an iterator
+        self.i = 0
+
+    def __len__(self):
+        return self.size
+
+    def __getitem__(self, index):
+        if index >= self.size or index < -self.size:
+            raise IndexError('sphere array index out of range')
+        # To walk backwards in the list
+        if index < 0:
+            index = self.size + index
+        props = dict((p, self.props[p][index]) for p in self.props
+                     if not numpy.isnan(self.props[p][index]))
+        return Sphere(self.x[index], self.y[index], self.z[index],
+                      self.radius[index], props=props)
+
+    def __iter__(self):
+        self.i = 0
+        return self
+
+    def next(self):
+        if self.i >= self.size:
+            raise StopIteration
+        sphere = self.__getitem__(self.i)
+        self.i += 1
+        return sphere
+
+    def addprop(self, prop, values):
+        """
+        Add physical property values to the spheres.
+
+        Parameters:
+
+        * prop : str
+            Name of the physical property.
+        * values :  list, array or float
+            Value of this physical property in each sphere. Use ``numpy.nan``
+            for spheres that don't have this property. If a float, all spheres
+            will have the same value.
+
+        """
+        values = numpy.ascontiguousarray(values*numpy.ones(self.size),
+                                         dtype=numpy.float)
+        if len(values) != self.size:
+            raise ValueError(
+                "Property '%s' has %d values but there are %d spheres"
+                % (prop, len(values), self.size))
+        self.props[prop] = values
+
 class PolygonalPrism(GeometricElement):
     """
     Create a 3D prism with polygonal crossection.
@@ -1041,6 +1308,50 @@ class PrismMesh(object):
         layer = [self.__getitem__(p) for p in xrange(start, end)]
         return layer
 
+    def toarray(self):
+        """
+        Convert the mesh into a :class:`~fatiando.mesher.PrismArray`.
+
+        All borders and physical properties are computed at once with array
+        operations, so no :class:`~fatiando.mesher.Prism` is created. Masked
+        prisms are not included. The ``index`` attribute of the output has the
+        index of each prism in the mesh.
+
+        Returns:
+
+        * prisms : :class:`~fatiando.mesher.PrismArray`
+            The prisms in the mesh
+
+        Examples::
+
+            >>> mesh = PrismMesh((0, 2, 0, 4, 0, 3), (1, 2, 2))
+            >>> mesh.addprop('density', [1, 2, 3, 4])
+            >>> mesh.mask.append(1)
+            >>> prisms = mesh.toarray()
+            >>> print prisms.index.tolist()
+            [0, 2, 3]
+            >>> for p in prisms:
+            ...     print p
+            x1:0 | x2:1 | y1:0 | y2:2 | z1:0 | z2:3 | density:1
+            x1:0 | x2:1 | y1:2 | y2:4 | z1:0 | z2:3 | density:3
+            x1:1 | x2:2 | y1:2 | y2:4 | z1:0 | z2:3 | density:4
+
+        """
+        nz, ny, nx = self.shape
+        index = numpy.arange(self.size)
+        if self.mask:
+            index = numpy.setdiff1d(index, self.mask)
+        k = index/(nx*ny)
+        j = (index - k*(nx*ny))/nx
+        i = (index - k*(nx*ny) - j*nx)
+        x1 = self.bounds[0] + self.dims[0]*i
+        y1 = self.bounds[2] + self.dims[1]*j
+        z1 = self.bounds[4] + self.dims[2]*k
+        props = dict((p, numpy.asarray(self.props[p], dtype=numpy.float)[index])
+                     for p in self.props)
+        return PrismArray(x1, x1 + self.dims[0], y1, y1 + self.dims[1], z1,
+                          z1 + self.dims[2], props=props, index=index)
+
     def dump(self, meshfile, propfile, prop):
         r"""
         Dump the mesh to a file in the format required by UBC-GIF program
@@ -1148,6 +1459,7 @@ class TesseroidMesh(PrismMesh):
         PrismMesh.__init__(self, bounds, shape, props)
         self.zdown = False
         self.dump = None
+        self.toarray = None
 
 def extract(prop, prisms):
     """
@@ -1277,3 +1589,116 @@ def vremove(value, prop, cells):
         if c is not None and (prop not in c.props or c.props[prop] != value)]
     return removed
 
+def prisms2array(prisms):
+    """
+    Convert a list of prisms or a mesh into a
+    :class:`~fatiando.mesher.PrismArray`.
+
+    Elements of *prisms* that are None are not included. Prisms that don't have
+    one of the physical properties get ``numpy.nan`` as its value. If *prisms*
+    is already a :class:`~fatiando.mesher.PrismArray`, will return it
+    unchanged.
+
+    Parameters:
+
+    * prisms : list of :class:`~fatiando.mesher.Prism`
+        The prisms. Can also be a :class:`~fatiando.mesher.PrismMesh` or any
+        object that has a ``toarray`` method.
+
+    Returns:
+
+    * array : :class:`~fatiando.mesher.PrismArray`
+        The prisms stored in arrays
+
+    Examples:
+
+        >>> prisms = [Prism(1, 2, 3, 4, 5, 6, {'density':1000}),
+        ...           None,
+        ...           Prism(1, 2, 3, 4, 6, 7, {'magnetization':2})]
+        >>> array = prisms2array(prisms)
+        >>> print array.index.tolist()
+        [0, 2]
+        >>> print array.z1.tolist()
+        [5.0, 6.0]
+        >>> print array.props['density'].tolist()
+        [1000.0, nan]
+        >>> for p in array:
+        ...     print p
+        x1:1 | x2:2 | y1:3 | y2:4 | z1:5 | z2:6 | density:1000
+        x1:1 | x2:2 | y1:3 | y2:4 | z1:6 | z2:7 | magnetization:2
+
+    """
+    if isinstance(prisms, PrismArray):
+        return prisms
+    if getattr(prisms, 'toarray', None) is not None:
+        return prisms.toarray()
+    index, cells = [], []
+    for i, p in enumerate(prisms):
+        if p is None:
+            continue
+        index.append(i)
+        cells.append(p)
+    bounds = numpy.reshape([[p.x1, p.x2, p.y1, p.y2, p.z1, p.z2]
+                            for p in cells], (len(cells), 6))
+    names = set()
+    for p in cells:
+        names.update(p.props)
+    props = dict((n, [p.props.get(n, numpy.nan) for p in cells])
+                 for n in names)
+    x1, x2, y1, y2, z1, z2 = bounds.T
+    return PrismArray(x1, x2, y1, y2, z1, z2, props=props, index=index)
+
+def spheres2array(spheres):
+    """
+    Convert a list of spheres into a :class:`~fatiando.mesher.SphereArray`.
+
+    Elements of *spheres* that are None are not included. Spheres that don't
+    have one of the physical properties get ``numpy.nan`` as its value. If
+    *spheres* is already a :class:`~fatiando.mesher.SphereArray`, will return
+    it unchanged.
+
+    Parameters:
+
+    * spheres : list of :class:`~fatiando.mesher.Sphere`
+        The spheres.
+
+    Returns:
+
+    * array : :class:`~fatiando.mesher.SphereArray`
+        The spheres stored in arrays
+
+    Examples:
+
+        >>> spheres = [Sphere(1, 2, 3, 4, {'density':1000}),
+        ...            None,
+        ...            Sphere(5, 6, 7, 8, {'magnetization':2})]
+        >>> array = spheres2array(spheres)
+        >>> print array.index.tolist()
+        [0, 2]
+        >>> print array.radius.tolist()
+        [4.0, 8.0]
+        >>> print array.props['density'].tolist()
+        [1000.0, nan]
+        >>> for s in array:
+        ...     print s
+        x:1 | y:2 | z:3 | radius:4 | density:1000
+        x:5 | y:6 | z:7 | radius:8 | magnetization:2
+
+    """
+    if isinstance(spheres, SphereArray):
+        return spheres
+    index, cells = [], []
+    for i, s in enumerate(spheres):
+        if s is None:
+            continue
+        index.append(i)
+        cells.append(s)
+    centers = numpy.reshape([[s.x, s.y, s.z, s.radius] for s in cells],
+                            (len(cells), 4))
+    names = set()
+    for s in cells:
+        names.update(s.props)
+    props = dict((n, [s.props.get(n, numpy.nan) for s in cells])
+                 for n in names)
+    x, y, z, radius = centers.T
+    return SphereArray(x, y, z, radius, props=props, index=index)
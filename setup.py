@@ -14,12 +14,25 @@ try:
         Extension("fatiando.gravmag._cprism",
                   [join('fatiando', 'gravmag', '_cprism.pyx')],
                   libraries=['m'],
+                  extra_compile_args=['-O3', '-fopenmp'],
+                  extra_link_args=['-fopenmp'],
+                  include_dirs=[numpy.get_include()]),
+        Extension("fatiando.gravmag._cpolyprism",
+                  [join('fatiando', 'gravmag', '_cpolyprism.pyx')],
+                  libraries=['m'],
                   extra_compile_args=['-O3'],
                   include_dirs=[numpy.get_include()]),
         Extension("fatiando.gravmag._ctesseroid",
                   [join('fatiando', 'gravmag', '_ctesseroid.pyx')],
                   libraries=['m'],
-                  extra_compile_args=['-O3'],
+                  extra_compile_args=['-O3', '-fopenmp'],
+                  extra_link_args=['-fopenmp'],
+                  include_dirs=[numpy.get_include()]),
+        Extension("fatiando.gravmag._csphere",
+                  [join('fatiando', 'gravmag', '_csphere.pyx')],
+                  libraries=['m'],
+                  extra_compile_args=['-O3', '-fopenmp'],
+                  extra_link_args=['-fopenmp'],
                   include_dirs=[numpy.get_include()]),
         Extension("fatiando.seismic._cttime2d",
                   [join('fatiando', 'seismic', '_cttime2d.pyx')],
@@ -2,6 +2,7 @@ import numpy as np
 
 from fatiando.mesher import PolygonalPrism, Prism
 from fatiando import gravmag
+from fatiando.gravmag import _polyprism, _cpolyprism
 
 model = None
 prismmodel = None
@@ -104,3 +105,62 @@ def test_tf():
     errormsg = 'max diff: %g | max polyprism: %g | max prism: %g' % (
         max(diff), max(polyprism), max(prism))
     assert np.all(diff <= max(prism)*precision), errormsg
+
+def test_dtype():
+    "gravmag.polyprism single precision output"
+    double = gravmag.polyprism.gz(xp, yp, zp, model)
+    single = gravmag.polyprism.gz(xp, yp, zp, model, dtype=np.float32)
+    assert double.dtype == np.float64
+    assert single.dtype == np.float32
+    assert np.all(single == double.astype(np.float32))
+
+def test_cython_vs_python():
+    "gravmag.polyprism Cython against Python on irregular polygons"
+    angles = np.linspace(0, 2*np.pi, 30, endpoint=False)
+    radius = 300 + 100*np.cos(3*angles)
+    props = {'density':-1., 'magnetization':3, 'inclination':60,
+             'declination':10}
+    irregular = [PolygonalPrism(np.transpose([radius*np.cos(angles),
+                                              radius*np.sin(angles)]),
+                                50, 500, props),
+                 None,
+                 PolygonalPrism([[0, 0], [300, -50], [100, 400]], 10, 200,
+                                {'density':2., 'magnetization':1})]
+    for f in ['gz', 'gxx', 'gxy', 'gxz', 'gyy', 'gyz', 'gzz', 'tf']:
+        args = [xp, yp, zp, irregular]
+        if f == 'tf':
+            args.extend([inc, dec])
+        py = getattr(_polyprism, f)(*args)
+        cy = getattr(_cpolyprism, f)(*args)
+        diff = np.abs(py - cy)
+        assert np.all(diff <= np.abs(py).max()*10**(-10)), \
+            '%s max diff: %g' % (f, max(diff))
+    pyfields = _polyprism.fields(xp, yp, zp, irregular)
+    cyfields = _cpolyprism.fields(xp, yp, zp, irregular)
+    for f, py, cy in zip(_polyprism._FIELDS, pyfields, cyfields):
+        diff = np.abs(py - cy)
+        assert np.all(diff <= np.abs(py).max()*10**(-10)), \
+            'fields %s max diff: %g' % (f, max(diff))
+
+def test_fields():
+    "gravmag.polyprism.fields against the separate functions"
+    components = ['gz', 'gxx', 'gxy', 'gxz', 'gyy', 'gyz', 'gzz']
+    for module in [_polyprism, _cpolyprism]:
+        for comps in [None, ['gzz', 'gxy'], 'gz']:
+            res = module.fields(xp, yp, zp, model, comps)
+            if comps is None:
+                comps = components
+            if isinstance(comps, str):
+                comps = [comps]
+            assert len(res) == len(comps)
+            for f, field in zip(comps, res):
+                true = getattr(module, f)(xp, yp, zp, model)
+                diff = np.abs(true - field)
+                assert np.all(diff <= np.abs(true).max()*10**(-10)), \
+                    '%s max diff: %g' % (f, max(diff))
+        try:
+            module.fields(xp, yp, zp, model, ['gzz', 'potential'])
+        except ValueError:
+            pass
+        else:
+            assert False, "Didn't raise ValueError for invalid component"
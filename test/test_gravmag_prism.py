@@ -1,7 +1,13 @@
+import os
+import shutil
+import tempfile
+
 import numpy as np
 
-from fatiando.mesher import Prism
-from fatiando.gravmag import _prism, _cprism, _neprism
+from fatiando.mesher import Prism, PrismMesh, prisms2array
+from fatiando import utils
+from fatiando.gravmag import (_prism, _cprism, _neprism, _fftprism, _treeprism,
+                              _streamprism, _autoprism)
 
 model = None
 xp, yp, zp = None, None, None
@@ -174,3 +180,266 @@ def test_tf_ne():
     ne = _neprism.tf(xp, yp, zp, model, inc, dec)
     diff = np.abs(py - ne)
     assert np.all(diff <= precision), 'max diff: %g' % (max(diff))
+
+def test_prismarray():
+    "gravmag.prism cython implementation with PrismArray vs list of prisms"
+    array = prisms2array(model)
+    for f in ['potential', 'gx', 'gy', 'gz', 'gxx', 'gxy', 'gxz', 'gyy', 'gyz',
+              'gzz']:
+        py = getattr(_prism, f)(xp, yp, zp, model)
+        cy = getattr(_cprism, f)(xp, yp, zp, array)
+        diff = np.abs(py - cy)
+        assert np.all(diff <= precision), '%s max diff: %g' % (f, max(diff))
+    py = _prism.tf(xp, yp, zp, model, inc, dec)
+    cy = _cprism.tf(xp, yp, zp, array, inc, dec)
+    diff = np.abs(py - cy)
+    assert np.all(diff <= precision), 'tf max diff: %g' % (max(diff))
+
+def test_prismmesh_toarray():
+    "gravmag.prism cython implementation with PrismMesh.toarray"
+    mesh = PrismMesh((-200, 200, -300, 300, 0, 400), (4, 3, 5))
+    mesh.addprop('density', np.arange(mesh.size, dtype=float))
+    mesh.addprop('magnetization', 2*np.ones(mesh.size))
+    mesh.mask.append(7)
+    array = mesh.toarray()
+    assert len(array) == mesh.size - 1
+    for f in ['gz', 'gxy', 'gzz']:
+        py = getattr(_prism, f)(xp, yp, zp, mesh)
+        cy = getattr(_cprism, f)(xp, yp, zp, array)
+        diff = np.abs(py - cy)
+        assert np.all(diff <= precision), '%s max diff: %g' % (f, max(diff))
+    py = _prism.tf(xp, yp, zp, mesh, inc, dec)
+    cy = _cprism.tf(xp, yp, zp, array, inc, dec)
+    diff = np.abs(py - cy)
+    assert np.all(diff <= precision), 'tf max diff: %g' % (max(diff))
+
+def test_fields():
+    "gravmag.prism.fields python and cython vs single component functions"
+    components = ['potential', 'gx', 'gy', 'gz', 'gxx', 'gxy', 'gxz', 'gyy',
+                  'gyz', 'gzz']
+    pyfields = _prism.fields(xp, yp, zp, model)
+    cyfields = _cprism.fields(xp, yp, zp, model)
+    for f, py, cy in zip(components, pyfields, cyfields):
+        single = getattr(_prism, f)(xp, yp, zp, model)
+        diff = np.abs(py - single)
+        assert np.all(diff <= precision), '%s max diff: %g' % (f, max(diff))
+        diff = np.abs(cy - single)
+        assert np.all(diff <= precision), '%s max diff: %g' % (f, max(diff))
+
+def test_fields_components():
+    "gravmag.prism.fields returns only the requested components in order"
+    components = ['gzz', 'gz', 'gxy']
+    pyfields = _prism.fields(xp, yp, zp, model, components, dens=3.)
+    cyfields = _cprism.fields(xp, yp, zp, model, components, dens=3.)
+    assert len(pyfields) == len(cyfields) == 3
+    for f, py, cy in zip(components, pyfields, cyfields):
+        single = getattr(_cprism, f)(xp, yp, zp, model, dens=3.)
+        diff = np.abs(py - single)
+        assert np.all(diff <= precision), '%s max diff: %g' % (f, max(diff))
+        diff = np.abs(cy - single)
+        assert np.all(diff <= precision), '%s max diff: %g' % (f, max(diff))
+
+def test_njobs():
+    "gravmag.prism cython implementation gives same results with threads"
+    for f in ['potential', 'gx', 'gz', 'gxy', 'gzz']:
+        serial = getattr(_cprism, f)(xp, yp, zp, model)
+        parallel = getattr(_cprism, f)(xp, yp, zp, model, njobs=3)
+        assert np.all(serial == parallel), f
+    serial = _cprism.tf(xp, yp, zp, model, inc, dec)
+    parallel = _cprism.tf(xp, yp, zp, model, inc, dec, njobs=3)
+    assert np.all(serial == parallel), 'tf'
+    serial = _cprism.fields(xp, yp, zp, model)
+    parallel = _cprism.fields(xp, yp, zp, model, njobs=3)
+    for s, p in zip(serial, parallel):
+        assert np.all(s == p), 'fields'
+
+def test_kernel_matrix():
+    "gravmag.prism.kernel_matrix python vs cython vs single prisms"
+    mesh = PrismMesh((-200, 200, -300, 300, 0, 400), (2, 3, 2))
+    mesh.mask.append(4)
+    cells = [c for c in mesh if c is not None]
+    for f in ['potential', 'gx', 'gy', 'gz', 'gxx', 'gxy', 'gxz', 'gyy', 'gyz',
+              'gzz']:
+        py = _prism.kernel_matrix(xp, yp, zp, mesh, f)
+        cy = _cprism.kernel_matrix(xp, yp, zp, mesh, f, njobs=2)
+        assert py.shape == cy.shape == (len(xp), mesh.size - 1)
+        for j, cell in enumerate(cells):
+            single = getattr(_prism, f)(xp, yp, zp, [cell], dens=1)
+            diff = np.abs(py[:, j] - single)
+            assert np.all(diff <= precision), '%s max diff: %g' % (f, max(diff))
+            diff = np.abs(cy[:, j] - single)
+            assert np.all(diff <= precision), '%s max diff: %g' % (f, max(diff))
+
+def test_kernel_matrix_float32():
+    "gravmag.prism.kernel_matrix with float32 output"
+    matrix = _cprism.kernel_matrix(xp, yp, zp, model, 'gz', dtype=np.float32)
+    assert matrix.dtype == np.float32
+    double = _cprism.kernel_matrix(xp, yp, zp, model, 'gz')
+    assert np.all(matrix == double.astype(np.float32))
+
+def test_fft():
+    "gravmag.prism.fft and FFTOperator vs direct computation"
+    mesh = PrismMesh((0, 1000, 0, 2000, 100, 600), (5, 20, 10))
+    mesh.addprop('density', np.linspace(-100, 200, mesh.size))
+    mesh.mask.append(13)
+    shape = (20, 17)
+    x, y = [i.ravel() for i in np.meshgrid(np.linspace(-250, 1350, 17),
+                                           np.linspace(50, 1950, 20))]
+    z = -5*np.ones_like(x)
+    for f in ['potential', 'gx', 'gy', 'gz', 'gxx', 'gxy', 'gxz', 'gyy', 'gyz',
+              'gzz']:
+        direct = getattr(_cprism, f)(x, y, z, mesh)
+        fft = _fftprism.fft(x, y, z, shape, mesh, f)
+        diff = np.abs(direct - fft)/np.abs(direct).max()
+        assert np.all(diff <= 10**(-12)), '%s max diff: %g' % (f, max(diff))
+    operator = _fftprism.FFTOperator(x, y, z, shape, mesh, 'gz')
+    matrix = _cprism.kernel_matrix(x, y, z, mesh, 'gz')
+    data = np.linspace(-1, 1, len(x))
+    true = np.zeros(mesh.size)
+    true[mesh.toarray().index] = np.dot(matrix.T, data)
+    diff = np.abs(operator.rmatvec(data) - true)/np.abs(true).max()
+    assert np.all(diff <= 10**(-12)), 'rmatvec max diff: %g' % (max(diff))
+
+def test_ratio():
+    "gravmag.prism multipole approximation python vs cython vs exact"
+    # The error bounds promised in the docstring of gravmag.prism
+    cubic = PrismMesh((-200, 200, -300, 300, 0, 400), (4, 3, 5))
+    elongated = PrismMesh((-2000, 2000, -300, 300, 0, 400), (4, 3, 5))
+    tests = [(cubic, 2, 2*10**(-4)), (cubic, 3, 2*10**(-5)),
+             (elongated, 2, 2*10**(-3))]
+    for mesh, ratio, bound in tests:
+        mesh.addprop('density', np.linspace(-500, 1000, mesh.size))
+        for f in ['potential', 'gx', 'gy', 'gz', 'gxx', 'gxy', 'gxz', 'gyy',
+                  'gyz', 'gzz']:
+            exact = getattr(_cprism, f)(xp, yp, zp, mesh)
+            py = getattr(_prism, f)(xp, yp, zp, mesh, ratio=ratio)
+            cy = getattr(_cprism, f)(xp, yp, zp, mesh, ratio=ratio)
+            diff = np.abs(py - cy)/np.abs(exact).max()
+            assert np.all(diff <= 10**(-12)), '%s max diff: %g' % (f, max(diff))
+            diff = np.abs(cy - exact)/np.abs(exact).max()
+            assert np.all(diff <= bound), '%s ratio %g max error: %g' % (
+                f, ratio, max(diff))
+            assert np.any(cy != exact), f
+    py = _prism.kernel_matrix(xp, yp, zp, cubic, 'gyz', ratio=3)
+    cy = _cprism.kernel_matrix(xp, yp, zp, cubic, 'gyz', ratio=3)
+    assert np.all(np.abs(py - cy) <= np.abs(cy).max()*10**(-12))
+
+def test_tree():
+    "gravmag.prism.PrismTree vs direct computation"
+    mesh = PrismMesh((-1000, 1000, -1000, 1000, 0, 1000), (5, 10, 10))
+    mesh.addprop('density', np.linspace(-500, 1000, mesh.size))
+    mesh.mask.extend([10, 200])
+    tree = _treeprism.PrismTree(mesh, leafsize=10)
+    assert tree.size == mesh.size - 2
+    x, y, z = xp[::5], yp[::5], zp[::5]
+    for f in ['potential', 'gx', 'gy', 'gz', 'gxx', 'gxy', 'gxz', 'gyy', 'gyz',
+              'gzz']:
+        direct = getattr(_cprism, f)(x, y, z, mesh)
+        for ratio, error in [(2, 5*10**(-4)), (3, 5*10**(-5))]:
+            approx = getattr(tree, f)(x, y, z, ratio=ratio)
+            diff = np.abs(direct - approx)/np.abs(direct).max()
+            assert np.all(diff <= error), \
+                '%s ratio %g max error: %g' % (f, ratio, max(diff))
+        # With a huge ratio all prisms are calculated exactly
+        exact = getattr(tree, f)(x, y, z, ratio=10**10)
+        diff = np.abs(direct - exact)/np.abs(direct).max()
+        assert np.all(diff <= 10**(-12)), '%s max diff: %g' % (f, max(diff))
+
+def test_dtype():
+    "gravmag.prism single precision output python vs cython implementation"
+    for f in ['potential', 'gx', 'gy', 'gz', 'gxx', 'gxy', 'gxz', 'gyy', 'gyz',
+              'gzz']:
+        double = getattr(_cprism, f)(xp, yp, zp, model)
+        py = getattr(_prism, f)(xp, yp, zp, model, dtype=np.float32)
+        cy = getattr(_cprism, f)(xp, yp, zp, model, dtype=np.float32)
+        assert py.dtype == cy.dtype == np.float32, f
+        assert np.all(cy == double.astype(np.float32)), f
+        assert np.all(np.abs(py - cy) <= 10**(-7)*np.abs(double).max()), f
+    double = _cprism.tf(xp, yp, zp, model, inc, dec)
+    cy = _cprism.tf(xp, yp, zp, model, inc, dec, dtype=np.float32)
+    assert np.all(cy == double.astype(np.float32))
+    for cy in _cprism.fields(xp, yp, zp, model, ['gz', 'gzz'],
+                             dtype=np.float32):
+        assert cy.dtype == np.float32
+
+def test_magnetic():
+    "gravmag.prism.magnetic python vs cython vs tf"
+    py = _prism.magnetic(xp, yp, zp, model, inc, dec)
+    cy = _cprism.magnetic(xp, yp, zp, model, inc, dec, njobs=2)
+    for p, c in zip(py, cy):
+        diff = np.abs(p - c)
+        assert np.all(diff <= 10**(-10)), 'max diff: %g' % (max(diff))
+    diff = np.abs(cy[0] - _cprism.tf(xp, yp, zp, model, inc, dec))
+    assert np.all(diff <= 10**(-10)), 'tf max diff: %g' % (max(diff))
+    # The components of the induction are the total-field anomaly in the
+    # direction of the axis if the magnetization doesn't depend on the field
+    magdir = [Prism(*p.get_bounds(), props={'magnetization':1.,
+                    'inclination':10, 'declination':20}) for p in model]
+    for c, (finc, fdec) in zip(['bx', 'by', 'bz'], [(0, 0), (0, 90), (90, 0)]):
+        tf = _cprism.tf(xp, yp, zp, magdir, finc, fdec)
+        b = _cprism.magnetic(xp, yp, zp, magdir, inc, dec, [c])[0]
+        diff = np.abs(tf - b)
+        assert np.all(diff <= 10**(-10)), '%s max diff: %g' % (c, max(diff))
+    # Giving the magnetization vectors directly
+    magvec = np.transpose(utils.dircos(10, 20))*np.ones((len(model), 1))
+    for c in ['bx', 'by', 'bz', 'tf']:
+        py = _prism.magnetic(xp, yp, zp, model, inc, dec, [c], magvec=magvec)
+        cy = _cprism.magnetic(xp, yp, zp, model, inc, dec, [c], magvec=magvec)
+        true = _cprism.magnetic(xp, yp, zp, magdir, inc, dec, [c])
+        assert np.all(np.abs(py[0] - true[0]) <= 10**(-10)), c
+        assert np.all(np.abs(cy[0] - true[0]) <= 10**(-10)), c
+
+def test_stream():
+    "gravmag.prism.stream with memmaps, iterators and processes"
+    tmpdir = tempfile.mkdtemp()
+    try:
+        fname = os.path.join(tmpdir, 'points.npy')
+        np.save(fname, np.array([xp, yp, zp]))
+        points = np.load(fname, mmap_mode='r')
+        out = np.lib.format.open_memmap(os.path.join(tmpdir, 'gz.npy'),
+                                        mode='w+', shape=(len(xp),))
+        true = _cprism.gz(xp, yp, zp, model)
+        _streamprism.stream(tuple(points), model, 'gz', out=out,
+                            chunksize=333)
+        assert np.all(out == true)
+        chunks = ((xp[i:i + 100], yp[i:i + 100], zp[i:i + 100])
+                  for i in xrange(0, len(xp), 100))
+        res = _streamprism.stream(chunks, model, 'gz', processes=2)
+        assert np.all(res == true)
+        res = _streamprism.stream((xp, yp, zp), model, 'tf', chunksize=1000,
+                                  processes=2, inc=inc, dec=dec)
+        assert np.all(res == _cprism.tf(xp, yp, zp, model, inc, dec))
+    finally:
+        shutil.rmtree(tmpdir)
+
+def test_backend():
+    "gravmag.prism.set_backend results don't depend on the backend"
+    try:
+        for f in ['gz', 'gxy', 'tf']:
+            args = [inc, dec] if f == 'tf' else []
+            true = getattr(_prism, f)(xp, yp, zp, model, *args)
+            for backend in ['numpy', 'cython', 'numexpr', 'auto']:
+                _autoprism.set_backend(backend)
+                assert _autoprism.get_backend() == backend
+                res = getattr(_autoprism, f)(xp, yp, zp, model, *args)
+                diff = np.abs(res - true)
+                assert np.all(diff <= precision), \
+                    '%s %s max diff: %g' % (f, backend, max(diff))
+                res = getattr(_autoprism, f)(xp, yp, zp, model, *args,
+                                             njobs=2, dtype=np.float32)
+                assert res.dtype == np.float32
+                diff = np.abs(res - true)
+                assert np.all(diff <= np.abs(true).max()*10**(-6)), \
+                    '%s %s float32 max diff: %g' % (f, backend, max(diff))
+        assert set(_autoprism._calibration.values()) <= set(
+            ['numpy', 'cython', 'numexpr'])
+    finally:
+        _autoprism.set_backend('cython')
+
+def test_ratio_ne():
+    "gravmag.prism numexpr vs cython implementation with ratio"
+    for f in ['gz', 'gzz']:
+        cy = getattr(_cprism, f)(xp, yp, zp, model, ratio=2)
+        ne = getattr(_neprism, f)(xp, yp, zp, model, ratio=2)
+        diff = np.abs(cy - ne)
+        assert np.all(diff <= 10**(-10)), 'max diff: %g' % (max(diff))
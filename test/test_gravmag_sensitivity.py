@@ -0,0 +1,78 @@
+import os
+import shutil
+import tempfile
+
+import numpy as np
+
+from fatiando.mesher import PrismMesh
+from fatiando.gravmag import prism, sensitivity
+
+mesh = None
+xp, yp, zp = None, None, None
+tmpdir = None
+
+def setup():
+    global mesh, xp, yp, zp, tmpdir
+    mesh = PrismMesh((-500, 500, -400, 400, 0, 600), (3, 4, 5))
+    mesh.mask.append(7)
+    tmp = np.linspace(-600, 600, 13)
+    xp, yp = [i.ravel() for i in np.meshgrid(tmp, tmp)]
+    zp = -10*np.ones_like(xp)
+    tmpdir = tempfile.mkdtemp()
+
+def teardown():
+    shutil.rmtree(tmpdir)
+
+def test_build():
+    "gravmag.sensitivity.build stores the same matrix as prism.kernel_matrix"
+    fname = os.path.join(tmpdir, 'gzz.dat')
+    disk = sensitivity.build(fname, xp, yp, zp, mesh, 'gzz',
+                             dtype=np.float64, blocksize=10)
+    matrix = prism.kernel_matrix(xp, yp, zp, mesh, 'gzz')
+    assert disk.shape == matrix.shape
+    assert np.all(np.array(disk.matrix) == matrix)
+    loaded = sensitivity.load(fname)
+    assert loaded.field == 'gzz'
+    assert loaded.meshshape == mesh.shape
+    assert np.all(loaded.index == mesh.toarray().index)
+    assert np.all(loaded.x == xp)
+
+def test_matvec():
+    "gravmag.sensitivity.DiskMatrix matvec and rmatvec in blocks"
+    fname = os.path.join(tmpdir, 'gz.dat')
+    disk = sensitivity.build(fname, xp, yp, zp, mesh, 'gz', blocksize=17)
+    matrix = np.array(disk.matrix, dtype=np.float64)
+    dens = np.linspace(-500, 1000, disk.shape[1])
+    data = np.linspace(-1, 1, disk.shape[0])
+    assert np.allclose(disk.matvec(dens), np.dot(matrix, dens))
+    assert np.allclose(disk.rmatvec(data), np.dot(matrix.T, data))
+    assert disk.matvec(dens).dtype == np.float64
+    assert disk.rmatvec(data).dtype == np.float64
+    operator = disk.aslinearoperator()
+    assert np.allclose(operator.matvec(dens), np.dot(matrix, dens))
+
+def test_wavelet_transform():
+    "gravmag.sensitivity.WaveletMatrix transform is orthonormal"
+    wavelet = sensitivity.WaveletMatrix(mesh.shape, mesh.toarray().index, 1)
+    vectors = np.random.RandomState(0).rand(4, mesh.size - 1)
+    coefs = wavelet.transform(vectors)
+    assert np.allclose(wavelet.inverse(coefs), vectors)
+    assert np.allclose(np.sum(coefs**2, axis=1), np.sum(vectors**2, axis=1))
+
+def test_compress():
+    "gravmag.sensitivity.compress matvec and rmatvec within the tolerance"
+    tol = 0.01
+    wavelet = sensitivity.compress(xp, yp, zp, mesh, 'gz', tol=tol,
+                                   blocksize=50)
+    matrix = prism.kernel_matrix(xp, yp, zp, mesh, 'gz')
+    assert wavelet.shape == matrix.shape
+    assert wavelet.compression < 1
+    dens = np.ones(wavelet.shape[1])
+    true = np.dot(matrix, dens)
+    # The error of each row is at most tol*norm(row)
+    bound = tol*np.linalg.norm(matrix)*np.linalg.norm(dens)
+    assert np.linalg.norm(wavelet.matvec(dens) - true) <= bound
+    data = np.ones(wavelet.shape[0])
+    true = np.dot(matrix.T, data)
+    bound = tol*np.linalg.norm(matrix)*np.linalg.norm(data)
+    assert np.linalg.norm(wavelet.rmatvec(data) - true) <= bound
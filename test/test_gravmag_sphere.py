@@ -0,0 +1,113 @@
+import numpy as np
+
+from fatiando.mesher import Sphere, Prism, SphereArray, spheres2array
+from fatiando import gravmag, gridder
+from fatiando.gravmag import _sphere, _csphere
+
+model = None
+xp, yp, zp = None, None, None
+inc, dec = None, None
+precision = 10**(-10)
+
+def setup():
+    global model, xp, yp, zp, inc, dec
+    model = [Sphere(0, 0, 1000, 500, {'density':1000., 'magnetization':2.,
+                                      'inclination':30, 'declination':10}),
+             None,
+             Sphere(1000, -500, 1500, 300, {'density':-300.}),
+             Sphere(-1000, 500, 800, 200, {'magnetization':3.})]
+    inc, dec = 40, -20
+    xp, yp, zp = gridder.regular((-3000, 3000, -3000, 3000), (30, 30),
+                                 z=-100)
+
+def test_cython_vs_python():
+    "gravmag.sphere Cython against Python"
+    for f in _sphere._FIELDS + ['tf']:
+        args = [xp, yp, zp, model]
+        if f == 'tf':
+            args.extend([inc, dec])
+        py = getattr(_sphere, f)(*args)
+        cy = getattr(_csphere, f)(*args)
+        diff = np.abs(py - cy)
+        assert np.all(diff <= np.abs(py).max()*precision), \
+            '%s max diff: %g' % (f, max(diff))
+
+def test_fields():
+    "gravmag.sphere.fields against the separate functions"
+    for module in [_sphere, _csphere]:
+        for comps in [None, ['gzz', 'gx'], 'gz']:
+            res = module.fields(xp, yp, zp, model, comps)
+            if comps is None:
+                comps = _sphere._FIELDS
+            if isinstance(comps, str):
+                comps = [comps]
+            assert len(res) == len(comps)
+            for f, field in zip(comps, res):
+                true = getattr(module, f)(xp, yp, zp, model)
+                diff = np.abs(true - field)
+                assert np.all(diff <= np.abs(true).max()*precision), \
+                    '%s max diff: %g' % (f, max(diff))
+        try:
+            module.fields(xp, yp, zp, model, ['gzz', 'gzzz'])
+        except ValueError:
+            pass
+        else:
+            assert False, "Didn't raise ValueError for invalid component"
+
+def test_kernel_matrix():
+    "gravmag.sphere.kernel_matrix times the densities against the fields"
+    dens = np.array([1000., -300., 500.])
+    for module in [_sphere, _csphere]:
+        for f in _sphere._FIELDS:
+            true = getattr(module, f)(xp, yp, zp, model, dens=1.)
+            for dtype in [np.float64, np.float32]:
+                matrix = module.kernel_matrix(xp, yp, zp, model, field=f,
+                                              dtype=dtype)
+                assert matrix.shape == (len(xp), 3)
+                assert matrix.dtype == dtype
+                diff = np.abs(true - matrix.sum(axis=1))
+                tol = np.abs(true).max()*10**(-6)
+                assert np.all(diff <= tol), '%s %s max diff: %g' % (
+                    f, dtype.__name__, max(diff))
+        matrix = module.kernel_matrix(xp, yp, zp, model, field='gzz')
+        array = spheres2array(model)
+        array.props['density'] = dens
+        true = module.gzz(xp, yp, zp, array)
+        diff = np.abs(true - np.dot(matrix, dens))
+        assert np.all(diff <= np.abs(true).max()*precision), \
+            'max diff: %g' % (max(diff))
+
+def test_against_prism():
+    "gravmag.sphere against gravmag.prism of the same mass far away"
+    radius = 100.
+    side = radius*(4*np.pi/3.)**(1/3.)
+    spheres = [Sphere(0, 0, 2000, radius, {'density':1000.})]
+    prisms = [Prism(-side/2, side/2, -side/2, side/2, 2000 - side/2,
+                    2000 + side/2, {'density':1000.})]
+    for f in ['potential', 'gx', 'gy', 'gz', 'gzz']:
+        sphere = getattr(gravmag.sphere, f)(xp, yp, zp, spheres)
+        prism = getattr(gravmag.prism, f)(xp, yp, zp, prisms)
+        diff = np.abs(sphere - prism)
+        assert np.all(diff <= np.abs(prism).max()*10**(-3)), \
+            '%s max diff: %g' % (f, max(diff))
+
+def test_sphere_array():
+    "gravmag.sphere with a SphereArray against a list of spheres"
+    array = spheres2array(model)
+    assert len(array) == 3
+    for module in [_sphere, _csphere]:
+        for f in _sphere._FIELDS:
+            true = getattr(module, f)(xp, yp, zp, model)
+            res = getattr(module, f)(xp, yp, zp, array)
+            assert np.all(true == res), '%s arrays differ' % (f)
+        true = module.tf(xp, yp, zp, model, inc, dec)
+        res = module.tf(xp, yp, zp, array, inc, dec)
+        assert np.all(np.abs(true - res) <= np.abs(true).max()*precision)
+    layer = SphereArray([0, 100], [0, 100], [500, 500], 10.,
+                        {'density':2000.})
+    true = _sphere.gz(xp, yp, zp, [Sphere(0, 0, 500, 10, {'density':2000.}),
+                                    Sphere(100, 100, 500, 10,
+                                           {'density':2000.})])
+    for module in [_sphere, _csphere]:
+        res = module.gz(xp, yp, zp, layer)
+        assert np.all(np.abs(true - res) <= np.abs(true).max()*precision)
@@ -1,8 +1,11 @@
+import sys
+from StringIO import StringIO
+
 import numpy as np
 
 from fatiando import gravmag
-from fatiando.mesher import Tesseroid
-#from fatiando.gravmag import _tesseroid, _ctesseroid
+from fatiando.mesher import Tesseroid, TesseroidMesh
+from fatiando.gravmag import tesseroid, _ctesseroid
 
 shellmodel = None
 heights = None
@@ -110,3 +113,222 @@ def test_gyz():
     tess = gravmag.tesseroid.gyz(lons, lats, heights, shellmodel)
     diff = np.abs(tess)
     assert np.all(diff <= 10**(-10)), 'diff: %s' % (str(diff))
+
+def test_adaptive_python():
+    "gravmag.tesseroid compiled adaptive discretization vs pure Python"
+    mesh = TesseroidMesh((-10, 10, -10, 10, 0, -50000), (2, 2, 2))
+    mesh.addprop('density', 200*np.arange(mesh.size))
+    lons = np.linspace(-15, 15, 5)
+    lats = np.linspace(-5, 10, 5)
+    hs = np.array([1000, 250000, 10000, 500000, 2000])
+    try:
+        for f, hs in [('gz', hs), ('potential', hs), ('gzz', hs[1::2]),
+                      ('gxy', hs[1::2])]:
+            ln, lt = lons[:len(hs)], lats[:len(hs)]
+            tesseroid._ctesseroid = _ctesseroid
+            cy = getattr(tesseroid, f)(ln, lt, hs, mesh)
+            tesseroid._ctesseroid = None
+            py = getattr(tesseroid, f)(ln, lt, hs, mesh)
+            diff = np.abs(cy - py)/np.abs(py).max()
+            assert np.all(diff <= 10**(-10)), '%s diff: %s' % (f, str(diff))
+    finally:
+        tesseroid._ctesseroid = _ctesseroid
+
+def test_coincident_point():
+    "gravmag.tesseroid raises ValueError on the tesseroid without printing"
+    model = [Tesseroid(0, 1, 0, 1, 0, -1000, {'density':1000.})]
+    lons, lats = np.zeros(1), np.zeros(1)
+    stderr = sys.stderr
+    for height in [0., 0.01]:
+        heights = height*np.ones(1)
+        for func in [tesseroid.gz, tesseroid.gzz, tesseroid.kernel_matrix]:
+            sys.stderr = StringIO()
+            try:
+                func(lons, lats, heights, model)
+            except ValueError:
+                pass
+            else:
+                assert False, "Didn't raise ValueError at %g m" % (height)
+            finally:
+                output = sys.stderr.getvalue()
+                sys.stderr = stderr
+            assert output == '', 'Wrote to stderr: %s' % (output[:200])
+
+def test_njobs():
+    "gravmag.tesseroid results don't depend on the number of threads"
+    lons = np.linspace(-10, 10, 7)
+    lats = np.linspace(-5, 5, 7)
+    hs = np.linspace(1000, 500000, 7)
+    for f in ['gz', 'gzz']:
+        serial = getattr(tesseroid, f)(lons, lats, hs, shellmodel[::10])
+        parallel = getattr(tesseroid, f)(lons, lats, hs, shellmodel[::10],
+                                         njobs=3)
+        assert np.all(serial == parallel), f
+
+def test_order():
+    "gravmag.tesseroid with higher and per dimension GLQ orders"
+    shell = gravmag.half_sph_shell.gz(heights, top, bottom, density)
+    lons = np.zeros_like(heights)
+    lats = lons
+    for order in [3, [2, 3, 4], (5, 5, 2)]:
+        tess = gravmag.tesseroid.gz(lons, lats, heights, shellmodel,
+                                    order=order)
+        diff = np.abs(shell - tess)/np.abs(shell)
+        assert np.all(diff <= 0.01), '%s diff: %s' % (str(order), str(diff))
+
+def test_maxorder():
+    "gravmag.tesseroid raising the GLQ order instead of dividing"
+    mesh = TesseroidMesh((-10, 10, -10, 10, 0, -50000), (2, 2, 2))
+    mesh.addprop('density', 200*np.arange(mesh.size))
+    lons = np.linspace(-15, 15, 5)
+    lats = np.linspace(-5, 10, 5)
+    hs = np.array([1000, 250000, 10000, 500000, 2000])
+    for f in ['gz', 'gzz']:
+        fine = getattr(tesseroid, f)(lons, lats, hs, mesh, ratio=10)
+        raised = getattr(tesseroid, f)(lons, lats, hs, mesh, maxorder=8)
+        diff = np.abs(fine - raised)/np.abs(fine).max()
+        assert np.all(diff <= 0.01), '%s diff: %s' % (f, str(diff))
+        try:
+            tesseroid._ctesseroid = None
+            py = getattr(tesseroid, f)(lons, lats, hs, mesh, maxorder=8)
+        finally:
+            tesseroid._ctesseroid = _ctesseroid
+        diff = np.abs(raised - py)/np.abs(py).max()
+        assert np.all(diff <= 10**(-10)), '%s diff: %s' % (f, str(diff))
+
+def test_invalid_order():
+    "gravmag.tesseroid raises ValueError for invalid GLQ orders"
+    for order, maxorder in [(0, None), ([2, 2], None), (40, None), (2, 40)]:
+        try:
+            tesseroid.gz([0], [0], [1000], shellmodel[:1], order=order,
+                         maxorder=maxorder)
+        except ValueError:
+            pass
+        else:
+            assert False, 'no error for %s %s' % (str(order), str(maxorder))
+
+def test_fields():
+    "gravmag.tesseroid.fields python and cython vs single component functions"
+    components = ['potential', 'gx', 'gy', 'gz', 'gxx', 'gxy', 'gxz', 'gyy',
+                  'gyz', 'gzz']
+    mesh = TesseroidMesh((-10, 10, -10, 10, 0, -50000), (2, 2, 2))
+    mesh.addprop('density', 200*np.arange(mesh.size))
+    lons = np.linspace(-15, 15, 3)
+    lats = np.linspace(-5, 10, 3)
+    hs = np.array([250000, 500000, 400000])
+    try:
+        for backend in [_ctesseroid, None]:
+            tesseroid._ctesseroid = backend
+            result = tesseroid.fields(lons, lats, hs, mesh, ratio=3,
+                                      maxorder=4)
+            assert len(result) == len(components)
+            for f, res in zip(components, result):
+                single = getattr(tesseroid, f)(lons, lats, hs, mesh, ratio=3,
+                                               maxorder=4)
+                diff = np.abs(res - single)/np.abs(single).max()
+                assert np.all(diff <= 10**(-10)), '%s diff: %s' % (f,
+                                                                  str(diff))
+    finally:
+        tesseroid._ctesseroid = _ctesseroid
+
+def test_fields_components():
+    "gravmag.tesseroid.fields returns only the requested components in order"
+    lons = np.zeros_like(heights)
+    lats = lons
+    components = ['gzz', 'gz', 'gxx']
+    result = tesseroid.fields(lons, lats, heights, shellmodel, components)
+    assert len(result) == 3
+    for f, res in zip(components, result):
+        single = getattr(tesseroid, f)(lons, lats, heights, shellmodel,
+                                       ratio=3)
+        assert np.all(res == single), f
+
+def test_fft():
+    "gravmag.tesseroid.fft and FFTOperator vs direct computation"
+    regional = TesseroidMesh((-10, 10, -5, 5, 0, -20000), (2, 5, 10))
+    world = TesseroidMesh((0, 360, -90, 90, 0, -50000), (1, 6, 12))
+    for mesh, lon0, nlon in [(regional, -13, 14), (world, 15, 12)]:
+        mesh.addprop('density', np.linspace(-100, 200, mesh.size))
+        mesh.mask.append(7)
+        lon, lat = np.meshgrid(lon0 + mesh.dims[0]*np.arange(nlon),
+                               [-8, 0, 3])
+        lons, lats = lon.ravel(), lat.ravel()
+        hs = np.repeat([300000, 400000, 500000], nlon)
+        shape = (3, nlon)
+        for f in ['potential', 'gz', 'gxy', 'gzz']:
+            direct = getattr(tesseroid, f)(lons, lats, hs, mesh)
+            fft = tesseroid.fft(lons, lats, hs, shape, mesh, f)
+            diff = np.abs(direct - fft)/np.abs(direct).max()
+            assert np.all(diff <= 10**(-10)), '%s diff: %s' % (f, str(diff))
+        operator = tesseroid.FFTOperator(lons, lats, hs, shape, mesh, 'gz')
+        data = np.linspace(-1, 1, len(lons))
+        true = np.zeros(mesh.size)
+        for i in xrange(mesh.size):
+            if i not in mesh.mask:
+                column = tesseroid.gz(lons, lats, hs, [mesh[i]], dens=1)
+                true[i] = np.dot(column, data)
+        diff = np.abs(operator.rmatvec(data) - true)/np.abs(true).max()
+        assert np.all(diff <= 10**(-10)), 'rmatvec diff: %s' % (str(diff))
+
+def test_calibrate():
+    "gravmag.tesseroid.calibrate finds the cheapest ratio within tolerance"
+    hs = [50000, 250000, 1000000]
+    for f, tol in [('gz', 10**(-3)), ('gzz', 10**(-2))]:
+        ratio, order, tried = tesseroid.calibrate(hs, 10, 50000, f, tol,
+                                                  orders=[2, 3])
+        good = [t for t in tried if t['error'] <= tol]
+        best = [t for t in good if t['ratio'] == ratio and
+                t['order'] == order][0]
+        assert all(best['kernels'] <= t['kernels'] for t in good), f
+        assert any(t['error'] > tol for t in tried), f
+    try:
+        tesseroid.calibrate(hs, 10, 50000, 'gzz', 10**(-12), ratios=[1])
+    except ValueError:
+        pass
+    else:
+        assert False, 'no error for unreachable tolerance'
+
+def test_counts():
+    "gravmag.tesseroid compiled and python count the same kernel evaluations"
+    mesh = TesseroidMesh((-10, 10, -10, 10, 0, -50000), (2, 2, 2))
+    lons = np.linspace(-15, 15, 3)
+    lats = np.linspace(-5, 10, 3)
+    hs = np.array([250000, 10000, 500000])
+    counts = []
+    try:
+        for backend in [_ctesseroid, None]:
+            tesseroid._ctesseroid = backend
+            counts.append(np.zeros(len(hs), dtype=np.int))
+            tesseroid._optimal_discretize(mesh, lons, lats, hs, ['gz'], 1, 2,
+                                          3, 1., counts=counts[-1])
+    finally:
+        tesseroid._ctesseroid = _ctesseroid
+    assert np.all(counts[0] == counts[1]), str(counts)
+    assert np.all(counts[0] >= 8*mesh.size)
+
+def test_kernel_matrix():
+    "gravmag.tesseroid.kernel_matrix compiled, python and symmetry vs direct"
+    mesh = TesseroidMesh((-10, 10, -5, 5, 0, -20000), (2, 2, 5))
+    mesh.addprop('density', np.linspace(-100, 200, mesh.size))
+    mesh.mask.append(3)
+    dens = np.array([d for i, d in enumerate(mesh.props['density'])
+                     if i not in mesh.mask])
+    lon, lat = np.meshgrid(-13 + mesh.dims[0]*np.arange(9), [-8, 0, 3])
+    lons, lats = lon.ravel(), lat.ravel()
+    hs = np.repeat([300000, 400000, 500000], 9)
+    for f in ['gz', 'gxz']:
+        direct = getattr(tesseroid, f)(lons, lats, hs, mesh)
+        matrices = []
+        try:
+            for backend in [_ctesseroid, None]:
+                tesseroid._ctesseroid = backend
+                matrices.append(tesseroid.kernel_matrix(lons, lats, hs, mesh,
+                                                        f))
+        finally:
+            tesseroid._ctesseroid = _ctesseroid
+        matrices.append(tesseroid.kernel_matrix(lons, lats, hs, mesh, f,
+                                                shape=(3, 9)))
+        assert matrices[-1].shape == (len(lons), mesh.size - 1)
+        for matrix in matrices:
+            diff = np.abs(matrix.dot(dens) - direct)/np.abs(direct).max()
+            assert np.all(diff <= 10**(-10)), '%s diff: %s' % (f, str(diff))